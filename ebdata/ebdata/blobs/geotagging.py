@@ -16,7 +16,29 @@
 #   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+"""
+Finds addresses in blob Pages and creates a NewsItem for each one.
+
+Geotagging a Page happens in stages:
+
+1. Text extraction: find the article text of the page, and check
+   whether its datelines mean we can skip it
+   (:py:func:`extract_page_text`).
+2. Address extraction: find all addresses in that text (also in
+   :py:func:`extract_page_text`).
+3. Geocoding of the addresses (:py:func:`geocode_address`).
+4. Creating the NewsItems and marking the Page as geocoded.
+
+:py:func:`save_locations_for_page` does all of that for one page.
+:py:func:`save_locations_for_ungeocoded_pages` works on batches of
+pages, running stages 1-3 in a pool of worker processes, geocoding
+each unique address only once per batch, and saving each batch in one
+transaction. Since a page is only marked as geocoded when its batch
+is committed, an interrupted run can simply be started again.
+"""
+
 from django.conf import settings
+from django.db import transaction
 from ebdata.blobs.auto_purge import page_should_be_purged
 from ebdata.blobs.models import Page
 from ebdata.nlp.addresses import parse_addresses
@@ -26,63 +48,204 @@ from ebpub.geocoder.parser.parsing import normalize, ParsingError
 from ebpub.streets.models import Suburb
 from ebpub.utils.text import slugify, smart_excerpt
 import datetime
+import logging
+import multiprocessing
+import os
 import time
 
+logger = logging.getLogger('eb.retrieval.blob_geotagging')
+
 
 def save_locations_for_page(p):
     """
     Given a Page object, this function parses the text, finds all valid
     locations and creates a NewsItem for each location.
     """
+    text = extract_page_text(p)
+    if text['skip']:
+        return
+    geocoder = SmartGeocoder()
+    geocoded = {}
+    for key in _unique_addresses([text]):
+        geocoded[key] = geocode_address(*key, geocoder=geocoder)
+    locations, location_report = page_locations(text, geocoded)
+    _save_page(p, text, locations, location_report)
+
+def extract_page_text(p):
+    """
+    Runs the text and address extraction stages for a Page.
+
+    Returns a dictionary with these keys:
+
+    * ``page_id``
+    * ``skip``: True if the page can't be geotagged yet, and
+      should be left alone.
+    * ``purge``, ``report``: the results of
+      :py:func:`ebdata.blobs.auto_purge.page_should_be_purged`.
+    * ``paragraphs``: a list of strings. If we're looking for
+      addresses, the first one is the article headline.
+    * ``addresses``: a list of the (address, city) tuples found in each
+      paragraph, or None if we're not looking for addresses.
+    * ``city``: the default city to use when geocoding.
+    """
     paragraph_list = p.auto_excerpt()
     do_purge, no_purge_reason = page_should_be_purged(paragraph_list)
-    robot_report = [no_purge_reason]
-    if do_purge:
-        p.set_no_locations(geocoded_by='confidentrobot')
-    else:
-        if p.seed.autodetect_locations:
-            if not p.article_headline:
-                return
-            if not p.article_date:
-                return
+    result = {'page_id': p.id, 'skip': False, 'purge': do_purge,
+              'report': no_purge_reason, 'paragraphs': paragraph_list,
+              'addresses': None, 'city': p.seed.city}
+    if do_purge or not p.seed.autodetect_locations:
+        return result
+    if not (p.article_headline and p.article_date):
+        result['skip'] = True
+        return result
+    # Add a paragraph of the article's headline so that we find any/all
+    # addresses in the headline, too.
+    paragraph_list = [p.article_headline] + paragraph_list
+    result['paragraphs'] = paragraph_list
+    result['addresses'] = [parse_addresses(para) for para in paragraph_list]
+    return result
+
+def _unique_addresses(texts):
+    # Returns a list of unique (address, city, default_city) tuples to
+    # geocode for the given extract_page_text() results.
+    keys = set()
+    for text in texts:
+        for para_addresses in (text['addresses'] or ()):
+            for addy, city in para_addresses:
+                keys.add((addy, city, text['city']))
+    return sorted(keys)
+
+def geocode_address(addy, city, default_city='', geocoder=None):
+    """
+    Geocodes an address found in a page, given the city (if any) that
+    was found with it, and the default city of the page's Seed.
+
+    Returns a tuple (point, report), where point is the geocoder
+    result or None, and report is a list of strings describing what
+    went wrong.
+    """
+    report = []
+    # Skip addresses if they have a city that's a known suburb.
+    if city and Suburb.objects.filter(normalized_name=normalize(city)).count():
+        report.append('got suburb "%s, %s"' % (addy, city))
+        return (None, report)
+
+    # Try geocoding the address. If a city was provided, first try
+    # geocoding with the city, then fall back to just the address
+    # (without the city).
+    if geocoder is None:
+        geocoder = SmartGeocoder()
+    point = None
+    attempts = [addy]
+    if default_city:
+        attempts.insert(0, '%s, %s' % (addy, default_city))
+    if city and city.lower() != default_city.lower():
+        attempts.insert(0, '%s, %s' % (addy, city))
+    for attempt in attempts:
+        try:
+            point = geocoder.geocode(attempt)
+            break
+        except AmbiguousResult:
+            report.append('got ambiguous address "%s"' % attempt)
+            # Don't try any other address attempts, because they only
+            # get *more* ambiguous. Plus, the subsequent attempts could
+            # be incorrect. For example, with this:
+            #    addy = '100 Broadway'
+            #    city = 'Manhattan'
+            #    default_city = 'Brooklyn'
+            # There are multiple "100 Broadway" addresses in Manhattan,
+            # so geocoding should fail at this point. It should not
+            # roll back to try the default_city (Brooklyn).
+            break
+        except (DoesNotExist, InvalidBlockButValidStreet):
+            report.append('got nonexistent address "%s"' % attempt)
+        except ParsingError:
+            report.append('got parsing error "%s"' % attempt)
+    return (point, report)
+
+def _locations_from_geocoded(paragraph_list, addresses, geocoded, default_city=''):
+    # The final stage of auto_locations(), given the parsed addresses
+    # of each paragraph and a dictionary of geocode_address() results
+    # keyed by (address, city, default_city).
+    result, report = [], []
+    addresses_seen = set()
+    for para, para_addresses in zip(paragraph_list, addresses):
+        for addy, city in para_addresses:
+            point, attempt_report = geocoded[(addy, city, default_city)]
+            report.extend(attempt_report)
+            if point is None:
+                continue # This address could not be geocoded.
+
+            if point['address'] in addresses_seen:
+                continue
+            if len(para) > 300:
+                try:
+                    excerpt = smart_excerpt(para, addy)
+                except ValueError:
+                    excerpt = para
+            else:
+                excerpt = para
+            result.append((addy, point['point'], excerpt, point['block']))
+            addresses_seen.add(point['address'])
+    return (result, '; '.join(report))
+
+def page_locations(text, geocoded):
+    """
+    Given an extract_page_text() result and a dictionary of
+    geocode_address() results keyed by (address, city, default_city),
+    returns a tuple (locations, report) like auto_locations().
+    locations is None if the page isn't being geotagged.
+    """
+    if text['addresses'] is None:
+        return (None, '')
+    return _locations_from_geocoded(text['paragraphs'], text['addresses'],
+                                    geocoded, text['city'])
 
-            # Add a paragraph of the article's headline so that we find any/all
-            # addresses in the headline, too.
-            paragraph_list = [p.article_headline] + paragraph_list
+def _newsitem_exists(p, location_name):
+    # Check for existing NewsItems with this exact pub_date,
+    # headline, location_name and source.
+    try:
+        source_schemafield = SchemaField.objects.get(schema__id=p.seed.schema_id, name='source')
+    except SchemaField.DoesNotExist:
+        return False
+    return bool(NewsItem.objects.filter(schema__id=p.seed.schema_id,
+        pub_date=p.article_date, title=p.article_headline,
+        location_name=location_name).by_attribute(source_schemafield, p.seed.pretty_name, is_lookup=True).count())
 
-            locations, location_report = auto_locations(paragraph_list, p.seed.city)
+def _save_page(p, text, locations, location_report, newsitem_exists=_newsitem_exists,
+               source_cache=None):
+    # The final stage: create NewsItems and update the Page.
+    robot_report = [text['report']]
+    if text['purge']:
+        p.set_no_locations(geocoded_by='confidentrobot')
+    else:
+        if locations is not None:
             if location_report:
                 robot_report.append(location_report)
 
             if locations:
-                # Check for existing NewsItems with this exact pub_date,
-                # headline, location_name and source.
-                do_geotag = True
-                try:
-                    source_schemafield = SchemaField.objects.get(schema__id=p.seed.schema_id, name='source')
-                except SchemaField.DoesNotExist:
-                    pass
+                if newsitem_exists(p, locations[0][0]):
+                    robot_report.append('article appears to exist already')
                 else:
-                    existing_newsitems = NewsItem.objects.filter(schema__id=p.seed.schema_id,
-                        pub_date=p.article_date, title=p.article_headline,
-                        location_name=locations[0][0]).by_attribute(source_schemafield, p.seed.pretty_name, is_lookup=True).count()
-                    if existing_newsitems:
-                        robot_report.append('article appears to exist already')
-                        do_geotag = False
-                if do_geotag:
                     geotag_page(p.id, p.seed.pretty_name, p.seed.schema, p.url,
-                        locations, p.article_headline, p.article_date)
+                        locations, p.article_headline, p.article_date,
+                        source_cache=source_cache)
             p.has_addresses = bool(locations)
             p.when_geocoded = datetime.datetime.now()
             p.geocoded_by = 'robot'
         p.robot_report = '; '.join(robot_report)[:255]
     p.save()
 
-def geotag_page(page_id, source, schema, url, data_tuples, article_headline, article_date):
+def geotag_page(page_id, source, schema, url, data_tuples, article_headline, article_date,
+                source_cache=None):
     """
     Given a Page ID and a list of (location, wkt, excerpt, block) tuples
     representing the addresses in the page, creates a NewsItem for each
     address. Returns a list of all created NewsItems.
+
+    If ``source_cache`` is given, it should be a dictionary; it's used to
+    remember the "source" Lookup for each (schema id, source) between
+    calls.
     """
     if not data_tuples:
         return
@@ -97,22 +260,13 @@ def geotag_page(page_id, source, schema, url, data_tuples, article_headline, art
     if not isinstance(article_date, datetime.date):
         article_date = datetime.date(*time.strptime(article_date, '%Y-%m-%d')[:3])
 
-    # If this schema has a "source" SchemaField, then get or create it.
-    try:
-        sf = SchemaField.objects.get(schema__id=schema.id, name='source')
-    except SchemaField.DoesNotExist:
-        source = None
+    if source_cache is None:
+        source_cache = {}
+    cache_key = (schema.id, source)
+    if cache_key in source_cache:
+        source = source_cache[cache_key]
     else:
-        try:
-            source = Lookup.objects.get(schema_field__id=sf.id, code=source)
-        except Lookup.DoesNotExist:
-            source = Lookup.objects.create(
-                schema_field_id=sf.id,
-                name=source,
-                code=source,
-                slug=slugify(source)[:32],
-                description=''
-            )
+        source = source_cache[cache_key] = _get_source_lookup(schema, source)
     ni_list = []
     for location, wkt, excerpt, block in data_tuples:
         description = excerpt = excerpt.replace('\n', ' ')
@@ -137,6 +291,23 @@ def geotag_page(page_id, source, schema, url, data_tuples, article_headline, art
         ni_list.append(ni)
     return ni_list
 
+def _get_source_lookup(schema, source):
+    # If this schema has a "source" SchemaField, then get or create it.
+    try:
+        sf = SchemaField.objects.get(schema__id=schema.id, name='source')
+    except SchemaField.DoesNotExist:
+        return None
+    try:
+        return Lookup.objects.get(schema_field__id=sf.id, code=source)
+    except Lookup.DoesNotExist:
+        return Lookup.objects.create(
+            schema_field_id=sf.id,
+            name=source,
+            code=source,
+            slug=slugify(source)[:32],
+            description=''
+        )
+
 def auto_locations(paragraph_list, default_city=''):
     """
     Given a list of strings, detects all valid, unique addresses and returns a
@@ -146,65 +317,174 @@ def auto_locations(paragraph_list, default_city=''):
     If default_city is given, it will be used in the geocoding for detected
     addresses that don't specify a city.
     """
-    result, report = [], []
-    addresses_seen = set()
     geocoder = SmartGeocoder()
-    for para in paragraph_list:
-        for addy, city in parse_addresses(para):
-            # Skip addresses if they have a city that's a known suburb.
-            if city and Suburb.objects.filter(normalized_name=normalize(city)).count():
-                report.append('got suburb "%s, %s"' % (addy, city))
-                continue
+    addresses = [parse_addresses(para) for para in paragraph_list]
+    geocoded = {}
+    for para_addresses in addresses:
+        for addy, city in para_addresses:
+            key = (addy, city, default_city)
+            if key not in geocoded:
+                geocoded[key] = geocode_address(addy, city, default_city, geocoder)
+    return _locations_from_geocoded(paragraph_list, addresses, geocoded, default_city)
 
-            # Try geocoding the address. If a city was provided, first try
-            # geocoding with the city, then fall back to just the address
-            # (without the city).
-            point = None
-            attempts = [addy]
-            if default_city:
-                attempts.insert(0, '%s, %s' % (addy, default_city))
-            if city and city.lower() != default_city.lower():
-                attempts.insert(0, '%s, %s' % (addy, city))
-            for attempt in attempts:
-                try:
-                    point = geocoder.geocode(attempt)
-                    break
-                except AmbiguousResult:
-                    report.append('got ambiguous address "%s"' % attempt)
-                    # Don't try any other address attempts, because they only
-                    # get *more* ambiguous. Plus, the subsequent attempts could
-                    # be incorrect. For example, with this:
-                    #    addy = '100 Broadway'
-                    #    city = 'Manhattan'
-                    #    default_city = 'Brooklyn'
-                    # There are multiple "100 Broadway" addresses in Manhattan,
-                    # so geocoding should fail at this point. It should not
-                    # roll back to try the default_city (Brooklyn).
-                    break
-                except (DoesNotExist, InvalidBlockButValidStreet):
-                    report.append('got nonexistent address "%s"' % attempt)
-                except ParsingError:
-                    report.append('got parsing error "%s"' % attempt)
-            if point is None:
-                continue # This address could not be geocoded.
+# Each worker process keeps one geocoder.
+_worker_geocoder = None
 
-            if point['address'] in addresses_seen:
-                continue
-            if len(para) > 300:
-                try:
-                    excerpt = smart_excerpt(para, addy)
-                except ValueError:
-                    excerpt = para
-            else:
-                excerpt = para
-            result.append((addy, point['point'], excerpt, point['block']))
-            addresses_seen.add(point['address'])
-    return (result, '; '.join(report))
+def _init_worker():
+    # Forked workers must not use the parent's database connection;
+    # drop it (without closing it) so each worker opens its own.
+    from django.db import connection
+    connection.connection = None
+
+def _extract_page_by_id(page_id):
+    try:
+        p = Page.objects.select_related('seed').get(id=page_id)
+        return extract_page_text(p)
+    except Exception:
+        logger.exception('Error extracting text of page %s' % page_id)
+        return None
+
+def _geocode_key(key):
+    global _worker_geocoder
+    if _worker_geocoder is None:
+        _worker_geocoder = SmartGeocoder()
+    try:
+        return geocode_address(*key, geocoder=_worker_geocoder)
+    except Exception:
+        logger.exception('Error geocoding %r' % (key,))
+        return (None, [])
+
+def _prefetched_newsitem_checker(pages, located):
+    # Returns a function like _newsitem_exists() that uses a couple of
+    # queries per batch, rather than one per page.
+    def pub_datetime(d):
+        if not isinstance(d, datetime.datetime):
+            d = datetime.datetime(d.year, d.month, d.day)
+        return d
+    groups = {}
+    for text, locations, location_report in located:
+        if locations:
+            p = pages[text['page_id']]
+            groups.setdefault((p.seed.schema_id, p.seed.pretty_name), []).append(p)
+    seen = set()
+    checked = set()
+    for (schema_id, source), group in groups.items():
+        try:
+            sf = SchemaField.objects.get(schema__id=schema_id, name='source')
+        except SchemaField.DoesNotExist:
+            continue
+        checked.add((schema_id, source))
+        qs = NewsItem.objects.filter(schema__id=schema_id,
+            pub_date__in=set([p.article_date for p in group]),
+            title__in=set([p.article_headline for p in group]))
+        qs = qs.by_attribute(sf, source, is_lookup=True)
+        for pub_date, title, location_name in qs.values_list('pub_date', 'title', 'location_name'):
+            seen.add((schema_id, source, pub_datetime(pub_date), title, location_name))
+
+    def newsitem_exists(p, location_name):
+        group = (p.seed.schema_id, p.seed.pretty_name)
+        if group not in checked:
+            return False
+        key = group + (pub_datetime(p.article_date), p.article_headline, location_name)
+        if key in seen:
+            return True
+        # We're about to create it, so later pages in the batch will
+        # see it as existing.
+        seen.add(key)
+        return False
+    return newsitem_exists
+
+def _read_checkpoint(checkpoint):
+    if checkpoint and os.path.exists(checkpoint):
+        value = open(checkpoint).read().strip()
+        if value:
+            return int(value)
+    return 0
+
+def _write_checkpoint(checkpoint, page_id):
+    if checkpoint:
+        tmpname = checkpoint + '.tmp'
+        f = open(tmpname, 'w')
+        f.write('%d\n' % page_id)
+        f.close()
+        os.rename(tmpname, checkpoint)
+
+def geotag_batch(page_ids, mapper=map, source_cache=None):
+    """
+    Geotags the Pages with the given IDs, saving them all in one
+    transaction. Returns the number of pages that were saved.
+
+    ``mapper`` is used to run the extraction and geocoding stages;
+    pass eg. the ``map`` method of a multiprocessing Pool to run them
+    in parallel.
+    """
+    texts = [t for t in mapper(_extract_page_by_id, page_ids)
+             if t is not None and not t['skip']]
+    keys = _unique_addresses(texts)
+    geocoded = dict(zip(keys, mapper(_geocode_key, keys)))
+    located = [(text,) + page_locations(text, geocoded) for text in texts]
+    pages = Page.objects.select_related('seed').in_bulk([t['page_id'] for t in texts])
+    newsitem_exists = _prefetched_newsitem_checker(pages, located)
+    if source_cache is None:
+        source_cache = {}
+    with transaction.commit_on_success():
+        for text, locations, location_report in located:
+            _save_page(pages[text['page_id']], text, locations, location_report,
+                       newsitem_exists, source_cache)
+    return len(located)
+
+def save_locations_for_ungeocoded_pages(workers=1, batch_size=100, checkpoint=None):
+    """
+    Geotags all Pages that haven't been geocoded yet, ``batch_size`` pages
+    at a time, using ``workers`` processes.
+
+    If ``checkpoint`` is a filename, the ID of the last page of each
+    committed batch is saved there, and the next run starts after it.
+    Pages are committed a batch at a time, so even without a
+    checkpoint, an interrupted run loses at most one batch of work.
+    """
+    last_id = _read_checkpoint(checkpoint)
+    pool = None
+    mapper = map
+    if workers > 1:
+        # Don't let the workers inherit our database connection.
+        from django.db import connection
+        connection.close()
+        pool = multiprocessing.Pool(workers, _init_worker)
+        mapper = pool.map
+    source_cache = {}
+    num_pages = num_saved = 0
+    start = time.time()
+    try:
+        while True:
+            page_ids = list(Page.objects.filter(when_geocoded__isnull=True, id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not page_ids:
+                break
+            num_saved += geotag_batch(page_ids, mapper, source_cache)
+            num_pages += len(page_ids)
+            last_id = page_ids[-1]
+            _write_checkpoint(checkpoint, last_id)
+            logger.info('Geotagged %d of %d pages in %.1fs; last page id %d'
+                        % (num_saved, num_pages, time.time() - start, last_id))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return num_saved
 
-def save_locations_for_ungeocoded_pages():
-    for p in Page.objects.filter(when_geocoded__isnull=True).iterator():
-        save_locations_for_page(p)
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-w', '--workers', type='int', default=1,
+                      help='Number of worker processes. Default 1.')
+    parser.add_option('-b', '--batch-size', type='int', default=100,
+                      help='Number of pages to commit at once. Default 100.')
+    parser.add_option('-c', '--checkpoint', default=None,
+                      help='File in which to save progress, to resume from on the next run.')
+    options, args = parser.parse_args(argv)
+    save_locations_for_ungeocoded_pages(options.workers, options.batch_size,
+                                        options.checkpoint)
 
 if __name__ == "__main__":
     from ebdata.retrieval import log_debug
-    save_locations_for_ungeocoded_pages()
+    main()
@@ -139,8 +139,9 @@ class Page(models.Model):
         other clutter), returning a list of strings. Each string represents a
         paragraph.
         """
-        from ebdata.textmining.treeutils import make_tree
-        tree = make_tree(self.html)
+        from ebdata.textmining.treeutils import tree_cache
+        # mine_page() has probably parsed the same pages already.
+        tree = tree_cache.make_tree(self.html)
         if self.seed.rss_full_entry:
             from ebdata.templatemaker.textlist import html_to_paragraph_list
             paras = html_to_paragraph_list(tree)
@@ -152,7 +153,7 @@ class Page(models.Model):
                 except IndexError:
                     pass
                 else:
-                    tree2 = make_tree(html2)
+                    tree2 = tree_cache.make_tree(html2)
                     strip_template(tree, tree2)
             if self.seed.guess_article_text:
                 from ebdata.templatemaker.articletext import article_text
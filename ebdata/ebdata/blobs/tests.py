@@ -0,0 +1,184 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebdata
+#
+#   ebdata is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebdata is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for ebdata.blobs.
+"""
+
+from ebdata.blobs.update_feeds import FeedUpdater, RateLimitedFetcher
+from ebdata.blobs.update_feeds import update_seeds
+import mock
+import unittest
+
+
+class TestRateLimitedFetcher(unittest.TestCase):
+
+    @mock.patch('ebdata.blobs.update_feeds.time')
+    def test_wait__per_host(self, mock_time):
+        mock_time.time.return_value = 100.0
+        fetcher = RateLimitedFetcher(mock.Mock, default_delay=2)
+        fetcher.wait('http://example.com/a')
+        self.assertEqual(mock_time.sleep.call_count, 0)
+        # Same host has to wait.
+        fetcher.wait('http://EXAMPLE.com/b')
+        mock_time.sleep.assert_called_with(2.0)
+        # ... and the next one waits longer.
+        fetcher.wait('http://example.com/c')
+        mock_time.sleep.assert_called_with(4.0)
+        # Other hosts don't.
+        mock_time.sleep.reset_mock()
+        fetcher.wait('http://example.org/a')
+        self.assertEqual(mock_time.sleep.call_count, 0)
+
+    @mock.patch('ebdata.blobs.update_feeds.time')
+    def test_fetch_data__delay_arg(self, mock_time):
+        mock_time.time.return_value = 100.0
+        retriever = mock.Mock()
+        retriever.fetch_data.return_value = 'data'
+        fetcher = RateLimitedFetcher(lambda: retriever)
+        self.assertEqual(fetcher.fetch_data('http://example.com/', delay=5), 'data')
+        retriever.fetch_data.assert_called_with('http://example.com/')
+        fetcher.fetch_data('http://example.com/')
+        mock_time.sleep.assert_called_with(5.0)
+
+    def test_retriever_per_thread(self):
+        import threading
+        fetcher = RateLimitedFetcher(mock.Mock)
+        retrievers = []
+        def get():
+            retrievers.append(fetcher.get_retriever())
+        threads = [threading.Thread(target=get) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assert_(retrievers[0] is not retrievers[1])
+        self.assert_(fetcher.get_retriever() is fetcher.get_retriever())
+
+
+class TestFeedUpdater(unittest.TestCase):
+
+    def _make_seed(self):
+        seed = mock.Mock()
+        seed.url = 'http://example.com/feed'
+        seed.base_url = 'http://example.com/'
+        seed.normalize_www = 3
+        seed.delay = 0
+        return seed
+
+    @mock.patch('ebdata.blobs.update_feeds.feedparser')
+    def test_update__known_urls(self, mock_feedparser):
+        mock_feedparser.parse.return_value = {'entries': [
+                {'link': 'http://example.com/1', 'title': 'one'},
+                {'link': 'http://example.com/2', 'title': 'two'},
+                {'link': 'http://example.com/2', 'title': 'two again'},
+                {'title': 'no link'},
+                ]}
+        updater = FeedUpdater(self._make_seed(), mock.Mock(), mock.Mock())
+        updater.known_urls = mock.Mock(return_value=set(['http://example.com/1']))
+        updater.save_entry = mock.Mock()
+        updater.update()
+        updater.known_urls.assert_called_once_with(
+            ['http://example.com/1', 'http://example.com/2', 'http://example.com/2'])
+        self.assertEqual(updater.save_entry.call_count, 1)
+        self.assertEqual(updater.save_entry.call_args[0][:2], ('http://example.com/2', 'two'))
+        self.assertEqual(updater.num_created, 1)
+        self.assertEqual(updater.num_skipped, 3)
+
+
+class TestUpdateSeeds(unittest.TestCase):
+
+    def test_failure_isolation(self):
+        seeds = [mock.Mock(), mock.Mock(), mock.Mock()]
+        updated = []
+        def update(updater):
+            updated.append(updater.seed)
+            if updater.seed is seeds[1]:
+                raise ValueError('oops')
+        for workers in (1, 3):
+            del updated[:]
+            with mock.patch.object(FeedUpdater, 'update', update):
+                results = update_seeds(seeds, logger=mock.Mock(), workers=workers)
+            self.assertEqual(len(results), 3)
+            self.assertEqual(len(updated), 3)
+            errors = [r.error for r in results if r.error is not None]
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(errors[0].args, ('oops',))
+            for r in results:
+                self.assert_(r.elapsed >= 0)
+
+
+class TestGeotaggingStages(unittest.TestCase):
+
+    def _mock_geocoder(self, results):
+        from ebpub.geocoder import DoesNotExist
+        geocoder = mock.Mock()
+        def geocode(attempt):
+            if attempt not in results:
+                raise DoesNotExist(attempt)
+            return results[attempt]
+        geocoder.geocode.side_effect = geocode
+        return geocoder
+
+    @mock.patch('ebdata.blobs.geotagging.Suburb')
+    def test_geocode_address__attempts(self, mock_suburb):
+        from ebdata.blobs.geotagging import geocode_address
+        mock_suburb.objects.filter.return_value.count.return_value = 0
+        point = {'address': '100 Main St.', 'point': 'POINT', 'block': None}
+        geocoder = self._mock_geocoder({'100 Main St., Springfield': point})
+        self.assertEqual(
+            geocode_address('100 Main St.', 'Shelbyville', 'Springfield', geocoder),
+            (point, ['got nonexistent address "100 Main St., Shelbyville"']))
+        self.assertEqual([c[0][0] for c in geocoder.geocode.call_args_list],
+                         ['100 Main St., Shelbyville', '100 Main St., Springfield'])
+
+    @mock.patch('ebdata.blobs.geotagging.Suburb')
+    def test_geocode_address__suburb(self, mock_suburb):
+        from ebdata.blobs.geotagging import geocode_address
+        mock_suburb.objects.filter.return_value.count.return_value = 1
+        geocoder = mock.Mock()
+        self.assertEqual(geocode_address('1 Elm St.', 'Suburbia', '', geocoder),
+                         (None, ['got suburb "1 Elm St., Suburbia"']))
+        self.assertEqual(geocoder.geocode.call_count, 0)
+
+    @mock.patch('ebdata.blobs.geotagging.SmartGeocoder')
+    @mock.patch('ebdata.blobs.geotagging.parse_addresses')
+    def test_auto_locations__geocodes_each_address_once(self, mock_parse, mock_geocoder_class):
+        from ebdata.blobs.geotagging import auto_locations
+        point = {'address': '100 Main St.', 'point': 'POINT', 'block': 'BLOCK'}
+        geocoder = self._mock_geocoder({'100 Main St.': point})
+        mock_geocoder_class.return_value = geocoder
+        mock_parse.side_effect = lambda para: {
+            'one': [('100 Main St.', ''), ('9 Nowhere Rd.', '')],
+            'two': [('100 Main St.', ''), ('9 Nowhere Rd.', '')]}[para]
+        result, report = auto_locations(['one', 'two'])
+        self.assertEqual(result, [('100 Main St.', 'POINT', 'one', 'BLOCK')])
+        self.assertEqual(report, '; '.join(['got nonexistent address "9 Nowhere Rd."'] * 2))
+        self.assertEqual(geocoder.geocode.call_count, 2)
+
+    def test_checkpoint(self):
+        import os, tempfile
+        from ebdata.blobs.geotagging import _read_checkpoint, _write_checkpoint
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'checkpoint')
+        self.assertEqual(_read_checkpoint(filename), 0)
+        self.assertEqual(_read_checkpoint(None), 0)
+        _write_checkpoint(filename, 123)
+        self.assertEqual(_read_checkpoint(filename), 123)
+        os.unlink(filename)
+        os.rmdir(dirname)
@@ -50,10 +50,12 @@ from ebdata.templatemaker.htmlutils import printer_friendly_link
 from ebdata.textmining.treeutils import make_tree
 from ebpub.utils.dates import parse_date
 import feedparser
+import Queue
 import cgi
 import datetime
 import logging
 import re
+import threading
 import time
 import urllib
 import urlparse
@@ -135,142 +137,233 @@ def normalize_url(base_href, url, normalize_www_flag):
     return urlparse.urlunparse((scheme, authority, path, parameters, query, ''))
 
 
+class RateLimitedFetcher(object):
+    """
+    Thread-safe wrapper around Retrievers, which makes sure that we
+    don't hit any one host more often than once every ``delay``
+    seconds, no matter how many threads are fetching.
+
+    Each thread gets its own Retriever (made by calling
+    ``retriever_factory``), because httplib2 isn't thread-safe.
+    """
+
+    def __init__(self, retriever_factory=None, default_delay=0):
+        if retriever_factory is None:
+            retriever_factory = lambda: UnicodeRetriever(cache=None)
+        self.retriever_factory = retriever_factory
+        self.default_delay = default_delay
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next_request_time = {}  # {host: earliest time of next request}
+
+    def get_retriever(self):
+        retriever = getattr(self._local, 'retriever', None)
+        if retriever is None:
+            retriever = self._local.retriever = self.retriever_factory()
+        return retriever
+
+    def wait(self, url, delay=None):
+        """
+        Blocks until we're allowed to make a request to the host of
+        ``url``, and reserves the following ``delay`` seconds.
+        """
+        if delay is None:
+            delay = self.default_delay
+        host = urlparse.urlparse(url)[1].lower()
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next_request_time.get(host, 0))
+            self._next_request_time[host] = start + delay
+        if start > now:
+            time.sleep(start - now)
+
+    def fetch_data(self, uri, *args, **kwargs):
+        """
+        Like Retriever.fetch_data(), but takes an extra ``delay``
+        keyword argument; see wait().
+        """
+        self.wait(uri, kwargs.pop('delay', None))
+        return self.get_retriever().fetch_data(uri, *args, **kwargs)
+
+
 class FeedUpdater(object):
     def __init__(self, seed, retriever, logger):
         self.seed = seed
+        if not isinstance(retriever, RateLimitedFetcher):
+            # A plain Retriever; only safe to use in this thread.
+            retriever = RateLimitedFetcher(lambda r=retriever: r)
         self.retriever = retriever
         self.logger = logger
+        # Stats about the last update().
+        self.num_created = 0
+        self.num_skipped = 0
+        self.num_errors = 0
+        self.elapsed = None
+        self.error = None
 
     def update(self):
+        self.num_created = self.num_skipped = self.num_errors = 0
         try:
             feed = feedparser.parse(self.seed.url)
         except UnicodeDecodeError:
             self.logger.info('UnicodeDecodeError on %r', self.seed.url)
             return
+        entries = []
         for entry in feed['entries']:
-            if 'feedburner_origlink' in entry:
-                url = entry['feedburner_origlink']
-            elif 'pheedo_origLink' in entry:
-                url = entry['pheedo_origLink']
-            elif 'link' in entry:
-                url = entry['link']
+            cleaned = self.clean_entry(entry)
+            if cleaned is None:
+                self.num_skipped += 1
             else:
-                continue # Skip entries with no link.
+                entries.append(cleaned)
 
-            try:
-                url = normalize_url(self.seed.base_url, url, self.seed.normalize_www)
-            except Exception:
-                self.logger.warn('Problem normalizing URL: %r, %r, %r', self.seed.base_url, url, self.seed.normalize_www)
+        # If we've already retrieved a page, there's no need to retrieve
+        # it again. Check them all with one query.
+        known_urls = self.known_urls([url for (url, title, article_date, entry) in entries])
+        for url, title, article_date, entry in entries:
+            if url in known_urls:
+                self.logger.debug('URL %s has already been retrieved', url)
+                self.num_skipped += 1
                 continue
+            # Feeds sometimes list the same article twice.
+            known_urls.add(url)
+            if self.save_entry(url, title, article_date, entry) is None:
+                self.num_skipped += 1
+            else:
+                self.num_created += 1
 
-            if not url:
-                self.logger.info('Skipping article with empty URL: %r, %r', self.seed.base_url, url)
-                continue
+    def clean_entry(self, entry):
+        """
+        Given a feed entry, returns a tuple of (url, title, article_date,
+        entry), or None if the entry should be skipped.
+        """
+        if 'feedburner_origlink' in entry:
+            url = entry['feedburner_origlink']
+        elif 'pheedo_origLink' in entry:
+            url = entry['pheedo_origLink']
+        elif 'link' in entry:
+            url = entry['link']
+        else:
+            return None # Skip entries with no link.
 
-            if len(url) > 512:
-                self.logger.warning('Skipping long URL %s', url)
-                continue
+        try:
+            url = normalize_url(self.seed.base_url, url, self.seed.normalize_www)
+        except Exception:
+            self.logger.warn('Problem normalizing URL: %r, %r, %r', self.seed.base_url, url, self.seed.normalize_www)
+            return None
 
-            article_date = entry.get('updated_parsed') and datetime.date(*entry['updated_parsed'][:3]) or None
-            if article_date and article_date > datetime.date.today():
-                # Skip articles in the future, because sometimes articles show
-                # up in the feed before they show up on the site, and we don't
-                # want to retrieve the article until it actually exists.
-                self.logger.info('Skipping article_date %s, which is in the future', article_date)
-                continue
+        if not url:
+            self.logger.info('Skipping article with empty URL: %r, %r', self.seed.base_url, url)
+            return None
 
-            url = self.normalize_url(url)
+        if len(url) > 512:
+            self.logger.warning('Skipping long URL %s', url)
+            return None
 
-            try:
-                title = entry['title']
-            except KeyError:
-                self.logger.debug('Skipping %s due to missing title', url)
-                continue
+        article_date = entry.get('updated_parsed') and datetime.date(*entry['updated_parsed'][:3]) or None
+        if article_date and article_date > datetime.date.today():
+            # Skip articles in the future, because sometimes articles show
+            # up in the feed before they show up on the site, and we don't
+            # want to retrieve the article until it actually exists.
+            self.logger.info('Skipping article_date %s, which is in the future', article_date)
+            return None
 
-            if not self.download_page(url, title):
-                self.logger.debug('Skipping %s due to download_page()', url)
-                continue
+        url = self.normalize_url(url)
+
+        try:
+            title = entry['title']
+        except KeyError:
+            self.logger.debug('Skipping %s due to missing title', url)
+            return None
+
+        if not self.download_page(url, title):
+            self.logger.debug('Skipping %s due to download_page()', url)
+            return None
+        return (url, title, article_date, entry)
+
+    def known_urls(self, urls):
+        """
+        Returns the set of the given URLs that we already have Pages for.
+        """
+        if not urls:
+            return set()
+        return set(Page.objects.filter(url__in=urls).values_list('url', flat=True))
 
-            # If we've already retrieved the page, there's no need to retrieve
-            # it again.
+    def save_entry(self, url, title, article_date, entry):
+        """
+        Retrieves the article for a feed entry and saves it as a Page.
+        Returns the Page, or None if nothing was saved.
+        """
+        # If this seed contains the full content in the RSS feed <summary>,
+        # then we just use it instead of downloading the contents.
+        if self.seed.rss_full_entry:
+            is_printer_friendly = False
             try:
-                Page.objects.filter(url=url)[0]
-            except IndexError:
-                pass
-            else:
-                self.logger.debug('URL %s has already been retrieved', url)
-                continue
+                html = entry['summary']
+            except KeyError:
+                html = entry['description']
+        else:
+            is_printer_friendly = False
+            html = None
 
-            # If this seed contains the full content in the RSS feed <summary>,
-            # then we just use it instead of downloading the contents.
-            if self.seed.rss_full_entry:
-                is_printer_friendly = False
+            # First, try deducing for the printer-friendly page, given the URL.
+            print_url = self.get_printer_friendly_url(url)
+            if print_url is not None:
                 try:
-                    html = entry['summary']
-                except KeyError:
-                    html = entry['description']
-            else:
-                is_printer_friendly = False
-                html = None
-                time.sleep(self.seed.delay)
-
-                # First, try deducing for the printer-friendly page, given the URL.
-                print_url = self.get_printer_friendly_url(url)
-                if print_url is not None:
-                    try:
-                        html = self.get_article_page(print_url)
-                        is_printer_friendly = True
-                    except Exception, e:
-                        self.logger.info('Error retrieving supposedly accurate printer-friendly page %s: %s', print_url, e)
-
-                # If a printer-friendly page didn't exist, get the real page.
-                if html is None:
-                    try:
-                        html = self.get_article_page(url)
-                    except Exception, e:
-                        self.logger.info('Error retrieving %s: %s', url, e)
-                        continue
-
-                    # If a page was downloaded, try looking for a printer-friendly
-                    # link, and download that.
-                    print_page = self.get_printer_friendly_page(html, url)
-                    if print_page is not None:
-                        is_printer_friendly = True
-                        html = print_page
-
-                new_html = self.scrape_article_from_page(html)
-                if new_html is not None:
-                    html = new_html
-
-                if article_date is None:
-                    article_date = self.scrape_article_date_from_page(html)
-
-            if not html.strip():
-                self.logger.debug('Got empty HTML page')
-                continue
+                    html = self.get_article_page(print_url)
+                    is_printer_friendly = True
+                except Exception, e:
+                    self.logger.info('Error retrieving supposedly accurate printer-friendly page %s: %s', print_url, e)
 
-            article_headline = strip_tags(title)
-            if len(article_headline) > 252:
-                article_headline = article_headline[252:] + '...'
-            p = Page.objects.create(
-                seed=self.seed,
-                url=url,
-                scraped_url=(is_printer_friendly and print_url or url),
-                html=html,
-                when_crawled=datetime.datetime.now(),
-                is_article=True,
-                is_pdf=False,
-                is_printer_friendly=is_printer_friendly,
-                article_headline=article_headline,
-                article_date=article_date,
-                has_addresses=None,
-                when_geocoded=None,
-                geocoded_by='',
-                times_skipped=0,
-                robot_report='',
-            )
-            self.logger.info('Created %s story %r', self.seed.base_url, article_headline)
-            save_locations_for_page(p)
+            # If a printer-friendly page didn't exist, get the real page.
+            if html is None:
+                try:
+                    html = self.get_article_page(url)
+                except Exception, e:
+                    self.logger.info('Error retrieving %s: %s', url, e)
+                    self.num_errors += 1
+                    return None
+
+                # If a page was downloaded, try looking for a printer-friendly
+                # link, and download that.
+                print_page = self.get_printer_friendly_page(html, url)
+                if print_page is not None:
+                    is_printer_friendly = True
+                    html = print_page
+
+            new_html = self.scrape_article_from_page(html)
+            if new_html is not None:
+                html = new_html
+
+            if article_date is None:
+                article_date = self.scrape_article_date_from_page(html)
+
+        if not html.strip():
+            self.logger.debug('Got empty HTML page')
+            return None
+
+        article_headline = strip_tags(title)
+        if len(article_headline) > 252:
+            article_headline = article_headline[252:] + '...'
+        p = Page.objects.create(
+            seed=self.seed,
+            url=url,
+            scraped_url=(is_printer_friendly and print_url or url),
+            html=html,
+            when_crawled=datetime.datetime.now(),
+            is_article=True,
+            is_pdf=False,
+            is_printer_friendly=is_printer_friendly,
+            article_headline=article_headline,
+            article_date=article_date,
+            has_addresses=None,
+            when_geocoded=None,
+            geocoded_by='',
+            times_skipped=0,
+            robot_report='',
+        )
+        self.logger.info('Created %s story %r', self.seed.base_url, article_headline)
+        save_locations_for_page(p)
+        return p
 
     def normalize_url(self, url):
         """
@@ -286,7 +379,7 @@ class FeedUpdater(object):
         return True
 
     def get_article_page(self, url):
-        return self.retriever.fetch_data(url)
+        return self.retriever.fetch_data(url, delay=self.seed.delay)
 
     def get_printer_friendly_url(self, url):
         """
@@ -325,19 +418,109 @@ class FeedUpdater(object):
         """
         return None
 
-def update(seed_id=None):
+def update_seed(seed, fetcher, logger):
+    """
+    Runs a FeedUpdater for one Seed, catching and logging any
+    exception so that one broken seed doesn't stop the others.
+    Returns the FeedUpdater, whose ``num_created``, ``num_skipped``,
+    ``num_errors``, ``elapsed`` and ``error`` attributes describe
+    what happened.
+    """
+    updater = FeedUpdater(seed, fetcher, logger)
+    start = time.time()
+    try:
+        updater.update()
+    except Exception, e:
+        updater.error = e
+        logger.exception('Error updating seed %s', seed.url)
+        # Don't leave the connection in an aborted transaction.
+        from django.db import connection
+        connection._rollback()
+    updater.elapsed = time.time() - start
+    return updater
+
+def _update_worker(seed_queue, fetcher, logger, results):
+    from django.db import connection
+    try:
+        while True:
+            try:
+                seed = seed_queue.get_nowait()
+            except Queue.Empty:
+                return
+            results.append(update_seed(seed, fetcher, logger))
+    finally:
+        # Django opens one connection per thread; don't leak them.
+        connection.close()
+
+def update_seeds(seeds, fetcher=None, logger=None, workers=1):
+    """
+    Updates all the given Seeds, using ``workers`` threads.
+    Downloads all go through ``fetcher`` (a RateLimitedFetcher),
+    so each host is still only hit once every ``seed.delay`` seconds.
+
+    Returns a list of FeedUpdaters, one per seed; see update_seed().
+    """
+    if fetcher is None:
+        fetcher = RateLimitedFetcher()
+    if logger is None:
+        logger = logging.getLogger('eb.retrieval.blob_rss')
+    results = []
+    if workers <= 1:
+        for seed in seeds:
+            results.append(update_seed(seed, fetcher, logger))
+        return results
+    seed_queue = Queue.Queue()
+    for seed in seeds:
+        seed_queue.put(seed)
+    threads = [threading.Thread(target=_update_worker,
+                                args=(seed_queue, fetcher, logger, results))
+               for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def log_report(results, logger):
+    """
+    Logs per-seed timings and failures for the results of update_seeds().
+    """
+    results = sorted(results, key=lambda r: r.elapsed, reverse=True)
+    for r in results:
+        if r.error is not None:
+            logger.error('%s: FAILED after %.1fs: %s', r.seed.url, r.elapsed, r.error)
+        else:
+            logger.info('%s: %d new, %d skipped, %d errors in %.1fs', r.seed.url,
+                        r.num_created, r.num_skipped, r.num_errors, r.elapsed)
+    failed = len([r for r in results if r.error is not None])
+    logger.info('Updated %d seeds (%d failed): %d new pages in %.1fs total seed time',
+                len(results), failed, sum([r.num_created for r in results]),
+                sum([r.elapsed for r in results]))
+
+def update(seed_id=None, workers=1):
     """
     Retrieves and saves every new item for every Seed that is an RSS feed.
+
+    If ``workers`` is more than 1, that many seeds are updated in parallel.
     """
-    retriever = UnicodeRetriever(cache=None)
     logger = logging.getLogger('eb.retrieval.blob_rss')
     qs = Seed.objects.filter(is_rss_feed=True, is_active=True)
     if seed_id is not None:
         qs = qs.filter(id=seed_id)
-    for seed in qs:
-        updater = FeedUpdater(seed, retriever, logger)
-        updater.update()
+    results = update_seeds(list(qs), RateLimitedFetcher(), logger, workers)
+    log_report(results, logger)
+    return results
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-w', '--workers', type='int', default=1,
+                      help='Number of seeds to update in parallel. Default 1.')
+    parser.add_option('-s', '--seed-id', type='int', default=None,
+                      help='Only update the Seed with this ID.')
+    options, args = parser.parse_args(argv)
+    update(options.seed_id, options.workers)
 
 if __name__ == "__main__":
     from ebdata.retrieval import log_debug
-    update()
+    main()
@@ -299,14 +299,69 @@ ADDRESSES_RE = r"""(?x)
 
 ADDRESSES_RE_COMPILED = re.compile(ADDRESSES_RE)
 
+# ADDRESSES_RE is slow, and most paragraphs of most news stories don't
+# contain any addresses. ADDRESS_HINT_RE is a much cheaper regex that
+# matches anything ADDRESSES_RE can match, and hopefully not much
+# else. Every match of ADDRESSES_RE must contain one of:
+#   * a digit (block or address), or "block of" ("First block of Main");
+#   * "between" or "from" (segment);
+#   * a space and an intersection word, followed by the start of a
+#     street name, which is a capital letter, a digit, a direction,
+#     "St" or "Dr".
+# If you change ADDRESSES_RE, make sure this still holds.
+ADDRESS_HINT_RE = re.compile(r"""(?x)
+    \d
+    |
+    [Bb][Ll][Oo][Cc][Kk]\ [Oo][Ff]
+    |
+    between | from
+    |
+    \ (?:
+        [Aa][Nn][Dd] | [Aa][Tt] | [Nn][Ee][Aa][Rr] | & | [Aa][Rr][Oo][Uu][Nn][Dd] |
+        [Tt][Oo][Ww][Aa][Rr][Dd][Ss]? | [Oo][Ff][Ff]? | [Pp][Aa][Ss][Tt]
+    )
+    \ +
+    (?:
+        [A-Z]
+        |
+        [nsew]\.?\ +
+        |
+        [Nn][Oo][Rr][Tt][Hh] | [Ss][Oo][Uu][Tt][Hh] | [Ee][Aa][Ss][Tt] | [Ww][Ee][Ss][Tt]
+        |
+        [Ss][Tt]\.?\ +
+        |
+        [Dd][Rr]\.?\ +
+    )
+    """)
+
+def might_contain_address(text):
+    """
+    Quick check whether the given string could contain any addresses.
+    If this returns False, parse_addresses(text) would return an empty list.
+    """
+    return ADDRESS_HINT_RE.search(text) is not None
+
 def parse_addresses(text):
     """
     Returns a list of all addresses found in the given string, as tuples in the
     format (address, city).
     """
+    if not might_contain_address(text):
+        return []
     # This assumes the last parenthetical grouping in ADDRESSES_RE is the city.
     return [(''.join(bits[:-1]), bits[-1]) for bits in ADDRESSES_RE_COMPILED.findall(text)]
 
+def iter_addresses(text):
+    """
+    Like parse_addresses(), but generates (address, city, start, end)
+    tuples, where start and end are the offsets of the match in text.
+    """
+    if not might_contain_address(text):
+        return
+    for m in ADDRESSES_RE_COMPILED.finditer(text):
+        bits = m.groups('')
+        yield (''.join(bits[:-1]), bits[-1], m.start(), m.end())
+
 def tag_addresses(text, pre='<addr>', post='</addr>'):
     """
     "Tags" any addresses in the given string by surrounding them with pre and post.
@@ -317,4 +372,6 @@ def tag_addresses(text, pre='<addr>', post='</addr>'):
     def _re_handle_address(m):
         bits = m.groups()
         return pre + ''.join(filter(None, bits[:-1])) + (bits[-1] and (', %s' % bits[-1]) or '') + post
+    if not might_contain_address(text):
+        return text
     return ADDRESSES_RE_COMPILED.sub(_re_handle_address, text)
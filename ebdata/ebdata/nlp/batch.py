@@ -0,0 +1,102 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebdata
+#
+#   ebdata is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebdata is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Address and dateline extraction over many documents at once.
+
+``documents`` can be any iterable (eg. a generator) of strings, or of
+(doc_id, text) pairs; plain strings get their position as doc_id.
+Results are generated lazily, one (doc_id, matches) pair per document
+and in the same order, so this works on corpora that don't fit in
+memory::
+
+    for doc_id, addresses in extract_addresses(paragraphs, workers=4):
+        for address, city, start, end in addresses:
+            ...
+
+Documents that can't contain a match are skipped cheaply (see
+:py:func:`ebdata.nlp.addresses.might_contain_address`), and with
+``workers`` > 1, large batches are spread over a pool of processes.
+"""
+
+from ebdata.nlp.addresses import iter_addresses
+from ebdata.nlp.datelines import iter_datelines
+import itertools
+import multiprocessing
+
+# With fewer documents than this, starting a process pool costs
+# more than it saves.
+MIN_PARALLEL_DOCUMENTS = 500
+
+def _documents(documents):
+    for i, doc in enumerate(documents):
+        if isinstance(doc, basestring):
+            yield (i, doc)
+        else:
+            yield doc
+
+def _addresses_for(document):
+    doc_id, text = document
+    return (doc_id, list(iter_addresses(text or '')))
+
+def _datelines_for(document):
+    doc_id, text = document
+    return (doc_id, list(iter_datelines(text or '')))
+
+def _extract(func, documents, workers, chunksize):
+    documents = _documents(documents)
+    if workers > 1:
+        head = list(itertools.islice(documents, MIN_PARALLEL_DOCUMENTS))
+        if len(head) < MIN_PARALLEL_DOCUMENTS:
+            workers = 1
+        documents = itertools.chain(head, documents)
+    if workers <= 1:
+        for document in documents:
+            yield func(document)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(func, documents, chunksize):
+            yield result
+    finally:
+        # Also stops the workers if the caller doesn't consume everything.
+        pool.terminate()
+        pool.join()
+
+def extract_addresses(documents, workers=1, chunksize=100):
+    """
+    Finds the addresses in each of ``documents``, generating a
+    (doc_id, addresses) pair per document, where addresses is a list
+    of (address, city, start, end) tuples; start and end are the
+    offsets of the whole match in the text.
+
+    The (address, city) parts are exactly what
+    :py:func:`ebdata.nlp.addresses.parse_addresses` returns.
+    """
+    return _extract(_addresses_for, documents, workers, chunksize)
+
+def extract_datelines(documents, workers=1, chunksize=100):
+    """
+    Finds the datelines in each of ``documents``, generating a
+    (doc_id, datelines) pair per document, where datelines is a list
+    of (dateline, start, end) tuples.
+
+    The datelines are exactly what
+    :py:func:`ebdata.nlp.datelines.guess_datelines` returns.
+    """
+    return _extract(_datelines_for, documents, workers, chunksize)
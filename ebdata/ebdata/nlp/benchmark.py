@@ -0,0 +1,101 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebdata
+#
+#   ebdata is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebdata is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks for :py:mod:`ebdata.nlp.batch`, on a generated corpus of
+news article paragraphs, some of which mention addresses, intersections
+or datelines.
+
+Run it like::
+
+    python -m ebdata.nlp.benchmark [--paragraphs=N] [--workers=N]
+"""
+
+from ebdata.nlp.addresses import ADDRESSES_RE_COMPILED
+from ebdata.nlp.batch import extract_addresses, extract_datelines
+from ebdata.nlp.datelines import dateline_re
+import multiprocessing
+import random
+import time
+
+WORDS = ('the city council police officials said on monday after residents '
+         'of the neighborhood complained at a meeting about permits for '
+         'schools and parks while the fire department and public works '
+         'crews responded to reports').split()
+
+NAMES = ('Main', 'Oak', 'Elm', 'Washington', 'Lake', 'Park', 'Halsted', 'Clark')
+
+def make_paragraph(rand):
+    words = [rand.choice(WORDS) for i in range(rand.randint(25, 70))]
+    words[0] = words[0].capitalize()
+    text = ' '.join(words)
+    roll = rand.random()
+    if roll < 0.05:
+        text += ' at %d %s St.' % (rand.randint(1, 9999), rand.choice(NAMES))
+    elif roll < 0.08:
+        text += ' near %s and %s' % (rand.choice(NAMES), rand.choice(NAMES))
+    elif roll < 0.10:
+        text = 'CHICAGO -- ' + text
+    elif roll < 0.30:
+        text += ' said Mayor %s.' % rand.choice(NAMES)
+    return text + '.'
+
+def make_corpus(paragraphs, seed=1):
+    rand = random.Random(seed)
+    return [make_paragraph(rand) for i in range(paragraphs)]
+
+def _timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+def regex_only(corpus):
+    # What callers did before: run both big regexes on every paragraph.
+    for text in corpus:
+        ADDRESSES_RE_COMPILED.findall(text)
+        dateline_re.findall(text)
+
+def batch(corpus, workers):
+    for result in extract_addresses(corpus, workers):
+        pass
+    for result in extract_datelines(corpus, workers):
+        pass
+
+def run(paragraphs=20000, workers=None, out=None):
+    import sys
+    out = out or sys.stdout
+    workers = workers or multiprocessing.cpu_count()
+    corpus = make_corpus(paragraphs)
+    out.write('%d paragraphs, %d bytes\n' % (len(corpus), sum(map(len, corpus))))
+    out.write('%-30s %8.3fs\n' % ('regex on every paragraph', _timeit(regex_only, corpus)))
+    out.write('%-30s %8.3fs\n' % ('batch, 1 process', _timeit(batch, corpus, 1)))
+    if workers > 1:
+        out.write('%-30s %8.3fs\n' % ('batch, %d processes' % workers, _timeit(batch, corpus, workers)))
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-p', '--paragraphs', type='int', default=20000,
+                      help='Number of paragraphs in the corpus. Default 20000.')
+    parser.add_option('-w', '--workers', type='int', default=None,
+                      help='Number of worker processes. Default is the number of CPUs.')
+    options, args = parser.parse_args(argv)
+    run(options.paragraphs, options.workers)
+
+if __name__ == '__main__':
+    main()
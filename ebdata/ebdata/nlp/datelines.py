@@ -51,9 +51,32 @@ dateline_re = re.compile(ur"""
 # &#151; = em dash as HTML char ref, numeric
 # &#x97; = em dash as HTML char ref, hex
 
+# Every dateline is followed by one of the dashes above; looking for
+# those first is much quicker than running dateline_re on everything.
+dash_re = re.compile(ur'--|\x97|\u2014|\u2015|&\#(?:8213|151|x97);')
+
+def might_contain_dateline(text):
+    """
+    Quick check whether the given text could contain any datelines.
+    If this returns False, guess_datelines(text) would return an empty list.
+    """
+    return dash_re.search(text) is not None
+
 def guess_datelines(text):
     """
     Given some text (with or without HTML), returns a list of the dateline(s)
     in it. Returns an empty list if none are found.
     """
+    if not might_contain_dateline(text):
+        return []
     return dateline_re.findall(text)
+
+def iter_datelines(text):
+    """
+    Like guess_datelines(), but generates (dateline, start, end) tuples,
+    where start and end are the offsets of the dateline in text.
+    """
+    if not might_contain_dateline(text):
+        return
+    for m in dateline_re.finditer(text):
+        yield (m.group(1), m.start(1), m.end(1))
@@ -22,3 +22,4 @@ if not settings.TEST_RUNNER.count('Nose'):
     # But it tricks Nose into running the tests twice.
     from .tests import *
     from .test_datelines import *
+    from .test_batch import *
@@ -0,0 +1,89 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebdata
+#
+#   ebdata is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebdata is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from ebdata.nlp import batch
+from ebdata.nlp.addresses import might_contain_address, parse_addresses
+from ebdata.nlp.addresses import ADDRESSES_RE_COMPILED
+from ebdata.nlp.datelines import might_contain_dateline
+import unittest
+
+class PrefilterTestCase(unittest.TestCase):
+
+    def test_addresses_without_digits(self):
+        # The prefilter must not drop anything that ADDRESSES_RE matches.
+        for text in ('Police were called to Main and Elm.',
+                     'It happened near N. Halsted & W. Division',
+                     'Broadway between Elm and Oak was closed',
+                     'Lake Shore Drive from Belmont to Diversey',
+                     'on the First block of Main St.',
+                     'at e Main and n Elm',
+                     'Halsted just north of Division',
+                     'Dr. Martin Luther King Jr. Drive and Halsted'):
+            self.assertTrue(ADDRESSES_RE_COMPILED.search(text), text)
+            self.assertTrue(might_contain_address(text), text)
+
+    def test_no_address(self):
+        text = 'The council said on Monday that residents complained about parks.'
+        self.assertFalse(might_contain_address(text))
+        self.assertEqual(parse_addresses(text), [])
+
+    def test_datelines(self):
+        self.assertTrue(might_contain_dateline('CHICAGO -- Something'))
+        self.assertTrue(might_contain_dateline(u'CHICAGO \u2014 Something'))
+        self.assertTrue(might_contain_dateline('CHICAGO &#151; Something'))
+        self.assertFalse(might_contain_dateline('CHICAGO - Something'))
+
+class BatchExtractionTestCase(unittest.TestCase):
+
+    documents = ['A fire broke out at 123 Main St. on Monday.',
+                 'Nothing to see here.',
+                 'CHICAGO -- Police closed Main and Elm, in Evanston.']
+
+    def test_addresses(self):
+        result = list(batch.extract_addresses(self.documents))
+        self.assertEqual(result,
+                         [(0, [('123 Main St.', '', 20, 32)]),
+                          (1, []),
+                          (2, [('Main and Elm', 'Evanston', 25, 50)])])
+        self.assertEqual(self.documents[2][25:50], 'Main and Elm, in Evanston')
+
+    def test_doc_ids(self):
+        documents = (('a', self.documents[0]), ('b', None))
+        self.assertEqual([doc_id for doc_id, matches in batch.extract_addresses(documents)],
+                         ['a', 'b'])
+
+    def test_datelines(self):
+        result = list(batch.extract_datelines(iter(self.documents)))
+        self.assertEqual(result, [(0, []), (1, []), (2, [('CHICAGO', 0, 7)])])
+
+    def test_workers(self):
+        old_min = batch.MIN_PARALLEL_DOCUMENTS
+        batch.MIN_PARALLEL_DOCUMENTS = 2
+        try:
+            documents = self.documents * 10
+            self.assertEqual(list(batch.extract_addresses(documents, workers=2, chunksize=3)),
+                             list(batch.extract_addresses(documents)))
+        finally:
+            batch.MIN_PARALLEL_DOCUMENTS = old_min
+
+    def test_same_as_parse_addresses(self):
+        for doc_id, matches in batch.extract_addresses(self.documents):
+            self.assertEqual([m[:2] for m in matches], parse_addresses(self.documents[doc_id]))
+
+if __name__ == "__main__":
+    unittest.main()
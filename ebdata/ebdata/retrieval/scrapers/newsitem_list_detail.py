@@ -18,8 +18,10 @@
 
 from django.conf import settings
 from ebdata.retrieval.scrapers.list_detail import ListDetailScraper
+from ebdata.retrieval.updaterdaemon import scheduler
 from ebdata.retrieval.utils import locations_are_close
-from ebpub.db.models import Schema, NewsItem, Lookup, DataUpdate, field_mapping
+from ebpub.db.lookupcache import LookupCache
+from ebpub.db.models import Schema, NewsItem, DataUpdate, field_mapping
 from ebpub.geocoder import SmartGeocoder, GeocodingException, ParsingError, AmbiguousResult
 from ebpub.geocoder.reverse import reverse_geocode
 
@@ -57,6 +59,10 @@ class NewsItemListDetailScraper(ListDetailScraper):
     SchemaField, mapping the name to the real_name.
     If schema_slugs has more than one element, self.schema_field_mapping
     is a dictionary in the format {schema_slug: {name: real_name}}.
+
+    self.get_or_create_lookup() and self.get_or_create_lookups() use
+    one :py:class:`ebpub.db.lookupcache.LookupCache` per SchemaField,
+    which is reset at the start of each update().
     """
     schema_slugs = None
     logname = None
@@ -70,6 +76,7 @@ class NewsItemListDetailScraper(ListDetailScraper):
         self._lookups_cache = None
         self._schema_fields_cache = None
         self._schema_field_mapping_cache = None
+        self._lookup_caches = {}
 
     # schemas, schema, lookups and schema_field_mapping are all lazily loaded
     # so that this scraper can be run (in raw_data(), xml_data() or
@@ -130,12 +137,31 @@ class NewsItemListDetailScraper(ListDetailScraper):
         If make_text_slug is True, then a slug will be created from the given
         name. If it's False, then the slug will be the Lookup's ID.
         """
-        if len(self.schema_slugs) > 1:
-            sf = self.lookups[schema][schema_field_name]
-        else:
-            sf = self.lookups[schema_field_name]
-        return Lookup.objects.get_or_create_lookup(sf, name, code, description, make_text_slug, self.logger)
+        cache = self.lookup_cache(schema_field_name, schema)
+        return cache.get_or_create(name, code, description, make_text_slug)
+
+    def get_or_create_lookups(self, schema_field_name, values, schema=None, make_text_slug=True):
+        """
+        Like get_or_create_lookup(), for a list of (name, code) or
+        (name, code, description) tuples. Returns a list of Lookups in
+        the same order, creating any missing ones in one batch.
+        """
+        cache = self.lookup_cache(schema_field_name, schema)
+        return cache.get_or_create_many(values, make_text_slug)
 
+    def lookup_cache(self, schema_field_name, schema=None):
+        """
+        Returns the LookupCache for the given SchemaField name
+        (and Schema slug, if there's more than one schema).
+        """
+        key = (schema, schema_field_name)
+        if key not in self._lookup_caches:
+            if len(self.schema_slugs) > 1:
+                sf = self.lookups[schema][schema_field_name]
+            else:
+                sf = self.lookups[schema_field_name]
+            self._lookup_caches[key] = LookupCache(sf, self.logger)
+        return self._lookup_caches[key]
 
 
     def update(self):
@@ -144,6 +170,7 @@ class NewsItemListDetailScraper(ListDetailScraper):
         """
         self.num_added = 0
         self.num_changed = 0
+        self._lookup_caches = {}
         update_start = datetime.datetime.now()
 
         # We use a try/finally here so that the DataUpdate object is created
@@ -166,10 +193,11 @@ class NewsItemListDetailScraper(ListDetailScraper):
             # updated in the database since we started the scrape.
             self._schemas_cache = self._schema_cache = None
 
+            data_update_ids = []
             for s in self.schemas.values():
                 s.last_updated = datetime.date.today()
                 s.save()
-                DataUpdate.objects.create(
+                data_update = DataUpdate.objects.create(
                     schema=s,
                     update_start=update_start,
                     update_finish=update_finish,
@@ -182,6 +210,13 @@ class NewsItemListDetailScraper(ListDetailScraper):
                     num_skipped=self.num_skipped,
                     got_error=got_error,
                 )
+                data_update_ids.append(data_update.id)
+
+            # Let the updaterdaemon scheduler know, if we're running under it.
+            scheduler.record_update(num_added=self.num_added,
+                                    num_changed=self.num_changed,
+                                    num_skipped=self.num_skipped,
+                                    data_update_ids=data_update_ids)
 
 
     def safe_location(self, location_name, geom, max_distance=200):
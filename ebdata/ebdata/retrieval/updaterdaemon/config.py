@@ -88,5 +88,12 @@ TASKS = (
     #
     # Example:
     # (daily(12, 0), run_some_function, {'arg': 'foo'}, {'DJANGO_SETTINGS_MODULE': 'foo.settings'})
+    #
+    # You can also use ebdata.retrieval.updaterdaemon.scheduler.Task
+    # instances, which take the same arguments plus optional name,
+    # priority (higher runs first when all workers are busy) and
+    # timeout (in seconds). Example:
+    # Task(multiple_hourly(0, 30), run_some_function, {'arg': 'foo'},
+    #      {'DJANGO_SETTINGS_MODULE': 'foo.settings'}, priority=10, timeout=20 * 60)
 )
 
@@ -16,6 +16,7 @@
 #   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from ebdata.retrieval.updaterdaemon import scheduler
 from ebdata.utils.daemon import Daemon
 import datetime
 import os
@@ -66,8 +67,15 @@ class UpdaterDaemon(EveryMinuteDaemon):
     A (deprecated) daemon for running OpenBlock scrapers based on a config file.
 
     We now recommend just using cron or your preferred scheduling tool instead.
+
+    Tasks are run by a :py:class:`ebdata.retrieval.updaterdaemon.scheduler.Scheduler`,
+    at most ``--workers`` at a time; the ``status`` command prints
+    how they've been doing.
     """
 
+    usage = "usage: %prog [options] start|stop|restart|status"
+    commands = Daemon.commands + ('status',)
+
     def __init__(self, *args, **kwargs):
         import warnings
         warnings.warn("UpdaterDaemon is deprecated, see http://openblockproject.org/docs/main/running_scrapers.html",
@@ -83,6 +91,12 @@ class UpdaterDaemon(EveryMinuteDaemon):
         self.parser.add_option("--log-file",
                                help="path to log file.",
                                action="store", default="/tmp/updaterdaemon.err")
+        self.parser.add_option("-w", "--workers",
+                               help="max number of tasks to run at once (default %d)." % scheduler.MAX_WORKERS,
+                               action="store", type="int", default=scheduler.MAX_WORKERS)
+        self.parser.add_option("--status-file",
+                               help="path to JSON status file.",
+                               action="store", default="/tmp/updaterdaemon.json")
 
     def parse_args(self, argv):
         """Given sys.argv, parses the command-line arguments.
@@ -101,57 +115,37 @@ class UpdaterDaemon(EveryMinuteDaemon):
         if configdir not in sys.path:
             sys.path.insert(0, configdir)
         self.config = __import__(configfile)
+        self.scheduler = scheduler.Scheduler(
+            max_workers=self.options.workers,
+            status_file=self.options.status_file)
 
-    def handle_time(self, timestamp):
-        # Get the tasks for the given timestamp, and run any that need to be
-        # run. Reload the config to take into account any changes that might
-        # have been made.
+    def get_tasks(self):
+        """
+        Returns the config's TASKS, reloading the config first to take
+        into account any changes that might have been made.
+        """
         reload(self.config)
-        for check, func, kwargs, env in self.config.TASKS:
-            if check(timestamp):
-                # Fork a child process and grandchild process, and kill the
-                # child process immediately so that it doesn't block.
-                # For more on this technique, see the final paragraph at
-                # http://www.faqs.org/faqs/unix-faq/faq/part3/section-13.html
-                try:
-                    pid = os.fork()
-                except OSError, e:
-                    sys.stderr.write("fork failed: %d (%s)\n" % (e.errno, e.strerror))
-                    os._exit(1)
-                if pid == 0: # child
-                    try:
-                        pid2 = os.fork()
-                    except OSError, e:
-                        sys.stderr.write("inner fork failed: %d (%s)\n" % (e.errno, e.strerror))
-                        os._exit(1)
-                    if pid2 == 0: # child
-                        os.environ.update(env)
-                        # Log the function call and PID.
-                        # TODO: use logging module.
-                        sys.stdout.write('%s\t%s\t%r\t%s\n' % (datetime.datetime.now(), func.func_name, kwargs, os.getpid()))
-                        sys.stdout.flush()
-
-                        try:
-                            func(**kwargs)
-                        except Exception, e:
-                            from django.core.mail import mail_admins
-                            import traceback
-                            traceback_string = '\n'.join(traceback.format_exception(*sys.exc_info()))
-                            sys.stderr.write("ERROR AT %s\n" % datetime.datetime.now())
-                            sys.stderr.write(traceback_string)
-                            sys.stderr.write("\n========================================\n")
-                            subject = '%s %s' % (func.func_name, str(kwargs).replace('\n', ' '))
-                            try:
-                                mail_admins(subject, traceback_string)
-                            except Exception, e:
-                                sys.stderr.write("Got error mailing admins: %s\n" % e)
-                            # Don't call sys.exit() for this,
-                            # because we're in a child process.
-                            os._exit(1)
-                        sys.stdout.flush()
-                    os._exit(0)
-                else: # parent
-                    os.waitpid(pid, 0)
+        return self.config.TASKS
+
+    def run(self):
+        self.scheduler.run_forever(self.get_tasks)
+
+    def handle_time(self, timestamp):
+        # Queue the tasks for the given timestamp; the scheduler runs
+        # them in worker processes, a few at a time.
+        self.scheduler.handle_time(timestamp, self.get_tasks())
+
+    def status(self):
+        """
+        Prints the stats from the running daemon's status file.
+        """
+        try:
+            status = scheduler.read_status(self.options.status_file)
+        except (IOError, ValueError), e:
+            sys.stderr.write("Couldn't read status file %s: %s\n"
+                             % (self.options.status_file, e))
+            sys.exit(1)
+        print scheduler.format_status(status)
 
 if __name__ == "__main__":
     daemon = UpdaterDaemon('/tmp/updaterdaemon.pid')
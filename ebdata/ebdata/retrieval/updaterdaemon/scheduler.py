@@ -0,0 +1,532 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebdata
+#
+#   ebdata is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebdata is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Runs scraper tasks with a bounded pool of worker processes.
+
+The :py:class:`Scheduler` is what
+:py:class:`ebdata.retrieval.updaterdaemon.runner.UpdaterDaemon` uses
+to run the ``TASKS`` from its config file. Compared to forking off
+every task as soon as it's due, it:
+
+* runs at most ``max_workers`` tasks at a time; the rest wait in a
+  queue, highest ``priority`` first;
+
+* never runs two copies of the same task at once; if a task is still
+  running or queued when it's due again, that run is skipped;
+
+* backs off after failures: a task that failed ``n`` times in a row
+  isn't started again until ``backoff_base * 2 ** (n - 1)`` seconds
+  (at most ``backoff_max``) after its last failure;
+
+* records how long each run took and, for scrapers based on
+  :py:class:`NewsItemListDetailScraper
+  <ebdata.retrieval.scrapers.newsitem_list_detail.NewsItemListDetailScraper>`,
+  how many items it added, changed and skipped, and which
+  :py:class:`DataUpdate <ebpub.db.models.DataUpdate>` records it created.
+
+All that is written to a JSON status file after every change; use
+``python -m ebdata.retrieval.updaterdaemon.scheduler <status file>``
+or ``runner.py status`` to print it.
+
+Each task still runs in its own process, so a crashing or leaky
+scraper can't take the scheduler down with it.
+"""
+
+import datetime
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import Queue
+import sys
+import time
+import traceback
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+logger = logging.getLogger('eb.retrieval.scheduler')
+
+# Defaults; see Scheduler.
+MAX_WORKERS = 4
+BACKOFF_BASE = 60
+BACKOFF_MAX = 60 * 60 * 6
+
+# How many recent runs to keep per task in the status file.
+HISTORY_LENGTH = 10
+
+
+class Task(object):
+    """
+    Something to run on a schedule.
+
+    ``check`` is called with a datetime and returns True if the task
+    should run then; see the helpers in
+    :py:mod:`ebdata.retrieval.updaterdaemon.config`. ``func`` is
+    called with ``kwargs`` as keyword arguments, in a child process
+    whose environment has been updated with ``env``.
+
+    ``name`` identifies the task, for mutual exclusion and stats; it
+    defaults to the function's module and name plus its arguments.
+    Tasks with higher ``priority`` are started first when there are
+    more due tasks than free workers. If ``timeout`` is given, a run
+    that takes longer than that many seconds is killed and counted
+    as a failure.
+    """
+
+    def __init__(self, check, func, kwargs=None, env=None, name=None,
+                 priority=0, timeout=None):
+        self.check = check
+        self.func = func
+        self.kwargs = kwargs or {}
+        self.env = env or {}
+        if name is None:
+            name = '%s.%s' % (func.__module__, func.__name__)
+            if self.kwargs:
+                name += '(%s)' % ', '.join(
+                    '%s=%r' % item for item in sorted(self.kwargs.items()))
+        self.name = name
+        self.priority = priority
+        self.timeout = timeout
+
+    def __repr__(self):
+        return '<Task %s>' % self.name
+
+    @classmethod
+    def from_config(cls, entry):
+        """
+        Returns a Task given an entry of a config file's ``TASKS``,
+        which may be a Task already, or an old-style tuple of
+        (check, func, kwargs, env).
+        """
+        if isinstance(entry, cls):
+            return entry
+        return cls(*entry)
+
+
+class _Run(object):
+
+    # No docstring, not part of API.
+    # One run of a Task, as seen by the parent process.
+
+    def __init__(self, task, process, queued_at):
+        self.task = task
+        self.process = process
+        self.queued_at = queued_at
+        self.started = time.time()
+        self.result = None
+
+
+# Counts reported by the current task, in a worker process.
+_current_counts = None
+
+
+def record_update(num_added=0, num_changed=0, num_skipped=0, num_deleted=0,
+                  data_update_ids=()):
+    """
+    Called by scrapers at the end of ``update()`` to report what they
+    did to the scheduler. Does nothing when not running under a
+    Scheduler, so it's safe to call unconditionally.
+    """
+    counts = _current_counts
+    if counts is None:
+        return
+    counts['num_added'] += num_added or 0
+    counts['num_changed'] += num_changed or 0
+    counts['num_skipped'] += num_skipped or 0
+    counts['num_deleted'] += num_deleted or 0
+    counts['data_updates'].extend(data_update_ids)
+
+
+def _empty_counts():
+    return {'num_added': 0, 'num_changed': 0, 'num_skipped': 0,
+            'num_deleted': 0, 'data_updates': []}
+
+
+def _run_task(task, results):
+    # Entry point of the worker process.
+    global _current_counts
+    os.environ.update(task.env)
+    if 'django.db' in sys.modules:
+        # Don't share the parent's database connection,
+        # if it has one; we'll open our own when needed.
+        from django.db import connection
+        connection.connection = None
+    _current_counts = _empty_counts()
+    result = {'status': 'ok', 'error': None}
+    try:
+        task.func(**task.kwargs)
+    except Exception:
+        traceback_string = ''.join(traceback.format_exception(*sys.exc_info()))
+        result['status'] = 'error'
+        result['error'] = traceback_string
+        sys.stderr.write("ERROR AT %s\n" % datetime.datetime.now())
+        sys.stderr.write(traceback_string)
+        sys.stderr.write("\n========================================\n")
+        sys.stderr.flush()
+        _mail_admins(task, traceback_string)
+    result.update(_current_counts)
+    results.put((task.name, result))
+
+
+def _mail_admins(task, traceback_string):
+    subject = '%s %s' % (task.func.__name__, str(task.kwargs).replace('\n', ' '))
+    try:
+        from django.core.mail import mail_admins
+        mail_admins(subject, traceback_string)
+    except Exception, e:
+        sys.stderr.write("Got error mailing admins: %s\n" % e)
+
+
+def _isoformat(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+
+class Scheduler(object):
+    """
+    Runs :py:class:`Task` instances in at most ``max_workers`` child
+    processes at a time.
+
+    Call :py:meth:`handle_time` whenever tasks might be due (eg. once
+    a minute), and :py:meth:`poll` often in between (eg. every
+    second) to start queued tasks and collect finished ones. Or just
+    call :py:meth:`run_forever`.
+
+    ``status_file``, if given, is a path where the current state and
+    stats are written as JSON.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, status_file=None,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.max_workers = max(1, max_workers)
+        self.status_file = status_file
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.running = {}  # {name: _Run}
+        self.stats = {}  # {name: dict}, see _stats_for()
+        self._queue = []  # heap of (-priority, sequence, queued_at, task)
+        self._queued = set()
+        self._sequence = itertools.count()
+        self._results = multiprocessing.Queue()
+        self._finished = {}  # {name: result} received before the process exited
+
+    def _stats_for(self, task):
+        stats = self.stats.get(task.name)
+        if stats is None:
+            stats = self.stats[task.name] = {
+                'runs': 0,
+                'failures': 0,
+                'consecutive_failures': 0,
+                'skipped_overlap': 0,
+                'skipped_backoff': 0,
+                'total_duration': 0.0,
+                'num_added': 0,
+                'num_changed': 0,
+                'num_skipped': 0,
+                'next_allowed': None,
+                'last_run': None,
+                'history': [],
+            }
+        stats['priority'] = task.priority
+        return stats
+
+    def handle_time(self, timestamp, tasks):
+        """
+        Queues each of ``tasks`` (Tasks, or old-style config tuples)
+        that is due at the datetime ``timestamp``, then starts as many
+        as there are free workers.
+        """
+        now = time.time()
+        for entry in tasks:
+            task = Task.from_config(entry)
+            if task.check(timestamp):
+                self.submit(task, now)
+        self.poll()
+
+    def submit(self, task, now=None):
+        """
+        Queues ``task`` to run as soon as a worker is free, unless it's
+        already running or queued, or backing off after a failure.
+        Returns True if it was queued.
+        """
+        if now is None:
+            now = time.time()
+        stats = self._stats_for(task)
+        if task.name in self.running or task.name in self._queued:
+            stats['skipped_overlap'] += 1
+            logger.warn("Skipping %s, previous run hasn't finished" % task.name)
+            return False
+        if stats['next_allowed'] is not None and now < stats['next_allowed']:
+            stats['skipped_backoff'] += 1
+            logger.info("Skipping %s, backing off after %d failure(s) until %s"
+                        % (task.name, stats['consecutive_failures'],
+                           _isoformat(stats['next_allowed'])))
+            return False
+        heapq.heappush(self._queue, (-task.priority, self._sequence.next(), now, task))
+        self._queued.add(task.name)
+        return True
+
+    def poll(self):
+        """
+        Collects finished tasks, kills timed-out ones, and starts
+        queued tasks while there are free workers. Writes the status
+        file if anything changed.
+        """
+        changed = self._reap()
+        while self._queue and len(self.running) < self.max_workers:
+            priority, sequence, queued_at, task = heapq.heappop(self._queue)
+            self._queued.discard(task.name)
+            self._start(task, queued_at)
+            changed = True
+        if changed:
+            self.write_status()
+
+    def is_idle(self):
+        """
+        True if nothing is running or queued.
+        """
+        return not (self.running or self._queue)
+
+    def _start(self, task, queued_at):
+        process = multiprocessing.Process(target=_run_task, args=(task, self._results),
+                                          name=task.name)
+        process.start()
+        self.running[task.name] = _Run(task, process, queued_at)
+        logger.info("Started %s (pid %s)" % (task.name, process.pid))
+
+    def _drain_results(self):
+        while True:
+            try:
+                name, result = self._results.get_nowait()
+            except Queue.Empty:
+                break
+            self._finished[name] = result
+
+    def _reap(self):
+        self._drain_results()
+        changed = False
+        now = time.time()
+        for name, run in self.running.items():
+            if run.process.is_alive():
+                timeout = run.task.timeout
+                if timeout is None or now - run.started < timeout:
+                    continue
+                run.process.terminate()
+                run.process.join()
+                result = _empty_counts()
+                result.update(status='timeout',
+                              error='Killed after %s seconds' % timeout)
+            else:
+                run.process.join()
+                # The worker puts its result before exiting, but it may
+                # not have been in the pipe yet when we last looked.
+                self._drain_results()
+                result = self._finished.get(name)
+                if result is None:
+                    result = _empty_counts()
+                    result.update(status='error',
+                                  error='Worker exited with code %s' % run.process.exitcode)
+            self._finished.pop(name, None)
+            del self.running[name]
+            self._record(run, result, now)
+            changed = True
+        return changed
+
+    def _record(self, run, result, finished):
+        stats = self._stats_for(run.task)
+        duration = finished - run.started
+        record = {
+            'queued': _isoformat(run.queued_at),
+            'started': _isoformat(run.started),
+            'finished': _isoformat(finished),
+            'duration': round(duration, 3),
+            'pid': run.process.pid,
+        }
+        record.update(result)
+        stats['runs'] += 1
+        stats['total_duration'] += duration
+        for key in ('num_added', 'num_changed', 'num_skipped'):
+            stats[key] += result.get(key, 0)
+        if result['status'] == 'ok':
+            stats['consecutive_failures'] = 0
+            stats['next_allowed'] = None
+            logger.info("Finished %s in %.1fs: %d added, %d changed, %d skipped"
+                        % (run.task.name, duration, result['num_added'],
+                           result['num_changed'], result['num_skipped']))
+        else:
+            stats['failures'] += 1
+            stats['consecutive_failures'] += 1
+            delay = min(self.backoff_max,
+                        self.backoff_base * 2 ** (stats['consecutive_failures'] - 1))
+            stats['next_allowed'] = finished + delay
+            logger.error("%s failed after %.1fs (%s); not retrying for %d seconds"
+                         % (run.task.name, duration, result['status'], delay))
+        stats['last_run'] = record
+        stats['history'] = (stats['history'] + [record])[-HISTORY_LENGTH:]
+
+    def status(self):
+        """
+        Returns the current state and stats as a JSON-serializable dict.
+        """
+        now = time.time()
+        tasks = {}
+        for name, stats in self.stats.items():
+            info = dict(stats)
+            info['next_allowed'] = _isoformat(stats['next_allowed'])
+            info['total_duration'] = round(stats['total_duration'], 3)
+            info['running'] = name in self.running
+            info['queued'] = name in self._queued
+            tasks[name] = info
+        running = [{'name': name, 'pid': run.process.pid,
+                    'started': _isoformat(run.started),
+                    'elapsed': round(now - run.started, 3)}
+                   for name, run in sorted(self.running.items())]
+        queued = [entry[3].name for entry in sorted(self._queue)]
+        return {
+            'updated': _isoformat(now),
+            'pid': os.getpid(),
+            'max_workers': self.max_workers,
+            'running': running,
+            'queued': queued,
+            'tasks': tasks,
+        }
+
+    def write_status(self):
+        """
+        Writes :py:meth:`status` to the status file, if we have one.
+        Readers never see a partly-written file.
+        """
+        if not self.status_file:
+            return
+        tmp_path = '%s.%d.tmp' % (self.status_file, os.getpid())
+        try:
+            out = open(tmp_path, 'w')
+            try:
+                json.dump(self.status(), out, indent=1, sort_keys=True)
+            finally:
+                out.close()
+            os.rename(tmp_path, self.status_file)
+        except (IOError, OSError), e:
+            logger.error("Couldn't write status file %s: %s" % (self.status_file, e))
+
+    def wait(self, poll_interval=0.1, timeout=None):
+        """
+        Polls until nothing is running or queued, or ``timeout``
+        seconds have passed. Returns True if we're idle.
+        """
+        start = time.time()
+        while True:
+            self.poll()
+            if self.is_idle():
+                return True
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            time.sleep(poll_interval)
+
+    def run_forever(self, get_tasks, poll_interval=1):
+        """
+        Calls :py:meth:`handle_time` with ``get_tasks()`` once at the
+        start of every minute, and :py:meth:`poll` every
+        ``poll_interval`` seconds. Never returns.
+        """
+        # Like EveryMinuteDaemon, we don't handle the current minute,
+        # or it would be handled twice if we were restarted during it.
+        last_minute = datetime.datetime.now().replace(second=0, microsecond=0)
+        self.write_status()
+        while True:
+            time.sleep(poll_interval)
+            minute = datetime.datetime.now().replace(second=0, microsecond=0)
+            if minute > last_minute:
+                last_minute = minute
+                self.handle_time(minute, get_tasks())
+            else:
+                self.poll()
+
+
+def read_status(path):
+    """
+    Returns the status dict written by a Scheduler to ``path``.
+    """
+    f = open(path)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def format_status(status):
+    """
+    Returns a human-readable summary of a status dict, as returned by
+    :py:func:`read_status`.
+    """
+    lines = ['Scheduler pid %s, status as of %s, %d of %d workers busy'
+             % (status['pid'], status['updated'], len(status['running']),
+                status['max_workers'])]
+    for run in status['running']:
+        lines.append('  running: %s (pid %s, %.0fs)' % (run['name'], run['pid'], run['elapsed']))
+    for name in status['queued']:
+        lines.append('  queued: %s' % name)
+    lines.append('')
+    lines.append('%-40s %5s %5s %9s %8s %7s %7s %7s  %s'
+                 % ('task', 'runs', 'fails', 'avg secs', 'last', 'added',
+                    'changed', 'skipped', 'next allowed'))
+    for name, info in sorted(status['tasks'].items()):
+        last = info['last_run'] or {}
+        if info['runs']:
+            average = '%.1f' % (info['total_duration'] / info['runs'])
+        else:
+            average = '-'
+        lines.append('%-40s %5d %5d %9s %8s %7s %7s %7s  %s'
+                     % (name[:40], info['runs'], info['failures'], average,
+                        last.get('status', '-'), last.get('num_added', '-'),
+                        last.get('num_changed', '-'), last.get('num_skipped', '-'),
+                        info['next_allowed'] or '-'))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Prints the stats from a scheduler's status file.
+    """
+    from optparse import OptionParser
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = OptionParser(usage="usage: %prog [options] STATUS_FILE")
+    parser.add_option('--json', action='store_true', default=False,
+                      help="Print the raw JSON instead of a summary.")
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("Please specify a status file.")
+    try:
+        status = read_status(args[0])
+    except (IOError, ValueError), e:
+        parser.error("Couldn't read status file %s: %s" % (args[0], e))
+    if options.json:
+        print json.dumps(status, indent=1, sort_keys=True)
+    else:
+        print format_status(status)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
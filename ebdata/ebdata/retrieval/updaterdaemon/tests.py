@@ -0,0 +1,198 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebdata
+#
+#   ebdata is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebdata is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests for the updaterdaemon scheduler.
+"""
+
+from ebdata.retrieval.updaterdaemon import scheduler
+from ebdata.retrieval.updaterdaemon.scheduler import Scheduler, Task
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+def always(dt):
+    return True
+
+def never(dt):
+    return False
+
+def touch(path, delay=0):
+    # Records when we started and finished, for checking concurrency.
+    start = time.time()
+    time.sleep(delay)
+    open(path, 'a').write('%r %r\n' % (start, time.time()))
+
+def fail():
+    raise ValueError("Oops")
+
+def report(num_added):
+    scheduler.record_update(num_added=num_added, num_changed=2, num_skipped=3,
+                            data_update_ids=[7])
+
+def check_env(path):
+    open(path, 'w').write(os.environ.get('SCHEDULER_TEST', ''))
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.status_file = os.path.join(self.tmpdir, 'status.json')
+        self.now = datetime.datetime(2012, 3, 4, 5, 6)
+        # Don't email anybody about our test failures.
+        self._orig_mail_admins = scheduler._mail_admins
+        scheduler._mail_admins = lambda task, tb: None
+
+    def tearDown(self):
+        scheduler._mail_admins = self._orig_mail_admins
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def _intervals(self, name):
+        return [tuple(map(float, line.split()))
+                for line in open(self._path(name)).readlines()]
+
+    def test_runs_due_tasks_only(self):
+        sched = Scheduler(status_file=self.status_file)
+        sched.handle_time(self.now, [
+                (always, touch, {'path': self._path('yes')}, {}),
+                (never, touch, {'path': self._path('no')}, {}),
+                ])
+        self.assert_(sched.wait(timeout=10))
+        self.assert_(os.path.exists(self._path('yes')))
+        self.failIf(os.path.exists(self._path('no')))
+
+    def test_env(self):
+        sched = Scheduler()
+        sched.handle_time(self.now, [
+                (always, check_env, {'path': self._path('env')}, {'SCHEDULER_TEST': 'yes'})])
+        self.assert_(sched.wait(timeout=10))
+        self.assertEqual(open(self._path('env')).read(), 'yes')
+        self.failIf('SCHEDULER_TEST' in os.environ)
+
+    def test_max_workers(self):
+        sched = Scheduler(max_workers=2)
+        tasks = [Task(always, touch, {'path': self._path('log'), 'delay': 0.3},
+                      name='task%d' % i) for i in range(4)]
+        sched.handle_time(self.now, tasks)
+        self.assertEqual(len(sched.running), 2)
+        self.assert_(sched.wait(timeout=10))
+        intervals = sorted(self._intervals('log'))
+        self.assertEqual(len(intervals), 4)
+        for start, finish in intervals:
+            overlapping = [1 for (s, f) in intervals if s < finish and f > start]
+            self.assert_(len(overlapping) <= 2)
+
+    def test_no_overlap(self):
+        sched = Scheduler()
+        task = Task(always, touch, {'path': self._path('log'), 'delay': 0.5}, name='slow')
+        sched.handle_time(self.now, [task])
+        sched.handle_time(self.now, [task])
+        self.assert_(sched.wait(timeout=10))
+        self.assertEqual(len(self._intervals('log')), 1)
+        self.assertEqual(sched.stats['slow']['skipped_overlap'], 1)
+        self.assertEqual(sched.stats['slow']['runs'], 1)
+
+    def test_priority(self):
+        sched = Scheduler(max_workers=1)
+        busy = Task(always, touch, {'path': self._path('busy'), 'delay': 0.2}, name='busy')
+        sched.handle_time(self.now, [busy])
+        low = Task(always, touch, {'path': self._path('log')}, name='low', priority=1)
+        high = Task(always, touch, {'path': self._path('log')}, name='high', priority=5)
+        sched.submit(low)
+        sched.submit(high)
+        self.assertEqual(sched.status()['queued'], ['high', 'low'])
+        self.assert_(sched.wait(timeout=10))
+        high_start = sched.stats['high']['last_run']['started']
+        low_start = sched.stats['low']['last_run']['started']
+        self.assert_(high_start <= low_start)
+
+    def test_backoff(self):
+        sched = Scheduler(backoff_base=60, backoff_max=90)
+        task = Task(always, fail, name='fail')
+        sched.handle_time(self.now, [task])
+        self.assert_(sched.wait(timeout=10))
+        stats = sched.stats['fail']
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['last_run']['status'], 'error')
+        self.assert_('ValueError' in stats['last_run']['error'])
+        self.assertAlmostEqual(stats['next_allowed'] - time.time(), 60, 0)
+
+        # Too soon.
+        self.assertEqual(sched.submit(task), False)
+        self.assertEqual(stats['skipped_backoff'], 1)
+
+        # Later, it fails again and backs off longer, up to backoff_max.
+        sched.submit(task, now=time.time() + 61)
+        self.assert_(sched.wait(timeout=10))
+        self.assertEqual(stats['consecutive_failures'], 2)
+        self.assertAlmostEqual(stats['next_allowed'] - time.time(), 90, 0)
+
+    def test_timeout(self):
+        sched = Scheduler()
+        task = Task(always, touch, {'path': self._path('log'), 'delay': 10},
+                    name='slow', timeout=0.2)
+        sched.handle_time(self.now, [task])
+        self.assert_(sched.wait(timeout=5))
+        self.assertEqual(sched.stats['slow']['last_run']['status'], 'timeout')
+        self.failIf(os.path.exists(self._path('log')))
+
+    def test_counts_and_status_file(self):
+        sched = Scheduler(status_file=self.status_file)
+        task = Task(always, report, {'num_added': 5}, name='report')
+        sched.handle_time(self.now, [task, task])
+        self.assert_(sched.wait(timeout=10))
+        status = scheduler.read_status(self.status_file)
+        info = status['tasks']['report']
+        self.assertEqual(info['runs'], 1)
+        self.assertEqual(info['skipped_overlap'], 1)
+        self.assertEqual(info['last_run']['status'], 'ok')
+        self.assertEqual(info['last_run']['num_added'], 5)
+        self.assertEqual(info['last_run']['num_changed'], 2)
+        self.assertEqual(info['last_run']['num_skipped'], 3)
+        self.assertEqual(info['last_run']['data_updates'], [7])
+        self.assertEqual(len(info['history']), 1)
+        self.assertEqual(status['running'], [])
+        self.assert_('report' in scheduler.format_status(status))
+
+    def test_record_update_outside_scheduler(self):
+        # Should be a harmless no-op.
+        scheduler.record_update(num_added=1)
+
+
+class TestTask(unittest.TestCase):
+
+    def test_from_config(self):
+        task = Task.from_config((always, touch, {'path': '/x'}, {'FOO': 'bar'}))
+        self.assertEqual(task.func, touch)
+        self.assertEqual(task.env, {'FOO': 'bar'})
+        self.assertEqual(task.priority, 0)
+        self.assertEqual(task.name,
+                         "ebdata.retrieval.updaterdaemon.tests.touch(path='/x')")
+        self.assert_(Task.from_config(task) is task)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,7 +21,8 @@
 
 from django.contrib.gis.geos import Point
 from ebpub.utils.geodjango import get_default_bounds
-from ebpub.db.models import Schema, SchemaField, NewsItem, Lookup
+from ebpub.db.lookupcache import LookupCache
+from ebpub.db.models import Schema, SchemaField, NewsItem
 from ebpub.geocoder.reverse import reverse_geocode
 from httplib2 import Http
 from lxml import etree
@@ -64,6 +65,7 @@ class GeoReportV2Scraper(object):
         self.schema_slug = schema_slug
         self.schema = Schema.objects.get(slug=self.schema_slug)
         self.service_request_id_field = SchemaField.objects.get(schema=self.schema, name='service_request_id')
+        self._lookup_caches = {}
         
         self.standard_params = {}
         if api_key is not None: 
@@ -264,8 +266,10 @@ class GeoReportV2Scraper(object):
         return (val.text or '').strip()
         
     def _lookup_for(self, fieldname, value):
-        sf = SchemaField.objects.get(schema=self.schema, name=fieldname)
-        lo = Lookup.objects.get_or_create_lookup(sf, value, make_text_slug=False)
+        if fieldname not in self._lookup_caches:
+            sf = SchemaField.objects.get(schema=self.schema, name=fieldname)
+            self._lookup_caches[fieldname] = LookupCache(sf)
+        lo = self._lookup_caches[fieldname].get_or_create(value, make_text_slug=False)
         return lo.slug
 
 def main(argv=None):
@@ -145,7 +145,7 @@ class RestaurantScraper(NewsItemListDetailScraper):
             return # We already have this inspection.
 
         result = self.get_or_create_lookup('result', list_record['result'], list_record['result'])
-        violation_lookups = [self.get_or_create_lookup('violation', v['description'], v['code'], make_text_slug=False) for v in detail_record['violation_list']]
+        violation_lookups = self.get_or_create_lookups('violation', [(v['description'], v['code']) for v in detail_record['violation_list']], make_text_slug=False)
 
         violation_lookup_text = ','.join([str(v.id) for v in violation_lookups])
         if len(violation_lookup_text) > 4096:
@@ -0,0 +1,113 @@
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebdata
+#
+#   ebdata is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebdata is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks for the longest common substring engines used by
+:py:mod:`ebdata.templatemaker.template` and :py:mod:`ebdata.templatemaker.sst`,
+on generated pages of realistic size.
+
+Run it like::
+
+    python -m ebdata.templatemaker.benchmark [--quadratic-limit=N]
+
+The quadratic engine is only timed where len(seq1) * len(seq2) is at
+most ``--quadratic-limit``, because it gets very slow.
+"""
+
+from ebdata.templatemaker import listdiff
+from ebdata.templatemaker import sst
+from ebdata.templatemaker.template import Template
+import random
+import time
+
+WORDS = ('the city council police street avenue said on monday after '
+         'residents of neighborhood block meeting permit school park '
+         'fire department news report building public officials').split()
+
+def make_page(seed, paragraphs, nav_links=60, sidebar_items=40):
+    """
+    Returns the HTML of a fake news article page: the same navigation,
+    sidebar and footer for every seed, with a different article.
+    """
+    rand = random.Random(seed)
+    def sentence():
+        return ' '.join([rand.choice(WORDS) for i in range(rand.randint(8, 25))]).capitalize() + '.'
+    nav = ''.join(['<li><a href="/section/%d/">Section %d</a></li>\n' % (i, i)
+                   for i in range(nav_links)])
+    sidebar = ''.join(['<li class="popular"><a href="/popular/%d/">Popular story %d</a></li>\n' % (i, i)
+                       for i in range(sidebar_items)])
+    article = ''.join(['<p>%s</p>\n' % ' '.join([sentence() for j in range(rand.randint(2, 5))])
+                       for i in range(paragraphs)])
+    return ('<html><head><title>Story %d</title></head><body>\n'
+            '<div id="header"><h1>The Daily News</h1><ul id="nav">\n%s</ul></div>\n'
+            '<div id="content"><h2>Headline number %d</h2>\n<div class="byline">By Reporter %d</div>\n'
+            '<div class="story">\n%s</div></div>\n'
+            '<div id="sidebar"><ul>\n%s</ul></div>\n'
+            '<div id="footer"><p>Copyright The Daily News</p></div>\n'
+            '</body></html>\n') % (seed, nav, seed, seed, article, sidebar)
+
+def _timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+def _with_engine(engine, func, *args):
+    # Temporarily makes listdiff and sst use the given LCS function.
+    old_listdiff, old_sst = listdiff.longest_common_substring, sst.longest_common_substring
+    listdiff.longest_common_substring = sst.longest_common_substring = engine
+    try:
+        return _timeit(func, *args)
+    finally:
+        listdiff.longest_common_substring, sst.longest_common_substring = old_listdiff, old_sst
+
+def learn_text(pages):
+    Template().learn(*pages)
+
+def learn_tree(pages):
+    sst.Template().learn_many(pages)
+
+def run(quadratic_limit=10 ** 8, out=None):
+    import sys
+    out = out or sys.stdout
+    engines = [('quadratic', listdiff.quadratic_longest_common_substring),
+               ('automaton', listdiff.automaton_longest_common_substring),
+               ('default', listdiff.longest_common_substring)]
+    out.write('%-28s %10s %12s %12s %12s\n' % ('benchmark', 'size', 'quadratic', 'automaton', 'default'))
+    for paragraphs in (5, 20, 60):
+        pages = [make_page(seed, paragraphs) for seed in (1, 2)]
+        size = len(pages[0])
+        for name, func, work in (('Template.learn (chars)', learn_text, size * size),
+                                 ('sst.Template.learn (tree)', learn_tree, 0)):
+            times = []
+            for engine_name, engine in engines:
+                if engine_name == 'quadratic' and work > quadratic_limit:
+                    times.append('skipped')
+                else:
+                    times.append('%.3fs' % _with_engine(engine, func, pages))
+            out.write('%-28s %9dB %12s %12s %12s\n' % ((name, size) + tuple(times)))
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('--quadratic-limit', type='int', default=10 ** 8,
+                      help='Skip the quadratic engine when len1 * len2 is more than this.')
+    options, args = parser.parse_args(argv)
+    run(options.quadratic_limit)
+
+if __name__ == '__main__':
+    main()
@@ -16,7 +16,7 @@
 #   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from ebdata.textmining.treeutils import make_tree_and_preprocess
+from ebdata.textmining.treeutils import tree_cache
 from listdiff import longest_common_substring # relative import
 from lxml import etree
 
@@ -126,8 +126,8 @@ def clean_page(html, other_page):
     Wrapper around the various cleaning functions. This accepts and returns
     strings instead of trees.
     """
-    tree1 = make_tree_and_preprocess(html)
-    tree2 = make_tree_and_preprocess(other_page)
+    tree1 = tree_cache.make_tree_and_preprocess(html)
+    tree2 = tree_cache.make_tree_and_preprocess(other_page)
     strip_template(tree1, tree2)
     # drop_useless_tags(tree1)
     # remove_empty_tags(tree1, ('div', 'span', 'td', 'tr', 'table'))
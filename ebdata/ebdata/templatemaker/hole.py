@@ -29,6 +29,9 @@ class Hole(object):
         "A Hole is equal to any other Hole (but not subclasses)."
         return type(other) is self.__class__
 
+    def __hash__(self):
+        return hash(self.__class__)
+
     def __repr__(self):
         return '<%s>' % self.__class__.__name__
 
@@ -45,6 +48,9 @@ class OrHole(Hole):
         "An OrHole is equal to another one if its choices are the same."
         return type(other) is self.__class__ and self.choices == other.choices
 
+    def __hash__(self):
+        return hash((self.__class__, self.choices))
+
     def __repr__(self):
         return '<%s: %r>' % (self.__class__.__name__, self.choices)
 
@@ -64,6 +70,9 @@ class RegexHole(Hole):
         "A RegexHole is equal to another one if its regex_string is the same."
         return type(other) is self.__class__ and self.regex_string == other.regex_string and self.capture == other.capture
 
+    def __hash__(self):
+        return hash((self.__class__, self.regex_string, self.capture))
+
     def __repr__(self):
         return '<%s: %s>' % (self.__class__.__name__, self.regex_string)
 
@@ -57,46 +57,263 @@ def listdiff(list1, list2):
 #
 # The longest common subsequence of "foolish" and "fools" is "fools".
 # The longest common substring of "foolish" and "fools" is "fool".
+
+# If there are more than this many pairs of equally long common
+# substrings to choose between, use the quadratic algorithm instead;
+# it isn't any slower in such degenerate cases, and uses less memory.
+MAX_CANDIDATES = 250000
+
+def longest_common_substring(seq1, seq2):
+    """
+    Given two sequences, calculates the longest common substring and returns
+    a tuple of:
+        (LCS length, LCS offset in seq1, LCS offset in seq2)
+
+    If there are several longest common substrings, the one with the
+    lowest offsets wins, as found by :py:func:`quadratic_longest_common_substring`.
+    Large inputs are handled in linear time by
+    :py:func:`automaton_longest_common_substring`, with identical results.
+    """
+    if len(seq1) * len(seq2) > QUADRATIC_THRESHOLD:
+        result = automaton_longest_common_substring(seq1, seq2)
+        if result is not None:
+            return result
+    return _quadratic_longest_common_substring(seq1, seq2)
+
+def quadratic_longest_common_substring(seq1, seq2):
+    """
+    The original pure-Python O(len(seq1) * len(seq2)) algorithm;
+    see :py:func:`longest_common_substring`.
+    """
+    best_size, offset1, offset2 = half_longest_match(seq1, seq2)
+    best_size, offset2, offset1 = half_longest_match(seq2, seq1, best_size, offset2, offset1)
+    return best_size, offset1, offset2
+
+def half_longest_match(seq1, seq2, best_size=0, offset1=-1, offset2=-1):
+    """
+    Implements "one half" of the longest common substring algorithm.
+    """
+    len1 = len(seq1)
+    len2 = len(seq2)
+    i = 0 # seq2 index
+    current_size = 0
+    while i < len2:
+        if best_size >= len2 - i:
+            break # Short circuit
+        j = i
+        k = 0
+        while k < len1 and j < len2:
+            if seq1[k] == seq2[j]:
+                current_size += 1
+                if current_size >= best_size:
+                    new_offset1 = k - current_size + 1
+                    new_offset2 = j - current_size + 1
+                    if current_size > best_size or (new_offset1 <= offset1 and new_offset2 <= offset2):
+                        offset1 = new_offset1
+                        offset2 = new_offset2
+                    best_size = current_size
+            else:
+                current_size = 0
+            j += 1
+            k += 1
+        i += 1
+        current_size = 0
+    return best_size, offset1, offset2
+
+# For inputs where len(seq1) * len(seq2) is at most QUADRATIC_THRESHOLD,
+# the simple quadratic algorithm is faster than building a suffix
+# automaton; more so if the C version is available.
+# See ebdata.templatemaker.benchmark.
 try:
-    from listdiffc import longest_common_subsequence as longest_common_substring
+    from listdiffc import longest_common_subsequence as _quadratic_longest_common_substring
+    QUADRATIC_THRESHOLD = 40000
 except ImportError:
-    def longest_common_substring(seq1, seq2):
-        """
-        Given two sequences, calculates the longest common substring and returns
-        a tuple of:
-            (LCS length, LCS offset in seq1, LCS offset in seq2)
-        """
-        best_size, offset1, offset2 = half_longest_match(seq1, seq2)
-        best_size, offset2, offset1 = half_longest_match(seq2, seq1, best_size, offset2, offset1)
-        return best_size, offset1, offset2
-
-    def half_longest_match(seq1, seq2, best_size=0, offset1=-1, offset2=-1):
-        """
-        Implements "one half" of the longest common substring algorithm.
-        """
-        len1 = len(seq1)
-        len2 = len(seq2)
-        i = 0 # seq2 index
-        current_size = 0
-        while i < len2:
-            if best_size >= len2 - i:
-                break # Short circuit
-            j = i
-            k = 0
-            while k < len1 and j < len2:
-                if seq1[k] == seq2[j]:
-                    current_size += 1
-                    if current_size >= best_size:
-                        new_offset1 = k - current_size + 1
-                        new_offset2 = j - current_size + 1
-                        if current_size > best_size or (new_offset1 <= offset1 and new_offset2 <= offset2):
-                            offset1 = new_offset1
-                            offset2 = new_offset2
-                        best_size = current_size
-                else:
-                    current_size = 0
-                j += 1
-                k += 1
-            i += 1
-            current_size = 0
-        return best_size, offset1, offset2
+    _quadratic_longest_common_substring = quadratic_longest_common_substring
+    QUADRATIC_THRESHOLD = 1500
+
+_consistent_hash_types = {}
+
+def _has_consistent_hash(cls):
+    # A class that overrides __eq__ without __hash__ keeps the
+    # identity-based hash, so we can't use it to compare items.
+    try:
+        return _consistent_hash_types[cls]
+    except KeyError:
+        pass
+    result = True
+    for klass in getattr(cls, '__mro__', ()):
+        if klass is object:
+            break
+        attrs = vars(klass)
+        if '__hash__' in attrs:
+            result = attrs['__hash__'] is not None
+            break
+        if '__eq__' in attrs or '__cmp__' in attrs:
+            result = False
+            break
+    _consistent_hash_types[cls] = result
+    return result
+
+def _freeze(obj):
+    # Returns a hashable stand-in for obj that is equal to another
+    # frozen object exactly when the originals are equal.
+    # Raises TypeError if there's no such thing.
+    if isinstance(obj, list):
+        return (_freeze, tuple([_freeze(x) for x in obj]))
+    if isinstance(obj, tuple):
+        return tuple([_freeze(x) for x in obj])
+    if not _has_consistent_hash(type(obj)):
+        raise TypeError('%r has no usable hash' % type(obj))
+    hash(obj)
+    return obj
+
+def _tokenize(seq1, seq2):
+    # Maps the items of both sequences to small ints, such that
+    # equal items get equal ints. Returns None if that's impossible.
+    ids = {}
+    result = []
+    for seq in (seq1, seq2):
+        tokens = []
+        for item in seq:
+            try:
+                key = _freeze(item)
+            except TypeError:
+                return None
+            token = ids.get(key)
+            if token is None:
+                token = ids[key] = len(ids)
+            tokens.append(token)
+        result.append(tokens)
+    return result
+
+def _build_automaton(tokens):
+    # Builds a suffix automaton of the token list. Returns the lists
+    # (link, length, transitions, endpos) indexed by state; endpos is
+    # the position of the token that created the state, or -1 for clones.
+    link = [-1]
+    length = [0]
+    trans = [{}]
+    endpos = [-1]
+    last = 0
+    for pos, c in enumerate(tokens):
+        cur = len(length)
+        link.append(-1)
+        length.append(length[last] + 1)
+        trans.append({})
+        endpos.append(pos)
+        p = last
+        while p != -1 and c not in trans[p]:
+            trans[p][c] = cur
+            p = link[p]
+        if p == -1:
+            link[cur] = 0
+        else:
+            q = trans[p][c]
+            if length[p] + 1 == length[q]:
+                link[cur] = q
+            else:
+                clone = len(length)
+                link.append(link[q])
+                length.append(length[p] + 1)
+                trans.append(dict(trans[q]))
+                endpos.append(-1)
+                while p != -1 and trans[p].get(c) == q:
+                    trans[p][c] = clone
+                    p = link[p]
+                link[q] = link[cur] = clone
+        last = cur
+    return link, length, trans, endpos
+
+def automaton_longest_common_substring(seq1, seq2):
+    """
+    Same as :py:func:`quadratic_longest_common_substring`, but runs in
+    time roughly linear in len(seq1) + len(seq2), using a suffix
+    automaton of seq1.
+
+    Returns None if the items aren't hashable (lists are OK), or if
+    there are too many equally long matches to choose between (see
+    ``MAX_CANDIDATES``).
+    """
+    tokens = _tokenize(seq1, seq2)
+    if tokens is None:
+        return None
+    tokens1, tokens2 = tokens
+    if not tokens1 or not tokens2:
+        return (0, -1, -1)
+    link, length, trans, endpos = _build_automaton(tokens1)
+
+    # Walk seq2 through the automaton, tracking the longest suffix
+    # of seq2[:j+1] that occurs in seq1, and remember the states
+    # where the longest match so far ends.
+    best_size = 0
+    hits = {}  # {state: [offsets in seq2 of matches of best_size]}
+    state = size = 0
+    for j, c in enumerate(tokens2):
+        while state and c not in trans[state]:
+            state = link[state]
+            size = length[state]
+        if c in trans[state]:
+            state = trans[state][c]
+            size += 1
+        if size > best_size:
+            best_size = size
+            hits = {}
+        if size == best_size and size:
+            hits.setdefault(state, []).append(j - size + 1)
+    if best_size == 0:
+        return (0, -1, -1)
+
+    # The occurrences in seq1 of each matching substring are the end
+    # positions of the states in its suffix link subtree.
+    children = [[] for i in range(len(link))]
+    for s in range(1, len(link)):
+        children[link[s]].append(s)
+
+    # Now pick the winner exactly the way half_longest_match() does.
+    # It scans the diagonals with offset2 - offset1 = 0, 1, 2... and then
+    # those with offset1 - offset2 = 0, 1, 2..., each from the start,
+    # stopping early once no further diagonal is longer than best_size.
+    # The first match of best_size wins, and later ones only replace it
+    # if both their offsets are <= the current ones; so only the
+    # earliest match on each diagonal matters.
+    len1, len2 = len(tokens1), len(tokens2)
+    first_half = {}  # {offset2 - offset1: lowest offset1}
+    second_half = {}  # {offset1 - offset2: lowest offset1}
+    num_candidates = 0
+    for state, offsets2 in hits.items():
+        offsets1 = []
+        stack = [state]
+        while stack:
+            s = stack.pop()
+            if endpos[s] != -1:
+                offsets1.append(endpos[s] - best_size + 1)
+            stack.extend(children[s])
+        num_candidates += len(offsets1) * len(offsets2)
+        if num_candidates > MAX_CANDIDATES:
+            return None
+        for a in offsets1:
+            for b in offsets2:
+                if b >= a and first_half.get(b - a, len2) > a:
+                    first_half[b - a] = a
+                if a >= b and second_half.get(a - b, len1) > a:
+                    second_half[a - b] = a
+
+    offset1 = offset2 = -1
+    found = False
+    for diagonal in sorted(first_half):
+        if found and len2 - diagonal <= best_size:
+            break
+        a = first_half[diagonal]
+        b = a + diagonal
+        if not found or (a <= offset1 and b <= offset2):
+            offset1, offset2 = a, b
+            found = True
+    for diagonal in sorted(second_half):
+        if found and len1 - diagonal <= best_size:
+            break
+        a = second_half[diagonal]
+        b = a - diagonal
+        if not found or (a <= offset1 and b <= offset2):
+            offset1, offset2 = a, b
+            found = True
+    return best_size, offset1, offset2
@@ -26,9 +26,8 @@ in this paper:
 """
 
 from ebdata.templatemaker.listdiff import longest_common_substring
-from ebdata.textmining.treeutils import make_tree_and_preprocess
+from ebdata.textmining.treeutils import tree_cache
 from lxml import etree
-import time
 
 class NoMatch(Exception):
     pass
@@ -38,56 +37,94 @@ def element_hash_strict(el):
     Returns a hash of the given etree Element, such that it can be used
     in a longest_common_substring comparison against another tree.
     """
-    # <br> tags should never be marked as the same as other <br> tags, so use
-    # the current time to introduce enough entropy. Note that we use '%.10f'
-    # instead of str(time.time()) because str() rounds the number to two
-    # decimal places, resulting in identical results for subsequent tags.
+    # <br> tags should never be marked as the same as other <br> tags,
+    # so each one gets a new object that's only equal to itself.
     if el.tag == 'br':
-        return '%.10f' % time.time()
+        return object()
 
-    attrs = sorted(dict(el.attrib).items())
+    attrs = tuple(sorted(el.attrib.items()))
     return (el.tag, attrs, el.text, el.tail)
 
 def element_hash_loose(el):
     if el.tag == 'br':
-        return '%.10f' % time.time()
+        return object()
     if el.tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'a', 'title'):
         return el.tag
     return (el.tag, el.text)
 
-def tree_diff_children(list1, list2, hash_func, algorithm):
+class ElementHasher(object):
+    """
+    Memoizes a hash function (eg. element_hash_strict) for the
+    elements of the trees being compared, and maps the results to
+    small ints, which longest_common_substring() handles fastest.
+
+    Each element is hashed at most once per hash function, no matter
+    how often the recursion in tree_diff_children() and
+    tree_extract_children() looks at it. Since a <br> is hashed only
+    once too, it keeps the same identity for the whole comparison.
+
+    Holds references to all elements it has seen, so use one per
+    comparison of two trees.
+    """
+    def __init__(self):
+        self._ids = {}
+        self._memo = {}
+
+    def hashes(self, elements, hash_func):
+        memo = self._memo.setdefault(hash_func, {})
+        ids = self._ids
+        result = []
+        for el in elements:
+            try:
+                result.append(memo[el])
+            except KeyError:
+                key = hash_func(el)
+                try:
+                    value = ids[key]
+                except KeyError:
+                    value = ids[key] = len(ids)
+                memo[el] = value
+                result.append(value)
+        return result
+
+    def longest_common_substring(self, list1, list2, hash_func):
+        return longest_common_substring(self.hashes(list1, hash_func), self.hashes(list2, hash_func))
+
+def tree_diff_children(list1, list2, hash_func, algorithm, hasher=None):
     # list1 and list2 are lists of etree Elements.
     if list1 == list2 == []:
         return []
+    if hasher is None:
+        hasher = ElementHasher()
     # Try to find the longest common substring, according to hash_func().
     # First we use element_hash_strict(), but then we use element_hash_loose()
     # as a fallback.
-    best_size, offset1, offset2 = longest_common_substring([hash_func(el) for el in list1], [hash_func(el) for el in list2])
+    best_size, offset1, offset2 = hasher.longest_common_substring(list1, list2, hash_func)
     result = []
     if best_size == 0:
         if hash_func == element_hash_strict:
-            result.extend(tree_diff_children(list1, list2, element_hash_loose, algorithm))
+            result.extend(tree_diff_children(list1, list2, element_hash_loose, algorithm, hasher))
         else:
             result.append(etree.Element('MULTITAG_HOLE'))
     if offset1 > 0 and offset2 > 0:
         # There's leftover stuff on the left side of BOTH lists.
-        result.extend(tree_diff_children(list1[:offset1], list2[:offset2], element_hash_strict, algorithm))
+        result.extend(tree_diff_children(list1[:offset1], list2[:offset2], element_hash_strict, algorithm, hasher))
     elif offset1 > 0 or offset2 > 0:
         # There's leftover stuff on the left side of ONLY ONE of the lists.
         result.append(etree.Element('MULTITAG_HOLE'))
     if best_size > 0:
         for i in range(best_size):
-            child = tree_diff(list1[offset1+i], list2[offset2+i], algorithm)
+            child = tree_diff(list1[offset1+i], list2[offset2+i], algorithm, hasher)
             result.append(child)
         if (offset1 + best_size < len(list1)) and (offset2 + best_size < len(list2)):
             # There's leftover stuff on the right side of BOTH lists.
-            result.extend(tree_diff_children(list1[offset1+best_size:], list2[offset2+best_size:], element_hash_strict, algorithm))
+            result.extend(tree_diff_children(list1[offset1+best_size:], list2[offset2+best_size:], element_hash_strict, algorithm, hasher))
         elif (offset1 + best_size < len(list1)) or (offset2 + best_size < len(list2)):
             # There's leftover stuff on the right side of ONLY ONE of the lists.
             result.append(etree.Element('MULTITAG_HOLE'))
     return result
 
-def tree_diff(tree1, tree2, algorithm=1):
+def tree_diff(tree1, tree2, algorithm=1, hasher=None):
     """
     Returns a "diff" of the two etree objects, using these placeholders in case
     of differences:
@@ -102,7 +139,12 @@ def tree_diff(tree1, tree2, algorithm=1):
        used when an element's children differ
 
     This assumes tree1 and tree2 share the same root tag, e.g. "<html>".
+
+    ``hasher`` is an ElementHasher to reuse; by default a new one is
+    used for each call.
     """
+    if hasher is None:
+        hasher = ElementHasher()
     # Copy the element (but not its children).
     result = etree.Element(tree1.tag)
     result.text = (tree1.text != tree2.text) and 'TEXT_HOLE' or tree1.text
@@ -116,12 +158,12 @@ def tree_diff(tree1, tree2, algorithm=1):
     for k2 in attrs2.keys():
         result.attrib[k2] = 'ATTRIB_HOLE'
     if algorithm == 1:
-        for child in tree_diff_children(list(tree1), list(tree2), element_hash_strict, algorithm):
+        for child in tree_diff_children(list(tree1), list(tree2), element_hash_strict, algorithm, hasher):
             result.append(child)
     elif algorithm == 2:
         if [child.tag for child in tree1] == [child.tag for child in tree2]:
             for i, child in enumerate(tree1):
-                diff_child = tree_diff(child, tree2[i], algorithm)
+                diff_child = tree_diff(child, tree2[i], algorithm, hasher)
                 result.append(diff_child)
         else:
             result.append(etree.Element('MULTITAG_HOLE'))
@@ -129,23 +171,25 @@ def tree_diff(tree1, tree2, algorithm=1):
         raise ValueError('Got invalid algorithm: %r' % algorithm)
     return result
 
-def tree_extract_children(list1, list2, hash_func, algorithm):
+def tree_extract_children(list1, list2, hash_func, algorithm, hasher=None):
     # list1 and list2 are lists of etree Elements.
     if list1 == list2 == []:
         return []
-    best_size, offset1, offset2 = longest_common_substring([hash_func(el) for el in list1], [hash_func(el) for el in list2])
+    if hasher is None:
+        hasher = ElementHasher()
+    best_size, offset1, offset2 = hasher.longest_common_substring(list1, list2, hash_func)
     result = []
     if best_size == 0:
         if [el.tag for el in list1] == ['MULTITAG_HOLE']:
             data = ''.join([etree.tostring(child, method='html') for child in list2])
             result.append({'type': 'multitag', 'value': data, 'tag': None})
         elif hash_func == element_hash_strict:
-            result.extend(tree_extract_children(list1, list2, element_hash_loose, algorithm))
+            result.extend(tree_extract_children(list1, list2, element_hash_loose, algorithm, hasher))
         else:
             raise NoMatch('Brain tag had children %r, but sample had %r' % (list1, list2))
     if offset1 > 0 and offset2 > 0:
         # There's leftover stuff on the left side of BOTH lists.
-        result.extend(tree_extract_children(list1[:offset1], list2[:offset2], element_hash_strict, algorithm))
+        result.extend(tree_extract_children(list1[:offset1], list2[:offset2], element_hash_strict, algorithm, hasher))
     elif offset1 > 0:
         # There's leftover stuff on the left side of ONLY the brain.
         if [el.tag for el in list1[:offset1]] == ['MULTITAG_HOLE']:
@@ -157,15 +201,15 @@ def tree_extract_children(list1, list2, hash_func, algorithm):
         raise NoMatch('Brain tag had children %r, but sample had %r' % (list1, list2))
     if best_size > 0:
         for i in range(best_size):
-            child_result = tree_extract(list1[offset1+i], list2[offset2+i], algorithm)
+            child_result = tree_extract(list1[offset1+i], list2[offset2+i], algorithm, hasher)
             result.extend(child_result)
         if (offset1 + best_size < len(list1)) or (offset2 + best_size < len(list2)):
             # There's leftover stuff on the right side of EITHER list.
-            child_result = tree_extract_children(list1[offset1+best_size:], list2[offset2+best_size:], element_hash_strict, algorithm)
+            child_result = tree_extract_children(list1[offset1+best_size:], list2[offset2+best_size:], element_hash_strict, algorithm, hasher)
             result.extend(child_result)
     return result
 
-def tree_extract(brain, sample, algorithm):
+def tree_extract(brain, sample, algorithm, hasher=None):
     """
     Given two etrees -- a brain (the result of a tree_diff()) and a sample
     to extract from -- this returns a list of raw data from the sample.
@@ -174,6 +218,8 @@ def tree_extract(brain, sample, algorithm):
         type is either 'attrib', 'text', 'multitag' or 'tail'
         value is a string of the raw data
     """
+    if hasher is None:
+        hasher = ElementHasher()
     result = []
 
     # Extract ATTRIB_HOLE.
@@ -201,7 +247,7 @@ def tree_extract(brain, sample, algorithm):
     sample_children = [child.tag for child in sample]
     if 'MULTITAG_HOLE' in brain_children:
         if algorithm == 1:
-            multitag_result = tree_extract_children(list(brain), list(sample), element_hash_strict, algorithm)
+            multitag_result = tree_extract_children(list(brain), list(sample), element_hash_strict, algorithm, hasher)
             result.extend(multitag_result)
         elif algorithm == 2:
             data = ''.join([etree.tostring(child) for child in sample])
@@ -210,7 +256,7 @@ def tree_extract(brain, sample, algorithm):
             ValueError('Got invalid algorithm: %r' % algorithm)
     elif brain_children == sample_children:
         for i, child in enumerate(brain):
-            child_result = tree_extract(child, sample[i], algorithm)
+            child_result = tree_extract(child, sample[i], algorithm, hasher)
             result.extend(child_result)
     else:
         raise NoMatch('Brain <%s> tag had children %r, but sample had %s' % \
@@ -233,19 +279,49 @@ class Template(object):
         #          never fails.
         self.htmltree = None
         self.algorithm = algorithm
+        self.num_learned = 0
 
     def learn(self, html):
-        tree = make_tree_and_preprocess(html)
+        # Neither learning nor extracting modifies the tree,
+        # so we don't need a copy.
+        self.learn_tree(tree_cache.make_tree_and_preprocess(html, copy=False))
+
+    def learn_tree(self, tree):
+        """
+        Like learn(), for a tree that has already been through
+        make_tree_and_preprocess(). The tree isn't modified.
+        """
         if self.htmltree is None:
             self.htmltree = tree
         else:
             self.htmltree = tree_diff(self.htmltree, tree, self.algorithm)
+        self.num_learned += 1
+
+    def learn_many(self, pages):
+        """
+        Learns each HTML string from the iterable ``pages`` in turn,
+        which may be a generator. Since everything learned so far is
+        summed up in self.htmltree, each new page is only diffed once,
+        against that; so a Template can keep learning from a stream of
+        pages as they are fetched. Returns the number of pages learned.
+        """
+        count = 0
+        for html in pages:
+            self.learn(html)
+            count += 1
+        return count
 
     def as_text(self):
         return etree.tostring(self.htmltree, method='html')
 
     def extract(self, html):
-        tree = make_tree_and_preprocess(html)
+        return self.extract_tree(tree_cache.make_tree_and_preprocess(html, copy=False))
+
+    def extract_tree(self, tree):
+        """
+        Like extract(), for a tree that has already been through
+        make_tree_and_preprocess().
+        """
         if self.htmltree is None:
             raise ValueError('This template has not learned anything yet.')
         return tree_extract(self.htmltree, tree, self.algorithm)
@@ -255,14 +331,16 @@ def extract(html, other_pages):
     Given an HTML page string and list of other pages, creates a Template
     and extracts the data from the page.
     """
+    # Parse each page only once, even if we need both algorithms.
+    trees = [tree_cache.make_tree_and_preprocess(page, copy=False) for page in [html] + other_pages]
     # First try algorithm 1, because it's more effective. But if it fails,
     # fall back to algorithm 2.
     for algorithm in (1, 2):
         t = Template(algorithm=algorithm)
-        for sample in [html] + other_pages:
-            t.learn(sample)
+        for tree in trees:
+            t.learn_tree(tree)
         try:
-            return t.extract(html)
+            return t.extract_tree(trees[0])
         except NoMatch:
             if algorithm == 1:
                 continue
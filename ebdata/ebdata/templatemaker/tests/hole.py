@@ -65,6 +65,20 @@ class HoleEquality(unittest.TestCase):
     def test_nonequal_ignorehole2(self):
         self.assertNotEqual(IgnoreHole(), OrHole('a'))
 
+class HoleHash(unittest.TestCase):
+    # Equal holes must hash equal, so listdiff can use them as dict keys.
+    def test_hole(self):
+        self.assertEqual(hash(Hole()), hash(Hole()))
+
+    def test_orhole(self):
+        self.assertEqual(hash(OrHole('a', 'b')), hash(OrHole('a', 'b')))
+
+    def test_regexhole(self):
+        self.assertEqual(hash(RegexHole('\d\d', False)), hash(RegexHole('\d\d', False)))
+
+    def test_ignorehole(self):
+        self.assertEqual(hash(IgnoreHole()), hash(IgnoreHole()))
+
 class HoleRepr(unittest.TestCase):
     def test_hole(self):
         self.assertEqual(repr(Hole()), '<Hole>')
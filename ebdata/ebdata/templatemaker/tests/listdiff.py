@@ -16,8 +16,11 @@
 #   along with ebdata.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from ebdata.templatemaker.hole import Hole
+from ebdata.templatemaker.hole import Hole, OrHole
 from ebdata.templatemaker.listdiff import listdiff, longest_common_substring
+from ebdata.templatemaker.listdiff import automaton_longest_common_substring
+from ebdata.templatemaker.listdiff import quadratic_longest_common_substring
+import random
 import unittest
 
 class LongestCommonSubstring(unittest.TestCase):
@@ -276,5 +279,40 @@ class ListdiffTestCase(unittest.TestCase):
             ['foo', Hole(), Hole()],
         )
 
+class LongestCommonSubstringAutomaton(LongestCommonSubstring):
+    def LCS(self, seq1, seq2):
+        return automaton_longest_common_substring(seq1, seq2)
+
+class AutomatonEquivalence(unittest.TestCase):
+    """
+    The suffix automaton must pick exactly the same match as the
+    quadratic algorithm, ties included.
+    """
+    def assertSame(self, seq1, seq2):
+        self.assertEqual(automaton_longest_common_substring(seq1, seq2),
+                         quadratic_longest_common_substring(seq1, seq2))
+
+    def test_random(self):
+        rand = random.Random(42)
+        for i in range(2000):
+            alphabet = 'abcdefghij'[:rand.randint(1, 10)]
+            seq1 = [rand.choice(alphabet) for j in range(rand.randint(0, 40))]
+            seq2 = [rand.choice(alphabet) for j in range(rand.randint(0, 40))]
+            self.assertSame(seq1, seq2)
+
+    def test_strings(self):
+        self.assertSame('the quick brown fox', 'the slow brown dog')
+        self.assertSame('aaaaaaaa', 'aaa')
+
+    def test_holes(self):
+        self.assertSame(['a', Hole(), 'b', OrHole('x', 'y')],
+                        ['c', Hole(), 'b', OrHole('x', 'y')])
+
+    def test_unhashable(self):
+        self.assertSame([['a'], ['b'], ['c']], [['b'], ['c']])
+
+    def test_no_match(self):
+        self.assertSame('abc', 'xyz')
+
 if __name__ == "__main__":
     unittest.main()
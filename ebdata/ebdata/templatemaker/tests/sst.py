@@ -17,6 +17,7 @@
 #
 
 from ebdata.templatemaker.sst import tree_diff, Template, NoMatch
+from ebdata.templatemaker.sst import ElementHasher, element_hash_strict, element_hash_loose
 from ebdata.textmining.treeutils import preprocess
 from lxml import etree
 from lxml.html import document_fromstring
@@ -853,5 +854,61 @@ class TemplateExtractionTestCaseAlgorithm2(TemplateExtractionTestCaseAlgorithm1)
               {'tag': 'div', 'type': 'text', 'value': 'Copyright 2007'}]]
         )
 
+class ElementHasherTestCase(unittest.TestCase):
+    def setUp(self):
+        tree = document_fromstring('<html><body><p class="a">x</p><br><p class="a">x</p><br><h1>y</h1></body></html>')
+        self.elements = list(preprocess(tree).find('body'))
+
+    def test_equal_elements(self):
+        hashes = ElementHasher().hashes(self.elements, element_hash_strict)
+        self.assertEqual(hashes[0], hashes[2])
+        self.assertNotEqual(hashes[0], hashes[4])
+
+    def test_br_unique(self):
+        hashes = ElementHasher().hashes(self.elements, element_hash_loose)
+        self.assertNotEqual(hashes[1], hashes[3])
+
+    def test_memoized(self):
+        hasher = ElementHasher()
+        first = hasher.hashes(self.elements, element_hash_strict)
+        self.assertEqual(hasher.hashes(self.elements, element_hash_strict), first)
+        self.assertEqual(hasher.hashes(self.elements[1:2], element_hash_strict), first[1:2])
+
+    def test_deterministic(self):
+        html1 = '<html><body>%s</body></html>' % ('<p>a</p><br>' * 50)
+        html2 = '<html><body>%s</body></html>' % ('<p>b</p><br>' * 50)
+        results = set()
+        for i in range(3):
+            t = Template()
+            t.learn(html1)
+            t.learn(html2)
+            results.add(t.as_text())
+        self.assertEqual(len(results), 1)
+        self.assertFalse('<br>' in results.pop())
+
+class IncrementalLearningTestCase(unittest.TestCase):
+    pages = ['<html><body><h1>Headline %d</h1><p>Story %d</p><div id="footer">Copyright</div></body></html>' % (i, i)
+             for i in range(5)]
+
+    def test_learn_many(self):
+        t1 = Template()
+        for html in self.pages:
+            t1.learn(html)
+        t2 = Template()
+        self.assertEqual(t2.learn_many(iter(self.pages)), 5)
+        self.assertEqual(t2.num_learned, 5)
+        self.assertEqual(t1.as_text(), t2.as_text())
+
+    def test_learn_more_later(self):
+        t1 = Template()
+        t1.learn_many(self.pages)
+        t2 = Template()
+        t2.learn_many(self.pages[:2])
+        t2.learn_many(self.pages[2:])
+        self.assertEqual(t1.as_text(), t2.as_text())
+        self.assertEqual(t2.extract(self.pages[3]),
+                         [{'tag': 'h1', 'type': 'text', 'value': 'Headline 3'},
+                          {'tag': None, 'type': 'multitag', 'value': '<p>Story 3</p>'}])
+
 if __name__ == "__main__":
     unittest.main()
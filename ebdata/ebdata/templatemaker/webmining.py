@@ -18,7 +18,7 @@
 
 from ebdata.templatemaker.htmlutils import remove_empty_tags, brs_to_paragraphs
 from ebdata.templatemaker.sst import extract
-from ebdata.textmining.treeutils import make_tree_and_preprocess, preprocess
+from ebdata.textmining.treeutils import make_tree_and_preprocess
 from lxml import etree
 import re
 
@@ -35,10 +35,8 @@ def mine_page(html, other_pages):
 
         # If it's a multitag value, clean its HTML a bit.
         if hole['type'] == 'multitag':
-            tree = make_tree_and_preprocess(hole['value'])
-
             # Drop a bunch of tags that can muck up the display.
-            tree = preprocess(tree,
+            tree = make_tree_and_preprocess(hole['value'],
                 drop_tags=('a', 'area', 'b', 'center', 'font', 'form', 'img', 'input', 'map', 'small', 'sub', 'sup', 'topic'),
                 drop_trees=('applet', 'button', 'embed', 'iframe', 'object', 'select', 'textarea'),
                 drop_attrs=('background', 'border', 'cellpadding', 'cellspacing', 'class', 'clear', 'id', 'rel', 'style', 'target'))
@@ -20,7 +20,7 @@
 Unit tests for ebdata/textmining/treeutils.py
 """
 
-from ebdata.textmining.treeutils import make_tree, preprocess
+from ebdata.textmining.treeutils import make_tree, preprocess, TreeCache
 from lxml import etree
 import unittest
 
@@ -119,5 +119,58 @@ class PreprocessTestCase(unittest.TestCase):
     def test_drop_namespaced_attrs2(self):
         self.assertPreprocesses('<html><body><div dc:foo="foo" id="bar">Hi</div></body></html>', '<html><body><div id="bar">Hi</div></body></html>')
 
+    def test_droptags_and_droptrees(self):
+        # Dropping the tag wins; its contents are kept.
+        self.assertPreprocesses('<html><body><div><p>Hello</p> there</div></body></html>', '<html><body><p>Hello</p> there</body></html>', drop_tags=('div',), drop_trees=('div',))
+
+    def test_droptrees_keeps_tail(self):
+        self.assertPreprocesses('<html><body><p>Hi <span>drop</span>there</p></body></html>', '<html><body><p>Hi there</p></body></html>', drop_trees=('span',))
+
+class TreeCacheTestCase(unittest.TestCase):
+    html = '<html><body><!-- c --><div id="a">Hello</div></body></html>'
+
+    def test_make_tree(self):
+        cache = TreeCache()
+        tree1 = cache.make_tree(self.html)
+        tree2 = cache.make_tree(self.html)
+        self.assertEqual(etree.tostring(tree1), etree.tostring(make_tree(self.html)))
+        self.assertEqual(etree.tostring(tree1), etree.tostring(tree2))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_copies(self):
+        cache = TreeCache()
+        tree1 = cache.make_tree_and_preprocess(self.html)
+        tree1.find('body').clear()
+        tree2 = cache.make_tree_and_preprocess(self.html)
+        self.assertEqual(etree.tostring(tree2), '<html><body><div id="a">Hello</div></body></html>')
+        self.failIf(tree1 is tree2)
+
+    def test_no_copy(self):
+        cache = TreeCache()
+        tree1 = cache.make_tree_and_preprocess(self.html, copy=False)
+        tree2 = cache.make_tree_and_preprocess(self.html, copy=False)
+        self.failUnless(tree1 is tree2)
+
+    def test_preprocess_options(self):
+        cache = TreeCache()
+        cache.make_tree_and_preprocess(self.html)
+        tree = cache.make_tree_and_preprocess(self.html, drop_attrs=('id',))
+        self.assertEqual(etree.tostring(tree), '<html><body><div>Hello</div></body></html>')
+        # The second call reused the parsed tree.
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_unicode_and_bytes(self):
+        cache = TreeCache()
+        cache.make_tree('<p>caf\xc3\xa9</p>')
+        cache.make_tree(u'<p>caf\xe9</p>')
+        self.assertEqual(cache.misses, 2)
+
+    def test_max_entries(self):
+        cache = TreeCache(max_entries=2)
+        for html in ('<p>1</p>', '<p>2</p>', '<p>1</p>', '<p>3</p>', '<p>1</p>', '<p>2</p>'):
+            cache.make_tree(html)
+        # Only '1' was still cached when asked for again.
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
 if __name__ == "__main__":
     unittest.main()
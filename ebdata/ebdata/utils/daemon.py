@@ -35,6 +35,10 @@ class Daemon(object):
 
     usage = "usage: %prog [options] start|stop|restart"
 
+    # Commands accepted on the command line. Subclasses can add
+    # more; each must have a method of the same name.
+    commands = ('start', 'stop', 'restart')
+
     def __init__(self, pidfile, stdin='/dev/null', stdout='/dev/null', stderr='/dev/null'):
         """
         pid file given is used by default unless overridden at the command line.
@@ -59,7 +63,7 @@ class Daemon(object):
         self.pidfile = self.options.pidfile
         self.command = None
         if len(self.args) == 1:
-            if self.args[0] in ('start', 'stop', 'restart'):
+            if self.args[0] in self.commands:
                 self.command = self.args[0]
             else:
                 self.parser.error("unknown command")
@@ -78,8 +82,8 @@ class Daemon(object):
             self.start(self.options.debugging)
         elif self.command == 'stop':
             self.stop()
-        elif self.command == 'restart':
-            self.restart()
+        elif self.command in self.commands:
+            getattr(self, self.command)()
         else:
             raise RuntimeError("self.command is %s, shouldn't happen" % self.command)
         sys.exit(0)
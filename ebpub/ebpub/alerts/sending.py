@@ -20,10 +20,12 @@ from django.conf import settings
 from django.core.mail import get_connection, EmailMultiAlternatives
 from django.template.loader import render_to_string
 from ebpub.alerts.models import EmailAlert
-from ebpub.db.models import NewsItem
+from ebpub.db.models import Location, NewsItem
 from ebpub.db.utils import populate_attributes_if_needed
+from ebpub.db.buckets import filter_by_geometry
 from ebpub.db.utils import make_search_buffer
 from ebpub.streets.models import Block
+from ebpub.utils.multidb import use_replica
 import datetime
 
 class NoNews(Exception):
@@ -63,7 +65,7 @@ def email_for_subscription(alert, start_date, frequency):
     from ebpub.utils.view_utils import get_schema_manager_for_user
     manager = get_schema_manager_for_user(alert.user)
     allowed_schemas = manager.allowed_schema_ids()
-    qs = NewsItem.objects.select_related().filter(schema__id__in=allowed_schemas)
+    qs = NewsItem.objects.select_related('schema').filter(schema__id__in=allowed_schemas)
     if alert.include_new_schemas:
         # We saved an opt-out list.
         if alert.schemas:
@@ -77,12 +79,13 @@ def email_for_subscription(alert, start_date, frequency):
         place = alert._get_block()
         place_name, place_url = place.pretty_name, place.url()
         search_buffer = make_search_buffer(place.geom.centroid, alert.radius)
-        qs = qs.filter(location__bboverlaps=search_buffer)
+        qs = filter_by_geometry(qs, search_buffer)
 
-    elif alert.location:
-        place_name, place_url = alert.location.name, alert.location.url()
-        place = alert.location
-        qs = qs.filter(newsitemlocation__location__id=alert.location.id)
+    elif alert.location_id:
+        # We only need the name and URL, not the polygon.
+        place = Location.objects.lean().select_related('location_type').get(id=alert.location_id)
+        place_name, place_url = place.name, place.url()
+        qs = qs.filter(newsitemlocation__location__id=place.id)
 
     # Order by schema__id to group schemas together.
     news_qs = qs.filter(schema__is_event=False,
@@ -111,23 +114,28 @@ def send_all(frequency, verbose=False):
 
     Note that it does not keep track of already-sent messages, so take
     care not to call send_all(frequency) more often than ``frequency`` days.
+
+    Reads from a replica database, if any are configured; see
+    :py:mod:`ebpub.utils.multidb`. The alerts only cover NewsItems
+    published up to the end of yesterday, so a little lag doesn't matter.
     """
     conn = get_connection() # Use default settings.
     count = 0
     start_date = datetime.date.today() - datetime.timedelta(days=frequency)
-    for alert in EmailAlert.active_objects.filter(frequency=frequency):
-        try:
-            place_name, text_content, html_content = email_for_subscription(alert, start_date, frequency)
-        except NoNews:
-            continue
-        subject = 'Update: %s' % place_name
-        message = EmailMultiAlternatives(subject, text_content, settings.GENERIC_EMAIL_SENDER,
-            [alert.user.email], connection=conn)
-        message.attach_alternative(html_content, 'text/html')
-        message.send()
-        if verbose:
-            print "Sent to %s" % alert.user.email
-        count += 1
+    with use_replica():
+        for alert in EmailAlert.active_objects.filter(frequency=frequency):
+            try:
+                place_name, text_content, html_content = email_for_subscription(alert, start_date, frequency)
+            except NoNews:
+                continue
+            subject = 'Update: %s' % place_name
+            message = EmailMultiAlternatives(subject, text_content, settings.GENERIC_EMAIL_SENDER,
+                [alert.user.email], connection=conn)
+            message.attach_alternative(html_content, 'text/html')
+            message.send()
+            if verbose:
+                print "Sent to %s" % alert.user.email
+            count += 1
     return count
 
 def main(argv=None):
@@ -0,0 +1,42 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Reproducible performance benchmarks for OpenBlock.
+
+:py:mod:`ebpub.benchmark.metro` generates a synthetic metro of any
+size: a grid of streets, neighborhoods, a few schemas with lookups,
+and as many NewsItems as you like. :py:mod:`ebpub.benchmark.scenarios`
+then times typical pages, API calls and batch jobs against it, and
+writes the results as JSON so you can compare them between commits.
+
+Use a dedicated, empty database for this! Generating a metro replaces
+all streets and intersections.  Typical usage::
+
+  make_synthetic_metro --streets 40 --items 1000000
+  run_benchmarks --output before.json
+  # ... change some code ...
+  run_benchmarks --output after.json --compare before.json
+
+Add ``--bytes`` to also see how many bytes the list views' queries
+transfer with and without geometries.
+
+Add ``--buckets`` to time block radius queries with and without
+:py:mod:`spatial buckets <ebpub.db.buckets>`; they only make a
+difference on big tables, eg. ``--items 5000000``.
+"""
@@ -0,0 +1,491 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Generates a synthetic metro for benchmarking.
+
+The metro is laid out in the middle of the current metro's extent
+(see ``METRO_LIST``):
+
+* a grid of north-south avenues and east-west streets, with one
+  :py:class:`Block <ebpub.streets.models.Block>` per street segment,
+  100 address numbers per block, plus the Streets and Intersections
+  derived from them;
+
+* a grid of neighborhood and zip code
+  :py:class:`Locations <ebpub.db.models.Location>`;
+
+* a few :py:class:`Schemas <ebpub.db.models.Schema>`, each with a
+  lookup, a many-to-many lookup, an integer, a date and a text
+  SchemaField;
+
+* any number of NewsItems with Attributes, at random points and dates,
+  created with bulk SQL so millions don't take all day;
+
+* some users with email alerts for blocks and locations.
+
+Everything is derived from a random seed, so the same options always
+give the same metro. Everything it creates has ``synth`` in its slug
+or email address, or ``SYNTH_ZIP`` as its zip code, and :py:meth:`SyntheticMetro.delete` removes it
+again; but populating streets and intersections replaces *all* of
+them, so use a dedicated database.
+"""
+
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
+from django.db import connection, transaction
+from ebpub.alerts.models import EmailAlert
+from ebpub.db.buckets import update_buckets
+from ebpub.db.bin.update_aggregates import update_aggregates
+from ebpub.db.lookupcache import LookupCache
+from ebpub.db.models import Location, LocationType, NewsItem, Schema, SchemaField
+from ebpub.metros.allmetros import get_metro
+from ebpub.streets.models import Block
+from ebpub.streets.name_utils import make_block_numbers, make_pretty_name
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+from ebpub.utils.text import slugify
+
+import datetime
+import logging
+import random
+
+logger = logging.getLogger('ebpub.benchmark.metro')
+
+SLUG_PREFIX = 'synth'
+EMAIL_TEMPLATE = 'synth-user-%d@example.com'
+# All synthetic Blocks have this zip code.
+SYNTH_ZIP = u'00000'
+
+# NewsItems are inserted this many at a time.
+BATCH_SIZE = 20000
+
+_SYLLABLES = ['ab', 'bel', 'cor', 'dan', 'el', 'fair', 'glen', 'har', 'iv',
+              'jas', 'kel', 'lor', 'mar', 'nor', 'or', 'pem', 'quin', 'ros',
+              'sel', 'tal', 'ver', 'wil']
+
+
+def street_names(count, offset=0):
+    """
+    Returns ``count`` distinct, pronounceable, made-up street names
+    like u'Abelton'. Different ``offset`` values give different names.
+
+    >>> street_names(3)
+    [u'Ababton', u'Abbelton', u'Abcorton']
+    """
+    names = []
+    num = len(_SYLLABLES)
+    for i in range(offset, offset + count):
+        first, second = _SYLLABLES[(i // num) % num], _SYLLABLES[i % num]
+        names.append((u'%s%ston' % (first, second)).capitalize())
+    return names
+
+
+class SyntheticMetro(object):
+    """
+    Creates (or describes) a synthetic metro; see the module docs.
+
+    ``streets`` is the number of avenues, and of streets, so there are
+    about ``2 * streets ** 2`` Blocks. ``spacing`` is the distance
+    between streets, in degrees. There are ``locations ** 2``
+    neighborhoods, in as many rows and columns.
+
+    The options only matter to :py:meth:`generate`; the ``get_*()``
+    methods and :py:meth:`describe` find whatever synthetic metro is
+    in the database.
+    """
+
+    def __init__(self, streets=30, spacing=0.002, locations=4, schemas=3,
+                 lookups=20, items=100000, days=365, alerts=50, seed=1):
+        self.streets = streets
+        self.spacing = spacing
+        self.locations = locations
+        self.schemas = schemas
+        self.lookups = lookups
+        self.items = items
+        self.days = days
+        self.alerts = alerts
+        self.seed = seed
+        metro = get_metro()
+        self.city = metro['city_name'].upper()
+        self.state = metro['state'].upper()
+        minx, miny, maxx, maxy = metro['extent']
+        size = spacing * (streets - 1)
+        self.origin = ((minx + maxx - size) / 2.0, (miny + maxy - size) / 2.0)
+        self.size = size
+
+    def options(self):
+        """
+        Returns the options this metro was created with, as a dict.
+        """
+        return dict((key, getattr(self, key)) for key in
+                    ('streets', 'spacing', 'locations', 'schemas', 'lookups',
+                     'items', 'days', 'alerts', 'seed'))
+
+    def generate(self):
+        """
+        Deletes any previous synthetic metro, and creates a new one.
+        """
+        self.delete()
+        self.random = random.Random(self.seed)
+        self.make_blocks()
+        self.make_streets()
+        self.make_locations()
+        self.make_schemas()
+        self.make_newsitems()
+        self.make_alerts()
+        self.make_aggregates()
+
+    # Things the scenarios need.
+
+    def get_schemas(self):
+        return list(Schema.objects.filter(slug__startswith=SLUG_PREFIX + '-').order_by('slug'))
+
+    def get_location_types(self):
+        return list(LocationType.objects.filter(slug__startswith=SLUG_PREFIX + '-').order_by('slug'))
+
+    def get_locations(self):
+        return list(Location.objects.filter(
+                location_type__slug__startswith=SLUG_PREFIX + '-').order_by('location_type', 'display_order'))
+
+    def get_blocks(self):
+        return list(Block.objects.filter(left_zip=SYNTH_ZIP).order_by('id'))
+
+    def get_alerts(self):
+        from ebpub.accounts.models import User
+        user_ids = User.objects.filter(email__startswith='synth-user-').values_list('id', flat=True)
+        return list(EmailAlert.objects.filter(user_id__in=list(user_ids)))
+
+    def _avenue_names(self):
+        return street_names(self.streets)
+
+    def _street_names(self):
+        return street_names(self.streets, offset=self.streets)
+
+    def addresses(self, count):
+        """
+        Returns ``count`` random (address, avenue name, street name)
+        tuples, for geocoding, eg. (u'1234 Abbelton Ave', u'Abbelton Ave',
+        u'Cordanton St'). The same for each call with the same count.
+
+        These are based on the Blocks in the database, so they work
+        no matter what options the metro was generated with.
+        """
+        rand = random.Random(self.seed)
+        blocks = Block.objects.filter(left_zip=SYNTH_ZIP)
+        avenues = sorted(set(blocks.filter(suffix=u'AVE').values_list('street', flat=True)))
+        streets = sorted(set(blocks.filter(suffix=u'ST').values_list('street', flat=True)))
+        num_blocks = len(avenues) - 1
+        result = []
+        for i in range(count):
+            avenue = u'%s Ave' % rand.choice(avenues).title()
+            street = u'%s St' % rand.choice(streets).title()
+            number = rand.randint(1, num_blocks) * 100 + rand.randint(0, 99)
+            result.append((u'%d %s' % (number, avenue), avenue, street))
+        return result
+
+    # Creating things.
+
+    @transaction.commit_on_success
+    def make_blocks(self):
+        x0, y0 = self.origin
+        count = 0
+        # Avenues run north-south, streets east-west.
+        for direction, names, suffix in (('ns', self._avenue_names(), u'AVE'),
+                                         ('ew', self._street_names(), u'ST')):
+            for i, name in enumerate(names):
+                for j in range(self.streets - 1):
+                    if direction == 'ns':
+                        x = x0 + i * self.spacing
+                        start = (x, y0 + j * self.spacing)
+                        end = (x, y0 + (j + 1) * self.spacing)
+                    else:
+                        y = y0 + i * self.spacing
+                        start = (x0 + j * self.spacing, y)
+                        end = (x0 + (j + 1) * self.spacing, y)
+                    self._make_block(name.upper(), suffix, (j + 1) * 100, start, end)
+                    count += 1
+        logger.info("Created %d blocks" % count)
+
+    def _make_block(self, street, suffix, base, start, end):
+        from django.contrib.gis.geos import LineString
+        left_from, left_to, right_from, right_to = base, base + 98, base + 1, base + 99
+        street_pretty_name, pretty_name = make_pretty_name(
+            left_from, left_to, right_from, right_to, u'', u'', street, suffix, u'')
+        from_num, to_num = make_block_numbers(left_from, left_to, right_from, right_to)
+        block = Block(
+            street_slug=slugify(u'%s %s' % (street, suffix)),
+            pretty_name=pretty_name, street_pretty_name=street_pretty_name,
+            predir=u'', prefix=u'', street=street, suffix=suffix, postdir=u'',
+            left_from_num=left_from, left_to_num=left_to,
+            right_from_num=right_from, right_to_num=right_to,
+            from_num=from_num, to_num=to_num,
+            left_zip=SYNTH_ZIP, right_zip=SYNTH_ZIP,
+            left_city=self.city, right_city=self.city,
+            left_state=self.state, right_state=self.state,
+            geom=LineString(start, end, srid=4326))
+        block.save()
+
+    def make_streets(self):
+        from ebpub.streets.bin import populate_streets
+        populate_streets.populate_streets()
+        populate_streets.populate_block_intersections()
+        populate_streets.populate_intersections()
+
+    @transaction.commit_on_success
+    def make_locations(self):
+        x0, y0 = self.origin
+        for slug, name, plural_name, per_side in (
+            ('neighborhoods', u'Neighborhood', u'Neighborhoods', self.locations),
+            ('zipcodes', u'ZIP Code', u'ZIP Codes', max(1, self.locations // 2))):
+            loctype = LocationType.objects.create(
+                name=name, plural_name=plural_name, scope=self.city.title(),
+                slug='%s-%s' % (SLUG_PREFIX, slug),
+                is_browsable=True, is_significant=True)
+            size = self.size / per_side
+            for row in range(per_side):
+                for col in range(per_side):
+                    index = row * per_side + col
+                    if slug == 'zipcodes':
+                        loc_name = u'%05d' % (90000 + index)
+                    else:
+                        loc_name = u'%s %d' % (street_names(1, offset=1000 + index)[0], index)
+                    bbox = (x0 + col * size, y0 + row * size,
+                            x0 + (col + 1) * size, y0 + (row + 1) * size)
+                    polygon = Polygon.from_bbox(bbox)
+                    polygon.srid = 4326
+                    Location.objects.create(
+                        name=loc_name, normalized_name=loc_name.upper(),
+                        slug=slugify(loc_name), location_type=loctype,
+                        location=MultiPolygon(polygon, srid=4326),
+                        display_order=index, city=self.city,
+                        source='synthetic', is_public=True)
+        logger.info("Created %d locations" % len(self.get_locations()))
+
+    @transaction.commit_on_success
+    def make_schemas(self):
+        for i in range(self.schemas):
+            schema = Schema.objects.create(
+                name=u'synthetic item %d' % i,
+                plural_name=u'synthetic items %d' % i,
+                indefinite_article=u'a',
+                slug=u'%s-%d' % (SLUG_PREFIX, i),
+                last_updated=datetime.date.today(),
+                min_date=datetime.date.today() - datetime.timedelta(days=self.days),
+                importance=i,
+                is_public=True,
+                has_newsitem_detail=True,
+                allow_charting=True,
+                uses_attributes_in_list=True,
+                number_in_overview=5,
+                )
+            fields = (
+                # name, real_name, is_lookup, is_filter, is_charted, is_searchable
+                ('category', 'int01', True, True, True, False),
+                ('tag', 'varchar01', True, True, False, False),
+                ('severity', 'int02', False, False, False, False),
+                ('reported', 'date01', False, False, False, False),
+                ('notes', 'varchar02', False, False, False, True),
+                )
+            for order, (name, real_name, is_lookup, is_filter, is_charted, is_searchable) in enumerate(fields):
+                sf = SchemaField.objects.create(
+                    schema=schema, name=name, real_name=real_name,
+                    pretty_name=name.capitalize(), pretty_name_plural=name.capitalize() + 's',
+                    display=True, is_lookup=is_lookup, is_filter=is_filter,
+                    is_charted=is_charted, is_searchable=is_searchable,
+                    display_order=order)
+                if is_lookup:
+                    values = [(u'%s %d' % (name.capitalize(), n), u'%s-%d' % (name, n))
+                              for n in range(self.lookups)]
+                    LookupCache(sf).get_or_create_many(values)
+        logger.info("Created %d schemas" % self.schemas)
+
+    def make_newsitems(self):
+        """
+        Creates NewsItems and their Attributes with bulk SQL.
+        """
+        cursor = connection.cursor()
+        schemas = self.get_schemas()
+        schema_ids = [s.id for s in schemas]
+        x0, y0 = self.origin
+        today = datetime.date.today()
+        # Make postgres' random() repeatable.
+        cursor.execute("SELECT setseed(%s)", [(self.seed % 1000) / 1000.0])
+        for start in range(0, self.items, BATCH_SIZE):
+            count = min(BATCH_SIZE, self.items - start)
+            cursor.execute("""
+                INSERT INTO db_newsitem (schema_id, title, description, url,
+                    pub_date, item_date, last_modification, location, location_name)
+                SELECT (%s::int[])[1 + g %% %s],
+                    'Synthetic item ' || g,
+                    'Synthetic news item number ' || g || ', for benchmarking.',
+                    'http://example.com/synthetic/' || g,
+                    d + random() * interval '1 day', d, now(),
+                    ST_SetSRID(ST_MakePoint(%s + random() * %s, %s + random() * %s), 4326),
+                    'Synthetic location ' || g
+                FROM (SELECT g, %s::date - floor(random() * %s)::int AS d
+                      FROM generate_series(%s, %s) AS g) AS s
+                """, [schema_ids, len(schema_ids), x0, self.size, y0, self.size,
+                      today, self.days, start, start + count - 1])
+            transaction.commit_unless_managed()
+            logger.info("Created %d of %d newsitems" % (start + count, self.items))
+        # Raw SQL skips NewsItem.save(), which normally does this.
+        update_buckets()
+
+        for schema in schemas:
+            fields = dict((sf.name, sf) for sf in schema.schemafield_set.all())
+            category_ids = list(fields['category'].lookup_set.values_list('id', flat=True))
+            tag_ids = list(fields['tag'].lookup_set.values_list('id', flat=True))
+            cursor.execute("""
+                INSERT INTO db_attribute (news_item_id, schema_id, int01, varchar01,
+                    int02, date01, varchar02)
+                SELECT ni.id, ni.schema_id,
+                    (%s::int[])[1 + floor(random() * %s)::int],
+                    (%s::int[])[1 + floor(random() * %s)::int] || ',' ||
+                        (%s::int[])[1 + floor(random() * %s)::int],
+                    floor(random() * 10)::int,
+                    ni.item_date - floor(random() * 3)::int,
+                    'Notes about synthetic item ' || ni.id
+                FROM db_newsitem ni
+                LEFT OUTER JOIN db_attribute a ON a.news_item_id = ni.id
+                WHERE ni.schema_id = %s AND a.news_item_id IS NULL
+                """, [category_ids, len(category_ids), tag_ids, len(tag_ids),
+                      tag_ids, len(tag_ids), schema.id])
+            transaction.commit_unless_managed()
+        logger.info("Created attributes")
+
+    @transaction.commit_on_success
+    def make_alerts(self):
+        from ebpub.accounts.models import User
+        blocks = self.get_blocks()
+        locations = self.get_locations()
+        for i in range(self.alerts):
+            user = User.objects.create_user(email=EMAIL_TEMPLATE % i)
+            alert = EmailAlert(user_id=user.id, frequency=7,
+                               include_new_schemas=True, schemas='',
+                               signup_date=datetime.datetime.now(),
+                               is_active=True)
+            if i % 2:
+                alert.location = self.random.choice(locations)
+            else:
+                alert.block_center = self.random.choice(blocks).geom.centroid
+                alert.radius = self.random.choice([1, 3, 8])
+            alert.save()
+        logger.info("Created %d alerts" % self.alerts)
+
+    def make_aggregates(self):
+        for schema in self.get_schemas():
+            update_aggregates(schema.id, reset=True)
+
+    # Cleaning up.
+
+    def delete(self):
+        """
+        Deletes everything that a previous :py:meth:`generate` created,
+        except Streets and Intersections.
+        """
+        from ebpub.accounts.models import User
+        cursor = connection.cursor()
+        schema_ids = [s.id for s in self.get_schemas()]
+        if schema_ids:
+            # Way faster than letting the ORM collect millions of
+            # NewsItems to cascade.
+            for sql in ("DELETE FROM db_attribute WHERE schema_id IN %s",
+                        "DELETE FROM db_newsitemlocation WHERE news_item_id IN"
+                        " (SELECT id FROM db_newsitem WHERE schema_id IN %s)",
+                        "DELETE FROM db_newsitem WHERE schema_id IN %s"):
+                cursor.execute(sql, [tuple(schema_ids)])
+            transaction.commit_unless_managed()
+            Schema.objects.filter(id__in=schema_ids).delete()
+        users = User.objects.filter(email__startswith='synth-user-')
+        EmailAlert.objects.filter(user_id__in=list(users.values_list('id', flat=True))).delete()
+        users.delete()
+        NewsItem.objects.filter(location_object__location_type__slug__startswith=SLUG_PREFIX + '-').update(location_object=None)
+        LocationType.objects.filter(slug__startswith=SLUG_PREFIX + '-').delete()
+        Block.objects.filter(left_zip=SYNTH_ZIP).delete()
+        transaction.commit_unless_managed()
+
+    def describe(self):
+        """
+        Returns a dict of how many of each thing the metro has.
+        """
+        from ebpub.streets.models import Intersection, Street
+        schemas = self.get_schemas()
+        cursor = connection.cursor()
+        info = {}
+        if schemas:
+            schema_ids = tuple(s.id for s in schemas)
+            cursor.execute("SELECT count(*) FROM db_newsitem WHERE schema_id IN %s", [schema_ids])
+            info['num_newsitems'] = cursor.fetchone()[0]
+            cursor.execute("SELECT count(*) FROM db_attribute WHERE schema_id IN %s", [schema_ids])
+            info['num_attributes'] = cursor.fetchone()[0]
+        else:
+            info['num_newsitems'] = info['num_attributes'] = 0
+        info.update({
+                'num_schemas': len(schemas),
+                'num_blocks': len(self.get_blocks()),
+                'num_streets': Street.objects.count(),
+                'num_intersections': Intersection.objects.count(),
+                'num_locations': len(self.get_locations()),
+                'num_alerts': len(self.get_alerts()),
+                })
+        return info
+
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    parser = OptionParser(usage='''usage: %prog [options]
+
+Creates a synthetic metro for ebpub.benchmark.scenarios, replacing any
+previous one. Use a dedicated database: this replaces all Streets and
+Intersections.
+''')
+    defaults = SyntheticMetro.__init__.im_func.func_defaults
+    names = ('streets', 'spacing', 'locations', 'schemas', 'lookups', 'items',
+             'days', 'alerts', 'seed')
+    helps = {
+        'streets': 'Number of avenues, and of streets.',
+        'spacing': 'Distance between streets, in degrees.',
+        'locations': 'Neighborhoods per side of the grid.',
+        'schemas': 'Number of schemas.',
+        'lookups': 'Number of lookup values per lookup field.',
+        'items': 'Total number of NewsItems.',
+        'days': 'Spread NewsItems over this many days before today.',
+        'alerts': 'Number of users with email alerts.',
+        'seed': 'Random seed.',
+        }
+    for name, default in zip(names, defaults):
+        parser.add_option('--' + name, type=isinstance(default, float) and 'float' or 'int',
+                          default=default, help='%s Default %s.' % (helps[name], default))
+    parser.add_option('--delete', action='store_true', default=False,
+                      help='Just delete the synthetic metro.')
+    add_verbosity_options(parser)
+    opts, args = parser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+    metro = SyntheticMetro(**dict((name, getattr(opts, name)) for name in names))
+    if opts.delete:
+        metro.delete()
+        return
+    logger.info("Generating metro with options %s" % metro.options())
+    metro.generate()
+    logger.info("Done: %s" % metro.describe())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Timed benchmark scenarios against a synthetic metro
+(see :py:mod:`ebpub.benchmark.metro`).
+
+Each scenario is a function that takes a
+:py:class:`SyntheticMetro <ebpub.benchmark.metro.SyntheticMetro>`,
+does any setup, and returns a callable to time. The callable is run
+``--repeat`` times; we record the wall-clock time and number of SQL
+queries of each run. The first run is usually slower, since caches are
+cold; use ``--cold`` to clear the cache before every run instead.
+
+Results are printed, and optionally written as JSON, along with the
+git commit and the size of the metro, so runs from different commits
+can be compared with ``--compare``.
+"""
+
+from django.conf import settings
+from django.core import urlresolvers
+from django.core.cache import cache
+from django.db import connection, reset_queries
+from django.test.client import Client
+from ebpub.benchmark.metro import SyntheticMetro
+from ebpub.db.urlresolvers import filter_reverse
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+
+import datetime
+import logging
+import os
+import subprocess
+import time
+
+logger = logging.getLogger('ebpub.benchmark.scenarios')
+
+# All scenarios, in the order they're run.
+SCENARIOS = []
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def scenario(func):
+    """
+    Decorator that registers a scenario function.
+    """
+    SCENARIOS.append(func)
+    return func
+
+
+def _get_pages(urls):
+    client = Client()
+    def run():
+        for url in urls:
+            response = client.get(url)
+            if response.status_code != 200:
+                raise BenchmarkError("Got status %d for %s" % (response.status_code, url))
+    return run
+
+
+def _date_range(days):
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=days)
+    return start, end
+
+
+# Pages.
+
+@scenario
+def homepage(metro):
+    return _get_pages([urlresolvers.reverse('ebpub-homepage')])
+
+
+@scenario
+def schema_detail(metro):
+    return _get_pages([urlresolvers.reverse('ebpub-schema-detail', args=[s.slug])
+                       for s in metro.get_schemas()])
+
+
+@scenario
+def filter_schema(metro):
+    return _get_pages([filter_reverse(s.slug, []) for s in metro.get_schemas()])
+
+
+@scenario
+def filter_location(metro):
+    location = metro.get_locations()[0]
+    return _get_pages([filter_reverse(s.slug, [('locations', location.location_type.slug, location.slug)])
+                       for s in metro.get_schemas()])
+
+
+@scenario
+def filter_lookup(metro):
+    urls = []
+    for schema in metro.get_schemas():
+        lookup = schema.schemafield_set.get(name='category').lookup_set.order_by('id')[0]
+        urls.append(filter_reverse(schema.slug, [('by-category', lookup.slug)]))
+    return _get_pages(urls)
+
+
+@scenario
+def filter_date(metro):
+    start, end = _date_range(30)
+    dates = (start.strftime('%m/%d/%Y'), end.strftime('%m/%d/%Y'))
+    return _get_pages([filter_reverse(s.slug, [('by-date',) + dates])
+                       for s in metro.get_schemas()])
+
+
+@scenario
+def place_detail(metro):
+    return _get_pages([urlresolvers.reverse('ebpub-location-recent',
+                                            args=[loc.location_type.slug, loc.slug])
+                       for loc in metro.get_locations()[:5]])
+
+
+@scenario
+def filter_block(metro):
+    from ebpub.db.schemafilters import radius_slug
+    block = metro.get_blocks()[len(metro.get_blocks()) // 2]
+    args = ('streets', block.street_slug, block.number() + block.dir_url_bit())
+    return _get_pages([filter_reverse(s.slug, [args + (radius_slug(radius),)])
+                       for s in metro.get_schemas() for radius in ('1', '8')])
+
+
+# API.
+
+def _api_queries(queries):
+    base = urlresolvers.reverse('items_json')
+    return _get_pages(['%s?%s' % (base, query) for query in queries])
+
+
+@scenario
+def api_items(metro):
+    return _api_queries(['type=%s&limit=50' % s.slug for s in metro.get_schemas()])
+
+
+@scenario
+def api_items_location(metro):
+    location = metro.get_locations()[0]
+    return _api_queries(['type=%s&locationid=%s/%s&limit=50'
+                         % (s.slug, location.location_type.slug, location.slug)
+                         for s in metro.get_schemas()])
+
+
+@scenario
+def api_items_radius(metro):
+    start, end = _date_range(30)
+    center = metro.get_blocks()[len(metro.get_blocks()) // 2].geom.centroid
+    return _api_queries(['center=%f,%f&radius=500&startdate=%s&enddate=%s&limit=200'
+                         % (center.x, center.y, start, end)])
+
+
+# Geocoder.
+
+@scenario
+def geocode_addresses(metro):
+    from ebpub.geocoder import SmartGeocoder
+    geocoder = SmartGeocoder(use_cache=False)
+    addresses = [a[0] for a in metro.addresses(50)]
+    def run():
+        for address in addresses:
+            geocoder.geocode(address)
+    return run
+
+
+@scenario
+def geocode_intersections(metro):
+    from ebpub.geocoder import SmartGeocoder
+    geocoder = SmartGeocoder(use_cache=False)
+    intersections = ['%s and %s' % (a[1], a[2]) for a in metro.addresses(50)]
+    def run():
+        for intersection in intersections:
+            geocoder.geocode(intersection)
+    return run
+
+
+# Batch jobs.
+
+@scenario
+def update_aggregates(metro):
+    from ebpub.db.bin.update_aggregates import update_aggregates
+    schemas = metro.get_schemas()
+    def run():
+        for schema in schemas:
+            update_aggregates(schema.id)
+    return run
+
+
+@scenario
+def populate_ni_loc(metro):
+    from ebpub.db.bin.import_locations import populate_ni_loc
+    location = metro.get_locations()[0]
+    return lambda: populate_ni_loc(location)
+
+
+@scenario
+def send_alerts(metro):
+    from ebpub.alerts.sending import send_all
+    def run():
+        # Don't really send mail.
+        old_backend = settings.EMAIL_BACKEND
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        try:
+            send_all(7)
+        finally:
+            settings.EMAIL_BACKEND = old_backend
+    return run
+
+
+# Bytes transferred by lean vs. full querysets.
+
+def query_bytes(queryset):
+    """
+    Returns (rows, bytes) for the given QuerySet: the number of rows,
+    and roughly how many bytes the database sends for them, measured as
+    the size of each row's text representation.
+    """
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    cursor = connection.cursor()
+    cursor.execute('SELECT count(*), coalesce(sum(octet_length(t::text)), 0) FROM (%s) t' % sql,
+                   params)
+    rows, size = cursor.fetchone()
+    return rows, int(size)
+
+
+def _lean_querysets(metro):
+    # (name, full QuerySet, lean QuerySet) as used by the views.
+    from ebpub.db.models import Location, NewsItem
+    from ebpub.streets.models import Block
+    location = metro.get_locations()[0]
+    street_slug = metro.get_blocks()[0].street_slug
+    return [
+        ('location_type_detail',
+         Location.objects.filter(location_type__id=location.location_type_id),
+         Location.objects.lean().filter(location_type__id=location.location_type_id)),
+        ('nearby_locations',
+         Location.objects.select_related().exclude(id=location.id),
+         Location.objects.lean().select_related('location_type').exclude(id=location.id)),
+        ('block_list',
+         Block.objects.filter(street_slug=street_slug),
+         Block.objects.lean().filter(street_slug=street_slug)),
+        ('newsitem_list',
+         NewsItem.objects.select_related().filter(schema__in=metro.get_schemas())[:100],
+         NewsItem.objects.select_related('schema').filter(schema__in=metro.get_schemas())[:100]),
+        ]
+
+
+def lean_report(metro):
+    """
+    Returns a dict of {name: {'full': bytes, 'lean': bytes, 'rows': rows}}
+    comparing the querysets used by list views with and without
+    :py:meth:`lean() <ebpub.utils.geodjango.LeanGeoQuerySet.lean>`.
+    """
+    report = {}
+    for name, full, lean in _lean_querysets(metro):
+        rows, full_bytes = query_bytes(full)
+        rows, lean_bytes = query_bytes(lean)
+        report[name] = {'rows': rows, 'full': full_bytes, 'lean': lean_bytes}
+    return report
+
+
+def format_lean_report(report):
+    lines = ['%-24s %8s %12s %12s' % ('query', 'rows', 'full bytes', 'lean bytes')]
+    for name in sorted(report):
+        stats = report[name]
+        lines.append('%-24s %8d %12d %12d' % (name, stats['rows'], stats['full'], stats['lean']))
+    return '\n'.join(lines)
+
+
+# Block radius queries with and without spatial buckets.
+
+def _time_count(queryset):
+    start = time.time()
+    count = queryset.count()
+    return count, time.time() - start
+
+
+def bucket_report(metro, repeat=3):
+    """
+    Returns a dict of {radius: {'rows': rows, 'plain': seconds,
+    'buckets': seconds}} comparing how long it takes to count the
+    recent NewsItems around a block with just the geometry index and
+    with :py:mod:`spatial buckets <ebpub.db.buckets>` first, best of
+    ``repeat`` runs each.
+    """
+    from ebpub.db.buckets import filter_by_geometry
+    from ebpub.db.models import NewsItem
+    from ebpub.db.utils import make_search_buffer
+    start, end = _date_range(30)
+    block = metro.get_blocks()[len(metro.get_blocks()) // 2]
+    report = {}
+    for radius in ('1', '3', '8'):
+        search_buffer = make_search_buffer(block.geom.centroid, radius)
+        qs = NewsItem.objects.filter(item_date__range=(start, end))
+        plain = qs.filter(location__bboverlaps=search_buffer)
+        bucketed = filter_by_geometry(qs, search_buffer)
+        plain_times, bucket_times = [], []
+        for i in range(repeat):
+            rows, seconds = _time_count(plain)
+            plain_times.append(seconds)
+            bucket_rows, seconds = _time_count(bucketed)
+            bucket_times.append(seconds)
+            if rows != bucket_rows:
+                raise BenchmarkError("Got %d items with buckets, %d without"
+                                     % (bucket_rows, rows))
+        report[radius] = {'rows': rows, 'plain': min(plain_times),
+                          'buckets': min(bucket_times)}
+    return report
+
+
+def format_bucket_report(report):
+    lines = ['%-8s %8s %12s %12s' % ('blocks', 'rows', 'plain', 'buckets')]
+    for radius in sorted(report, key=int):
+        stats = report[radius]
+        lines.append('%-8s %8d %12.4f %12.4f' % (radius, stats['rows'], stats['plain'],
+                                                 stats['buckets']))
+    return '\n'.join(lines)
+
+
+# Running and reporting.
+
+def _summarize(times, queries):
+    ordered = sorted(times)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        median = ordered[middle]
+    else:
+        median = (ordered[middle - 1] + ordered[middle]) / 2.0
+    return {
+        'times': times,
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': sum(times) / len(times),
+        'median': median,
+        'queries': queries,
+        }
+
+
+def run_scenario(func, metro, repeat=3, cold=False):
+    """
+    Runs one scenario ``repeat`` times, and returns a dict of timings
+    in seconds plus the number of SQL queries of the last run.
+    """
+    from ebpub.openblockapi import views as api_views
+    run = func(metro)
+    times = []
+    old_debug_cursor = connection.use_debug_cursor
+    old_throttle_at = api_views._throttle.throttle_at
+    # We'll make way more API calls than any real client is allowed.
+    api_views._throttle.throttle_at = 10 ** 9
+    connection.use_debug_cursor = True
+    try:
+        for i in range(repeat):
+            if cold:
+                cache.clear()
+            reset_queries()
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+            queries = len(connection.queries)
+    finally:
+        connection.use_debug_cursor = old_debug_cursor
+        api_views._throttle.throttle_at = old_throttle_at
+        reset_queries()
+    return _summarize(times, queries)
+
+
+def git_commit():
+    """
+    Returns the current git commit of this checkout, or None.
+    """
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+    except OSError:
+        return None
+    if proc.returncode:
+        return None
+    return out.strip()
+
+
+def run_benchmarks(metro, names=None, repeat=3, cold=False):
+    """
+    Runs the named scenarios (default all), returns the results as a
+    dict ready for JSON.
+    """
+    results = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'commit': git_commit(),
+        'metro': metro.describe(),
+        'repeat': repeat,
+        'cold': cold,
+        'scenarios': {},
+        }
+    for func in SCENARIOS:
+        if names and func.__name__ not in names:
+            continue
+        logger.info("Running %s" % func.__name__)
+        results['scenarios'][func.__name__] = run_scenario(func, metro, repeat, cold)
+    return results
+
+
+def format_results(results, baseline=None):
+    """
+    Returns a plain-text table of ``results``; if ``baseline`` results
+    are given, they're compared by median time.
+    """
+    lines = ['commit %s, %d newsitems' % (results['commit'], results['metro']['num_newsitems'])]
+    if baseline:
+        lines.append('baseline commit %s, %d newsitems' % (
+                baseline['commit'], baseline['metro']['num_newsitems']))
+    lines.append('%-24s %10s %10s %8s' % ('scenario', 'median (s)', 'min (s)', 'queries'))
+    for func in SCENARIOS:
+        name = func.__name__
+        stats = results['scenarios'].get(name)
+        if stats is None:
+            continue
+        line = '%-24s %10.3f %10.3f %8d' % (name, stats['median'], stats['min'], stats['queries'])
+        old = (baseline or {}).get('scenarios', {}).get(name)
+        if old and old['median']:
+            line += '   was %.3f (x%.2f), %d queries' % (
+                old['median'], stats['median'] / old['median'], old['queries'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from django.utils import simplejson as json
+    from optparse import OptionParser
+    parser = OptionParser(usage='''usage: %prog [options]
+
+Times pages, API calls and batch jobs against the synthetic metro
+created by make_synthetic_metro.
+
+Scenarios: ''' + ', '.join(f.__name__ for f in SCENARIOS))
+    parser.add_option('-s', '--scenario', action='append', dest='scenarios', default=[],
+                      help='Run only this scenario. May be given more than once.')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='Run each scenario this many times. Default %default.')
+    parser.add_option('--cold', action='store_true', default=False,
+                      help='Clear the cache before each run.')
+    parser.add_option('-o', '--output', help='Write results to this JSON file.')
+    parser.add_option('-c', '--compare', help='Compare with results from this JSON file.')
+    parser.add_option('--bytes', action='store_true', default=False,
+                      help='Also report bytes transferred by list queries with '
+                      'and without geometries. Needs PostgreSQL.')
+    parser.add_option('--buckets', action='store_true', default=False,
+                      help='Also compare block radius queries with and without '
+                      'spatial buckets. Needs PostgreSQL.')
+    add_verbosity_options(parser)
+    opts, args = parser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+    known = set(f.__name__ for f in SCENARIOS)
+    unknown = set(opts.scenarios) - known
+    if unknown:
+        parser.error('Unknown scenario(s): %s' % ', '.join(sorted(unknown)))
+
+    metro = SyntheticMetro()
+    if not metro.get_schemas():
+        parser.error('No synthetic metro found. Run make_synthetic_metro first.')
+    results = run_benchmarks(metro, opts.scenarios, opts.repeat, opts.cold)
+    baseline = None
+    if opts.compare:
+        baseline = json.load(open(opts.compare))
+    print format_results(results, baseline)
+    if opts.bytes:
+        results['bytes'] = lean_report(metro)
+        print
+        print format_lean_report(results['bytes'])
+    if opts.buckets:
+        results['buckets'] = bucket_report(metro, opts.repeat)
+        print
+        print format_bucket_report(results['buckets'])
+    if opts.output:
+        outfile = open(opts.output, 'w')
+        try:
+            json.dump(results, outfile, indent=2)
+        finally:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,7 @@ from optparse import OptionParser
 from django.contrib.gis.gdal import DataSource
 from django.db import connection
 from django.db.utils import IntegrityError
+from ebpub.db import partitions
 from ebpub.db.models import Location, LocationType, NewsItem, NewsItemLocation
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.utils.text import slugify
@@ -46,26 +47,37 @@ def populate_ni_loc(location):
     Add NewsItemLocations for all NewsItems that overlap with the new
     Location.
     """
-    ni_count = NewsItem.objects.count()
     cursor = connection.cursor()
     # In case the location is not new...
     NewsItemLocation.objects.filter(location=location).delete()
     old_niloc_count = NewsItemLocation.objects.count()
-    i = 0
     batch_size = 400
-    while i < ni_count:
-        # We don't use intersecting_collection() because we should have cleaned up
-        # all our geometries by now and it's sloooow ... there could be millions
-        # of db_newsitem rows.
-        cursor.execute("""
-            INSERT INTO db_newsitemlocation (news_item_id, location_id)
-            SELECT ni.id, loc.id FROM db_newsitem ni, db_location loc
-            WHERE st_intersects(ni.location, loc.location)
-                AND ni.id >= %s AND ni.id < %s
-                AND loc.id = %s
-        """, (i, i + batch_size, location.id))
-        connection._commit()
-        i += batch_size
+    # NewsItems in partitions get their NewsItemLocations in the
+    # matching partition table; see ebpub.db.partitions.
+    for ni_table, nl_table, is_partition in partitions.newsitem_tables():
+        cursor.execute("SELECT min(id), max(id) FROM ONLY %s" % ni_table)
+        min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            continue
+        if is_partition:
+            columns, values = 'news_item_id, location_id, item_date', 'ni.id, loc.id, ni.item_date'
+        else:
+            columns, values = 'news_item_id, location_id', 'ni.id, loc.id'
+        i = min_id
+        while i <= max_id:
+            # We don't use intersecting_collection() because we should have cleaned up
+            # all our geometries by now and it's sloooow ... there could be millions
+            # of db_newsitem rows.
+            cursor.execute("""
+                INSERT INTO %s (%s)
+                SELECT %s FROM ONLY %s ni, db_location loc
+                WHERE st_intersects(ni.location, loc.location)
+                    AND ni.id >= %%s AND ni.id < %%s
+                    AND loc.id = %%s
+            """ % (nl_table, columns, values, ni_table),
+                           (i, i + batch_size, location.id))
+            connection._commit()
+            i += batch_size
     new_count = NewsItemLocation.objects.count()
     logger.info("New: %d NewsItemLocations" % (new_count - old_niloc_count))
 
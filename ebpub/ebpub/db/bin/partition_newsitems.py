@@ -0,0 +1,98 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Script to move old NewsItems into partitions by date, and to archive,
+detach or re-attach those partitions. See :py:mod:`ebpub.db.partitions`.
+"""
+
+from ebpub.db import partitions
+from ebpub.db.bin.update_aggregates import update_all_aggregates
+from ebpub.db.models import NewsItemPartition
+from ebpub.utils.dates import today
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import datetime
+import logging
+
+logger = logging.getLogger('ebpub.db.bin.partition_newsitems')
+
+COMMANDS = ('list', 'partition', 'archive', 'activate', 'detach', 'attach')
+
+
+def list_partitions():
+    for partition in NewsItemPartition.objects.all():
+        print "%s\t%s\t%s\t%s" % (partition.name, partition.start_date,
+                                  partition.end_date, partition.state)
+
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options] COMMAND [PARTITION]
+
+Commands:
+  list               List partitions and their states.
+  partition          Move NewsItems older than --days into partitions.
+  archive            Archive partitions older than --days, so the site
+                     stops showing them. Updates aggregates first.
+  activate NAME      Un-archive (and if need be attach) a partition,
+                     and any newer ones.
+  detach NAME        Detach an archived partition's tables.
+  attach NAME        Attach a detached partition's tables again, as archived.
+''')
+    optparser.add_option('-d', '--days', type='int', default=365,
+                         help='Only whole periods ending at least this many days ago. Default %default.')
+    optparser.add_option('-p', '--period', choices=('year', 'month'), default=None,
+                         help='Size of new partitions: year or month. Default from NEWSITEM_PARTITION_PERIOD.')
+    add_verbosity_options(optparser)
+    opts, args = optparser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+    if not args or args[0] not in COMMANDS:
+        optparser.error('Please give one of the commands: %s' % ', '.join(COMMANDS))
+    command = args[0]
+    before = today() - datetime.timedelta(days=opts.days)
+
+    if command == 'list':
+        list_partitions()
+    elif command == 'partition':
+        moved = partitions.partition_before(before, opts.period)
+        logger.info("Moved %d NewsItems in all" % moved)
+    elif command == 'archive':
+        update_all_aggregates()
+        partitions.archive_before(before)
+    else:
+        if len(args) != 2:
+            optparser.error('The %s command needs a partition name' % command)
+        try:
+            partition = NewsItemPartition.objects.get(name=args[1])
+        except NewsItemPartition.DoesNotExist:
+            optparser.error('No partition named %r' % args[1])
+        if command == 'activate':
+            partitions.activate(partition)
+        elif partition.state == NewsItemPartition.ACTIVE and command == 'detach':
+            optparser.error('Archive partition %s before detaching it' % partition.name)
+        elif command == 'detach':
+            partitions.detach(partition)
+        elif partition.state != NewsItemPartition.DETACHED:
+            optparser.error('Partition %s is already attached' % partition.name)
+        else:
+            partitions.attach(partition)
+
+if __name__ == "__main__":
+    main()
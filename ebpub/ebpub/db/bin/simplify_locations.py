@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+#   Copyright 2007,2008,2009,2011 Everyblock LLC, OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Script to regenerate the simplified map geometries of
+:py:class:`ebpub.db.models.Location`, see :py:mod:`ebpub.db.simplify`.
+
+They're normally updated whenever a Location is saved, so you only
+need this after changing ``LOCATION_SIMPLIFY_TOLERANCES``, or for
+Locations loaded some other way (eg. ``loaddata`` or raw SQL).
+"""
+
+from django.db import transaction
+from ebpub.db.models import Location
+from ebpub.db.simplify import update_all_simplified
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import logging
+
+logger = logging.getLogger('ebpub.db.bin.simplify_locations')
+
+
+@transaction.commit_on_success
+def simplify_locations(location_type_slug=None):
+    locations = Location.objects.all()
+    if location_type_slug:
+        locations = locations.filter(location_type__slug=location_type_slug)
+    count = update_all_simplified(locations)
+    logger.info("Simplified %d locations" % count)
+    return count
+
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options] [location_type_slug]
+
+Regenerates simplified geometries for all Locations
+(default), or just those of the given LocationType.
+''')
+    add_verbosity_options(optparser)
+    opts, args = optparser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+    simplify_locations(*args[:1])
+
+if __name__ == "__main__":
+    main()
@@ -21,28 +21,60 @@
 Script to populate :ref:`aggregates`.
 Typically run without arguments.  The ``--reset`` option will delete
 all aggregates first.
+
+Daily aggregates for archived partitions (see
+:py:mod:`ebpub.db.partitions`) are left alone, since they don't
+change; ``--partition`` recounts just one partition's dates.
+
+With ``--replica``, NewsItems are counted on a replica database (see
+:py:mod:`ebpub.utils.multidb`), so the counts may miss the last few
+seconds of changes.
 """
 
-from django.db import connection, transaction
+from django.db import connection, connections, transaction
 from ebpub.db import constants
-from ebpub.db.models import Schema, SchemaField, NewsItem, AggregateAll, AggregateDay, AggregateLocationDay, AggregateLocation, AggregateFieldLookup
+from ebpub.db.models import Schema, SchemaField, NewsItem, AggregateAll, AggregateDay, AggregateLocationDay, AggregateLocation, AggregateFieldLookup, AggregateSchemaSummary
+from ebpub.db.models import NewsItemPartition
+from ebpub.db.partitions import archive_cutoff
+from ebpub.db.homepage import mark_stale, refresh_homepage
+from ebpub.db.schemasummary import update_summary
 from ebpub.utils.dates import today
+from ebpub.utils.multidb import pinned_db, use_primary, use_replica
 from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
 import logging
 
 logger = logging.getLogger('ebpub.db.bin.update_aggregates')
 
+def _date_range_sql(field, since, until):
+    # SQL conditions and params for since <= field < until; either may be None.
+    conditions, params = [], []
+    if since is not None:
+        conditions.append('%s >= %%s' % field)
+        params.append(since)
+    if until is not None:
+        conditions.append('%s < %%s' % field)
+        params.append(until)
+    return conditions, params
+
 def smart_update(cursor, new_values, table_name, field_names, comparable_fields,
-                 where, pk_name='id', dry_run=False):
+                 where, pk_name='id', dry_run=False, date_range=None):
     # new_values is a list of dictionaries, each with a value for each field in field_names.
+    # date_range is an optional (field, since, until) tuple; rows
+    # outside it are left alone.
 
     # Run a query to determine the current values in the DB.
     where = where.items()
+    conditions = ['%s=%%s' % k for k, v in where]
+    params = [v for k, v in where]
+    if date_range is not None:
+        range_conditions, range_params = _date_range_sql(*date_range)
+        conditions.extend(range_conditions)
+        params.extend(range_params)
     cursor.execute("""
         SELECT %s, %s
         FROM %s
         WHERE %s""" % (pk_name, ','.join(field_names), table_name,
-            ' AND '.join(['%s=%%s' % k for k, v in where])), tuple([v for k, v in where]))
+            ' AND '.join(conditions)), tuple(params))
     old_values = dict([(tuple(row[1:len(comparable_fields)+1]), dict(zip((pk_name,)+field_names, row))) for row in cursor.fetchall()])
     for new_value in new_values:
         key = tuple([new_value[i] for i in comparable_fields])
@@ -71,7 +103,7 @@ def smart_update(cursor, new_values, table_name, field_names, comparable_fields,
         if not dry_run:
             cursor.execute("DELETE FROM %s WHERE %s = %%s" % (table_name, pk_name), (old_value[pk_name],))
 
-def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
+def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False, partition=None):
     """
     Updates all Aggregate* tables for the given schema_id/slug,
     deleting/updating the existing records if necessary.
@@ -81,6 +113,10 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
 
     If reset is True, then all aggregates for this schema will be deleted before
     updating.
+
+    Daily aggregates are only recounted for dates after any archived
+    partitions, unless reset is True; or, if partition (a
+    NewsItemPartition or its name) is given, only for its dates.
     """
     logger.info('... %s' % schema_id_or_slug)
     if not str(schema_id_or_slug).isdigit():
@@ -88,42 +124,70 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
     else:
         schema_id = schema_id_or_slug
     cursor = connection.cursor()
+    # Counting NewsItems can be done on a replica, if main() pinned
+    # reads to one; everything else needs the primary.
+    read_cursor = connections[pinned_db()].cursor()
+
+    if partition is not None:
+        if not isinstance(partition, NewsItemPartition):
+            partition = NewsItemPartition.objects.get(name=partition)
+        since, until = partition.start_date, partition.end_date
+    elif reset:
+        since = until = None
+    else:
+        # Archived partitions don't change.
+        since, until = archive_cutoff(), None
+    date_conditions, date_params = _date_range_sql('item_date', since, until)
+    item_date_where = ''.join([' AND ni.' + c for c in date_conditions])
 
     if reset and not dry_run:
         for aggmodel in (AggregateAll, AggregateDay, AggregateLocation,
-                         AggregateLocationDay, AggregateFieldLookup):
+                         AggregateLocationDay, AggregateFieldLookup,
+                         AggregateSchemaSummary):
             logger.info('... deleting all %s for schema %s' % (aggmodel.__name__, schema_id_or_slug))
             aggmodel.objects.filter(schema__id=schema_id).delete()
 
-    # AggregateAll
-    cursor.execute("SELECT COUNT(*) FROM db_newsitem WHERE schema_id = %s", (schema_id,))
-    new_values = [{'total': row[0]} for row in cursor.fetchall()]
-    smart_update(cursor, new_values, AggregateAll._meta.db_table, ('total',),
-                 (), {'schema_id': schema_id}, dry_run=dry_run)
-
     # AggregateDay
-    cursor.execute("""
+    read_cursor.execute("""
         SELECT item_date, COUNT(*)
-        FROM db_newsitem
-        WHERE schema_id = %s
-        GROUP BY 1""", (schema_id,))
-    new_values = [{'date_part': row[0], 'total': row[1]} for row in cursor.fetchall()]
-    smart_update(cursor, new_values, AggregateDay._meta.db_table, ('date_part', 'total'),
+        FROM db_newsitem ni
+        WHERE schema_id = %%s%s
+        GROUP BY 1""" % item_date_where, [schema_id] + date_params)
+    day_values = [{'date_part': row[0], 'total': row[1]} for row in read_cursor.fetchall()]
+    smart_update(cursor, day_values, AggregateDay._meta.db_table, ('date_part', 'total'),
                  ('date_part',), {'schema_id': schema_id}, dry_run=dry_run,
+                 date_range=('date_part', since, until),
                  )
 
+    # AggregateAll
+    total = sum([v['total'] for v in day_values])
+    if since is not None or until is not None:
+        # Plus the daily totals we didn't recount.
+        cursor.execute("""
+            SELECT COALESCE(SUM(total), 0)
+            FROM %s
+            WHERE schema_id = %%s AND NOT (%s)""" % (
+                AggregateDay._meta.db_table,
+                ' AND '.join(_date_range_sql('date_part', since, until)[0])),
+                       [schema_id] + date_params)
+        total += cursor.fetchone()[0]
+    new_values = [{'total': total}]
+    smart_update(cursor, new_values, AggregateAll._meta.db_table, ('total',),
+                 (), {'schema_id': schema_id}, dry_run=dry_run)
+
     # AggregateLocationDay
-    cursor.execute("""
+    read_cursor.execute("""
         SELECT nl.location_id, ni.item_date, loc.location_type_id, COUNT(*)
         FROM db_newsitemlocation nl, db_newsitem ni, db_location loc
         WHERE nl.news_item_id = ni.id
-            AND ni.schema_id = %s
-            AND nl.location_id = loc.id
-        GROUP BY 1, 2, 3""", (schema_id,))
-    new_values = [{'location_id': row[0], 'date_part': row[1], 'location_type_id': row[2], 'total': row[3]} for row in cursor.fetchall()]
+            AND ni.schema_id = %%s
+            AND nl.location_id = loc.id%s
+        GROUP BY 1, 2, 3""" % item_date_where, [schema_id] + date_params)
+    new_values = [{'location_id': row[0], 'date_part': row[1], 'location_type_id': row[2], 'total': row[3]} for row in read_cursor.fetchall()]
     smart_update(cursor, new_values, AggregateLocationDay._meta.db_table, ('location_id', 'date_part', 'location_type_id', 'total'),
                  ('location_id', 'date_part', 'location_type_id'),
                  {'schema_id': schema_id}, dry_run=dry_run,
+                 date_range=('date_part', since, until),
                  )
 
     # AggregateLocation
@@ -168,7 +232,7 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
 
         if sf.is_many_to_many_lookup():
             # AggregateFieldLookup
-            cursor.execute("""
+            read_cursor.execute("""
                 SELECT id, (
                     SELECT COUNT(*) FROM db_attribute a, db_newsitem ni
                     WHERE a.news_item_id = ni.id
@@ -179,7 +243,7 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
                 )
                 FROM db_lookup
                 WHERE schema_field_id = %%s""" % sf.real_name, (schema_id, schema_id, start_date, end_date, sf.id))
-            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in cursor.fetchall()]
+            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in read_cursor.fetchall()]
             smart_update(cursor, new_values, AggregateFieldLookup._meta.db_table,
                          ('lookup_id', 'total'), ('lookup_id',),
                          {'schema_id': schema_id, 'schema_field_id': sf.id},
@@ -187,7 +251,7 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
                          )
         else:
             # AggregateFieldLookup
-            cursor.execute("""
+            read_cursor.execute("""
                 SELECT a.%s, COUNT(*)
                 FROM db_attribute a, db_newsitem ni
                 WHERE a.news_item_id = ni.id
@@ -196,15 +260,21 @@ def update_aggregates(schema_id_or_slug, dry_run=False,  reset=False):
                     AND %s IS NOT NULL
                     AND ni.item_date BETWEEN %%s AND %%s
                 GROUP BY 1""" % (sf.real_name, sf.real_name), (schema_id, schema_id, start_date, end_date))
-            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in cursor.fetchall()]
+            new_values = [{'lookup_id': row[0], 'total': row[1]} for row in read_cursor.fetchall()]
             smart_update(cursor, new_values, AggregateFieldLookup._meta.db_table,
                          ('lookup_id', 'total'), ('lookup_id',),
                          {'schema_id': schema_id, 'schema_field_id': sf.id},
                          dry_run=dry_run)
 
+    # AggregateSchemaSummary, and the homepage which uses AggregateDay.
+    if not dry_run:
+        with use_primary():
+            update_summary(Schema.objects.get(id=schema_id))
+            mark_stale()
+
     transaction.commit_unless_managed()
 
-def update_all_aggregates(dry_run=False, reset=False):
+def update_all_aggregates(dry_run=False, reset=False, partition=None):
     for schema in Schema.objects.all():
         if dry_run:
             logger.info('Dry run: Updating %s aggregates' % schema.plural_name)
@@ -212,7 +282,10 @@ def update_all_aggregates(dry_run=False, reset=False):
             logger.info('Resetting all %s aggregates' % schema.plural_name)
         else:
             logger.info('Updating %s aggregates' % schema.plural_name)
-        update_aggregates(schema.id, dry_run=dry_run, reset=reset)
+        update_aggregates(schema.id, dry_run=dry_run, reset=reset, partition=partition)
+    if not dry_run:
+        with use_primary():
+            refresh_homepage()
 
 def main(argv=None):
     import sys
@@ -230,16 +303,27 @@ Updates aggregate statistics for the given schema (default: all schemas).
 
     optparser.add_option('-d', '--dry-run', action='store_true',
                          help='Dry run, change nothing.')
+    optparser.add_option('-p', '--partition',
+                         help='Only recount daily aggregates for this NewsItem partition, eg. y2009.')
+    optparser.add_option('--replica', action='store_true',
+                         help='Count NewsItems on a replica database, if any are configured.')
 
     opts, args = optparser.parse_args(argv)
 
 
     setup_logging_from_opts(opts, logger)
 
-    if args:
-        return update_aggregates(*args, reset=opts.reset, dry_run=opts.dry_run)
+    if opts.replica:
+        pin = use_replica()
     else:
-        return update_all_aggregates(reset=opts.reset, dry_run=opts.dry_run)
+        pin = use_primary()
+    with pin:
+        if args:
+            return update_aggregates(*args, reset=opts.reset, dry_run=opts.dry_run,
+                                     partition=opts.partition)
+        else:
+            return update_all_aggregates(reset=opts.reset, dry_run=opts.dry_run,
+                                         partition=opts.partition)
 
 if __name__ == "__main__":
     main()
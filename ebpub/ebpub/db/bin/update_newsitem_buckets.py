@@ -0,0 +1,54 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Script to fill in the spatial buckets of
+:py:class:`ebpub.db.models.NewsItem`, see :py:mod:`ebpub.db.buckets`.
+
+They're normally set whenever a NewsItem is saved, so you only need
+this after first migrating, after changing ``NEWSITEM_BUCKET_SIZE``
+(use ``--all``), or for NewsItems loaded with raw SQL.
+"""
+
+from ebpub.db.buckets import update_buckets, BATCH_SIZE
+from ebpub.utils.script_utils import add_verbosity_options, setup_logging_from_opts
+import logging
+
+logger = logging.getLogger('ebpub.db.bin.update_newsitem_buckets')
+
+
+def main(argv=None):
+    import sys
+    if argv is None:
+        argv = sys.argv[1:]
+    from optparse import OptionParser
+    optparser = OptionParser(usage='''usage: %prog [options]
+
+Sets the spatial bucket of NewsItems that don't have one yet, or of
+all NewsItems with --all.
+''')
+    optparser.add_option('-a', '--all', action='store_true', default=False,
+                         help='Recalculate all buckets, eg. after changing NEWSITEM_BUCKET_SIZE.')
+    optparser.add_option('-b', '--batch-size', type='int', default=BATCH_SIZE,
+                         help='How many NewsItem IDs to update per transaction. Default %default.')
+    add_verbosity_options(optparser)
+    opts, args = optparser.parse_args(argv)
+    setup_logging_from_opts(opts, logger)
+    update_buckets(only_missing=not opts.all, batch_size=opts.batch_size)
+
+if __name__ == "__main__":
+    main()
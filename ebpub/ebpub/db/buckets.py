@@ -0,0 +1,206 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Spatial buckets for fast radius and bounding-box queries on NewsItems.
+
+Block pages, block alerts, block feeds and the API's ``center`` /
+``radius`` and ``bbox`` parameters all look for NewsItems whose
+location overlaps a small box. The GiST index on ``location`` can do
+that, but on a big table it can't be combined with the other filters,
+eg. on ``item_date``.
+
+So each NewsItem also stores ``location_bucket``: the number of the
+grid cell, ``NEWSITEM_BUCKET_SIZE`` degrees square (default 0.005,
+about half a kilometer), that contains its whole location. It's NULL
+if the location is missing or spans more than one cell. There's a
+btree index on ``(location_bucket, item_date)``.
+
+:py:func:`filter_by_geometry` first narrows a query to the buckets
+that the search area touches, plus the NULL bucket, and then does the
+exact geometry test. Including the NULL bucket means results are
+always the same as without buckets, even before they've been filled
+in.
+
+Buckets are set whenever a NewsItem is saved. For NewsItems created
+some other way (eg. raw SQL), or after changing
+``NEWSITEM_BUCKET_SIZE``, run the ``update_newsitem_buckets`` script;
+it fills them in with bulk SQL, in batches.
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+
+import logging
+import math
+
+logger = logging.getLogger('ebpub.db.buckets')
+
+# Size of a grid cell, in degrees.
+BUCKET_SIZE = float(getattr(settings, 'NEWSITEM_BUCKET_SIZE', 0.005))
+
+# Searches touching more cells than this just use the geometry index.
+MAX_CANDIDATE_BUCKETS = getattr(settings, 'NEWSITEM_MAX_CANDIDATE_BUCKETS', 400)
+
+# How many NewsItems to update per transaction when backfilling.
+BATCH_SIZE = 50000
+
+# Cell numbers: (row + Y_OFFSET) * WIDTH + (column + X_OFFSET),
+# which is never negative.
+X_OFFSET = int(math.ceil(180.0 / BUCKET_SIZE))
+Y_OFFSET = int(math.ceil(90.0 / BUCKET_SIZE))
+WIDTH = 2 * X_OFFSET + 1
+
+SRID = 4326
+
+
+def _cell(x, y):
+    return int(math.floor(x / BUCKET_SIZE)), int(math.floor(y / BUCKET_SIZE))
+
+
+def _bucket(column, row):
+    return (row + Y_OFFSET) * WIDTH + column + X_OFFSET
+
+
+def _to_srid(geom):
+    if geom.srid and geom.srid != SRID:
+        geom = geom.transform(SRID, clone=True)
+    return geom
+
+
+def bucket_for_geometry(geom):
+    """
+    Returns the bucket of the cell that contains all of ``geom``, or
+    None if there isn't one.
+    """
+    if geom is None or geom.empty:
+        return None
+    xmin, ymin, xmax, ymax = _to_srid(geom).extent
+    column, row = _cell(xmin, ymin)
+    if (column, row) != _cell(xmax, ymax):
+        return None
+    return _bucket(column, row)
+
+
+def candidate_buckets(geom):
+    """
+    Returns a list of the buckets of all cells that overlap the bounding
+    box of ``geom``, or None if there are more than
+    ``MAX_CANDIDATE_BUCKETS``.
+    """
+    xmin, ymin, xmax, ymax = _to_srid(geom).extent
+    col_min, row_min = _cell(xmin, ymin)
+    col_max, row_max = _cell(xmax, ymax)
+    if (col_max - col_min + 1) * (row_max - row_min + 1) > MAX_CANDIDATE_BUCKETS:
+        return None
+    return [_bucket(column, row)
+            for row in range(row_min, row_max + 1)
+            for column in range(col_min, col_max + 1)]
+
+
+def _has_buckets(model):
+    try:
+        model._meta.get_field('location_bucket')
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def filter_by_buckets(queryset, geom):
+    """
+    Narrows a NewsItem ``queryset`` to items that might overlap the
+    bounding box of ``geom``. You still need to test the geometry;
+    see :py:func:`filter_by_geometry`.
+
+    Returns the ``queryset`` unchanged if its model has no buckets (eg.
+    Places) or ``geom`` is too big to bother.
+    """
+    if not _has_buckets(queryset.model):
+        return queryset
+    buckets = candidate_buckets(geom)
+    if buckets is None:
+        return queryset
+    return queryset.filter(Q(location_bucket__in=buckets) | Q(location_bucket__isnull=True))
+
+
+def filter_by_geometry(queryset, geom, lookup='bboverlaps'):
+    """
+    Filters ``queryset`` to items whose ``location`` matches ``geom``
+    with the given spatial ``lookup``, eg. ``'bboverlaps'`` or
+    ``'contained'``, using buckets first where possible.
+
+    The lookup must only match locations whose bounding box overlaps
+    that of ``geom``.
+    """
+    queryset = filter_by_buckets(queryset, geom)
+    return queryset.filter(**{'location__%s' % lookup: geom})
+
+
+# The same calculation as bucket_for_geometry(), in SQL. Box3D()
+# keeps full precision, unlike box2d.
+_BUCKET_SQL = """CASE
+    WHEN floor(ST_XMin(Box3D(location)) / %(size)r::float8) = floor(ST_XMax(Box3D(location)) / %(size)r::float8)
+     AND floor(ST_YMin(Box3D(location)) / %(size)r::float8) = floor(ST_YMax(Box3D(location)) / %(size)r::float8)
+    THEN (floor(ST_YMin(Box3D(location)) / %(size)r::float8)::bigint + %(y_offset)d) * %(width)d
+         + floor(ST_XMin(Box3D(location)) / %(size)r::float8)::bigint + %(x_offset)d
+    ELSE NULL END"""
+
+
+def bucket_sql():
+    """
+    Returns an SQL expression for the bucket of ``db_newsitem.location``.
+    """
+    return _BUCKET_SQL % {'size': BUCKET_SIZE, 'x_offset': X_OFFSET,
+                          'y_offset': Y_OFFSET, 'width': WIDTH}
+
+
+def update_buckets(only_missing=True, batch_size=BATCH_SIZE):
+    """
+    Sets ``location_bucket`` on NewsItems in bulk, committing every
+    ``batch_size`` IDs. By default, only items that have a location
+    and no bucket yet are updated; with ``only_missing=False``, all
+    are recalculated, as needed after changing
+    ``NEWSITEM_BUCKET_SIZE``.
+
+    Returns the number of NewsItems updated.
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT min(id), max(id) FROM db_newsitem")
+    min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return 0
+    where = "id BETWEEN %s AND %s AND location IS NOT NULL"
+    if only_missing:
+        where += " AND location_bucket IS NULL"
+    sql = "UPDATE db_newsitem SET location_bucket = %s WHERE %s" % (bucket_sql(), where)
+    total = 0
+    for start in xrange(min_id, max_id + 1, batch_size):
+        cursor.execute(sql, [start, start + batch_size - 1])
+        total += cursor.rowcount
+        transaction.commit_unless_managed()
+        logger.debug("Updated buckets up to NewsItem %d" % (start + batch_size - 1))
+    logger.info("Updated buckets of %d NewsItems" % total)
+    return total
+
+
+# Signal handler.
+
+def newsitem_pre_save(sender, instance, **kwargs):
+    instance.location_bucket = bucket_for_geometry(instance.location)
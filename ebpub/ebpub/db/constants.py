@@ -49,5 +49,7 @@ NUM_NEWS_ITEMS_PLACE_DETAIL = 300
 # 'n', 'ne', 'n-w', '-sw').
 BLOCK_URL_REGEX = r'(\d{1,6})-(\d{1,6})([nsew]{1,2})?(?:-([nsew]{0,2}))?'
 
-# How long the Schema managers should cache allowed_schema_ids()
-ALLOWED_IDS_CACHE_TIME = 60 * 10
+# How often, in seconds, each process checks whether the schema
+# metadata registry was invalidated by another process.
+# See ebpub.db.schemaregistry.
+SCHEMA_REGISTRY_CHECK_INTERVAL = 10
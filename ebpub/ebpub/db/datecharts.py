@@ -0,0 +1,178 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Date charts: how many NewsItems of a schema there are on each day.
+
+The homepage, the schema detail page and the place pages chart a
+week or a month of days for one or many schemas. Rather than a list of
+``{'date': ..., 'count': ...}`` dicts per schema, built and then
+scanned again for the maximum, total and latest date, a
+:py:class:`DateChart` keeps its counts in an array indexed by day
+offset, filled in one pass from aggregate rows or
+:py:meth:`date_counts() <ebpub.db.models.NewsItemQuerySet.date_counts>`.
+The per-day dicts are only built if a template iterates over
+``dates``; the homepage never does.
+
+A DateChart can be used like the dicts it replaces, eg.
+``chart['total_count']`` or ``{{ chart.total_count }}``.
+"""
+
+from array import array
+from django.db.models import Sum
+
+import datetime
+
+_ONE_DAY = datetime.timedelta(days=1)
+
+
+class DateChart(object):
+    """
+    Counts per day for ``schema``, from ``start_date`` to ``end_date``
+    inclusive. ``counts``, if given, is a sequence of one count per
+    day starting at ``start_date``.
+    """
+
+    KEYS = ('schema', 'dates', 'max_count', 'total_count', 'latest_date')
+
+    def __init__(self, schema, start_date, end_date, counts=None):
+        self.schema = schema
+        self.start_date = start_date
+        self.end_date = end_date
+        num_days = max(0, (end_date - start_date).days + 1)
+        if counts is None:
+            self.counts = array('l', [0]) * num_days
+        else:
+            self.counts = array('l', counts[:num_days])
+            if len(self.counts) < num_days:
+                self.counts.extend([0] * (num_days - len(self.counts)))
+        self._dates = None
+
+    def add(self, date, count):
+        """
+        Adds ``count`` to the count for ``date``, if it's in the chart.
+        """
+        offset = (date - self.start_date).days
+        if 0 <= offset < len(self.counts):
+            self.counts[offset] += count
+            self._dates = None
+
+    def add_counts(self, counts):
+        """
+        Adds a ``{date: count}`` dictionary, eg. from
+        :py:meth:`date_counts() <ebpub.db.models.NewsItemQuerySet.date_counts>`.
+        """
+        for date, count in counts.iteritems():
+            self.add(date, count)
+
+    @property
+    def max_count(self):
+        return self.counts and max(self.counts) or 0
+
+    @property
+    def total_count(self):
+        return sum(self.counts)
+
+    @property
+    def latest_date(self):
+        for offset in xrange(len(self.counts) - 1, -1, -1):
+            if self.counts[offset]:
+                return self.start_date + datetime.timedelta(days=offset)
+        return None
+
+    def nonzero_dates(self):
+        """
+        Returns a list of the dates with a nonzero count, in order.
+        """
+        return [self.start_date + datetime.timedelta(days=offset)
+                for offset, count in enumerate(self.counts) if count]
+
+    @property
+    def dates(self):
+        """
+        A list of ``{'date': date, 'count': count}`` dicts, one per day.
+        """
+        if self._dates is None:
+            dates = []
+            date = self.start_date
+            for count in self.counts:
+                dates.append({'date': date, 'count': count})
+                date += _ONE_DAY
+            self._dates = dates
+        return self._dates
+
+    # Dict-style access, for code and templates written for the old
+    # chart dicts.
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __getstate__(self):
+        # Don't pickle the dates, eg. when cached.
+        state = self.__dict__.copy()
+        state['_dates'] = None
+        return state
+
+    def __repr__(self):
+        return '<DateChart %s %s-%s>' % (getattr(self.schema, 'slug', self.schema),
+                                         self.start_date, self.end_date)
+
+
+def make_date_charts(schemas, start_date, end_date, rows=()):
+    """
+    Returns a list of DateCharts, one per schema in ``schemas`` in the
+    same order, filled from ``rows`` of ``(schema_id, date, count)``.
+    Counts for the same schema and date are added up.
+    """
+    charts = [DateChart(schema, start_date, end_date) for schema in schemas]
+    by_id = dict((chart.schema.id, chart) for chart in charts)
+    for schema_id, date, count in rows:
+        chart = by_id.get(schema_id)
+        if chart is not None and count:
+            chart.add(date, count)
+    return charts
+
+
+def aggregate_date_charts(schemas, start_date, end_date, agg_model, **kwargs):
+    """
+    Returns a list of DateCharts for ``schemas`` from an aggregate
+    model with a ``date_part``, eg. ``AggregateDay`` or
+    ``AggregateLocationDay``, further filtered by ``kwargs``
+    (eg. ``location__id=...``). Does one query for all the schemas.
+    """
+    if not schemas:
+        return []
+    rows = agg_model.objects.filter(
+        schema__id__in=[s.id for s in schemas],
+        date_part__range=(start_date, end_date), **kwargs
+        ).values_list('schema', 'date_part').annotate(count=Sum('total')).order_by()
+    return make_date_charts(schemas, start_date, end_date, rows)
@@ -23,7 +23,9 @@ from django.http import Http404
 from django.utils.feedgenerator import Rss201rev2Feed
 from ebpub.db.models import NewsItem, Location
 from ebpub.db.utils import populate_attributes_if_needed
+from ebpub.db.buckets import filter_by_geometry
 from ebpub.db.utils import make_search_buffer, url_to_block, BLOCK_RADIUS_CHOICES, BLOCK_RADIUS_DEFAULT
+from ebpub.db.versions import conditional_get, LOCATIONS, NEWSITEMS
 from ebpub.streets.models import Block
 from ebpub.utils.dates import today
 import datetime
@@ -41,6 +43,18 @@ class CorrectMimeTypeFeed(Rss201rev2Feed):
 class EbpubFeed(Feed):
     feed_type = CorrectMimeTypeFeed
 
+    # Kinds of data the feed depends on; see ebpub.db.versions.
+    versions = [NEWSITEMS]
+
+    def __call__(self, request, *args, **kwargs):
+        # Feed readers poll a lot; answer 304 Not Modified if we can.
+        # Feeds cover a date range relative to today, so that's part of
+        # the version too.
+        return conditional_get(
+            request, self.versions,
+            lambda: Feed.__call__(self, request, *args, **kwargs),
+            extra=[today()])
+
 location_re = re.compile(r'^([-_a-z0-9]{1,32})/([-_a-z0-9]{1,32})$')
 
 def bunch_by_date_and_schema(newsitem_list, date_cutoff):
@@ -91,7 +105,7 @@ class AbstractLocationFeed(EbpubFeed):
         # Include future stuff, useful for events
         end_date = today_value + datetime.timedelta(days=5)
 
-        qs = NewsItem.objects.select_related().by_request(self.request).filter(
+        qs = NewsItem.objects.select_related('schema').by_request(self.request).filter(
             item_date__gte=start_date,
             item_date__lte=end_date).order_by('-item_date', 'schema__id', 'id')
 
@@ -175,15 +189,17 @@ class BlockFeed(AbstractLocationFeed):
 
     def newsitems_for_obj(self, obj, qs, block_radius):
         search_buffer = make_search_buffer(obj.location.centroid, block_radius)
-        return qs.filter(location__bboverlaps=search_buffer)
+        return filter_by_geometry(qs, search_buffer)
 
 
 class LocationFeed(AbstractLocationFeed):
 
+    versions = [NEWSITEMS, LOCATIONS]
+
     def get_object(self, request, type_slug, slug):
         self.request = request
-        return Location.objects.select_related().get(location_type__slug=type_slug,
-                                                     slug=slug)
+        return Location.objects.lean().select_related('location_type').get(
+            location_type__slug=type_slug, slug=slug)
 
     def title(self, obj):
         return u"OpenBlock: %s" % obj.name
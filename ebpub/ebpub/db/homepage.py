@@ -0,0 +1,177 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+The precomputed, user-independent part of the homepage.
+
+The homepage is usually the most requested page, and building its
+context takes a count of Locations per LocationType, a count of
+Streets, the sparkline aggregates for every schema, and the map
+configuration. None of that depends on who is asking, so we build it
+once into a "document" kept in the Django cache, and
+``ebpub.db.views._homepage_context`` just filters it by the schemas
+the current user may see.
+
+The document is refreshed:
+
+* by ``update_aggregates``, which scrapers typically run after
+  loading news;
+
+* when it's older than ``HOMEPAGE_REFRESH_TIME`` seconds, or from
+  a previous day. Then requests keep getting the stale document while
+  a `django-background-task
+  <https://github.com/lilspikey/django-background-task>`_ job
+  refreshes it ("stale-while-revalidate"), if that app is installed
+  and ``process_tasks`` is running; otherwise the request that finds
+  it stale refreshes it.
+
+Only when there's no document at all (eg. the cache was cleared) does
+a request build it. This only helps if ``CACHES['default']`` is
+something other than a DummyCache, and shared between processes.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from ebpub.utils.dates import today
+
+import datetime
+import logging
+import time
+
+logger = logging.getLogger('ebpub.db.homepage')
+
+# How long the document is fresh, in seconds.
+HOMEPAGE_REFRESH_TIME = getattr(settings, 'HOMEPAGE_REFRESH_TIME', 60 * 10)
+
+# How long to keep serving a stale document while it's refreshed.
+HOMEPAGE_CACHE_TIME = 60 * 60 * 24 * 7
+
+# Only schedule one refresh at a time, at most this often.
+REFRESH_LOCK_TIME = 60
+
+CACHE_KEY = 'ebpub.db.homepage'
+LOCK_CACHE_KEY = 'ebpub.db.homepage.refreshing'
+
+# Bump this if the format of the document changes.
+DOCUMENT_VERSION = 2
+
+
+def build_document():
+    """
+    Returns a new homepage document: a dict with the ``date`` and
+    ``expires`` time of the ``context``, which has everything in the
+    homepage context that doesn't depend on the user, for all schemas.
+    """
+    # Avoid circular imports.
+    from ebpub.db import breadcrumbs
+    from ebpub.db.models import AggregateDay, LocationType, Schema
+    from ebpub.db.datecharts import aggregate_date_charts
+    from ebpub.db.views import _preconfigured_map
+    from ebpub.streets.models import Street
+
+    date = today()
+    start_date = date - datetime.timedelta(days=settings.DEFAULT_DAYS)
+    end_date = date + datetime.timedelta(days=1)
+
+    schemas = list(Schema.objects.all())
+    sparkline_schemas = [s for s in schemas if s.allow_charting and not s.is_special_report]
+
+    # Order by slug to ensure case-insensitive ordering. (Kind of hackish.)
+    lt_list = list(LocationType.objects.filter(is_significant=True).order_by('slug').extra(select={'count': 'select count(*) from db_location where is_public=True and location_type_id=db_locationtype.id'}))
+    street_count = Street.objects.count()
+    more_schemas = sorted([s for s in schemas if not s.allow_charting],
+                          key=lambda s: s.name)
+
+    date_charts = aggregate_date_charts(sparkline_schemas, start_date, end_date, AggregateDay)
+    empty_date_charts, non_empty_date_charts = [], []
+    for chart in date_charts:
+        if chart['total_count']:
+            non_empty_date_charts.append(chart)
+        else:
+            empty_date_charts.append(chart)
+    def _date_chart_sort_func(a, b):
+        return cmp(
+            # Higher importance first, higher count first, lower name first.
+            (b['schema'].importance, b['total_count'], a['schema'].plural_name),
+            (a['schema'].importance, a['total_count'], b['schema'].plural_name))
+
+    non_empty_date_charts.sort(_date_chart_sort_func)
+    empty_date_charts.sort(_date_chart_sort_func)
+    context = {
+        'all_schemas': schemas,
+        'location_type_list': lt_list,
+        'street_count': street_count,
+        'more_schemas': more_schemas,
+        'non_empty_date_charts': non_empty_date_charts,
+        'empty_date_charts': empty_date_charts,
+        'breadcrumbs': breadcrumbs.home({}),
+        'map_configuration': _preconfigured_map({}),
+        }
+    return {'version': DOCUMENT_VERSION, 'date': date,
+            'expires': time.time() + HOMEPAGE_REFRESH_TIME,
+            'context': context}
+
+
+def refresh_homepage():
+    """
+    Builds and caches a new homepage document, and returns it.
+    """
+    document = build_document()
+    cache.set(CACHE_KEY, document, HOMEPAGE_CACHE_TIME)
+    cache.delete(LOCK_CACHE_KEY)
+    return document
+
+
+def mark_stale():
+    """
+    Makes the next request refresh the homepage document (in the
+    background if possible), eg. because new NewsItems arrived.
+    """
+    document = cache.get(CACHE_KEY, None)
+    if document is not None:
+        document['expires'] = 0
+        cache.set(CACHE_KEY, document, HOMEPAGE_CACHE_TIME)
+
+
+def _is_stale(document):
+    return document['expires'] < time.time() or document['date'] != today()
+
+
+def _schedule_refresh():
+    if not cache.add(LOCK_CACHE_KEY, True, REFRESH_LOCK_TIME):
+        # Someone else is on it.
+        return
+    if 'background_task' in settings.INSTALLED_APPS:
+        from ebpub.db.tasks import refresh_homepage_task
+        logger.debug("Scheduling homepage refresh")
+        refresh_homepage_task()
+    else:
+        refresh_homepage()
+
+
+def get_homepage_context():
+    """
+    Returns the user-independent homepage context, from the cached
+    document if there is one. Don't modify it.
+    """
+    document = cache.get(CACHE_KEY, None)
+    if document is None or document.get('version') != DOCUMENT_VERSION:
+        document = refresh_homepage()
+    elif _is_stale(document):
+        _schedule_refresh()
+    return document['context']
@@ -0,0 +1,256 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Fast :py:class:`Lookup <ebpub.db.models.Lookup>` resolution for
+code that creates lots of NewsItems, eg. scrapers.
+
+:py:meth:`Lookup.objects.get_or_create_lookup()
+<ebpub.db.models.LookupManager.get_or_create_lookup>` does at least
+one query per call. But a scraper typically sees the same few dozen
+values over and over, thousands of times. A
+:py:class:`LookupCache` loads all Lookups of one SchemaField with a
+single query, answers from memory after that, and creates any new
+values in bulk.
+
+Usage::
+
+    cache = LookupCache(schema_field)
+    lookup = cache.get_or_create('Burglary', code='BURG')
+    lookups = cache.get_or_create_many([('Burglary', 'BURG'), ('Theft', 'THEFT')])
+
+A LookupCache is meant to live for one scraper run or so; it doesn't
+notice Lookups that other processes create or delete in the meantime,
+except when they collide with ones it is creating itself.
+"""
+
+from django.db import connection, transaction
+from django.db.utils import IntegrityError
+from django.template.defaultfilters import slugify
+from ebpub.db.models import Lookup
+
+import logging
+
+logger = logging.getLogger('ebpub.db.lookupcache')
+
+# Max number of Lookups to INSERT per statement.
+BATCH_SIZE = 500
+
+
+class LookupCache(object):
+    """
+    Caches all the :py:class:`Lookup <ebpub.db.models.Lookup>` instances of
+    one SchemaField, keyed by code and by name.
+
+    Lookups are matched by ``code`` just like ``get_or_create_lookup()``,
+    and new ones get the same name and slug munging.
+    """
+
+    def __init__(self, schema_field, logger=None):
+        self.schema_field = schema_field
+        self.logger = logger
+        self._by_code = None
+        self._by_name = None
+        # Simple instrumentation.
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+
+    def _log_info(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def _log_warn(self, message):
+        if self.logger is not None:
+            self.logger.warn(message)
+
+    def _warm(self):
+        if self._by_code is not None:
+            return
+        self._by_code = {}
+        self._by_name = {}
+        for lookup in Lookup.objects.filter(schema_field__id=self.schema_field.id):
+            self._add(lookup)
+
+    def _add(self, lookup):
+        self._by_code[lookup.code] = lookup
+        self._by_name[lookup.name] = lookup
+
+    def clear(self):
+        """
+        Forget all cached Lookups; they'll be reloaded when next needed.
+        """
+        self._by_code = self._by_name = None
+
+    def get(self, code):
+        """
+        Returns the cached Lookup with the given code, or None.
+        """
+        self._warm()
+        return self._by_code.get(code)
+
+    def get_by_name(self, name):
+        """
+        Returns the cached Lookup with the given name, or None.
+        """
+        self._warm()
+        return self._by_name.get(name)
+
+    def get_or_create(self, name, code=None, description='', make_text_slug=True):
+        """
+        Returns the Lookup matching ``code`` (which defaults to ``name``),
+        creating it if needed. Arguments are the same as for
+        :py:meth:`LookupManager.get_or_create_lookup
+        <ebpub.db.models.LookupManager.get_or_create_lookup>`.
+        """
+        return self.get_or_create_many([(name, code, description)],
+                                       make_text_slug=make_text_slug)[0]
+
+    def get_or_create_many(self, values, make_text_slug=True):
+        """
+        Like :py:meth:`get_or_create`, for a batch of values.
+
+        ``values`` is a sequence of names, or of (name, code) or (name,
+        code, description) tuples. Returns a list of Lookups in the
+        same order. All missing Lookups are created with one INSERT
+        (per ``BATCH_SIZE`` of them), so it pays to call this once per
+        chunk of records rather than once per value.
+        """
+        self._warm()
+        codes = []
+        pending = {}
+        pending_order = []
+        for value in values:
+            if isinstance(value, basestring):
+                value = (value,)
+            name = value[0]
+            code = (len(value) > 1 and value[1]) or name
+            description = (len(value) > 2 and value[2]) or ''
+            codes.append(code)
+            if code in self._by_code:
+                self.hits += 1
+            elif code not in pending:
+                self.misses += 1
+                pending[code] = (name, description)
+                pending_order.append(code)
+        for start in range(0, len(pending_order), BATCH_SIZE):
+            batch = [(pending[code][0], code, pending[code][1])
+                     for code in pending_order[start:start + BATCH_SIZE]]
+            self._create(batch, make_text_slug)
+        return [self._by_code[code] for code in codes]
+
+    def _prepare(self, name, code, description, make_text_slug, names_in_use):
+        # Same munging as LookupManager.get_or_create_lookup(),
+        # but checking for dupes in memory.
+        if len(name) > 255:
+            old_name = name
+            name = name[:250] + '...'
+            # Save the full name in the description.
+            if not description:
+                description = old_name
+            self._log_warn("Trimming name %r to %r in order to fit 255-char limit." % (old_name, name))
+        while name in names_in_use:
+            # Avoid integrity errors on 'name'.
+            old_name = name
+            name = name + ' b'
+            self._log_warn("Munging name %r to %r in order to avoid dupe." % (old_name, name))
+        if make_text_slug:
+            slug = slugify(name)
+            if len(slug) > 32:
+                self._log_warn("Trimming slug %r to %r in order to fit 32-char limit." % (slug, slug[:32]))
+                slug = slug[:32]
+        else:
+            # The slug will be the ID, once we have one.
+            slug = None
+        return Lookup(schema_field_id=self.schema_field.id, name=name, code=code,
+                      slug=slug, description=description, featured=False)
+
+    def _create(self, batch, make_text_slug):
+        names_in_use = set(self._by_name)
+        new_lookups = []
+        for name, code, description in batch:
+            lookup = self._prepare(name, code, description, make_text_slug, names_in_use)
+            names_in_use.add(lookup.name)
+            new_lookups.append(lookup)
+
+        sid = transaction.savepoint()
+        try:
+            self._insert(new_lookups)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            # Most likely another process created some of the same
+            # Lookups since we loaded ours. Start over for this batch,
+            # one at a time.
+            logger.info("Conflict creating %d %s lookups, retrying one by one"
+                        % (len(new_lookups), self.schema_field.name))
+            self.clear()
+            self._warm()
+            for name, code, description in batch:
+                if code not in self._by_code:
+                    self._create_one(name, code, description, make_text_slug)
+        else:
+            transaction.savepoint_commit(sid)
+            transaction.commit_unless_managed()
+            for lookup in new_lookups:
+                self._add(lookup)
+                self.created += 1
+                self._log_info('Created %s %r' % (self.schema_field.name, lookup.name))
+
+    def _insert(self, lookups):
+        # Reserve all the IDs first, so we know the slugs and don't
+        # need RETURNING or a second UPDATE.
+        cursor = connection.cursor()
+        table = Lookup._meta.db_table
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))"
+                       " FROM generate_series(1, %s)", [table, len(lookups)])
+        ids = [row[0] for row in cursor.fetchall()]
+        params = []
+        for lookup, lookup_id in zip(lookups, ids):
+            lookup.id = lookup_id
+            if lookup.slug is None:
+                lookup.slug = str(lookup_id)
+            params.extend([lookup.id, lookup.schema_field_id, lookup.name,
+                           lookup.code, lookup.slug, lookup.description,
+                           lookup.featured])
+        placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(lookups))
+        cursor.execute(
+            "INSERT INTO %s (id, schema_field_id, name, code, slug, description, featured)"
+            " VALUES " % connection.ops.quote_name(table) + placeholders,
+            params)
+
+    def _create_one(self, name, code, description, make_text_slug):
+        lookup = self._prepare(name, code, description, make_text_slug,
+                               set(self._by_name))
+        sid = transaction.savepoint()
+        try:
+            self._insert([lookup])
+        except IntegrityError, e:
+            transaction.savepoint_rollback(sid)
+            # Lost the race for this one; use the winner's.
+            existing = list(Lookup.objects.filter(
+                    schema_field__id=self.schema_field.id, code=code))
+            if not existing:
+                # Not a race after all, eg. a slug collision.
+                raise e
+            lookup = existing[0]
+        else:
+            transaction.savepoint_commit(sid)
+            transaction.commit_unless_managed()
+            self.created += 1
+            self._log_info('Created %s %r' % (self.schema_field.name, lookup.name))
+        self._add(lookup)
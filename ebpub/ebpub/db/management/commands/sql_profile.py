@@ -0,0 +1,79 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Shows the per-view SQL stats collected by
+:py:class:`ebpub.utils.sqlprofile.SQLProfileMiddleware`.
+"""
+
+from django.core.management.base import BaseCommand
+from django.utils import simplejson
+from ebpub.utils import sqlprofile
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    help = "Show per-view SQL query stats from ebpub.utils.sqlprofile."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--buckets', type='int', default=None,
+                    help='How many of the most recent time windows to include'
+                    ' (default: all of them, SQL_PROFILE_BUCKETS)'),
+        make_option('--view', default=None,
+                    help='Only show views whose name contains this string'),
+        make_option('--limit', type='int', default=10,
+                    help='How many views and queries to show (default 10)'),
+        make_option('--json', action='store_true', default=False,
+                    help='Print the report as JSON'),
+        make_option('--reset', action='store_true', default=False,
+                    help='Forget all collected stats'),
+    )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            sqlprofile.collector.reset()
+            return
+        stats = sqlprofile.collector.get_stats(options['buckets'])
+        report = sqlprofile.make_report(stats, limit=options['limit'],
+                                        view=options['view'])
+        if options['json']:
+            self.stdout.write(simplejson.dumps(report, indent=1) + '\n')
+            return
+        if not report['views']:
+            self.stdout.write("No stats collected. Is SQL_PROFILE_SAMPLE_RATE set,"
+                              " and CACHES['default'] shared between processes?\n")
+            return
+        for view in report['views']:
+            self.stdout.write(
+                "%(name)s\n  %(requests)d requests, %(avg_queries).1f queries"
+                " and %(avg_db_time).3fs in the DB per request"
+                " (max %(max_queries)d queries, %(max_db_time).3fs)\n" % view)
+            self.stdout.write("  queries: %s\n" % _format_histogram(view['query_hist']))
+            self.stdout.write("  DB time: %s\n" % _format_histogram(view['time_hist']))
+            for fp in view['fingerprints']:
+                self.stdout.write("  %6.1f/req %8.3fs  %s\n"
+                                  % (fp['per_request'], fp['time'], fp['sql'][:100]))
+            self.stdout.write('\n')
+        self.stdout.write("Most expensive queries overall:\n")
+        for fp in report['fingerprints']:
+            self.stdout.write("  %7d x %.4fs = %8.3fs  %s\n"
+                              % (fp['count'], fp['avg_time'], fp['time'], fp['sql'][:100]))
+
+
+def _format_histogram(histogram):
+    return ', '.join('%s: %d' % (label, count) for (label, count) in histogram if count)
@@ -273,6 +273,11 @@ You'll want to do this on a regular basis, depending on how often you update
 your data. **Some parts of the site (such as charts) will not be visible** until
 you populate the aggregates.
 
+The script also stores a precomputed summary of each schema's
+aggregates for the schema detail page (see
+:py:mod:`ebpub.db.schemasummary`), so that page doesn't reflect new
+data until the next run either.
+
 .. _future_events:
 
 Event-like News Types
@@ -418,13 +423,14 @@ from django.conf import settings
 from django.contrib.gis.db import models
 from django.contrib.gis.db.models import Count
 from django.core import urlresolvers
-from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import connection, transaction
-from ebpub.db import constants
+from ebpub.db.schemaregistry import schema_registry
+from ebpub.db.schemaregistry import invalidate_schema_registry
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.utils.geodjango import flatten_geomcollection
 from ebpub.utils.geodjango import ensure_valid
+from ebpub.utils.geodjango import LeanGeoManager, LeanGeoQuerySet
 from ebpub.utils.text import slugify
 from .fields import OpenblockImageField
 
@@ -462,11 +468,12 @@ def field_mapping(schema_id_list):
         {1: {u'crime_type': 'varchar01', u'crime_date', 'date01'},
          2: {u'permit_number': 'int01', 'to_date': 'date01'},
         }
+
+    This is served from the in-process
+    :py:mod:`schema registry <ebpub.db.schemaregistry>`,
+    so it normally doesn't query the database.
     """
-    result = {}
-    for sf in SchemaField.objects.filter(schema__id__in=(schema_id_list)).values('schema', 'name', 'real_name'):
-        result.setdefault(sf['schema'], {})[sf['name']] = sf['real_name']
-    return result
+    return schema_registry.field_mapping(schema_id_list)
 
 
 class SchemaQuerySet(models.query.GeoQuerySet):
@@ -507,12 +514,14 @@ class SchemaManager(models.Manager):
         """
         Useful for filtering out schemas (or things related to
         schemas) based on the current Manager.
+
+        The result is kept in the
+        :py:mod:`schema registry <ebpub.db.schemaregistry>`
+        until any Schema is changed.
         """
-        ids = cache.get(self._allowed_ids_cache_key, None)
-        if ids is None:
-            ids = [s['id'] for s in self.all().values('id')]
-            cache.set(self._allowed_ids_cache_key, ids, constants.ALLOWED_IDS_CACHE_TIME)
-        return ids
+        return schema_registry.memoize(
+            self._allowed_ids_cache_key,
+            lambda: [s['id'] for s in self.all().values('id')])
 
 
 class SchemaPublicManager(SchemaManager):
@@ -800,7 +809,7 @@ class LocationType(models.Model):
     objects = LocationTypeManager()
 
 
-class LocationManager(models.GeoManager):
+class LocationManager(LeanGeoManager):
     def get_by_natural_key(self, slug, location_type_slug):
         return self.get(slug=slug, location_type__slug=location_type_slug)
 
@@ -917,6 +926,28 @@ class Location(models.Model):
         return self.location_type.slug == 'custom'
 
 
+class SimplifiedLocation(models.Model):
+    """
+    A simplified version of a Location's geometry, for drawing it at
+    lower zoom levels. There's one per Location and tolerance in
+    :py:data:`ebpub.db.simplify.TOLERANCES`; they're regenerated
+    whenever the Location is saved.
+    """
+    location = models.ForeignKey(Location, related_name='simplified_set')
+    level = models.PositiveSmallIntegerField(
+        help_text='1 is the most detailed, higher levels are simpler.')
+    tolerance = models.FloatField(help_text='In degrees.')
+    geometry = models.GeometryField(null=True)
+
+    objects = models.GeoManager()
+
+    class Meta:
+        unique_together = (('location', 'level'),)
+
+    def __unicode__(self):
+        return u'%s (level %d)' % (self.location_id, self.level)
+
+
 class LocationSynonymManager(models.Manager):
     def get_canonical(self, name):
         """
@@ -992,11 +1023,16 @@ class AttributesDescriptor(object):
         # If no records were updated, that means the DB doesn't yet have a
         # row in the attributes table for this news item. Do an INSERT.
         if cursor.rowcount < 1:
+            # The foreign key can't see NewsItems in partitions.
+            from ebpub.db.partitions import unpartition
+            unpartition(instance.id)
             cursor.execute("""
                 INSERT INTO %s (news_item_id, schema_id, %s)
                 VALUES (%%s, %%s, %s)""" % (Attribute._meta.db_table, ','.join([v for k, v in mapping]), ','.join(['%s' for k in mapping])),
                 [instance.id, instance.schema_id] + values)
         transaction.commit_unless_managed()
+        attributes_saved.send(sender=Attribute, news_item_id=instance.id,
+                              schema_id=instance.schema_id)
 
 
 class AttributeDict(dict):
@@ -1059,20 +1095,156 @@ class AttributeDict(dict):
         # If no records were updated, that means the DB doesn't yet have a
         # row in the attributes table for this news item. Do an INSERT.
         if cursor.rowcount < 1:
+            # The foreign key can't see NewsItems in partitions.
+            from ebpub.db.partitions import unpartition
+            unpartition(self.news_item_id)
             cursor.execute("""
                 INSERT INTO %s (news_item_id, schema_id, %s)
                 VALUES (%%s, %%s, %%s)""" % (Attribute._meta.db_table, real_name),
                 [self.news_item_id, self.schema_id, value])
         transaction.commit_unless_managed()
+        attributes_saved.send(sender=Attribute, news_item_id=self.news_item_id,
+                              schema_id=self.schema_id)
         dict.__setitem__(self, name, value)
 
 
-class NewsItemQuerySet(models.query.GeoQuerySet):
+def populate_attributes(newsitem_list, get_lookups=True):
+    """
+    Loads the ``attributes`` of all the given NewsItems in bulk,
+    so that accessing ``ni.attributes`` later doesn't do a query
+    per NewsItem.
+
+    This takes one query for the Attribute rows, plus (if
+    ``get_lookups`` is True and there are any lookup fields) one
+    query for all the referenced :py:class:`Lookup` instances. With
+    ``get_lookups``, lookup values are Lookup instances, and
+    many-to-many lookup values are lists of Lookup instances;
+    otherwise they're the raw ids as stored in the database.
+
+    NewsItems that have no Attribute row get an empty dictionary.
+
+    Usually you'll want :py:meth:`NewsItemQuerySet.with_attributes`
+    rather than calling this directly.
+    """
+    newsitem_list = [ni for ni in newsitem_list if ni.id is not None]
+    if not newsitem_list:
+        return
+    mappings = schema_registry.field_mapping(set([ni.schema_id for ni in newsitem_list]))
+    # {schema_id: {real_name: is_many_to_many}}
+    lookup_fields = {}
+    columns = set(['news_item'])
+    for schema_id, mapping in mappings.items():
+        columns.update([str(real_name) for real_name in mapping.values()])
+        lookup_fields[schema_id] = dict(
+            [(real_name, is_m2m) for name, real_name, is_m2m
+             in schema_registry.lookup_fields(schema_id)])
+
+    att_rows = {}
+    if len(columns) > 1:
+        att_qs = Attribute.objects.filter(news_item__id__in=[ni.id for ni in newsitem_list])
+        att_rows = dict([(row['news_item'], row) for row in att_qs.values(*columns)])
+
+    lookup_objs = {}
+    if get_lookups:
+        lookup_ids = set()
+        for ni in newsitem_list:
+            row = att_rows.get(ni.id)
+            if row is None:
+                continue
+            for real_name, is_m2m in lookup_fields.get(ni.schema_id, {}).items():
+                lookup_ids.update(_lookup_ids(row[real_name], is_m2m))
+        if lookup_ids:
+            lookup_objs = Lookup.objects.in_bulk(list(lookup_ids))
+
+    for ni in newsitem_list:
+        mapping = mappings.get(ni.schema_id, {})
+        attributes = AttributeDict(ni.id, ni.schema_id, mapping)
+        attributes.cached = True
+        row = att_rows.get(ni.id)
+        if row is not None:
+            lookups = lookup_fields.get(ni.schema_id, {})
+            for name, real_name in mapping.items():
+                value = row[real_name]
+                if get_lookups and real_name in lookups:
+                    ids = _lookup_ids(value, lookups[real_name])
+                    values = [lookup_objs[i] for i in ids if i in lookup_objs]
+                    if lookups[real_name]:
+                        value = values
+                    else:
+                        value = values and values[0] or None
+                dict.__setitem__(attributes, name, value)
+        ni._attributes_cache = attributes
+
+
+def _lookup_ids(value, is_many_to_many):
+    # Lookup IDs are stored as ints, or for many-to-many lookups,
+    # as comma-separated strings of ints.
+    if value is None or value == '':
+        return []
+    if is_many_to_many:
+        try:
+            return [int(i) for i in value.split(',') if i]
+        except ValueError:
+            return []
+    return [value]
+
+
+class NewsItemQuerySet(LeanGeoQuerySet):
 
     """
     Adds special methods for searching :py:class:`NewsItem`.
     """
 
+    # Settings for with_attributes(); carried over by _clone().
+    _prefetch_attributes = False
+    _prefetch_lookups = True
+
+    # How many NewsItems to populate attributes for at once
+    # when iterating.
+    ATTRIBUTES_CHUNK_SIZE = 500
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('_prefetch_attributes', self._prefetch_attributes)
+        kwargs.setdefault('_prefetch_lookups', self._prefetch_lookups)
+        return super(NewsItemQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def with_attributes(self, lookups=True):
+        """
+        Returns a QuerySet that loads the ``attributes`` of its
+        NewsItems in bulk when it's evaluated, instead of
+        doing one query per NewsItem when you access ``ni.attributes``.
+
+        If ``lookups`` is True (the default), lookup values are
+        dereferenced into :py:class:`Lookup` instances (or lists of them, for
+        many-to-many lookups), also in bulk.
+
+        This works for normal evaluation and slicing, as well as
+        ``iterator()``, which populates attributes a chunk at a time.
+        See :py:func:`populate_attributes`.
+        """
+        return self._clone(_prefetch_attributes=True, _prefetch_lookups=lookups)
+
+    def iterator(self):
+        # QuerySet evaluation in all its forms goes through here.
+        items = super(NewsItemQuerySet, self).iterator()
+        if not self._prefetch_attributes:
+            return items
+        return self._iterator_with_attributes(items)
+
+    def _iterator_with_attributes(self, items):
+        chunk = []
+        for ni in items:
+            chunk.append(ni)
+            if len(chunk) >= self.ATTRIBUTES_CHUNK_SIZE:
+                populate_attributes(chunk, get_lookups=self._prefetch_lookups)
+                for item in chunk:
+                    yield item
+                chunk = []
+        if chunk:
+            populate_attributes(chunk, get_lookups=self._prefetch_lookups)
+            for item in chunk:
+                yield item
+
     def prepare_attribute_qs(self):
         clone = self._clone()
         if 'db_attribute' not in clone.query.extra_tables:
@@ -1238,6 +1410,18 @@ class NewsItemQuerySet(models.query.GeoQuerySet):
         allowed_schema_ids = get_schema_manager(request).allowed_schema_ids()
         return clone.filter(schema__id__in=allowed_schema_ids)
 
+    def exclude_archived(self):
+        """
+        Returns a QuerySet without NewsItems in archived partitions, so
+        the database doesn't even look at them. See
+        :py:mod:`ebpub.db.partitions`.
+        """
+        from ebpub.db.partitions import archive_cutoff
+        cutoff = archive_cutoff()
+        if cutoff is None:
+            return self._clone()
+        return self.filter(item_date__gte=cutoff)
+
 
 class NewsItemManager(models.GeoManager):
     """
@@ -1279,6 +1463,24 @@ class NewsItemManager(models.GeoManager):
         """
         return self.get_query_set().by_request(request)
 
+    def with_attributes(self, *args, **kwargs):
+        """
+        See :py:meth:`NewsItemQuerySet.with_attributes`
+        """
+        return self.get_query_set().with_attributes(*args, **kwargs)
+
+    def exclude_archived(self):
+        """
+        See :py:meth:`NewsItemQuerySet.exclude_archived`
+        """
+        return self.get_query_set().exclude_archived()
+
+    def lean(self, *args, **kwargs):
+        """
+        See :py:meth:`ebpub.utils.geodjango.LeanGeoQuerySet.lean`
+        """
+        return self.get_query_set().lean(*args, **kwargs)
+
 
 class NewsItem(models.Model):
     """
@@ -1329,6 +1531,11 @@ class NewsItem(models.Model):
         Location, through='NewsItemLocation', blank=True, null=True,
         help_text="db.Location objects that intersect with our .location geometry. These are set automatically, do not try to assign to them.")
 
+    # Grid cell containing .location, for fast radius queries; set
+    # automatically. There's also an index on (location_bucket,
+    # item_date), see migration 0032. See ebpub.db.buckets.
+    location_bucket = models.BigIntegerField(blank=True, null=True, editable=False)
+
     objects = NewsItemManager()
 
     # Treat this like a dict. The related Schema and SchemaFields explain
@@ -1381,7 +1588,7 @@ class NewsItem(models.Model):
         Return a list of AttributeForTemplate objects for this NewsItem. The
         objects are ordered by SchemaField.display_order.
         """
-        fields = SchemaField.objects.filter(schema__id=self.schema_id).select_related().order_by('display_order')
+        fields = schema_registry.get_schemafields(self.schema_id)
         if not fields:
             return []
         if not self.attributes:
@@ -1402,13 +1609,12 @@ class AttributeForTemplate(object):
         self.is_lookup = schema_field.is_lookup
         self.is_filter = schema_field.is_filter
         if self.is_lookup:
-            # Earlier queries may have already looked up Lookup instances.
-            # Don't do unnecessary work.
+            # Earlier queries may have already looked up Lookup instances,
+            # eg. via populate_attributes(). Don't do unnecessary work.
             if isinstance(self.raw_value, Lookup):
                 self.values = [self.raw_value]
-            elif (isinstance(self.raw_value, list) and self.raw_value
-                  and isinstance(self.raw_value[0], Lookup)):
-                self.values = self.raw_values
+            elif isinstance(self.raw_value, list):
+                self.values = self.raw_value
             elif self.raw_value is None or self.raw_value == '':
                 self.values = []
             elif self.sf.is_many_to_many_lookup():
@@ -1628,8 +1834,10 @@ class LookupManager(models.Manager):
         template tag.
 
         """
-        # This uses several queries, not very efficient...
-        sf = SchemaField.objects.get(schema__id=newsitem.schema_id, name=attribute_key)
+        sf = schema_registry.get_schemafield(newsitem.schema_id, attribute_key)
+        if sf is None:
+            raise SchemaField.DoesNotExist(
+                "No SchemaField %r for schema %s" % (attribute_key, newsitem.schema_id))
         # Yet another manual decode of the comma-separated value,
         # refs #265
         if sf.is_many_to_many_lookup():
@@ -1725,6 +1933,36 @@ class NewsItemLocation(models.Model):
         return u'%s - %s' % (self.news_item, self.location)
 
 
+class NewsItemPartition(models.Model):
+    """
+    A range of item dates whose NewsItems, Attributes and
+    NewsItemLocations have been moved out of the main tables into
+    their own partition tables. Maintained by the
+    ``partition_newsitems`` script; see :py:mod:`ebpub.db.partitions`.
+    """
+    ACTIVE = 'active'
+    ARCHIVED = 'archived'
+    DETACHED = 'detached'
+    STATE_CHOICES = (
+        (ACTIVE, 'Active: shown everywhere'),
+        (ARCHIVED, 'Archived: only in API queries'),
+        (DETACHED, 'Detached: not queryable'),
+        )
+
+    name = models.CharField(max_length=32, unique=True,
+                            help_text="Suffix of the partition tables' names, eg. y2009.")
+    start_date = models.DateField(help_text='First item_date in the partition.')
+    end_date = models.DateField(help_text='First item_date after the partition.')
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=ACTIVE)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('start_date',)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.name, self.state)
+
+
 #############################################################################
 # Aggregates.
 
@@ -1773,6 +2011,16 @@ class AggregateFieldLookup(AggregateBaseClass):
     lookup = models.ForeignKey(Lookup)
 
 
+class AggregateSchemaSummary(models.Model):
+    """A JSON document summarizing the other aggregates for one schema,
+    as needed by the schema detail page. Built by ``update_aggregates``;
+    see :py:mod:`ebpub.db.schemasummary`.
+    """
+    schema = models.ForeignKey(Schema, unique=True)
+    summary = models.TextField()
+    last_updated = models.DateTimeField()
+
+
 class SearchSpecialCase(models.Model):
     """
     Used as a fallback for location searches that don't match
@@ -1857,14 +2105,48 @@ class NewsItemImage(models.Model):
 # Django doesn't provide a pre_update() signal, rats.
 # See https://code.djangoproject.com/ticket/13021
 from django.dispatch import Signal
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import class_prepared, post_save, post_delete, pre_save
 
 post_update = Signal(providing_args=[])
 
-def clear_allowed_schema_ids_cache(sender, **kwargs):
-    cache.delete_many((SchemaPublicManager._allowed_ids_cache_key,
-                       SchemaManager._allowed_ids_cache_key))
-
-post_update.connect(clear_allowed_schema_ids_cache, sender=Schema)
-post_save.connect(clear_allowed_schema_ids_cache, sender=Schema)
-post_delete.connect(clear_allowed_schema_ids_cache, sender=Schema)
+# Sent when NewsItem.attributes are saved, which bypasses the usual
+# Attribute.save() and thus post_save.
+attributes_saved = Signal(providing_args=['news_item_id', 'schema_id'])
+
+# Schema metadata is cached in-process; see ebpub.db.schemaregistry.
+post_update.connect(invalidate_schema_registry, sender=Schema)
+post_save.connect(invalidate_schema_registry, sender=Schema)
+post_delete.connect(invalidate_schema_registry, sender=Schema)
+post_save.connect(invalidate_schema_registry, sender=SchemaField)
+post_delete.connect(invalidate_schema_registry, sender=SchemaField)
+
+# Version stamps for conditional GET; see ebpub.db.versions.
+from ebpub.db import versions
+post_update.connect(versions.newsitems_changed, sender=Schema)
+attributes_saved.connect(versions.newsitems_changed, sender=Attribute)
+for _model in (Schema, SchemaField, Lookup, NewsItem, Attribute):
+    post_save.connect(versions.newsitems_changed, sender=_model)
+    post_delete.connect(versions.newsitems_changed, sender=_model)
+for _model in (LocationType, Location):
+    post_save.connect(versions.locations_changed, sender=_model)
+    post_delete.connect(versions.locations_changed, sender=_model)
+del _model
+
+# Simplified geometries for maps; see ebpub.db.simplify.
+from ebpub.db import simplify
+post_save.connect(simplify.location_saved, sender=Location)
+
+# Spatial buckets for radius queries; see ebpub.db.buckets.
+from ebpub.db import buckets
+pre_save.connect(buckets.newsitem_pre_save, sender=NewsItem)
+
+# Archived partitions; see ebpub.db.partitions.
+from ebpub.db import partitions
+post_save.connect(partitions.partitions_changed, sender=NewsItemPartition)
+post_delete.connect(partitions.partitions_changed, sender=NewsItemPartition)
+pre_save.connect(partitions.newsitem_refs_pre_save, sender=NewsItem)
+for _model in (Attribute, NewsItemLocation, NewsItemImage):
+    partitions.connect_newsitem_refs(_model)
+del _model
+# And models in other apps that refer to NewsItems, which are loaded later.
+class_prepared.connect(partitions.connect_newsitem_refs)
@@ -0,0 +1,485 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Time-partitioned storage for old NewsItems.
+
+Most traffic is for recent news, but ``db_newsitem``, ``db_attribute``
+and ``db_newsitemlocation`` keep growing, and every query pays for all
+of history. So old NewsItems can be moved, one period (a year by
+default) at a time, into partition tables that inherit from the main
+ones, eg. ``db_newsitem_y2009``, ``db_attribute_y2009`` and
+``db_newsitemlocation_y2009``. Each partition table has a CHECK
+constraint on ``item_date`` (the dependent tables get an ``item_date``
+column for that), so PostgreSQL skips partitions that can't match a
+query's date range (with ``constraint_exclusion = partition``, the
+default).
+
+PostgreSQL of the vintage we support has no declarative partitioning,
+and foreign keys don't work across inheritance, so this uses table
+inheritance:
+
+* Queries on the main tables include the partitions, so the ORM
+  doesn't need to know about them. New NewsItems always go in the
+  main table.
+
+* Each partition is registered as a
+  :py:class:`NewsItemPartition <ebpub.db.models.NewsItemPartition>`
+  in one of three states:
+
+  * ``active``: moved, but shown everywhere as before;
+
+  * ``archived``: skipped by the site's views (see
+    :py:meth:`NewsItemQuerySet.exclude_archived
+    <ebpub.db.models.NewsItemQuerySet.exclude_archived>`), but still
+    found by API queries for those dates;
+
+  * ``detached``: no longer part of the main tables at all, ready to
+    dump or drop, or attach again.
+
+* Foreign keys to ``db_newsitem`` only see the main table. So
+  NewsItems that other tables refer to (eg. images, pinned widget
+  items) are left in the main table; and a partitioned NewsItem is
+  moved back, with :py:func:`unpartition`, just before any model
+  with a foreign key to NewsItem is saved referring to it, or the
+  NewsItem itself is saved (so the trigger that maintains
+  NewsItemLocations sees the change). That's done by a ``pre_save``
+  signal handler, connected only for NewsItem and the models that
+  refer to it, which costs one indexed lookup per save; code that
+  inserts such rows with raw SQL needs to call :py:func:`unpartition`
+  itself.
+
+* Moving is done in batches of ``BATCH_SIZE`` NewsItem IDs, each in its
+  own transaction, and only locks the rows being moved.
+
+``update_aggregates`` only recounts dates after the archived
+partitions, since those never change. ``populate_ni_loc`` handles each
+partition separately.
+
+Everything is done by the ``partition_newsitems`` script. For example,
+to move everything more than a year old into yearly partitions, and
+archive everything more than three years old::
+
+  partition_newsitems partition --days 365
+  partition_newsitems archive --days 1095
+
+Migrations that add indexes to one of the main tables need to add them
+to the partitions too; see :py:func:`partition_tables`. Adding and
+dropping columns works as usual.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import pre_save
+
+import datetime
+import logging
+
+logger = logging.getLogger('ebpub.db.partitions')
+
+NEWSITEM_TABLE = 'db_newsitem'
+
+# Tables of rows that belong to a NewsItem, and their NewsItem column.
+DEPENDENT_TABLES = (('db_attribute', 'news_item_id'),
+                    ('db_newsitemlocation', 'news_item_id'))
+
+# 'year' or 'month'.
+PERIOD = getattr(settings, 'NEWSITEM_PARTITION_PERIOD', 'year')
+
+# How many NewsItem IDs to move per transaction.
+BATCH_SIZE = 10000
+
+CUTOFF_CACHE_KEY = 'ebpub.db.partitions.cutoff'
+CUTOFF_CACHE_TIME = 60 * 60
+
+
+def period_for_date(date, period=None):
+    """
+    Returns (name, start_date, end_date) of the partition period
+    containing ``date``; end_date is exclusive.
+    """
+    period = period or PERIOD
+    if period == 'year':
+        start = datetime.date(date.year, 1, 1)
+        return 'y%d' % date.year, start, datetime.date(date.year + 1, 1, 1)
+    elif period == 'month':
+        start = datetime.date(date.year, date.month, 1)
+        if date.month == 12:
+            end = datetime.date(date.year + 1, 1, 1)
+        else:
+            end = datetime.date(date.year, date.month + 1, 1)
+        return 'm%d%02d' % (date.year, date.month), start, end
+    raise ValueError('Unknown NEWSITEM_PARTITION_PERIOD %r' % period)
+
+
+def table_name(parent, name):
+    return '%s_%s' % (parent, name)
+
+
+def partition_tables(parent=NEWSITEM_TABLE):
+    """
+    Returns the names of all partition tables of ``parent``, whether
+    attached or not. Only uses SQL, so it's safe to call from South
+    migrations, eg.::
+
+      for table in partitions.partition_tables('db_newsitem'):
+          db.create_index(table, ['title'])
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM db_newsitempartition ORDER BY start_date")
+    return [table_name(parent, row[0]) for row in cursor.fetchall()]
+
+
+def _columns(table):
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+        ORDER BY attnum""", [table])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _referencing_columns():
+    # (table, column) of foreign keys to db_newsitem, other than the
+    # ones we move along with the NewsItems.
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT cl.relname, att.attname
+        FROM pg_constraint con
+        JOIN pg_class cl ON cl.oid = con.conrelid
+        JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = con.conkey[1]
+        WHERE con.contype = 'f' AND con.confrelid = %s::regclass""", [NEWSITEM_TABLE])
+    dependent = set(DEPENDENT_TABLES)
+    return [row for row in cursor.fetchall() if tuple(row) not in dependent]
+
+
+def _not_referenced(alias):
+    # SQL condition: the NewsItem with ID ``alias``.id isn't referred
+    # to by any table other than the ones we move along with it.
+    conditions = ["NOT EXISTS (SELECT 1 FROM %s r WHERE r.%s = %s.id)" % (table, column, alias)
+                  for table, column in _referencing_columns()]
+    return ' AND '.join(conditions) or 'TRUE'
+
+
+def create_partition(date, period=None):
+    """
+    Creates the partition tables for the period containing ``date``,
+    if they don't exist yet, and returns its NewsItemPartition.
+    """
+    from ebpub.db.models import NewsItemPartition
+    name, start_date, end_date = period_for_date(date, period)
+    try:
+        return NewsItemPartition.objects.get(name=name)
+    except NewsItemPartition.DoesNotExist:
+        pass
+    cursor = connection.cursor()
+    check = "CHECK (item_date >= %s AND item_date < %s)"
+    for parent, extra_column in [(NEWSITEM_TABLE, '')] + [
+        (table, 'item_date date NOT NULL, ') for table, column in DEPENDENT_TABLES]:
+        child = table_name(parent, name)
+        cursor.execute(
+            "CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES, "
+            "%sCONSTRAINT %s_item_date_check %s)" % (child, parent, extra_column, child, check),
+            [start_date, end_date])
+        cursor.execute("ALTER TABLE %s INHERIT %s" % (child, parent))
+    partition = NewsItemPartition.objects.create(name=name, start_date=start_date,
+                                                 end_date=end_date)
+    logger.info("Created partition %s" % name)
+    return partition
+
+
+def _move_batch(cursor, partition, start_id, end_id):
+    # Moves the movable NewsItems of ``partition``'s period with
+    # start_id <= id < end_id. Returns how many were moved.
+    ids = 'partition_move_ids'
+    cursor.execute("""
+        CREATE TEMP TABLE %s AS SELECT ni.id FROM ONLY %s ni
+        WHERE ni.item_date >= %%s AND ni.item_date < %%s
+            AND ni.id >= %%s AND ni.id < %%s AND %s""" % (
+            ids, NEWSITEM_TABLE, _not_referenced('ni')),
+                   [partition.start_date, partition.end_date, start_id, end_id])
+    # Lock them, so nothing can refer to them or change them until
+    # we're done; then drop any that got referred to meanwhile.
+    cursor.execute("SELECT id FROM ONLY %s WHERE id IN (SELECT id FROM %s) FOR UPDATE"
+                   % (NEWSITEM_TABLE, ids))
+    cursor.execute("DELETE FROM %s ni WHERE NOT (%s)" % (ids, _not_referenced('ni')))
+
+    # Set the dependent rows aside; the location trigger, if any,
+    # would delete NewsItemLocations from the partition tables too.
+    stashed = []
+    for parent, column in DEPENDENT_TABLES:
+        stash = 'partition_move_%s' % parent
+        columns = _columns(parent)
+        cursor.execute("""
+            CREATE TEMP TABLE %s AS SELECT %s, ni.item_date
+            FROM ONLY %s d JOIN ONLY %s ni ON d.%s = ni.id
+            WHERE ni.id IN (SELECT id FROM %s)""" % (
+                stash, ', '.join(['d.%s' % c for c in columns]),
+                parent, NEWSITEM_TABLE, column, ids))
+        cursor.execute("DELETE FROM ONLY %s WHERE %s IN (SELECT id FROM %s)"
+                       % (parent, column, ids))
+        stashed.append((parent, stash, columns))
+
+    columns = ', '.join(_columns(NEWSITEM_TABLE))
+    cursor.execute("""
+        INSERT INTO %s (%s) SELECT %s FROM ONLY %s WHERE id IN (SELECT id FROM %s)
+        """ % (table_name(NEWSITEM_TABLE, partition.name), columns, columns,
+               NEWSITEM_TABLE, ids))
+    moved = cursor.rowcount
+    cursor.execute("DELETE FROM ONLY %s WHERE id IN (SELECT id FROM %s)"
+                   % (NEWSITEM_TABLE, ids))
+
+    for parent, stash, columns in stashed:
+        cursor.execute("INSERT INTO %s (%s, item_date) SELECT * FROM %s" % (
+                table_name(parent, partition.name), ', '.join(columns), stash))
+        cursor.execute("DROP TABLE %s" % stash)
+    cursor.execute("DROP TABLE %s" % ids)
+    return moved
+
+
+def move_to_partition(partition, batch_size=None):
+    """
+    Moves the NewsItems of ``partition``'s period that are in the main
+    table, with their Attributes and NewsItemLocations, into the
+    partition tables, ``batch_size`` (default ``BATCH_SIZE``) IDs per
+    transaction. Returns how many NewsItems were moved.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT min(id), max(id) FROM ONLY %s
+        WHERE item_date >= %%s AND item_date < %%s""" % NEWSITEM_TABLE,
+                   [partition.start_date, partition.end_date])
+    min_id, max_id = cursor.fetchone()
+    moved = 0
+    if min_id is not None:
+        for start_id in xrange(min_id, max_id + 1, batch_size):
+            moved += _move_batch(cursor, partition, start_id, start_id + batch_size)
+            transaction.commit_unless_managed()
+    partition.save()
+    logger.info("Moved %d NewsItems to partition %s" % (moved, partition.name))
+    return moved
+
+
+def unpartition(news_item_id):
+    """
+    Moves a NewsItem, with its Attributes and NewsItemLocations, from
+    its partition back to the main tables, so that foreign keys can
+    refer to it. Does nothing if it's already in the main table, or in
+    a detached partition. Returns True if it was moved.
+    """
+    if news_item_id is None:
+        return False
+    # Ask the row itself, rather than caching whether there are any
+    # partitions, which could be stale in another process.
+    cursor = connection.cursor()
+    cursor.execute("SELECT tableoid::regclass::text FROM %s WHERE id = %%s"
+                   % NEWSITEM_TABLE, [news_item_id])
+    rows = cursor.fetchall()
+    if not rows or rows[0][0] == NEWSITEM_TABLE:
+        return False
+    child = rows[0][0]
+    cursor.execute("SELECT id FROM ONLY %s WHERE id = %%s FOR UPDATE" % child,
+                   [news_item_id])
+    if not cursor.fetchall():
+        # Someone else just moved it.
+        return False
+    name = child[len(NEWSITEM_TABLE) + 1:]
+    # The location trigger, if any, creates NewsItemLocations for it.
+    columns = ', '.join(_columns(NEWSITEM_TABLE))
+    cursor.execute("INSERT INTO %s (%s) SELECT %s FROM ONLY %s WHERE id = %%s" % (
+            NEWSITEM_TABLE, columns, columns, table_name(NEWSITEM_TABLE, name)),
+                   [news_item_id])
+    for parent, column in DEPENDENT_TABLES:
+        child = table_name(parent, name)
+        columns = ', '.join(_columns(parent))
+        cursor.execute("""
+            INSERT INTO %s (%s) SELECT %s FROM ONLY %s
+            WHERE %s = %%s AND NOT EXISTS (SELECT 1 FROM ONLY %s WHERE %s = %%s)
+            """ % (parent, columns, columns, child, column, parent, column),
+                       [news_item_id, news_item_id])
+        cursor.execute("DELETE FROM ONLY %s WHERE %s = %%s" % (child, column),
+                       [news_item_id])
+    cursor.execute("DELETE FROM ONLY %s WHERE id = %%s"
+                   % table_name(NEWSITEM_TABLE, name), [news_item_id])
+    logger.info("Moved NewsItem %s from partition %s back to the main table"
+                % (news_item_id, name))
+    return True
+
+
+def partition_before(date, period=None):
+    """
+    Moves NewsItems in all whole periods that end on or before
+    ``date`` into partitions, creating them as needed, one transaction
+    per partition. Returns how many NewsItems were moved.
+    """
+    cursor = connection.cursor()
+    moved = 0
+    after = datetime.date.min
+    while True:
+        cursor.execute("SELECT min(item_date) FROM ONLY %s WHERE item_date >= %%s"
+                       % NEWSITEM_TABLE, [after])
+        oldest = cursor.fetchone()[0]
+        if oldest is None:
+            break
+        name, start_date, after = period_for_date(oldest, period)
+        if after > date:
+            break
+        partition = create_partition(start_date, period)
+        if partition.state == partition.DETACHED:
+            logger.warn("Not moving NewsItems to detached partition %s" % partition.name)
+            continue
+        moved += move_to_partition(partition)
+        transaction.commit_unless_managed()
+    return moved
+
+
+def archive_before(date):
+    """
+    Archives all active partitions that end on or before ``date``.
+    Returns the archived NewsItemPartitions.
+
+    Their aggregates won't be updated again, so run
+    ``update_aggregates`` first.
+    """
+    from ebpub.db.models import NewsItemPartition
+    partitions = list(NewsItemPartition.objects.filter(
+            state=NewsItemPartition.ACTIVE, end_date__lte=date))
+    for partition in partitions:
+        partition.state = NewsItemPartition.ARCHIVED
+        partition.save()
+        logger.info("Archived partition %s" % partition.name)
+    return partitions
+
+
+def activate(partition):
+    """
+    Un-archives ``partition``, and any newer archived partitions,
+    since archived partitions have to be the oldest ones.
+    """
+    from ebpub.db.models import NewsItemPartition
+    if partition.state == NewsItemPartition.DETACHED:
+        attach(partition)
+    for newer in NewsItemPartition.objects.filter(
+        state=NewsItemPartition.ARCHIVED, start_date__gte=partition.start_date):
+        newer.state = NewsItemPartition.ACTIVE
+        newer.save()
+        logger.info("Activated partition %s" % newer.name)
+
+
+def _set_inherit(partition, inherit):
+    cursor = connection.cursor()
+    for parent in [NEWSITEM_TABLE] + [table for table, column in DEPENDENT_TABLES]:
+        cursor.execute("ALTER TABLE %s %s %s" % (table_name(parent, partition.name),
+                                                 inherit and 'INHERIT' or 'NO INHERIT',
+                                                 parent))
+
+
+def detach(partition):
+    """
+    Detaches the tables of ``partition`` from the main tables. Its
+    NewsItems are then invisible, but still in the database.
+    """
+    from ebpub.db.models import NewsItemPartition
+    _set_inherit(partition, False)
+    partition.state = NewsItemPartition.DETACHED
+    partition.save()
+    logger.info("Detached partition %s" % partition.name)
+
+
+def attach(partition):
+    """
+    Attaches the tables of a detached ``partition`` again, as archived.
+    """
+    from ebpub.db.models import NewsItemPartition
+    _set_inherit(partition, True)
+    partition.state = NewsItemPartition.ARCHIVED
+    partition.save()
+    logger.info("Attached partition %s" % partition.name)
+
+
+def archive_cutoff():
+    """
+    Returns the first item_date after all archived and detached
+    partitions, or None if there aren't any.
+    """
+    cutoff = cache.get(CUTOFF_CACHE_KEY)
+    if cutoff is None:
+        from ebpub.db.models import NewsItemPartition
+        cutoff = NewsItemPartition.objects.exclude(
+            state=NewsItemPartition.ACTIVE).order_by('-end_date').values_list(
+            'end_date', flat=True)[:1]
+        cutoff = cutoff and cutoff[0] or ''
+        cache.set(CUTOFF_CACHE_KEY, cutoff, CUTOFF_CACHE_TIME)
+    return cutoff or None
+
+
+def newsitem_tables():
+    """
+    Returns a list of (newsitem_table, newsitemlocation_table,
+    is_partition) for the main tables and each attached partition.
+    Use ``FROM ONLY`` to query just one of them.
+    """
+    from ebpub.db.models import NewsItemPartition
+    tables = [(NEWSITEM_TABLE, 'db_newsitemlocation', False)]
+    for name in NewsItemPartition.objects.exclude(
+        state=NewsItemPartition.DETACHED).values_list('name', flat=True):
+        tables.append((table_name(NEWSITEM_TABLE, name),
+                       table_name('db_newsitemlocation', name), True))
+    return tables
+
+
+# Signal handlers.
+
+def partitions_changed(sender, **kwargs):
+    cache.delete(CUTOFF_CACHE_KEY)
+
+_newsitem_fields = {}
+
+def _newsitem_attnames(model):
+    # Attribute names of ``model``'s foreign keys to NewsItem.
+    try:
+        return _newsitem_fields[model]
+    except KeyError:
+        from ebpub.db.models import NewsItem
+        from django.db.models import ForeignKey
+        # rel.to is still a string if the relation isn't resolved yet.
+        attnames = [f.attname for f in model._meta.fields
+                    if isinstance(f, ForeignKey) and isinstance(f.rel.to, type)
+                    and issubclass(f.rel.to, NewsItem)]
+        _newsitem_fields[model] = attnames
+        return attnames
+
+def newsitem_refs_pre_save(sender, instance, **kwargs):
+    # Connected for NewsItem and models that refer to it; see the module docs.
+    if kwargs.get('raw'):
+        # Loading fixtures.
+        return
+    from ebpub.db.models import NewsItem
+    if isinstance(instance, NewsItem):
+        unpartition(instance.pk)
+        return
+    for attname in _newsitem_attnames(sender):
+        unpartition(getattr(instance, attname))
+
+def connect_newsitem_refs(sender, **kwargs):
+    # class_prepared handler: watches saves of any model with a
+    # foreign key to NewsItem.
+    if _newsitem_attnames(sender):
+        pre_save.connect(newsitem_refs_pre_save, sender=sender)
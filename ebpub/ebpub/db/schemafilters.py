@@ -40,6 +40,7 @@ from django.utils.datastructures import SortedDict
 from ebpub.db import constants
 from ebpub.db import models
 from ebpub.db.utils import block_radius_value
+from ebpub.db.buckets import filter_by_geometry
 from ebpub.db.utils import make_search_buffer
 from ebpub.db.utils import url_to_block
 from ebpub.db.utils import url_to_location
@@ -553,7 +554,7 @@ class BlockFilter(NewsitemFilter):
         """
         block = self.location_object
         search_buf = make_search_buffer(block.location.centroid, self.block_radius)
-        self.qs = self.qs.filter(location__bboverlaps=search_buf)
+        self.qs = filter_by_geometry(self.qs, search_buf)
         return self.qs
 
 
@@ -895,7 +896,8 @@ class FilterChain(SortedDict):
 
         if self.request and (not 'schema' in self):
             queryset = queryset.by_request(self.request)
-        return queryset
+        # Archived NewsItems aren't shown on the site.
+        return queryset.exclude_archived()
 
     def copy(self):
         # Overriding because default dict.copy() re-inits attributes,
@@ -0,0 +1,218 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+In-process registry of :py:class:`Schema <ebpub.db.models.Schema>` and
+:py:class:`SchemaField <ebpub.db.models.SchemaField>` metadata.
+
+Schemas and SchemaFields change a few times a year, but almost every
+page and every ``NewsItem.attributes`` access needs them. So we load
+all of them once per process and keep them in memory.
+
+Invalidation works across processes via a "version stamp" stored in
+the Django cache: whenever a Schema or SchemaField is saved or deleted,
+the local registry is cleared and a new stamp is written to the cache.
+Other processes compare their stamp with the shared one at most once
+every ``SCHEMA_REGISTRY_CHECK_INTERVAL`` seconds, and reload if it has
+changed. If the cache can't tell us anything (eg. the default
+DummyCache), we simply reload on that interval.
+
+Usage::
+
+    from ebpub.db.schemaregistry import schema_registry
+    schema_registry.field_mapping([schema.id])
+    schema_registry.get_schemafield(schema.id, 'crime_type')
+
+Don't modify the returned objects; they are shared by the whole process.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from ebpub.db import constants
+
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('ebpub.db.schemaregistry')
+
+VERSION_CACHE_KEY = 'ebpub.db.schemaregistry.version'
+
+# How long the shared version stamp lives in the cache.
+VERSION_CACHE_TIME = 60 * 60 * 24 * 30
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+class _RegistryState(object):
+
+    # No docstring, not part of API.
+    # All the loaded data, swapped in as a whole so that
+    # readers in other threads never see a half-loaded registry.
+
+    def __init__(self, version, schemas, schemafields):
+        self.version = version
+        self.schemas = schemas  # {schema_id: Schema}
+        self.fields = {}  # {schema_id: [SchemaField, ...]}
+        self.fields_by_name = {}  # {(schema_id, name): SchemaField}
+        self.mappings = {}  # {schema_id: {name: real_name}}
+        self.lookups = {}  # {schema_id: [(name, real_name, is_m2m), ...]}
+        self.memo = {}
+        for sf in schemafields:
+            if sf.schema_id in schemas:
+                # Save a query on sf.schema.
+                sf._schema_cache = schemas[sf.schema_id]
+            self.fields.setdefault(sf.schema_id, []).append(sf)
+            self.fields_by_name[(sf.schema_id, sf.name)] = sf
+            self.mappings.setdefault(sf.schema_id, {})[sf.name] = sf.real_name
+            if sf.is_lookup:
+                self.lookups.setdefault(sf.schema_id, []).append(
+                    (sf.name, sf.real_name, sf.is_many_to_many_lookup()))
+
+
+class SchemaRegistry(object):
+    """
+    Process-wide cache of Schema and SchemaField metadata.
+    You normally want the module-level ``schema_registry`` instance.
+    """
+
+    def __init__(self, check_interval=None):
+        if check_interval is None:
+            check_interval = getattr(settings, 'SCHEMA_REGISTRY_CHECK_INTERVAL',
+                                     constants.SCHEMA_REGISTRY_CHECK_INTERVAL)
+        self.check_interval = check_interval
+        self._state = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        # Simple instrumentation, see stats().
+        self._loads = 0
+        self._queries = 0
+
+    def _load(self):
+        from ebpub.db.models import Schema, SchemaField
+        # Read the stamp *before* loading, so any change that
+        # happens while we're loading makes us reload next time.
+        version = cache.get(VERSION_CACHE_KEY, None)
+        if version is None:
+            version = _new_version()
+            cache.add(VERSION_CACHE_KEY, version, VERSION_CACHE_TIME)
+        schemas = dict((s.id, s) for s in Schema.objects.all())
+        schemafields = list(SchemaField.objects.order_by('schema', 'display_order', 'id'))
+        self._loads += 1
+        self._queries += 2
+        logger.debug("Loaded %d schemas and %d schemafields (load #%d)"
+                     % (len(schemas), len(schemafields), self._loads))
+        return _RegistryState(version, schemas, schemafields)
+
+    def _get_state(self):
+        state = self._state
+        now = time.time()
+        if state is not None and now - self._checked_at < self.check_interval:
+            return state
+        with self._lock:
+            state = self._state
+            if state is not None and now - self._checked_at < self.check_interval:
+                return state
+            if state is None or cache.get(VERSION_CACHE_KEY, None) != state.version:
+                state = self._state = self._load()
+            self._checked_at = now
+        return state
+
+    def invalidate(self, broadcast=True):
+        """
+        Forget everything we've loaded. If ``broadcast`` is True, also
+        bump the shared version stamp so other processes reload.
+        """
+        with self._lock:
+            self._state = None
+        if broadcast:
+            cache.set(VERSION_CACHE_KEY, _new_version(), VERSION_CACHE_TIME)
+
+    def stats(self):
+        """
+        Returns a dict of how many times the registry was loaded
+        and how many queries that took.
+        """
+        return {'loads': self._loads, 'queries': self._queries}
+
+    def get_schema(self, schema_id):
+        """
+        Returns the Schema with the given ID, or None.
+        Note this ignores ``is_public``; use the Schema managers
+        for visibility checks.
+        """
+        return self._get_state().schemas.get(schema_id)
+
+    def get_schemafields(self, schema_id):
+        """
+        Returns a list of all SchemaFields for the given schema ID,
+        ordered by ``display_order``.
+        """
+        return list(self._get_state().fields.get(schema_id, ()))
+
+    def get_schemafield(self, schema_id, name):
+        """
+        Returns the SchemaField with the given schema ID and name, or None.
+        """
+        return self._get_state().fields_by_name.get((schema_id, name))
+
+    def field_mapping(self, schema_id_list):
+        """
+        Like :py:func:`ebpub.db.models.field_mapping`, but without
+        any queries.
+        """
+        mappings = self._get_state().mappings
+        result = {}
+        for schema_id in schema_id_list:
+            if schema_id in mappings:
+                result[schema_id] = mappings[schema_id].copy()
+        return result
+
+    def lookup_fields(self, schema_id):
+        """
+        Returns a list of (name, real_name, is_many_to_many)
+        tuples for each lookup SchemaField of the given schema.
+        """
+        return list(self._get_state().lookups.get(schema_id, ()))
+
+    def memoize(self, key, func):
+        """
+        Returns ``func()``, computed at most once until the registry
+        is next invalidated. ``key`` must uniquely identify ``func``.
+        Useful for anything derived purely from schema metadata.
+        """
+        memo = self._get_state().memo
+        try:
+            return memo[key]
+        except KeyError:
+            result = memo[key] = func()
+            return result
+
+
+schema_registry = SchemaRegistry()
+
+
+def invalidate_schema_registry(sender, **kwargs):
+    """
+    Signal handler that clears the registry, locally and
+    in all other processes.
+    """
+    schema_registry.invalidate()
@@ -0,0 +1,206 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Precomputed summaries for the schema detail page.
+
+The schema detail page shows a date chart, the most common values of
+each charted lookup field, and the locations with the most items of
+each significant location type. Computing all that on every hit means
+several queries per field and per location type, including loading
+every Location in the type just to show the top nine.
+
+Instead, ``update_aggregates`` calls :py:func:`update_summary` after
+updating the other :ref:`aggregates`, which stores one small JSON
+document per schema in
+:py:class:`AggregateSchemaSummary <ebpub.db.models.AggregateSchemaSummary>`.
+The view loads that with one query, and :py:func:`summary_context`
+turns it back into the objects the templates expect, without touching
+any geometries.
+"""
+
+from django.utils import simplejson
+from ebpub.db import constants
+from ebpub.db.datecharts import DateChart, aggregate_date_charts
+from ebpub.db.models import AggregateDay, AggregateFieldLookup, AggregateLocation
+from ebpub.db.models import AggregateSchemaSummary, Location, Lookup
+from ebpub.db.schemaregistry import schema_registry
+from ebpub.utils.dates import today
+
+import datetime
+import logging
+
+logger = logging.getLogger('ebpub.db.schemasummary')
+
+# How many values of each lookup field to show.
+LOOKUP_MAX_DISPLAYED = 12
+
+# Show a few more rather than a "more" link for just a few more.
+LOOKUP_BUFFER = 4
+
+# How many locations of each type to show.
+LOCATIONS_DISPLAYED = 9
+
+# Bump this if the format of the summary changes; older summaries
+# will be ignored until update_aggregates runs again.
+SUMMARY_VERSION = 1
+
+
+def _date_to_str(date):
+    return date and date.strftime('%Y-%m-%d') or None
+
+def _str_to_date(value):
+    return value and datetime.datetime.strptime(value, '%Y-%m-%d').date() or None
+
+
+def build_summary(schema):
+    """
+    Returns the summary of ``schema`` as a dict ready for JSON,
+    computed from the other aggregates.
+    """
+    summary = {'version': SUMMARY_VERSION, 'start_date': None, 'end_date': None,
+               'counts': [], 'total_count': 0, 'lookups': [], 'locations': []}
+    # The end_date is the last non-future date with at least one NewsItem.
+    end_dates = AggregateDay.objects.filter(
+        schema__id=schema.id, date_part__lte=today(), total__gt=0
+        ).order_by('-date_part').values_list('date_part', flat=True)[:1]
+    if not end_dates:
+        return summary
+    end_date = end_dates[0]
+    start_date = end_date - constants.DAYS_AGGREGATE_TIMEDELTA
+    date_chart = aggregate_date_charts([schema], start_date, end_date, AggregateDay)[0]
+    summary['start_date'] = _date_to_str(start_date)
+    summary['end_date'] = _date_to_str(end_date)
+    summary['counts'] = date_chart.counts.tolist()
+    summary['total_count'] = total_count = date_chart.total_count
+
+    for sf in schema_registry.get_schemafields(schema.id):
+        if not (sf.is_filter and sf.is_lookup):
+            continue
+        values = AggregateFieldLookup.objects.filter(schema_field__id=sf.id)
+        top_values = list(values.order_by('-total').values_list(
+                'lookup__id', 'lookup__name', 'lookup__slug', 'total'
+                )[:LOOKUP_MAX_DISPLAYED + LOOKUP_BUFFER])
+        if len(top_values) < LOOKUP_MAX_DISPLAYED + LOOKUP_BUFFER:
+            total_value_count = len(top_values)
+            has_more = False
+        else:
+            top_values = top_values[:LOOKUP_MAX_DISPLAYED]
+            total_value_count = values.count()
+            has_more = True
+        summary['lookups'].append({
+                'name': sf.name,
+                'top_values': top_values,
+                'total_value_count': total_value_count,
+                'has_more': has_more,
+                })
+
+    # values_list() keeps the Location geometries out of this entirely.
+    location_totals = {}
+    for row in AggregateLocation.objects.filter(
+        schema__id=schema.id, location__is_public=True).order_by('-total').values_list(
+        'location_type__id', 'location__id', 'location__name', 'location__slug', 'total'):
+        location_totals.setdefault(row[0], []).append(row[1:])
+    for location_type_id, rows in sorted(location_totals.items()):
+        known_count = sum(row[-1] for row in rows)
+        summary['locations'].append({
+                'location_type_id': location_type_id,
+                'locations': rows[:LOCATIONS_DISPLAYED],
+                'unknown': max(0, total_count - known_count),
+                })
+    return summary
+
+
+def update_summary(schema):
+    """
+    Builds and saves the summary of ``schema``.
+    """
+    summary = simplejson.dumps(build_summary(schema), separators=(',', ':'))
+    now = datetime.datetime.now()
+    updated = AggregateSchemaSummary.objects.filter(schema__id=schema.id).update(
+        summary=summary, last_updated=now)
+    if not updated:
+        AggregateSchemaSummary.objects.create(schema=schema, summary=summary,
+                                              last_updated=now)
+
+
+def get_summary(schema):
+    """
+    Returns the saved summary of ``schema``, or builds one if there
+    isn't one yet.
+    """
+    try:
+        summary = AggregateSchemaSummary.objects.filter(
+            schema__id=schema.id).values_list('summary', flat=True)[0]
+    except IndexError:
+        summary = None
+    else:
+        summary = simplejson.loads(summary)
+    if summary is None or summary.get('version') != SUMMARY_VERSION:
+        logger.info("No current summary for schema %s; run update_aggregates" % schema.slug)
+        summary = build_summary(schema)
+    return summary
+
+
+def summary_context(schema, summary, location_types):
+    """
+    Turns a summary into the ``date_chart``, ``latest_dates``,
+    ``lookup_list`` and ``location_chartfield_list`` used by the
+    schema detail template. Only charted lookup fields and the given
+    LocationTypes are included.
+
+    The Lookups and Locations are unsaved stand-ins holding just the
+    fields the templates and filter URLs need.
+    """
+    start_date = _str_to_date(summary['start_date'])
+    end_date = _str_to_date(summary['end_date'])
+    if end_date is None:
+        return {}, (), [], []
+
+    date_chart = DateChart(schema, start_date, end_date, summary['counts'])
+    latest_dates = date_chart.nonzero_dates()
+
+    lookup_list = []
+    for info in summary['lookups']:
+        sf = schema_registry.get_schemafield(schema.id, info['name'])
+        if sf is None or not (sf.is_charted and sf.is_lookup):
+            continue
+        top_values = [AggregateFieldLookup(schema=schema, schema_field=sf, total=total,
+                                           lookup=Lookup(id=id, name=name, slug=slug,
+                                                         schema_field=sf))
+                      for (id, name, slug, total) in info['top_values']]
+        lookup_list.append({'sf': sf,
+                            'top_values': top_values,
+                            'has_more': info['has_more'],
+                            'total_value_count': info['total_value_count'],
+                            })
+
+    by_type = dict((info['location_type_id'], info) for info in summary['locations'])
+    location_chartfield_list = []
+    for lt in location_types:
+        info = by_type.get(lt.id)
+        if not info:
+            continue
+        locations = [AggregateLocation(schema=schema, location_type=lt, total=total,
+                                       location=Location(id=id, name=name, slug=slug,
+                                                         location_type=lt))
+                     for (id, name, slug, total) in info['locations']]
+        location_chartfield_list.append({'location_type': lt,
+                                         'locations': locations,
+                                         'unknown': info['unknown']})
+    return date_chart, latest_dates, lookup_list, location_chartfield_list
@@ -0,0 +1,198 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Simplified Location geometries for maps.
+
+Neighborhood and ZIP code boundaries can have thousands of vertices,
+far more than anyone can see on a map that shows the whole metro. So
+for each :py:class:`Location <ebpub.db.models.Location>` we store
+topology-preserving simplifications at a few tolerances
+(:py:class:`SimplifiedLocation <ebpub.db.models.SimplifiedLocation>`),
+regenerated whenever the Location is saved. Map views pick the
+simplest one that's still accurate to about a pixel at the requested
+zoom level (or tolerance), and round coordinates to match.
+
+The tolerances, in degrees, can be set with
+``LOCATION_SIMPLIFY_TOLERANCES``. After changing them, run the
+``simplify_locations`` script.
+
+Places are points, so there's nothing to simplify; but their map
+output also gets rounded coordinates, see :py:func:`round_geojson`.
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+import logging
+import math
+
+logger = logging.getLogger('ebpub.db.simplify')
+
+# Level 1 is the first tolerance, level 2 the second, etc.
+# Level 0 means the full geometry.
+TOLERANCES = tuple(getattr(settings, 'LOCATION_SIMPLIFY_TOLERANCES',
+                           (0.00005, 0.0002, 0.001, 0.005)))
+
+# Digits after the decimal point for full-resolution coordinates;
+# 6 digits of a degree is about 10 cm.
+MAX_PRECISION = 6
+
+
+def tolerance_for_zoom(zoom):
+    """
+    Returns the size in degrees of one pixel at the given (spherical
+    mercator, 256-pixel tile) zoom level, at the equator.
+    """
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def level_for_tolerance(tolerance):
+    """
+    Returns the simplest level whose tolerance is no more than
+    ``tolerance``, or 0 if even level 1 is too coarse.
+    """
+    level = 0
+    for i, level_tolerance in enumerate(TOLERANCES):
+        if level_tolerance <= tolerance:
+            level = i + 1
+    return level
+
+
+def precision_for_tolerance(tolerance):
+    """
+    Returns how many digits after the decimal point are worth keeping
+    for coordinates accurate to ``tolerance`` degrees.
+    """
+    if not tolerance or tolerance <= 0:
+        return MAX_PRECISION
+    return max(0, min(MAX_PRECISION, int(math.ceil(-math.log10(tolerance))) + 1))
+
+
+def parse_tolerance(params):
+    """
+    Gets a tolerance in degrees from the ``tolerance`` or ``zoom``
+    query parameters; returns 0 (meaning full resolution) if neither
+    is given. Raises ValueError if they're not numbers.
+    """
+    if params.get('tolerance'):
+        return max(0.0, float(params['tolerance']))
+    if params.get('zoom'):
+        return tolerance_for_zoom(min(30, max(0, int(params['zoom']))))
+    return 0.0
+
+
+def update_simplified(location):
+    """
+    Replaces the simplified geometries of ``location``.
+    """
+    from ebpub.db.models import SimplifiedLocation
+    SimplifiedLocation.objects.filter(location__id=location.id).delete()
+    geom = location.location
+    if geom is None:
+        return
+    for i, tolerance in enumerate(TOLERANCES):
+        simple = geom.simplify(tolerance, preserve_topology=True)
+        if simple.empty:
+            # Too small for this tolerance; keep the previous level.
+            simple = geom
+        SimplifiedLocation.objects.create(location=location, level=i + 1,
+                                          tolerance=tolerance, geometry=simple)
+        geom = simple
+
+
+def update_all_simplified(queryset=None):
+    """
+    Regenerates simplified geometries for all Locations, or those in
+    ``queryset``. Returns how many Locations were done.
+    """
+    from ebpub.db.models import Location
+    if queryset is None:
+        queryset = Location.objects.all()
+    count = 0
+    for location in queryset.iterator():
+        if _safe_update_simplified(location):
+            count += 1
+    return count
+
+
+def _safe_update_simplified(location):
+    # Logs errors rather than raising them; we never want to block
+    # saving or importing a Location, the maps can still use the full
+    # geometry.
+    sid = transaction.savepoint()
+    try:
+        update_simplified(location)
+    except Exception:
+        transaction.savepoint_rollback(sid)
+        logger.exception("Couldn't simplify %s" % location)
+        return False
+    transaction.savepoint_commit(sid)
+    return True
+
+
+def location_geojson(location, tolerance=0.0):
+    """
+    Returns the GeoJSON of ``location``'s geometry as a string,
+    simplified to ``tolerance`` degrees if we have a suitable
+    simplification, with coordinates rounded to match.
+    """
+    from ebpub.db.models import Location, SimplifiedLocation
+    precision = precision_for_tolerance(tolerance)
+    level = level_for_tolerance(tolerance)
+    if level:
+        simplified = SimplifiedLocation.objects.filter(
+            location__id=location.id, level=level).geojson(
+            field_name='geometry', precision=precision)
+        for s in simplified:
+            if s.geojson:
+                return s.geojson
+    return Location.objects.lean().filter(id=location.id).geojson(
+        precision=precision)[0].geojson
+
+
+def simplified_geometry(location, tolerance=0.0):
+    """
+    Like :py:func:`location_geojson`, but returns a GEOS geometry.
+    """
+    from django.contrib.gis.geos import GEOSGeometry
+    return GEOSGeometry(location_geojson(location, tolerance))
+
+
+def round_geojson(geometry, precision=MAX_PRECISION):
+    """
+    Rounds the coordinates of a decoded GeoJSON geometry dict, in
+    place, and returns it.
+    """
+    def _round(coords):
+        if coords and isinstance(coords[0], (list, tuple)):
+            return [_round(c) for c in coords]
+        return [round(c, precision) for c in coords]
+    if geometry.get('type') == 'GeometryCollection':
+        for geom in geometry.get('geometries', []):
+            round_geojson(geom, precision)
+    elif 'coordinates' in geometry:
+        geometry['coordinates'] = _round(geometry['coordinates'])
+    return geometry
+
+
+# Signal handler.
+
+def location_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _safe_update_simplified(instance)
@@ -0,0 +1,138 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Request-scoped memoization for the :py:mod:`eb <ebpub.db.templatetags.eb>`
+template tags.
+
+Tags like ``featured_lookup_for_item`` and ``get_locations_for_item``
+are typically used once per NewsItem inside a loop, and tags like
+``get_featured_lookups_by_schema`` may be used by several templates
+that make up one page. Each call used to run its own queries.
+
+Instead, tags share a :py:class:`TagCache` that lives as long as the
+request (or, without a request, the template context):
+
+* :py:meth:`TagCache.get` memoizes any value by a key, so repeated
+  calls with the same arguments run their queries once;
+
+* :py:meth:`TagCache.add_newsitems` registers NewsItems that are about
+  to be rendered, eg. by ``newsitem_list_by_schema``; then
+  :py:meth:`TagCache.get_for_newsitem` loads a per-item value for the
+  requested NewsItem *and* all the registered ones that don't have it
+  yet, with one bulk query, so a loop over N items does one query
+  per tag rather than N.
+"""
+
+from ebpub.db.models import NewsItem
+from ebpub.utils.models import is_instance_of_model
+
+# Where the cache lives: an attribute of the request if the context has
+# one, else a context variable.
+CACHE_NAME = '_eb_tag_cache'
+
+# Max NewsItems to load per bulk query.
+BATCH_SIZE = 500
+
+
+class TagCache(object):
+    """
+    Memoized values for one request; see the module docs.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._newsitems = {}
+
+    def get(self, kind, key, load):
+        """
+        Returns the value of ``load()``, calling it only the first
+        time for a given ``kind`` and ``key``. Unhashable keys aren't
+        memoized.
+        """
+        cache_key = (kind, key)
+        try:
+            return self._values[cache_key]
+        except KeyError:
+            pass
+        except TypeError:
+            return load()
+        value = self._values[cache_key] = load()
+        return value
+
+    def add_newsitems(self, newsitems):
+        """
+        Registers NewsItems that are going to be rendered, so per-item
+        values can be loaded for all of them at once. Anything else,
+        including unsaved NewsItems, is ignored.
+        """
+        if is_instance_of_model(newsitems, NewsItem):
+            newsitems = [newsitems]
+        elif not isinstance(newsitems, (list, tuple)):
+            # Don't evaluate QuerySets behind the caller's back.
+            return
+        for ni in newsitems:
+            if is_instance_of_model(ni, NewsItem) and ni.id is not None:
+                self._newsitems.setdefault(ni.id, ni)
+
+    def get_for_newsitem(self, kind, newsitem, load_many, default=None):
+        """
+        Returns the value of ``kind`` for ``newsitem``.
+
+        ``load_many`` is called with a list of NewsItems, including
+        ``newsitem`` and up to ``BATCH_SIZE`` registered ones that
+        don't have a value of this kind yet, and should return a dict
+        of values by NewsItem ID. NewsItems missing from the dict get
+        ``default``.
+        """
+        cache_key = (kind, newsitem.id)
+        if cache_key not in self._values:
+            self.add_newsitems([newsitem])
+            batch = [newsitem]
+            for ni in self._newsitems.values():
+                if len(batch) >= BATCH_SIZE:
+                    break
+                if ni.id != newsitem.id and (kind, ni.id) not in self._values:
+                    batch.append(ni)
+            values = load_many(batch)
+            for ni in batch:
+                self._values[(kind, ni.id)] = values.get(ni.id, default)
+        return self._values[cache_key]
+
+
+def get_tag_cache(context):
+    """
+    Returns the TagCache for the current request, creating it if
+    needed.
+    """
+    request = context.get('request')
+    if request is not None:
+        cache = getattr(request, CACHE_NAME, None)
+        if cache is None:
+            cache = TagCache()
+            setattr(request, CACHE_NAME, cache)
+        return cache
+    cache = context.get(CACHE_NAME)
+    if cache is None:
+        cache = TagCache()
+        # In a new dict at the bottom of the context stack, so it
+        # outlives any {% block %} or {% with %} that pushes and pops,
+        # without modifying the caller's dict.
+        context.dicts.insert(0, {CACHE_NAME: cache})
+    return cache
+
@@ -0,0 +1,33 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Background jobs for `django-background-task
+<https://github.com/lilspikey/django-background-task>`_;
+run them with ``django-admin.py process_tasks``.
+"""
+
+from background_task import background
+from ebpub.db.homepage import refresh_homepage
+
+@background
+def refresh_homepage_task():
+    """
+    Refreshes the cached homepage; see :py:mod:`ebpub.db.homepage`.
+    """
+    refresh_homepage()
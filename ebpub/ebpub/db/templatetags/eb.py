@@ -28,6 +28,8 @@ To use these, your template must include:
 
     {% load eb %}
 
+Tags that query the database memoize their results for the rest of the
+request, see :py:mod:`ebpub.db.tagcache`.
 """
 from django import template
 from django.core.cache import cache
@@ -35,10 +37,12 @@ from django.template.defaultfilters import stringfilter
 from django.template.loader import select_template
 from ebpub.db.models import LocationType
 from ebpub.db.models import Lookup
-from ebpub.db.models import NewsItem
+from ebpub.db.models import NewsItem, NewsItemLocation
 from ebpub.db.models import SchemaField, Schema
+from ebpub.db.models import populate_attributes
 from ebpub.db.schemafilters import FilterChain
-from ebpub.db.utils import populate_attributes_if_needed
+from ebpub.db.schemaregistry import schema_registry
+from ebpub.db.tagcache import CACHE_NAME, get_tag_cache
 from ebpub.metros import allmetros
 from ebpub.utils.bunch import bunch, bunchlong, stride
 from ebpub.utils.dates import today
@@ -193,10 +197,14 @@ class GetNewsItemNode(template.Node):
 
     def render(self, context):
         newsitem_id = self.variable.resolve(context)
-        try:
-            context[self.context_var] = NewsItem.objects.select_related().get(id=newsitem_id)
-        except NewsItem.DoesNotExist:
-            pass
+        def load():
+            try:
+                return NewsItem.objects.select_related().get(id=newsitem_id)
+            except NewsItem.DoesNotExist:
+                return None
+        newsitem = get_tag_cache(context).get('newsitem', unicode(newsitem_id), load)
+        if newsitem is not None:
+            context[self.context_var] = newsitem
         return ''
 
 def get_newsitem(parser, token):
@@ -272,18 +280,27 @@ class GetNewsItemListByAttributeNode(template.Node):
             schema_kwargs = {'schema__id': schema_id}
 
         att_value = self.att_value_variable.resolve(context)
-        sf = SchemaField.objects.select_related().get(name=self.att_name, **schema_kwargs)
-        queryset = NewsItem.objects.select_related().filter(**schema_kwargs)
-
+        newsitem_id = None
         if self.newsitem_id_variable is not None:
             newsitem_id = self.newsitem_id_variable.resolve(context)
             if hasattr(newsitem_id, 'id'):
                 # It could be a NewsItem.
                 newsitem_id = newsitem_id.id
-            queryset = queryset.exclude(id=newsitem_id)
 
-        queryset = queryset.by_attribute(sf, att_value).order_by('-item_date')
-        populate_attributes_if_needed(queryset, [sf.schema])
+        # The same QuerySet for the same arguments, so it's only
+        # evaluated once per request.
+        cache = get_tag_cache(context)
+        schema_key = schema_kwargs.items()[0]
+        sf = cache.get('schemafield', (schema_key, self.att_name), lambda:
+                       SchemaField.objects.select_related().get(name=self.att_name, **schema_kwargs))
+        def load():
+            queryset = NewsItem.objects.select_related().filter(**schema_kwargs)
+            if newsitem_id is not None:
+                queryset = queryset.exclude(id=newsitem_id)
+            queryset = queryset.by_attribute(sf, att_value).order_by('-item_date')
+            return queryset.with_attributes()
+        queryset = cache.get('newsitem_list_by_attribute',
+                             (schema_key, newsitem_id, self.att_name, att_value), load)
 
         # We're assigning directly to context.dicts[-1] so that the variable
         # gets set in the top-most context in the context stack. If we didn't
@@ -365,11 +382,16 @@ class NewsItemListBySchemaNode(template.Node):
         if isinstance(ni_list, NewsItem):
             ni_list = [ni_list]
 
+        # Tags in the snippet can then load data for all the items at once.
+        cache = get_tag_cache(context)
+        cache.add_newsitems(ni_list)
+
         schema = ni_list[0].schema
         template_list = ['db/snippets/newsitem_list/%s.html' % schema.slug,
                          'db/snippets/newsitem_list.html']
         schema_template = select_template(template_list)
         return schema_template.render(template.Context({
+            CACHE_NAME: cache,
             'is_grouped': not self.is_ungrouped,
             'schema': schema,
             'newsitem_list': ni_list,
@@ -528,11 +550,48 @@ def featured_lookup_for_item(context, newsitem, attribute_key):
       {% endfor %}
 
     """
-    lookups = Lookup.objects.featured_lookups_for(newsitem, attribute_key)
+    sf = schema_registry.get_schemafield(newsitem.schema_id, attribute_key)
+    if sf is None or newsitem.id is None:
+        # Let the manager raise its usual error, or handle unsaved items.
+        context[attribute_key] = Lookup.objects.featured_lookups_for(newsitem, attribute_key)
+        return ""
+    cache = get_tag_cache(context)
+    featured = cache.get('featured_lookups', sf.id, lambda: dict(
+            (lookup.id, lookup) for lookup in
+            Lookup.objects.filter(featured=True, schema_field__id=sf.id)))
+    lookups = []
+    if featured:
+        # Load attributes for all the items in the list at once.
+        cache.add_newsitems(context.get('newsitem_list'))
+        cache.get_for_newsitem('attributes', newsitem, _populate_attributes)
+        ids = _lookup_ids(newsitem.attributes.get(attribute_key))
+        lookups = sorted([featured[i] for i in ids if i in featured],
+                         key=lambda lookup: lookup.slug)
     context[attribute_key] = lookups
     return ""
 
 
+def _populate_attributes(newsitems):
+    populate_attributes([ni for ni in newsitems if not hasattr(ni, '_attributes_cache')],
+                        get_lookups=False)
+    return {}
+
+
+def _lookup_ids(value):
+    # Attribute values of lookup fields may be Lookups or IDs, or lists
+    # of them, or comma-separated strings of IDs for many-to-many lookups.
+    if value is None or value == '':
+        return []
+    if isinstance(value, basestring):
+        try:
+            return [int(i) for i in value.split(',') if i]
+        except ValueError:
+            return []
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return [getattr(v, 'id', v) for v in value]
+
+
 @register.simple_tag(takes_context="true")
 def get_featured_lookups_by_schema(context):
     """
@@ -553,20 +612,23 @@ def get_featured_lookups_by_schema(context):
             {% endfor %}
         {% endfor %}
     """
-    lookups = {}
-    for lookup in Lookup.objects.filter(featured=True).select_related():
-        sf = lookup.schema_field
-        schema = sf.schema
-        filters = FilterChain(schema=schema)
-        filters.add(sf, lookup)
-        info = {'lookup': lookup.name, 'url': filters.make_url()}
-        lookups.setdefault(schema.slug, []).append(info)
-    context['featured_lookups'] = lookups
+    def load():
+        lookups = {}
+        for lookup in Lookup.objects.filter(featured=True).select_related():
+            sf = lookup.schema_field
+            schema = sf.schema
+            filters = FilterChain(schema=schema)
+            filters.add(sf, lookup)
+            info = {'lookup': lookup.name, 'url': filters.make_url()}
+            lookups.setdefault(schema.slug, []).append(info)
+        return lookups
+    context['featured_lookups'] = get_tag_cache(context).get(
+        'featured_lookups_by_schema', None, load)
     return u''
 
 
-@register.simple_tag()
-def json_lookup_values_for_attribute(schema_slug, sf_name):
+@register.simple_tag(takes_context=True)
+def json_lookup_values_for_attribute(context, schema_slug, sf_name):
     """Given a schema slug and attribute name, returns
     all the current Lookup values of the relevant attribute,
     as a JSON-formatted list.
@@ -591,10 +653,13 @@ def json_lookup_values_for_attribute(schema_slug, sf_name):
     """
     if is_instance_of_model(schema_slug, Schema):
         schema_slug = schema_slug.slug
-    values = Lookup.objects.filter(schema_field__schema__slug=schema_slug,
-                                   schema_field__name=sf_name).values_list('name')
-    values = [d[0] for d in values]
-    return json.dumps(sorted(values))
+    def load():
+        values = Lookup.objects.filter(schema_field__schema__slug=schema_slug,
+                                       schema_field__name=sf_name).values_list('name')
+        values = [d[0] for d in values]
+        return json.dumps(sorted(values))
+    return get_tag_cache(context).get('json_lookup_values',
+                                      (schema_slug, sf_name), load)
 
 
 def get_locations_for_item(parser, token):
@@ -664,30 +729,48 @@ class LocationInfoNode(template.Node):
         if not is_instance_of_model(newsitem, NewsItem):
             raise template.TemplateSyntaxError("The newsitem argument to 'get_locations_for_item' tag must be either a NewsItem, or a dictionary eg. as created by the template_context_for_item() function")
 
-        # TODO: cache the LocationType lookup?
-        location_types = LocationType.objects.filter(slug__in=self.loctype_slugs)
-        loctype_dict = dict([(d['slug'], d)
-                             for d in location_types.values('name', 'slug')])
+        cache = get_tag_cache(context)
+        slugs = tuple(self.loctype_slugs)
+        loctype_dict = cache.get('location_types', slugs, lambda: dict(
+                [(d['slug'], d) for d in
+                 LocationType.objects.filter(slug__in=slugs).values('name', 'slug')]))
+        if newsitem.id is None:
+            nilocations = {}
+        else:
+            # Load locations for all the items in the list at once.
+            cache.add_newsitems(context.get('newsitem_list'))
+            nilocations = cache.get_for_newsitem(
+                ('locations', slugs), newsitem,
+                lambda newsitems: _locations_for_newsitems(newsitems, slugs), {})
         result = []
-        nilocations = newsitem.location_set.all()
-        for slug in self.loctype_slugs:
+        for slug in slugs:
             loctype = loctype_dict.get(slug)
-            if loctype is None:
+            location = nilocations.get(slug)
+            if loctype is None or location is None:
                 continue
-            locations = nilocations.filter(location_type__slug=loctype['slug'])
-            # Assume there is at most one intersecting location of each type.
-            # That will probably be wrong somewhere someday...
-            # eg. neighborhoods with fuzzy borders.
-            locations = list(locations[:1])
-            if locations:
-                location = locations[0]
-                result.append(
-                    {'location_slug': location.slug,
-                     'location_type_slug': loctype['slug'],
-                     'location_type_name': smart_title(loctype['name'], ['ZIP']),
-                     'location_name': location.name,
-                     }
-                    )
+            result.append(
+                {'location_slug': location[0],
+                 'location_type_slug': loctype['slug'],
+                 'location_type_name': smart_title(loctype['name'], ['ZIP']),
+                 'location_name': location[1],
+                 }
+                )
 
         context[self.varname] = result
         return u''
+
+
+def _locations_for_newsitems(newsitems, location_type_slugs):
+    # Returns {newsitem_id: {location_type_slug: (location_slug, location_name)}}.
+    # Assume there is at most one intersecting location of each type.
+    # That will probably be wrong somewhere someday...
+    # eg. neighborhoods with fuzzy borders. If so, take the first by slug.
+    rows = NewsItemLocation.objects.filter(
+        news_item__id__in=[ni.id for ni in newsitems],
+        location__location_type__slug__in=location_type_slugs,
+        ).order_by('location__slug').values_list(
+        'news_item', 'location__location_type__slug', 'location__slug', 'location__name')
+    result = {}
+    for newsitem_id, loctype_slug, slug, name in rows:
+        result.setdefault(newsitem_id, {}).setdefault(loctype_slug, (slug, name))
+    return result
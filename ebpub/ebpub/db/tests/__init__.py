@@ -24,3 +24,11 @@ if not settings.TEST_RUNNER.count('Nose'):
     from .test_models import *
     from .test_schemafilters import *
     from .test_templatetags import *
+    from .test_lookupcache import *
+    from .test_schemasummary import *
+    from .test_datecharts import *
+    from .test_simplify import *
+    from .test_buckets import *
+    from .test_partitions import *
+    from .test_homepage import *
+    from .test_benchmark import *
@@ -0,0 +1,83 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for ebpub.benchmark.
+"""
+
+from ebpub.utils.django_testcase_backports import TestCase
+from ebpub.benchmark import metro, scenarios
+
+
+class TestSyntheticMetro(TestCase):
+
+    def setUp(self):
+        self.metro = metro.SyntheticMetro(streets=3, locations=2, schemas=2,
+                                          lookups=3, items=40, days=10,
+                                          alerts=2)
+        self.metro.generate()
+
+    def test_generate(self):
+        info = self.metro.describe()
+        self.assertEqual(info['num_schemas'], 2)
+        # 3 avenues and 3 streets of 2 blocks each.
+        self.assertEqual(info['num_blocks'], 12)
+        # 4 neighborhoods and 1 zip code.
+        self.assertEqual(info['num_locations'], 5)
+        self.assertEqual(info['num_newsitems'], 40)
+        self.assertEqual(info['num_attributes'], 40)
+        self.assertEqual(info['num_alerts'], 2)
+
+    def test_generate_is_repeatable(self):
+        self.metro.generate()
+        self.assertEqual(self.metro.describe()['num_newsitems'], 40)
+
+    def test_addresses(self):
+        addresses = self.metro.addresses(5)
+        self.assertEqual(len(addresses), 5)
+        self.assertEqual(addresses, self.metro.addresses(5))
+        address, avenue, street = addresses[0]
+        self.assert_(address.endswith(avenue))
+        self.assert_(street.endswith(' St'))
+
+    def test_delete(self):
+        self.metro.delete()
+        info = self.metro.describe()
+        self.assertEqual(info['num_schemas'], 0)
+        self.assertEqual(info['num_blocks'], 0)
+        self.assertEqual(info['num_locations'], 0)
+        self.assertEqual(info['num_alerts'], 0)
+
+    def test_run_scenario(self):
+        result = scenarios.run_scenario(scenarios.api_items, self.metro, repeat=2)
+        self.assertEqual(len(result['times']), 2)
+        self.assert_(result['min'] <= result['median'] <= result['max'])
+        self.assert_(result['queries'] > 0)
+
+    def test_bucket_report(self):
+        report = scenarios.bucket_report(self.metro, repeat=1)
+        self.assertEqual(sorted(report.keys()), ['1', '3', '8'])
+        self.assert_(report['1']['rows'] <= report['8']['rows'])
+
+    def test_format_results__compare(self):
+        results = {'commit': 'abc', 'metro': {'num_newsitems': 40},
+                   'scenarios': {'homepage': {'median': 1.0, 'min': 0.5, 'queries': 10}}}
+        baseline = {'commit': 'def', 'metro': {'num_newsitems': 40},
+                    'scenarios': {'homepage': {'median': 2.0, 'min': 1.5, 'queries': 20}}}
+        text = scenarios.format_results(results, baseline)
+        self.assert_('was 2.000 (x0.50), 20 queries' in text)
@@ -0,0 +1,115 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for db.buckets.
+"""
+
+from django.contrib.gis.geos import Point, Polygon
+from ebpub.db import buckets
+from ebpub.db import models
+from ebpub.utils.django_testcase_backports import TestCase
+import datetime
+import mock
+
+
+class TestBucketUtils(TestCase):
+
+    def test_bucket_for_geometry__point(self):
+        bucket = buckets.bucket_for_geometry(Point(-71.0601, 42.3584, srid=4326))
+        self.assertNotEqual(bucket, None)
+        self.assert_(bucket >= 0)
+        self.assertEqual(bucket, buckets.bucket_for_geometry(Point(-71.0602, 42.3585)))
+        self.assertNotEqual(bucket, buckets.bucket_for_geometry(Point(-71.0701, 42.3585)))
+        self.assertNotEqual(bucket, buckets.bucket_for_geometry(Point(-71.0601, 42.3684)))
+
+    def test_bucket_for_geometry__none(self):
+        self.assertEqual(buckets.bucket_for_geometry(None), None)
+
+    @mock.patch('ebpub.db.buckets.BUCKET_SIZE', 0.01)
+    def test_bucket_for_geometry__polygon(self):
+        small = Polygon.from_bbox((1.001, 1.001, 1.009, 1.009))
+        self.assertEqual(buckets.bucket_for_geometry(small),
+                         buckets.bucket_for_geometry(Point(1.005, 1.005)))
+        # Spans cells.
+        big = Polygon.from_bbox((1.001, 1.001, 1.011, 1.009))
+        self.assertEqual(buckets.bucket_for_geometry(big), None)
+
+    @mock.patch('ebpub.db.buckets.BUCKET_SIZE', 0.01)
+    def test_candidate_buckets(self):
+        area = Polygon.from_bbox((1.005, 1.005, 1.015, 1.025))
+        candidates = buckets.candidate_buckets(area)
+        self.assertEqual(len(candidates), 6)
+        for point in (Point(1.005, 1.005), Point(1.019, 1.029), Point(1.011, 1.021)):
+            self.assert_(buckets.bucket_for_geometry(point) in candidates)
+        for point in (Point(1.021, 1.005), Point(0.999, 1.005), Point(1.005, 1.031)):
+            self.failIf(buckets.bucket_for_geometry(point) in candidates)
+
+    @mock.patch('ebpub.db.buckets.MAX_CANDIDATE_BUCKETS', 5)
+    @mock.patch('ebpub.db.buckets.BUCKET_SIZE', 0.01)
+    def test_candidate_buckets__too_many(self):
+        area = Polygon.from_bbox((1.005, 1.005, 1.015, 1.025))
+        self.assertEqual(buckets.candidate_buckets(area), None)
+        qs = models.NewsItem.objects.all()
+        self.assertEqual(buckets.filter_by_buckets(qs, area), qs)
+
+    def test_filter_by_buckets__other_models(self):
+        qs = models.Location.objects.all()
+        self.assertEqual(buckets.filter_by_buckets(qs, Point(1, 1)), qs)
+
+
+class TestBuckets(TestCase):
+
+    fixtures = ('test-schemafilter-views.json',)
+
+    def _make_item(self, location):
+        return models.NewsItem.objects.create(
+            schema=models.Schema.objects.get(slug='crime'), title='Bucket test',
+            location=location, location_name='somewhere',
+            item_date=datetime.date(2011, 1, 1))
+
+    def test_save_sets_bucket(self):
+        item = self._make_item(Point(-87.6, 41.8, srid=4326))
+        item = models.NewsItem.objects.get(id=item.id)
+        self.assertEqual(item.location_bucket,
+                         buckets.bucket_for_geometry(Point(-87.6, 41.8)))
+        item.location = None
+        item.save()
+        self.assertEqual(models.NewsItem.objects.get(id=item.id).location_bucket, None)
+
+    def test_update_buckets__matches_python(self):
+        points = [Point(-87.6, 41.8), Point(-87.601, 41.799), Point(10.0, -10.0),
+                  Point(-180, -90), Point(179.9999, 89.9999)]
+        items = [self._make_item(Point(p.x, p.y, srid=4326)) for p in points]
+        wide = self._make_item(Polygon.from_bbox((-87.7, 41.7, -87.5, 41.9)))
+        models.NewsItem.objects.update(location_bucket=None)
+        buckets.update_buckets(batch_size=2)
+        for item, point in zip(items, points):
+            self.assertEqual(models.NewsItem.objects.get(id=item.id).location_bucket,
+                             buckets.bucket_for_geometry(point))
+        self.assertEqual(models.NewsItem.objects.get(id=wide.id).location_bucket, None)
+
+    def test_filter_by_geometry(self):
+        near = self._make_item(Point(-87.6, 41.8, srid=4326))
+        far = self._make_item(Point(-87.5, 41.8, srid=4326))
+        wide = self._make_item(Polygon.from_bbox((-87.7, 41.7, -87.5, 41.9)))
+        area = Point(-87.6001, 41.8001, srid=4326).buffer(0.001).envelope
+        qs = models.NewsItem.objects.filter(title='Bucket test')
+        found = set(buckets.filter_by_geometry(qs, area).values_list('id', flat=True))
+        self.assertEqual(found, set([near.id, wide.id]))
+        self.assertEqual(found, set(qs.filter(location__bboverlaps=area).values_list('id', flat=True)))
@@ -0,0 +1,114 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for db.datecharts.
+"""
+
+from ebpub.db import datecharts
+from ebpub.db import models
+from ebpub.utils.django_testcase_backports import TestCase
+import datetime
+import pickle
+
+
+class TestDateChart(TestCase):
+
+    start = datetime.date(2006, 9, 1)
+    end = datetime.date(2006, 9, 5)
+
+    def test_empty(self):
+        chart = datecharts.DateChart('schema', self.start, self.end)
+        self.assertEqual(len(chart.counts), 5)
+        self.assertEqual(chart.max_count, 0)
+        self.assertEqual(chart.total_count, 0)
+        self.assertEqual(chart.latest_date, None)
+        self.assertEqual(chart.dates[0], {'date': self.start, 'count': 0})
+        self.assertEqual(chart.dates[-1], {'date': self.end, 'count': 0})
+
+    def test_add(self):
+        chart = datecharts.DateChart('schema', self.start, self.end)
+        chart.add_counts({datetime.date(2006, 9, 2): 3,
+                          datetime.date(2006, 9, 3): 1,
+                          # Out of range; ignored.
+                          datetime.date(2006, 9, 6): 7})
+        chart.add(datetime.date(2006, 9, 2), 1)
+        self.assertEqual(list(chart.counts), [0, 4, 1, 0, 0])
+        self.assertEqual(chart.max_count, 4)
+        self.assertEqual(chart.total_count, 5)
+        self.assertEqual(chart.latest_date, datetime.date(2006, 9, 3))
+        self.assertEqual(chart.nonzero_dates(), [datetime.date(2006, 9, 2),
+                                                 datetime.date(2006, 9, 3)])
+        self.assertEqual(chart.dates[1], {'date': datetime.date(2006, 9, 2), 'count': 4})
+
+    def test_counts_argument(self):
+        chart = datecharts.DateChart('schema', self.start, self.end, [1, 2])
+        self.assertEqual(list(chart.counts), [1, 2, 0, 0, 0])
+        chart = datecharts.DateChart('schema', self.start, self.end, range(10))
+        self.assertEqual(list(chart.counts), [0, 1, 2, 3, 4])
+
+    def test_dict_access(self):
+        chart = datecharts.DateChart('schema', self.start, self.end, [0, 2])
+        self.assertEqual(chart['schema'], 'schema')
+        self.assertEqual(chart['total_count'], 2)
+        self.assertEqual(chart.get('latest_date'), datetime.date(2006, 9, 2))
+        self.assertEqual(chart.get('counts', 'nope'), 'nope')
+        self.assertRaises(KeyError, chart.__getitem__, 'start_date')
+
+    def test_pickle(self):
+        chart = datecharts.DateChart('schema', self.start, self.end, [0, 2])
+        chart.dates
+        chart = pickle.loads(pickle.dumps(chart))
+        self.assertEqual(chart._dates, None)
+        self.assertEqual(chart.total_count, 2)
+        self.assertEqual(len(chart.dates), 5)
+
+    def test_make_date_charts(self):
+        class FakeSchema(object):
+            def __init__(self, id):
+                self.id = id
+        schemas = [FakeSchema(2), FakeSchema(1)]
+        rows = [(1, self.start, 1), (2, self.end, 2), (1, self.start, 3),
+                (3, self.start, 1)]
+        charts = datecharts.make_date_charts(schemas, self.start, self.end, rows)
+        self.assertEqual([c.schema.id for c in charts], [2, 1])
+        self.assertEqual(list(charts[0].counts), [0, 0, 0, 0, 2])
+        self.assertEqual(list(charts[1].counts), [4, 0, 0, 0, 0])
+
+
+class TestAggregateDateCharts(TestCase):
+
+    fixtures = ('test-locationdetail-views.json',)
+
+    def test_aggregate_date_charts(self):
+        schemas = list(models.Schema.objects.all())
+        crime = models.Schema.objects.get(slug='crime')
+        for day, total in ((1, 1), (3, 2), (30, 5)):
+            models.AggregateDay.objects.create(
+                schema=crime, date_part=datetime.date(2006, 9, day), total=total)
+        with self.assertNumQueries(1):
+            charts = datecharts.aggregate_date_charts(
+                schemas, datetime.date(2006, 9, 1), datetime.date(2006, 9, 7),
+                models.AggregateDay)
+        self.assertEqual(len(charts), len(schemas))
+        by_slug = dict((c.schema.slug, c) for c in charts)
+        self.assertEqual(list(by_slug['crime'].counts), [1, 0, 2, 0, 0, 0, 0])
+        self.assertEqual(by_slug['crime'].latest_date, datetime.date(2006, 9, 3))
+        for chart in charts:
+            if chart.schema.slug != 'crime':
+                self.assertEqual(chart.total_count, 0)
@@ -0,0 +1,101 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for db.homepage.
+"""
+
+from django.core.cache.backends.locmem import LocMemCache
+from ebpub.db import homepage
+from ebpub.db.models import Schema
+from ebpub.utils.django_testcase_backports import TestCase
+import mock
+import time
+
+
+class TestHomepageDocument(TestCase):
+
+    def setUp(self):
+        self.cache = LocMemCache('homepage', {})
+        self.patcher = mock.patch('ebpub.db.homepage.cache', self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def _document(self, **kwargs):
+        document = {'version': homepage.DOCUMENT_VERSION, 'date': homepage.today(),
+                    'expires': time.time() + 60, 'context': {'street_count': 1}}
+        document.update(kwargs)
+        return document
+
+    @mock.patch('ebpub.db.homepage.build_document')
+    def test_built_once(self, mock_build):
+        mock_build.return_value = self._document()
+        self.assertEqual(homepage.get_homepage_context(), {'street_count': 1})
+        self.assertEqual(homepage.get_homepage_context(), {'street_count': 1})
+        self.assertEqual(mock_build.call_count, 1)
+
+    @mock.patch('ebpub.db.homepage._schedule_refresh')
+    @mock.patch('ebpub.db.homepage.build_document')
+    def test_stale_while_revalidate(self, mock_build, mock_schedule):
+        self.cache.set(homepage.CACHE_KEY, self._document(expires=0))
+        # We get the stale one, and a refresh is scheduled.
+        self.assertEqual(homepage.get_homepage_context(), {'street_count': 1})
+        self.assertEqual(mock_build.call_count, 0)
+        self.assertEqual(mock_schedule.call_count, 1)
+
+    @mock.patch('ebpub.db.homepage.build_document')
+    def test_mark_stale(self, mock_build):
+        self.cache.set(homepage.CACHE_KEY, self._document())
+        homepage.mark_stale()
+        self.assert_(homepage._is_stale(self.cache.get(homepage.CACHE_KEY)))
+
+    @mock.patch('ebpub.db.homepage.build_document')
+    def test_schedule_refresh__only_once(self, mock_build):
+        mock_build.return_value = self._document()
+        with mock.patch.object(homepage.settings, 'INSTALLED_APPS', ()):
+            self.cache.add(homepage.LOCK_CACHE_KEY, True)
+            homepage._schedule_refresh()
+            self.assertEqual(mock_build.call_count, 0)
+            self.cache.delete(homepage.LOCK_CACHE_KEY)
+            homepage._schedule_refresh()
+            self.assertEqual(mock_build.call_count, 1)
+
+
+class TestHomepageContext(TestCase):
+
+    @mock.patch('ebpub.db.views.get_schema_manager')
+    @mock.patch('ebpub.db.views.get_homepage_context')
+    def test_filtered_by_user(self, mock_shared, mock_get_manager):
+        from ebpub.db.views import _homepage_context
+        allowed, restricted = Schema(id=1, name='a'), Schema(id=2, name='b')
+        mock_shared.return_value = {
+            'all_schemas': [allowed, restricted],
+            'location_type_list': [], 'street_count': 0,
+            'more_schemas': [restricted],
+            'non_empty_date_charts': [{'schema': allowed}, {'schema': restricted}],
+            'empty_date_charts': [],
+            'breadcrumbs': [], 'map_configuration': '{}',
+            }
+        mock_get_manager.return_value.allowed_schema_ids.return_value = [1]
+        context = _homepage_context(mock.Mock())
+        self.assertEqual(context['non_empty_date_charts'], [{'schema': allowed}])
+        self.assertEqual(context['more_schemas'], [])
+        self.assertEqual(context['restricted_schemas'], [restricted])
+        self.assertEqual(context['allowed_schema_ids'], [1])
@@ -0,0 +1,99 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for db.lookupcache.
+"""
+
+from ebpub.utils.django_testcase_backports import TestCase
+from ebpub.db.lookupcache import LookupCache
+from ebpub.db.models import Lookup, SchemaField
+
+
+class TestLookupCache(TestCase):
+
+    fixtures = ('crimes.json',)
+
+    def setUp(self):
+        self.sf = SchemaField.objects.get(name='beat')
+        self.cache = LookupCache(self.sf)
+
+    def test_warm_with_one_query(self):
+        self.assertNumQueries(1, self.cache.get, '214')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get('214').slug, u'beat-214')
+            self.assertEqual(self.cache.get_by_name(u'Police Beat 64').code, u'64')
+            self.assertEqual(self.cache.get('nonexistent'), None)
+
+    def test_get_existing__no_queries(self):
+        self.cache.get('214')
+        with self.assertNumQueries(0):
+            lookups = self.cache.get_or_create_many(
+                [('Police Beat 214', '214'), ('Police Beat 64', '64'),
+                 ('Police Beat 214', '214')])
+        self.assertEqual([l.id for l in lookups], [214, 64, 214])
+        self.assertEqual(self.cache.hits, 3)
+        self.assertEqual(self.cache.created, 0)
+
+    def test_code_defaults_to_name(self):
+        lookup = self.cache.get_or_create(u'Beat 1')
+        self.assertEqual(lookup.code, u'Beat 1')
+        self.assertEqual(lookup.slug, u'beat-1')
+
+    def test_create_many(self):
+        lookups = self.cache.get_or_create_many(
+            [('Beat 1', '1'), ('Beat 2', '2', 'The second beat'),
+             ('Beat 1', '1'), ('Police Beat 64', '64')])
+        self.assertEqual(self.cache.created, 2)
+        self.assertEqual(lookups[0].id, lookups[2].id)
+        self.assertEqual(lookups[3].id, 64)
+        saved = Lookup.objects.get(schema_field=self.sf, code='2')
+        self.assertEqual(saved.id, lookups[1].id)
+        self.assertEqual(saved.name, u'Beat 2')
+        self.assertEqual(saved.slug, u'beat-2')
+        self.assertEqual(saved.description, u'The second beat')
+        # Now they're cached.
+        self.assertNumQueries(0, self.cache.get_or_create, 'Beat 2', '2')
+
+    def test_create__id_slug(self):
+        lookup = self.cache.get_or_create('Beat 1', '1', make_text_slug=False)
+        saved = Lookup.objects.get(id=lookup.id)
+        self.assertEqual(saved.slug, str(lookup.id))
+
+    def test_create__dupe_name(self):
+        lookup = self.cache.get_or_create('Police Beat 64', 'new code')
+        self.assertEqual(lookup.name, u'Police Beat 64 b')
+        lookup = self.cache.get_or_create('Police Beat 64', 'another code')
+        self.assertEqual(lookup.name, u'Police Beat 64 b b')
+
+    def test_create__long_name(self):
+        name = u'x' * 300
+        lookup = self.cache.get_or_create(name, 'long')
+        self.assertEqual(len(lookup.name), 253)
+        self.assertEqual(lookup.description, name)
+        self.assertEqual(len(lookup.slug), 32)
+
+    def test_create__race(self):
+        self.cache.get('214')
+        # Somebody else creates the same Lookup after we warmed up.
+        other = Lookup.objects.create(schema_field=self.sf, name='Beat 1',
+                                      code='1', slug='beat-1')
+        lookups = self.cache.get_or_create_many([('Beat 1', '1'), ('Beat 2', '2')])
+        self.assertEqual(lookups[0].id, other.id)
+        self.assertEqual(lookups[1].code, u'2')
+        self.assertEqual(Lookup.objects.filter(schema_field=self.sf, code__in=['1', '2']).count(), 2)
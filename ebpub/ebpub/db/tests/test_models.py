@@ -22,6 +22,7 @@ Unit tests for db.models.
 
 from ebpub.utils.django_testcase_backports import TestCase
 from ebpub.db.models import NewsItem, Attribute
+from ebpub.db.schemaregistry import schema_registry
 import datetime
 import mock
 
@@ -36,13 +37,16 @@ class DatabaseExtensionsTestCase(TestCase):
         # Turn DEBUG on and reset queries, so we can keep track of queries.
         # This is hackish.
         from django.db import connection
+        # SchemaField metadata comes from the schema registry,
+        # so make sure it's loaded before we start counting.
+        schema_registry.field_mapping([1])
         connection.queries = []
         with self.settings(DEBUG=True):
             ni = NewsItem.objects.get(id=1)
             self.assertEquals(ni.attributes['case_number'], u'case number 1')
             self.assertEquals(ni.attributes['crime_date'], datetime.date(2006, 9, 19))
             self.assertEquals(ni.attributes['crime_time'], None)
-            self.assertEquals(len(connection.queries), 3)
+            self.assertEquals(len(connection.queries), 2)
             connection.queries = []
 
     def testSetAllAttributesNonDict(self):
@@ -137,11 +141,12 @@ class DatabaseExtensionsTestCase(TestCase):
 
         # Turn DEBUG on and reset queries, so we can keep track of queries.
         from django.db import connection
+        schema_registry.field_mapping([1])
         connection.queries = []
         with self.settings(DEBUG=True):
             ni = NewsItem.objects.get(id=1)
             ni.attributes['case_number'] = u'Hello'
-            self.assertEquals(len(connection.queries), 3)
+            self.assertEquals(len(connection.queries), 2)
 
         connection.queries = []
 
@@ -276,3 +281,192 @@ class DatabaseExtensionsTestCase(TestCase):
         self.assertEqual(qs.count(), 1)
         qs = by_attribute(sf, ['999'], is_lookup=True)
         self.assertEqual(qs.count(), 0)
+
+
+class WithAttributesTestCase(TestCase):
+
+    fixtures = ('crimes.json',)
+
+    def setUp(self):
+        # Make sure schema metadata isn't counted in the queries below.
+        schema_registry.invalidate()
+        schema_registry.field_mapping([1])
+
+    def _check_attributes(self, items):
+        for ni in items:
+            self.assertEqual(ni.attributes['case_number'], u'case number %d' % ni.id)
+
+    def test_with_attributes__num_queries(self):
+        qs = NewsItem.objects.filter(id__in=[1, 2, 3]).order_by('id')
+        # One for the NewsItems, one for the Attributes, one for the Lookups.
+        with self.assertNumQueries(3):
+            items = list(qs.with_attributes())
+        self.assertEqual(len(items), 3)
+        self.assertNumQueries(0, self._check_attributes, items)
+
+    def test_with_attributes__no_lookups(self):
+        qs = NewsItem.objects.order_by('id').with_attributes(lookups=False)
+        with self.assertNumQueries(2):
+            items = list(qs)
+        self.assertEqual(items[0].attributes['beat'], 214)
+        self.assertEqual(items[0].attributes['tag'], u'71,72,73')
+
+    def test_with_attributes__lookups(self):
+        items = list(NewsItem.objects.order_by('id').with_attributes())
+        with self.assertNumQueries(0):
+            beat = items[0].attributes['beat']
+            tags = items[0].attributes['tag']
+        self.assertEqual(beat.slug, u'beat-214')
+        self.assertEqual([tag.id for tag in tags], [71, 72, 73])
+
+    def test_with_attributes__survives_clone(self):
+        qs = NewsItem.objects.with_attributes().filter(id__in=[1, 2])
+        qs = qs.order_by('-id')[:1]
+        with self.assertNumQueries(3):
+            items = list(qs)
+        self.assertEqual(items[0].id, 2)
+        self.assertNumQueries(0, self._check_attributes, items)
+
+    def test_with_attributes__iterator_chunks(self):
+        qs = NewsItem.objects.order_by('id').with_attributes(lookups=False)
+        qs.ATTRIBUTES_CHUNK_SIZE = 2
+        ids = []
+        for ni in qs.iterator():
+            # Each item's attributes are loaded before we see it.
+            self.assertNumQueries(0, self._check_attributes, [ni])
+            ids.append(ni.id)
+        self.assertEqual(ids, [1, 2, 3])
+
+    def test_with_attributes__no_attribute_row(self):
+        Attribute.objects.filter(news_item__id=3).delete()
+        items = list(NewsItem.objects.filter(id=3).with_attributes())
+        with self.assertNumQueries(0):
+            self.assertEqual(items[0].attributes, {})
+
+    def test_without_attributes(self):
+        items = list(NewsItem.objects.order_by('id'))
+        self.assertNumQueries(1, self._check_attributes, items[:1])
+
+
+class SchemaRegistryTestCase(TestCase):
+
+    fixtures = ('crimes.json',)
+
+    def setUp(self):
+        schema_registry.invalidate()
+
+    def test_field_mapping__no_queries_when_loaded(self):
+        from ebpub.db.models import field_mapping
+        mapping = field_mapping([1])
+        self.assertEqual(mapping[1]['case_number'], 'varchar01')
+        self.assertEqual(mapping[1]['tag'], 'varchar04')
+        self.assertNumQueries(0, field_mapping, [1])
+        self.assertNumQueries(0, schema_registry.get_schemafield, 1, 'beat')
+
+    def test_field_mapping__unknown_schema(self):
+        self.assertEqual(schema_registry.field_mapping([1, 999]).keys(), [1])
+
+    def test_field_mapping__copies(self):
+        mapping = schema_registry.field_mapping([1])
+        mapping[1]['case_number'] = 'oops'
+        self.assertEqual(schema_registry.field_mapping([1])[1]['case_number'],
+                         'varchar01')
+
+    def test_get_schemafields__ordered(self):
+        sfs = schema_registry.get_schemafields(1)
+        self.assertEqual(len(sfs), 13)
+        orders = [sf.display_order for sf in sfs]
+        self.assertEqual(orders, sorted(orders))
+        # The schema is pre-populated, no query needed.
+        self.assertNumQueries(0, lambda: sfs[0].schema.slug)
+
+    def test_lookup_fields(self):
+        lookups = dict((name, (real_name, m2m)) for name, real_name, m2m
+                       in schema_registry.lookup_fields(1))
+        self.assertEqual(lookups['beat'], ('int02', False))
+        self.assertEqual(lookups['tag'], ('varchar04', True))
+        self.assert_('case_number' not in lookups)
+
+    def test_invalidated_on_schemafield_save(self):
+        from ebpub.db.models import SchemaField
+        self.assertEqual(schema_registry.get_schemafield(1, 'status').real_name, 'varchar02')
+        sf = SchemaField.objects.get(schema__id=1, name='status')
+        sf.name = 'state'
+        sf.save()
+        self.assertEqual(schema_registry.get_schemafield(1, 'status'), None)
+        self.assertEqual(schema_registry.get_schemafield(1, 'state').real_name, 'varchar02')
+
+    def test_invalidated_on_schemafield_delete(self):
+        from ebpub.db.models import SchemaField
+        self.assert_('status' in schema_registry.field_mapping([1])[1])
+        SchemaField.objects.get(schema__id=1, name='status').delete()
+        self.assert_('status' not in schema_registry.field_mapping([1])[1])
+
+    def test_allowed_schema_ids__memoized(self):
+        from ebpub.db.models import Schema
+        self.assertEqual(Schema.objects.allowed_schema_ids(), [1])
+        self.assertNumQueries(0, Schema.objects.allowed_schema_ids)
+
+    @mock.patch('ebpub.db.schemaregistry.cache')
+    def test_reload_when_other_process_invalidates(self, mock_cache):
+        from ebpub.db.schemaregistry import SchemaRegistry
+        mock_cache.get.return_value = 'version 1'
+        registry = SchemaRegistry(check_interval=0)
+        registry.field_mapping([1])
+        registry.field_mapping([1])
+        self.assertEqual(registry.stats()['loads'], 1)
+        # Another process bumped the stamp.
+        mock_cache.get.return_value = 'version 2'
+        registry.field_mapping([1])
+        self.assertEqual(registry.stats()['loads'], 2)
+
+    @mock.patch('ebpub.db.schemaregistry.cache')
+    def test_no_check_within_interval(self, mock_cache):
+        from ebpub.db.schemaregistry import SchemaRegistry
+        mock_cache.get.return_value = 'version 1'
+        registry = SchemaRegistry(check_interval=3600)
+        registry.field_mapping([1])
+        mock_cache.get.return_value = 'version 2'
+        registry.field_mapping([1])
+        self.assertEqual(registry.stats()['loads'], 1)
+
+    @mock.patch('ebpub.db.schemaregistry.cache')
+    def test_invalidate_bumps_version(self, mock_cache):
+        from ebpub.db.schemaregistry import SchemaRegistry, VERSION_CACHE_KEY
+        registry = SchemaRegistry()
+        registry.invalidate()
+        self.assertEqual(mock_cache.set.call_count, 1)
+        self.assertEqual(mock_cache.set.call_args[0][0], VERSION_CACHE_KEY)
+
+
+class LeanLoadingTestCase(TestCase):
+
+    fixtures = ('test-locationdetail-views.json',)
+
+    def test_location_lean(self):
+        from ebpub.db.models import Location
+        loc = Location.objects.lean().select_related('location_type').get(slug='hood-1')
+        with self.assertNumQueries(0):
+            self.assertEqual(loc.name, 'Hood 1')
+            loc.url()
+        with self.assertNumQueries(1):
+            self.assert_(loc.location is not None)
+
+    def test_lean_only(self):
+        from ebpub.db.models import Location
+        loc = Location.objects.lean('id', 'name').get(slug='hood-1')
+        with self.assertNumQueries(0):
+            self.assertEqual(loc.name, 'Hood 1')
+        with self.assertNumQueries(1):
+            loc.slug
+
+    def test_newsitem_and_block_lean(self):
+        from ebpub.streets.models import Block
+        item = NewsItem.objects.filter(title='crime title 1').lean()[0]
+        with self.assertNumQueries(1):
+            item.location
+        block = Block.objects.lean()[0]
+        with self.assertNumQueries(0):
+            block.street_url()
+        with self.assertNumQueries(1):
+            block.geom
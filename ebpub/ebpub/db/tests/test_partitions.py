@@ -0,0 +1,204 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for db.partitions.
+"""
+
+from django.core.cache import cache
+from django.db import connection
+from ebpub.db import partitions
+from ebpub.db.models import AggregateAll, AggregateDay, Attribute, NewsItem
+from ebpub.db.models import Location, LocationType, NewsItemLocation, NewsItemPartition
+from ebpub.moderation.models import NewsItemFlag
+from ebpub.utils.django_testcase_backports import TestCase
+import datetime
+import mock
+
+
+class TestPeriods(TestCase):
+
+    def test_year(self):
+        self.assertEqual(partitions.period_for_date(datetime.date(2009, 6, 15), 'year'),
+                         ('y2009', datetime.date(2009, 1, 1), datetime.date(2010, 1, 1)))
+
+    def test_month(self):
+        self.assertEqual(partitions.period_for_date(datetime.date(2009, 6, 15), 'month'),
+                         ('m200906', datetime.date(2009, 6, 1), datetime.date(2009, 7, 1)))
+
+    def test_month__december(self):
+        self.assertEqual(partitions.period_for_date(datetime.date(2009, 12, 31), 'month'),
+                         ('m200912', datetime.date(2009, 12, 1), datetime.date(2010, 1, 1)))
+
+    def test_unknown_period(self):
+        self.assertRaises(ValueError, partitions.period_for_date,
+                          datetime.date(2009, 6, 15), 'week')
+
+
+class TestPartitions(TestCase):
+
+    fixtures = ('crimes.json',)
+
+    def setUp(self):
+        partitions.partitions_changed(None)
+
+    def tearDown(self):
+        partitions.partitions_changed(None)
+
+    def _count_only(self, table):
+        cursor = connection.cursor()
+        cursor.execute("SELECT count(*) FROM ONLY %s" % table)
+        return cursor.fetchone()[0]
+
+    def _partition_and_archive(self):
+        partitions.partition_before(datetime.date(2007, 1, 1), 'year')
+        partitions.archive_before(datetime.date(2007, 1, 1))
+        return NewsItemPartition.objects.get(name='y2006')
+
+    def test_partition_before(self):
+        item_count = NewsItem.objects.count()
+        attribute_count = Attribute.objects.count()
+        moved = partitions.partition_before(datetime.date(2007, 1, 1), 'year')
+        self.assertEqual(moved, item_count)
+        self.assertEqual(list(NewsItemPartition.objects.values_list('name', 'state')),
+                         [(u'y2006', NewsItemPartition.ACTIVE)])
+        self.assertEqual(self._count_only('db_newsitem'), 0)
+        self.assertEqual(self._count_only('db_newsitem_y2006'), item_count)
+        self.assertEqual(self._count_only('db_attribute_y2006'), attribute_count)
+        # The ORM still sees everything.
+        self.assertEqual(NewsItem.objects.count(), item_count)
+        self.assertEqual(Attribute.objects.count(), attribute_count)
+        self.assertEqual(NewsItem.objects.exclude_archived().count(), item_count)
+
+    def test_partition_before__nothing_old_enough(self):
+        self.assertEqual(partitions.partition_before(datetime.date(2006, 12, 31), 'year'), 0)
+        self.assertEqual(NewsItemPartition.objects.count(), 0)
+
+    def test_archive(self):
+        item_count = NewsItem.objects.count()
+        self._partition_and_archive()
+        self.assertEqual(partitions.archive_cutoff(), datetime.date(2007, 1, 1))
+        self.assertEqual(NewsItem.objects.exclude_archived().count(), 0)
+        self.assertEqual(NewsItem.objects.count(), item_count)
+
+    def test_activate(self):
+        item_count = NewsItem.objects.count()
+        partition = self._partition_and_archive()
+        partitions.activate(partition)
+        self.assertEqual(partitions.archive_cutoff(), None)
+        self.assertEqual(NewsItem.objects.exclude_archived().count(), item_count)
+
+    def test_detach_and_attach(self):
+        item_count = NewsItem.objects.count()
+        partition = self._partition_and_archive()
+        partitions.detach(partition)
+        self.assertEqual(NewsItem.objects.count(), 0)
+        self.assertEqual(Attribute.objects.count(), 0)
+        self.assertEqual(partitions.newsitem_tables(),
+                         [('db_newsitem', 'db_newsitemlocation', False)])
+        partitions.attach(partition)
+        self.assertEqual(NewsItem.objects.count(), item_count)
+        self.assertEqual(NewsItemPartition.objects.get(name='y2006').state,
+                         NewsItemPartition.ARCHIVED)
+
+    def test_update_aggregates__keeps_archived(self):
+        from ebpub.db.bin.update_aggregates import update_aggregates
+        update_aggregates('crime')
+        day_totals = list(AggregateDay.objects.filter(schema__slug='crime').order_by(
+                'date_part').values_list('date_part', 'total'))
+        self.assertEqual(AggregateAll.objects.get(schema__slug='crime').total,
+                         NewsItem.objects.count())
+        partitions.detach(self._partition_and_archive())
+        update_aggregates('crime')
+        # The archived days weren't recounted.
+        self.assertEqual(list(AggregateDay.objects.filter(schema__slug='crime').order_by(
+                    'date_part').values_list('date_part', 'total')), day_totals)
+        self.assertEqual(AggregateAll.objects.get(schema__slug='crime').total,
+                         sum([total for date, total in day_totals]))
+
+    @mock.patch('ebpub.db.partitions.BATCH_SIZE', 1)
+    def test_move_in_batches__keeps_locations(self):
+        loctype = LocationType.objects.create(name='Ward', plural_name='Wards',
+                                              scope='Test', slug='wards')
+        location = Location.objects.create(name='Ward 1', normalized_name='WARD 1',
+                                           slug='ward-1', location_type=loctype,
+                                           display_order=0, city='Test', source='test')
+        item_count = NewsItem.objects.count()
+        for item in NewsItem.objects.all():
+            NewsItemLocation.objects.create(news_item=item, location=location)
+        self.assertEqual(partitions.partition_before(datetime.date(2007, 1, 1), 'year'),
+                         item_count)
+        self.assertEqual(self._count_only('db_newsitem_y2006'), item_count)
+        self.assertEqual(self._count_only('db_newsitemlocation'), 0)
+        self.assertEqual(self._count_only('db_newsitemlocation_y2006'), item_count)
+        self.assertEqual(NewsItemLocation.objects.count(), item_count)
+
+    def test_flag_partitioned_item(self):
+        item_count = NewsItem.objects.count()
+        attribute_count = Attribute.objects.count()
+        self._partition_and_archive()
+        item = NewsItem.objects.order_by('id')[0]
+        # Would fail the foreign key check if the item stayed in the partition.
+        NewsItemFlag.objects.create(news_item=item, reason='spam')
+        self.assertEqual(NewsItemFlag.objects.filter(news_item=item).count(), 1)
+        self.assertEqual(self._count_only('db_newsitem'), 1)
+        self.assertEqual(self._count_only('db_attribute'), 1)
+        self.assertEqual(NewsItem.objects.count(), item_count)
+        self.assertEqual(Attribute.objects.count(), attribute_count)
+        self.assertEqual(NewsItem.objects.get(id=item.id).attributes.items(),
+                         item.attributes.items())
+        # And it stays there next time.
+        partitions.partition_before(datetime.date(2007, 1, 1), 'year')
+        self.assertEqual(self._count_only('db_newsitem'), 1)
+
+    def test_edit_partitioned_item(self):
+        partitions.partition_before(datetime.date(2007, 1, 1), 'year')
+        item = NewsItem.objects.order_by('id')[0]
+        # Outside the partition's CHECK constraint.
+        item.item_date = datetime.date(2011, 1, 1)
+        item.save()
+        self.assertEqual(self._count_only('db_newsitem'), 1)
+        self.assertEqual(NewsItem.objects.get(id=item.id).item_date, item.item_date)
+
+    def test_unpartition__stale_cache(self):
+        # Another process partitioned it; our cache doesn't know.
+        partitions.partition_before(datetime.date(2007, 1, 1), 'year')
+        item = NewsItem.objects.order_by('id')[0]
+        with mock.patch('ebpub.db.partitions.cache') as mock_cache:
+            mock_cache.get.return_value = ''
+            NewsItemFlag.objects.create(news_item=item, reason='spam')
+        self.assertEqual(self._count_only('db_newsitem'), 1)
+
+    @mock.patch('ebpub.db.partitions.unpartition')
+    def test_pre_save__only_newsitem_refs(self, mock_unpartition):
+        loctype = LocationType.objects.create(name='Ward', plural_name='Wards',
+                                              scope='Test', slug='wards')
+        self.assertEqual(mock_unpartition.call_count, 0)
+        item = NewsItem.objects.order_by('id')[0]
+        NewsItemFlag.objects.create(news_item=item, reason='spam')
+        mock_unpartition.assert_called_once_with(item.id)
+        # Not when loading fixtures.
+        partitions.newsitem_refs_pre_save(NewsItem, item, raw=True)
+        self.assertEqual(mock_unpartition.call_count, 1)
+
+    def test_unpartition__main_table(self):
+        item = NewsItem.objects.order_by('id')[0]
+        self.assertEqual(partitions.unpartition(item.id), False)
+        partitions.partition_before(datetime.date(2007, 1, 1), 'year')
+        self.assertEqual(partitions.unpartition(item.id), True)
+        self.assertEqual(partitions.unpartition(item.id), False)
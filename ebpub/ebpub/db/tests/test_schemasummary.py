@@ -0,0 +1,97 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for db.schemasummary.
+"""
+
+from ebpub.db import models
+from ebpub.db import schemasummary
+from ebpub.utils.django_testcase_backports import TestCase
+import datetime
+import mock
+
+
+@mock.patch('ebpub.db.schemasummary.today', mock.Mock(return_value=datetime.date(2006, 10, 1)))
+class TestSchemaSummary(TestCase):
+
+    fixtures = ('test-locationdetail-views.json',)
+
+    def setUp(self):
+        self.schema = models.Schema.objects.get(slug='crime')
+        for day, total in ((23, 1), (26, 2)):
+            models.AggregateDay.objects.create(
+                schema=self.schema, date_part=datetime.date(2006, 9, day), total=total)
+        # In the future; ignored.
+        models.AggregateDay.objects.create(
+            schema=self.schema, date_part=datetime.date(2006, 11, 8), total=2)
+        lt = models.LocationType.objects.get(slug='neighborhoods')
+        for slug, total in (('hood-1', 2), ('hood-2', 0)):
+            models.AggregateLocation.objects.create(
+                schema=self.schema, location_type=lt, total=total,
+                location=models.Location.objects.get(slug=slug))
+
+    def test_build_summary(self):
+        summary = schemasummary.build_summary(self.schema)
+        self.assertEqual(summary['end_date'], '2006-09-26')
+        self.assertEqual(summary['total_count'], 3)
+        self.assertEqual(summary['counts'][-4:], [1, 0, 0, 2])
+        self.assertEqual(len(summary['locations']), 1)
+        self.assertEqual(summary['locations'][0]['unknown'], 1)
+        self.assertEqual([row[1] for row in summary['locations'][0]['locations']],
+                         ['Hood 1', 'Hood 2'])
+
+    def test_build_summary__empty(self):
+        models.AggregateDay.objects.all().delete()
+        summary = schemasummary.build_summary(self.schema)
+        self.assertEqual(summary['end_date'], None)
+        self.assertEqual(schemasummary.summary_context(self.schema, summary, []),
+                         ({}, (), [], []))
+
+    def test_update_and_get_summary(self):
+        schemasummary.update_summary(self.schema)
+        schemasummary.update_summary(self.schema)
+        self.assertEqual(models.AggregateSchemaSummary.objects.count(), 1)
+        # Even if the aggregates change, we use the saved summary.
+        models.AggregateDay.objects.all().delete()
+        summary = schemasummary.get_summary(self.schema)
+        self.assertEqual(summary['total_count'], 3)
+
+    def test_summary_context(self):
+        schemasummary.update_summary(self.schema)
+        summary = schemasummary.get_summary(self.schema)
+        location_types = models.LocationType.objects.filter(is_significant=True)
+        with self.assertNumQueries(0):
+            date_chart, latest_dates, lookup_list, location_chartfield_list = \
+                schemasummary.summary_context(self.schema, summary, location_types)
+        self.assertEqual(date_chart['total_count'], 3)
+        self.assertEqual(date_chart['max_count'], 2)
+        self.assertEqual(latest_dates, [datetime.date(2006, 9, 23),
+                                        datetime.date(2006, 9, 26)])
+        self.assertEqual(lookup_list, [])
+        locations = location_chartfield_list[0]['locations']
+        self.assertEqual(locations[0].location.name, 'Hood 1')
+        self.assertEqual(locations[0].location.location_type.slug, 'neighborhoods')
+        self.assertEqual(locations[0].total, 2)
+
+    def test_schema_detail(self):
+        schemasummary.update_summary(self.schema)
+        response = self.client.get('/crime/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Hood 1')
+        self.assertContains(response, 'hood-1')
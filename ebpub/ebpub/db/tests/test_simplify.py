@@ -0,0 +1,88 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for db.simplify.
+"""
+
+from ebpub.db import models
+from ebpub.db import simplify
+from ebpub.utils.django_testcase_backports import TestCase
+import mock
+
+
+class TestSimplifyUtils(TestCase):
+
+    @mock.patch('ebpub.db.simplify.TOLERANCES', (0.001, 0.01))
+    def test_level_for_tolerance(self):
+        self.assertEqual(simplify.level_for_tolerance(0), 0)
+        self.assertEqual(simplify.level_for_tolerance(0.0005), 0)
+        self.assertEqual(simplify.level_for_tolerance(0.001), 1)
+        self.assertEqual(simplify.level_for_tolerance(0.005), 1)
+        self.assertEqual(simplify.level_for_tolerance(1), 2)
+
+    def test_precision_for_tolerance(self):
+        self.assertEqual(simplify.precision_for_tolerance(0), simplify.MAX_PRECISION)
+        self.assertEqual(simplify.precision_for_tolerance(0.001), 4)
+        self.assertEqual(simplify.precision_for_tolerance(0.005), 4)
+        self.assertEqual(simplify.precision_for_tolerance(1e-9), simplify.MAX_PRECISION)
+        self.assertEqual(simplify.precision_for_tolerance(10), 0)
+
+    def test_parse_tolerance(self):
+        self.assertEqual(simplify.parse_tolerance({}), 0.0)
+        self.assertEqual(simplify.parse_tolerance({'tolerance': '0.01'}), 0.01)
+        self.assertEqual(simplify.parse_tolerance({'zoom': '0'}), 360.0 / 256)
+        # tolerance wins.
+        self.assertEqual(simplify.parse_tolerance({'tolerance': '0.5', 'zoom': '3'}), 0.5)
+        self.assertRaises(ValueError, simplify.parse_tolerance, {'zoom': 'x'})
+
+    def test_round_geojson(self):
+        geom = {'type': 'GeometryCollection', 'geometries': [
+                {'type': 'Point', 'coordinates': [1.23456, 2.34567]},
+                {'type': 'LineString', 'coordinates': [[1.23456, 2.34567], [3.0, 4.0]]},
+                ]}
+        self.assertEqual(simplify.round_geojson(geom, 2)['geometries'],
+                         [{'type': 'Point', 'coordinates': [1.23, 2.35]},
+                          {'type': 'LineString', 'coordinates': [[1.23, 2.35], [3.0, 4.0]]},
+                          ])
+
+
+class TestSimplifiedLocation(TestCase):
+
+    fixtures = ('test-locationdetail-views.json',)
+
+    @mock.patch('ebpub.db.simplify.TOLERANCES', (0.001, 0.01, 1))
+    def test_update_simplified(self):
+        location = models.Location.objects.get(slug='hood-1')
+        simplify.update_simplified(location)
+        levels = list(location.simplified_set.order_by('level'))
+        self.assertEqual([s.level for s in levels], [1, 2, 3])
+        self.assertEqual([s.tolerance for s in levels], [0.001, 0.01, 1])
+        for s in levels:
+            self.failIf(s.geometry.empty)
+            self.assert_(s.geometry.num_coords <= location.location.num_coords)
+
+        # Updating replaces them.
+        simplify.update_simplified(location)
+        self.assertEqual(location.simplified_set.count(), 3)
+
+    def test_saving_updates_simplified(self):
+        location = models.Location.objects.get(slug='hood-2')
+        self.assertEqual(location.simplified_set.count(), 0)
+        location.save()
+        self.assertEqual(location.simplified_set.count(), len(simplify.TOLERANCES))
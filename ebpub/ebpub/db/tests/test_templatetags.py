@@ -470,3 +470,95 @@ class TestTemplateTagsWithDatabase(BaseTemplateTagSetup, TestCase):
                  ),
 
             }
+
+
+class TestTagCache(unittest.TestCase):
+
+    def test_get(self):
+        from ebpub.db.tagcache import TagCache
+        cache = TagCache()
+        load = mock.Mock(return_value='x')
+        self.assertEqual(cache.get('kind', 1, load), 'x')
+        self.assertEqual(cache.get('kind', 1, load), 'x')
+        self.assertEqual(load.call_count, 1)
+        cache.get('other kind', 1, load)
+        self.assertEqual(load.call_count, 2)
+
+    def test_get__unhashable(self):
+        from ebpub.db.tagcache import TagCache
+        cache = TagCache()
+        load = mock.Mock(return_value='x')
+        cache.get('kind', [1], load)
+        cache.get('kind', [1], load)
+        self.assertEqual(load.call_count, 2)
+
+    def test_get_for_newsitem__batches(self):
+        from ebpub.db.models import NewsItem
+        from ebpub.db.tagcache import TagCache
+        cache = TagCache()
+        items = [NewsItem(id=i) for i in (1, 2, 3)]
+        cache.add_newsitems(items)
+        load_many = mock.Mock(side_effect=lambda nis: dict((ni.id, ni.id * 10) for ni in nis))
+        self.assertEqual([cache.get_for_newsitem('kind', ni, load_many) for ni in items],
+                         [10, 20, 30])
+        self.assertEqual(load_many.call_count, 1)
+        self.assertEqual(sorted(ni.id for ni in load_many.call_args[0][0]), [1, 2, 3])
+
+    def test_add_newsitems__ignores_others(self):
+        from ebpub.db.models import NewsItem
+        from ebpub.db.tagcache import TagCache
+        cache = TagCache()
+        queryset = mock.Mock()
+        cache.add_newsitems(queryset)
+        cache.add_newsitems(['foo', NewsItem(), None])
+        self.assertEqual(cache._newsitems, {})
+        self.assertEqual(queryset.mock_calls, [])
+
+    def test_get_tag_cache(self):
+        from ebpub.db.tagcache import get_tag_cache
+        request = mock.Mock(spec=['GET'])
+        context = template.Context({'request': request})
+        cache = get_tag_cache(context)
+        self.assert_(cache is get_tag_cache(template.Context({'request': request})))
+        # Without a request, it lives as long as the context.
+        data = {}
+        context = template.Context(data)
+        context.push()
+        cache = get_tag_cache(context)
+        context.pop()
+        self.assert_(cache is get_tag_cache(context))
+        self.assertEqual(data, {})
+
+
+class TestTagQueries(TestCase):
+
+    fixtures = ('test-schemafilter-views.json',)
+
+    def _render(self, source, **kwargs):
+        return template.Template('{% load eb %}' + source).render(template.Context(kwargs))
+
+    def test_get_locations_for_item__batched(self):
+        from ebpub.db.models import NewsItem
+        items = list(NewsItem.objects.filter(id__in=(1, 2, 3)).order_by('id'))
+        source = ('{% for item in newsitem_list %}'
+                  '{% get_locations_for_item item neighborhoods as locs %}'
+                  '{% for loc in locs %}{{ loc.location_slug }}, {% endfor %}'
+                  '{% endfor %}')
+        with self.assertNumQueries(2):
+            result = self._render(source, newsitem_list=items)
+        self.assertEqual(result, u'hood-1, hood-1, hood-2, ')
+
+    def test_json_lookup_values_for_attribute__memoized(self):
+        source = ('{% json_lookup_values_for_attribute "crime" "tag" %}'
+                  '{% json_lookup_values_for_attribute "crime" "tag" %}')
+        with self.assertNumQueries(1):
+            result = self._render(source)
+        self.assertEqual(result, u'["Tag 1", "Tag 2", "Tag 3", "Tag 999 UNUSED"]' * 2)
+
+    def test_get_newsitem__memoized(self):
+        source = ('{% get_newsitem "1" as a %}{% get_newsitem 1 as b %}'
+                  '{% get_newsitem "987654331" as c %}{% get_newsitem "987654331" as d %}'
+                  '{{ a.title }}, {{ b.title }}')
+        with self.assertNumQueries(2):
+            result = self._render(source)
+        self.assertEqual(result, u'crime title 1, crime title 1')
@@ -223,6 +223,21 @@ class TestSchemaFilterView(BaseTestCase):
         self.assertContains(response, 'choose a location')
         self.assertContains(response, 'id="date-filtergroup"')
 
+    def test_filter__schema_metadata_not_requeried(self):
+        # Once the schema registry is warm, rendering the page
+        # shouldn't hit db_schemafield at all.
+        from django.db import connection
+        url = filter_reverse('crime', [])
+        self.client.get(url)
+        connection.queries = []
+        with self.settings(DEBUG=True):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            sf_queries = [q for q in connection.queries
+                          if 'db_schemafield' in q['sql']]
+            self.assertEqual(sf_queries, [])
+        connection.queries = []
+
     def test_filter_by_location_choices(self):
         url = filter_reverse('crime', [('locations', 'neighborhoods')])
         response = self.client.get(url)
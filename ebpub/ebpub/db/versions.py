@@ -0,0 +1,188 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Cheap data versions for conditional GET (``ETag`` and ``Last-Modified``).
+
+Feed readers and API clients poll the same URLs over and over, and
+most of the time nothing has changed. Rather than re-running the
+NewsItem query to find out, we compute a version of each *kind* of data
+a response depends on:
+
+* ``NEWSITEMS``: from the newest ``Schema.last_updated`` and
+  ``DataUpdate.update_finish``, which scrapers maintain;
+* ``LOCATIONS``: from the number and max ID of Locations;
+* ``PLACES``: from the number and max ID of Places;
+
+all fetched with one small query; plus, for each kind, a "version
+stamp" stored in the Django cache, which is replaced whenever a
+relevant model instance is saved or deleted (see the signal handlers
+in ``ebpub.db.models`` and ``ebpub.streets.models``). That catches
+edits made through the admin, the API or user-contributed content.
+
+The stamps only work across processes if the cache is shared, eg.
+memcached. If the cache forgets a stamp (eg. the default DummyCache),
+we make up a new one, so the worst case is that clients don't get
+304 responses; never that they get stale data.
+
+Usage::
+
+    from ebpub.db.versions import conditional_get, NEWSITEMS
+    return conditional_get(request, [NEWSITEMS], lambda: make_response(request))
+
+API views get this via the ``versions`` argument of
+:py:func:`ebpub.openblockapi.views.rest_view`.
+"""
+
+from django.conf import settings
+from django.db import connection
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+import calendar
+import datetime
+import hashlib
+import pytz
+import time
+import uuid
+
+NEWSITEMS = 'newsitems'
+LOCATIONS = 'locations'
+PLACES = 'places'
+
+VERSION_CACHE_KEY = 'ebpub.db.versions.%s'
+
+# How long version stamps live in the cache.
+VERSION_CACHE_TIME = 60 * 60 * 24 * 30
+
+# Subqueries that give the database's idea of each kind's version.
+_METADATA_SQL = {
+    NEWSITEMS: ['SELECT max(last_updated) FROM db_schema',
+                'SELECT max(update_finish) FROM db_dataupdate'],
+    LOCATIONS: ['SELECT count(*) FROM db_location',
+                'SELECT max(id) FROM db_location'],
+    PLACES: ['SELECT count(*) FROM streets_place',
+             'SELECT max(id) FROM streets_place'],
+    }
+
+
+def touch(kind):
+    """
+    Records that data of the given kind has changed.
+    """
+    cache.set(VERSION_CACHE_KEY % kind, (uuid.uuid4().hex, time.time()),
+              VERSION_CACHE_TIME)
+
+
+def _get_stamp(kind):
+    stamp = cache.get(VERSION_CACHE_KEY % kind, None)
+    if stamp is None:
+        # We don't know what changed when; assume it just did.
+        stamp = (uuid.uuid4().hex, time.time())
+        cache.add(VERSION_CACHE_KEY % kind, stamp, VERSION_CACHE_TIME)
+    return stamp
+
+
+# Signal handlers.
+
+def newsitems_changed(sender, **kwargs):
+    touch(NEWSITEMS)
+
+def locations_changed(sender, **kwargs):
+    touch(LOCATIONS)
+
+def places_changed(sender, **kwargs):
+    touch(PLACES)
+
+
+def _to_datetime(value):
+    # Naive local datetimes, dates, or timestamps -> aware datetimes.
+    local_tz = pytz.timezone(settings.TIME_ZONE)
+    if isinstance(value, float):
+        value = datetime.datetime.fromtimestamp(value)
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if value.tzinfo is None:
+        value = local_tz.localize(value)
+    return value
+
+
+def get_version(kinds, extra=()):
+    """
+    Returns an (etag, last_modified) pair for a response that depends on
+    the given kinds of data. ``extra`` is any other hashable data the
+    response depends on, eg. the current user or date.
+
+    Does one database query.
+    """
+    kinds = sorted(set(kinds))
+    subqueries = []
+    for kind in kinds:
+        subqueries.extend(_METADATA_SQL[kind])
+    cursor = connection.cursor()
+    cursor.execute('SELECT ' + ', '.join('(%s)' % sql for sql in subqueries))
+    values = cursor.fetchone()
+    stamps = [_get_stamp(kind) for kind in kinds]
+
+    times = [stamp[1] for stamp in stamps]
+    times.extend([v for v in values if isinstance(v, (datetime.date, datetime.datetime))])
+    last_modified = max([_to_datetime(t) for t in times])
+    etag = hashlib.md5(repr((kinds, values, stamps, tuple(extra)))).hexdigest()
+    return etag, last_modified
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_none_match is None and if_modified_since is None:
+        return False
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        if etag not in etags and '*' not in etags:
+            return False
+    if if_modified_since is not None:
+        since = parse_http_date_safe(if_modified_since)
+        if since is None or calendar.timegm(last_modified.utctimetuple()) > since:
+            return False
+    return True
+
+
+def conditional_get(request, kinds, get_response, extra=()):
+    """
+    Returns a 304 Not Modified response if the client already has the
+    current version of the response, else calls ``get_response()`` and
+    adds ``ETag`` and ``Last-Modified`` headers to its result.
+
+    Only GET and HEAD requests are conditional. The version depends on
+    ``kinds``, ``extra`` and the current user.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return get_response()
+    user = getattr(request, 'user', None)
+    user_id = (user is not None and user.is_authenticated()) and user.pk or None
+    etag, last_modified = get_version(kinds, tuple(extra) + (user_id,))
+    if _not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = get_response()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(calendar.timegm(last_modified.utctimetuple()))
+    return response
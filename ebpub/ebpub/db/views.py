@@ -33,9 +33,14 @@ from django.views.decorators.csrf import csrf_protect
 from ebpub.constants import HIDE_ADS_COOKIE_NAME
 from ebpub.db import breadcrumbs
 from ebpub.db import constants
-from ebpub.db.models import AggregateDay, AggregateLocation, AggregateFieldLookup
+from ebpub.db.datecharts import DateChart, aggregate_date_charts, make_date_charts
+from ebpub.db.homepage import get_homepage_context
+from ebpub.db import simplify
+from ebpub.db.models import AggregateFieldLookup
 from ebpub.db.models import NewsItem, Schema, SchemaField, LocationType, Location, SearchSpecialCase
 from ebpub.db.schemafilters import FilterError
+from ebpub.db.schemaregistry import schema_registry
+from ebpub.db.schemasummary import get_summary, summary_context
 from ebpub.db.schemafilters import FilterChain
 from ebpub.db.schemafilters import BadAddressException
 from ebpub.db.schemafilters import BadDateException
@@ -50,7 +55,7 @@ from ebpub.metros.allmetros import get_metro
 from ebpub.openblockapi.views import api_items_geojson
 from ebpub.preferences.models import HiddenSchema
 from ebpub.streets.models import Street, City, Block, Intersection
-from ebpub.utils.dates import daterange, today
+from ebpub.utils.dates import today
 from ebpub.utils.view_utils import eb_render
 from ebpub.utils.view_utils import get_schema_manager
 from ebpub.utils.view_utils import paginate
@@ -58,7 +63,6 @@ from ebpub.utils.view_utils import paginate
 import datetime
 import hashlib
 import logging
-import operator
 import re
 
 logger = logging.getLogger('ebpub.db.views')
@@ -70,12 +74,11 @@ logger = logging.getLogger('ebpub.db.views')
 
 def get_date_chart_agg_model(schemas, start_date, end_date, agg_model, kwargs=None):
     """start_date and end_date are *inclusive*.
+
+    Returns a list of :py:class:`ebpub.db.datecharts.DateChart`,
+    from one query on ``agg_model``.
     """
-    kwargs = kwargs or {}
-    counts = {}
-    for agg in agg_model.objects.filter(schema__id__in=[s.id for s in schemas], date_part__range=(start_date, end_date), **kwargs):
-        counts.setdefault(agg.schema_id, {})[agg.date_part] = agg.total
-    return get_date_chart(schemas, start_date, end_date, counts)
+    return aggregate_date_charts(schemas, start_date, end_date, agg_model, **(kwargs or {}))
 
 def get_date_chart(schemas, start_date, end_date, counts):
     """
@@ -87,32 +90,13 @@ def get_date_chart(schemas, start_date, end_date, counts):
     counts should be a nested dictionary: {schema_id: {date: count}}
 
     The list will be in order given by the `schemas` parameter.
+    Its items are :py:class:`ebpub.db.datecharts.DateChart` instances,
+    which can be used like dictionaries.
     """
-    result = []
-    for schema in schemas:
-        if schema.id not in counts:
-            result.append({
-                'schema': schema,
-                'dates': [{'date': d, 'count': 0} for d in daterange(start_date, end_date)],
-                'max_count': 0,
-                'total_count': 0,
-                'latest_date': None,
-            })
-        else:
-            dates = [{'date': d, 'count': counts[schema.id].get(d, 0)} for d in daterange(start_date, end_date)]
-            nonzero_dates = [d['date'] for d in dates if d['count']]
-            if nonzero_dates:
-                latest_date = max(nonzero_dates)
-            else:
-                latest_date = None
-            result.append({
-                'schema': schema,
-                'dates': dates,
-                'max_count': max(d['count'] for d in dates),
-                'total_count': sum(d['count'] for d in dates),
-                'latest_date': latest_date,
-            })
-    return result
+    charts = make_date_charts(schemas, start_date, end_date)
+    for chart in charts:
+        chart.add_counts(counts.get(chart.schema.id, {}))
+    return charts
 
 
 def block_bbox(block, radius):
@@ -200,8 +184,8 @@ def ajax_place_date_chart(request):
         start_date = end_date - date_span
 
     filters.add('date', start_date, end_date)
-    counts = filters.apply().date_counts()
-    date_chart = get_date_chart([schema], start_date, end_date, {schema.id: counts})[0]
+    date_chart = DateChart(schema, start_date, end_date)
+    date_chart.add_counts(filters.apply().date_counts())
     return render_to_response('db/snippets/date_chart.html', {
         'schema': schema,
         'date_chart': date_chart,
@@ -255,7 +239,8 @@ def newsitems_geojson(request):
 
         # Put a hard limit on the number of newsitems, and throw away
         # older items.
-        newsitem_qs = newsitem_qs.select_related().order_by('-item_date', '-pub_date', '-id')
+        newsitem_qs = newsitem_qs.select_related('schema').order_by('-item_date', '-pub_date', '-id')
+        newsitem_qs = newsitem_qs.with_attributes()
         newsitem_qs = newsitem_qs[:constants.NUM_NEWS_ITEMS_PLACE_DETAIL]
 
     # Done preparing the query; cache based on the raw SQL
@@ -280,7 +265,15 @@ def _make_cache_key_from_queryset(qs):
 @cache_page(60 * 60)
 def place_kml(request, *args, **kwargs):
     place = url_to_place(*args, **kwargs)
-    return render_to_kml('place.kml', {'place': place})
+    if isinstance(place, Location):
+        try:
+            tolerance = simplify.parse_tolerance(request.GET)
+        except ValueError:
+            return HttpResponse('Invalid tolerance or zoom', status=400)
+        geometry = simplify.simplified_geometry(place, tolerance)
+    else:
+        geometry = place.location
+    return render_to_kml('place.kml', {'place': place, 'geometry': geometry})
 
 
 #########
@@ -295,17 +288,10 @@ def homepage(request):
 
 def _homepage_context(request):
     # Factored out to make easier to override or wrap.
-    end_date = today()
-    start_date = end_date - datetime.timedelta(days=settings.DEFAULT_DAYS)
-    end_date += datetime.timedelta(days=1)
 
-    manager = get_schema_manager(request)
-    sparkline_schemas = list(manager.filter(allow_charting=True, is_special_report=False))
-
-    # Order by slug to ensure case-insensitive ordering. (Kind of hackish.)
-    lt_list = LocationType.objects.filter(is_significant=True).order_by('slug').extra(select={'count': 'select count(*) from db_location where is_public=True and location_type_id=db_locationtype.id'})
-    street_count = Street.objects.count()
-    more_schemas = manager.filter(allow_charting=False).order_by('name')
+    # Everything that doesn't depend on the user is precomputed;
+    # see ebpub.db.homepage.
+    shared = get_homepage_context()
 
     # Get schemas that are restricted / allowed for this user.  Note,
     # in some use cases you might want to override these so that
@@ -315,27 +301,18 @@ def _homepage_context(request):
     # don't have anything on which to make such a distinction,
     # so these mean allowed & restricted *for the current user*.
     allowed_schema_ids = get_schema_manager(request).allowed_schema_ids()
-    restricted_schemas = Schema.objects.exclude(id__in=allowed_schema_ids)
+    allowed = set(allowed_schema_ids)
+    restricted_schemas = [s for s in shared['all_schemas'] if s.id not in allowed]
 
     # Get the public records.
-    date_charts = get_date_chart_agg_model(sparkline_schemas, start_date, end_date, AggregateDay)
-    empty_date_charts, non_empty_date_charts = [], []
-    for chart in date_charts:
-        if chart['total_count']:
-            non_empty_date_charts.append(chart)
-        else:
-            empty_date_charts.append(chart)
-    def _date_chart_sort_func(a, b):
-        return cmp(
-            # Higher importance first, higher count first, lower name first.
-            (b['schema'].importance, b['total_count'], a['schema'].plural_name),
-            (a['schema'].importance, a['total_count'], b['schema'].plural_name))
-
-    non_empty_date_charts.sort(_date_chart_sort_func)
-    empty_date_charts.sort(_date_chart_sort_func)
+    non_empty_date_charts = [chart for chart in shared['non_empty_date_charts']
+                             if chart['schema'].id in allowed]
+    empty_date_charts = [chart for chart in shared['empty_date_charts']
+                         if chart['schema'].id in allowed]
+    more_schemas = [s for s in shared['more_schemas'] if s.id in allowed]
     return {
-        'location_type_list': lt_list,
-        'street_count': street_count,
+        'location_type_list': shared['location_type_list'],
+        'street_count': shared['street_count'],
         'more_schemas': more_schemas,
         'non_empty_date_charts': non_empty_date_charts,
         'empty_date_charts': empty_date_charts,
@@ -344,8 +321,8 @@ def _homepage_context(request):
         'default_lat': settings.DEFAULT_MAP_CENTER_LAT,
         'default_zoom': settings.DEFAULT_MAP_ZOOM,
         'bodyclass': 'homepage',
-        'breadcrumbs': breadcrumbs.home({}),
-        'map_configuration': _preconfigured_map({}),
+        'breadcrumbs': shared['breadcrumbs'],
+        'map_configuration': shared['map_configuration'],
         'restricted_schemas': restricted_schemas,
         'allowed_schema_ids': allowed_schema_ids,
         }
@@ -433,7 +410,7 @@ def search(request, schema_slug=''):
 
     # Failing that, display a list of ZIP codes if this looks like a ZIP.
     if re.search(r'^\s*\d{5}(?:-\d{4})?\s*$', q):
-        z_list = Location.objects.filter(location_type__slug='zipcodes', is_public=True).select_related().order_by('name')
+        z_list = Location.objects.lean().filter(location_type__slug='zipcodes', is_public=True).select_related('location_type').order_by('name')
         if z_list:
             return eb_render(request, 'db/search_error_zip_list.html', {'query': q, 'zipcode_list': z_list})
 
@@ -463,7 +440,7 @@ def newsitem_detail(request, schema_slug, newsitem_id):
     has_location = ni.location is not None
 
     if has_location:
-        locations_within = Location.objects.select_related().filter(
+        locations_within = Location.objects.lean().select_related('location_type').filter(
             newsitemlocation__news_item__id=ni.id)
         center_x = ni.location.centroid.x
         center_y = ni.location.centroid.y
@@ -550,57 +527,22 @@ def schema_detail(request, slug):
 
     location_type_list = LocationType.objects.filter(is_significant=True).order_by('slug')
     if s.allow_charting:
-        # For the date range, the end_date is the last non-future date
-        # with at least one NewsItem.
-        try:
-            end_date = NewsItem.objects.filter(schema__id=s.id, item_date__lte=today()).values_list('item_date', flat=True).order_by('-item_date')[0]
-        except IndexError:
-            latest_dates = ()
-            date_chart = {}
-            start_date = end_date = None
-        else:
-            start_date = end_date - constants.DAYS_AGGREGATE_TIMEDELTA
-            date_chart = get_date_chart_agg_model([s], start_date, end_date, AggregateDay)[0]
-            latest_dates = [date['date'] for date in date_chart['dates'] if date['count']]
-
-        # Populate schemafield_list and lookup_list.
-        schemafield_list = list(s.schemafield_set.filter(is_filter=True).order_by('display_order'))
-        LOOKUP_MAX_DISPLAYED = 12
-        LOOKUP_BUFFER = 4
-        lookup_list = []
-        for sf in schemafield_list:
-            if not (sf.is_charted and sf.is_lookup):
-                continue
-            lookup_list.append(_get_lookup_list_for_sf(sf, LOOKUP_MAX_DISPLAYED, LOOKUP_BUFFER))
-
-        location_chartfield_list = []
-
-        # Populate location_chartfield_list.
-        for lt in location_type_list:
-            # Collect the locations in the location_type here so we don't have
-            # to query them again in the select_related() below.
-            locations = dict([(loc.id, loc) for loc in lt.location_set.iterator()])
-
-            ni_totals = AggregateLocation.objects.filter(
-                schema__id=s.id,
-                location_type__id=lt.id,
-                location__is_public=True).select_related('location').order_by('-total')
-
-            if ni_totals:  # This runs the query.
-                known_count = reduce(operator.add, (n.total for n in ni_totals))
-                total_count = date_chart.get('total_count', 0)
-                unknown_count = max(0, total_count - known_count)
-                location_chartfield_list.append({'location_type': lt, 'locations': ni_totals[:9], 'unknown': unknown_count})
+        # Everything we chart is precomputed by update_aggregates.
+        summary = get_summary(s)
+        date_chart, latest_dates, lookup_list, location_chartfield_list = \
+            summary_context(s, summary, location_type_list)
+        schemafield_list = [sf for sf in schema_registry.get_schemafields(s.id) if sf.is_filter]
         ni_list = ()
     else:
         date_chart = {}
         latest_dates = schemafield_list = lookup_list = location_chartfield_list = ()
-        ni_list = list(NewsItem.objects.filter(schema__id=s.id).order_by('-item_date', '-id')[:30])
+        ni_list = list(NewsItem.objects.exclude_archived().filter(schema__id=s.id).order_by('-item_date', '-id')[:30])
         populate_schema(ni_list, s)
         populate_attributes_if_needed(ni_list, [s])
 
-    textsearch_sf_list = list(SchemaField.objects.filter(schema__id=s.id, is_searchable=True).order_by('display_order'))
-    boolean_lookup_list = [sf for sf in SchemaField.objects.filter(schema__id=s.id, is_filter=True, is_lookup=False).order_by('display_order') if sf.is_type('bool')]
+    all_sfs = schema_registry.get_schemafields(s.id)
+    textsearch_sf_list = [sf for sf in all_sfs if sf.is_searchable]
+    boolean_lookup_list = [sf for sf in all_sfs if sf.is_filter and not sf.is_lookup and sf.is_type('bool')]
 
     templates_to_try = ('db/schema_detail/%s.html' % s.slug, 'db/schema_detail.html')
 
@@ -629,7 +571,7 @@ def schema_detail_special_report(request, schema):
     """
     For display of schemas where is_special_report=True.
     """
-    ni_list = NewsItem.objects.filter(schema__id=schema.id)
+    ni_list = NewsItem.objects.exclude_archived().filter(schema__id=schema.id)
     populate_schema(ni_list, schema)
     populate_attributes_if_needed(ni_list, [schema])
 
@@ -658,8 +600,11 @@ def _get_filter_schemafields(schema):
     Only SchemaFields that have is_searchable or is_filter enabled
     will be returned.
     """
-    filter_sf_list = list(SchemaField.objects.filter(schema=schema, is_filter=True).order_by('display_order'))
-    textsearch_sf_list = list(SchemaField.objects.filter(schema=schema, is_searchable=True).order_by('display_order'))
+    if schema is None:
+        return SortedDict()
+    all_sfs = schema_registry.get_schemafields(schema.id)
+    filter_sf_list = [sf for sf in all_sfs if sf.is_filter]
+    textsearch_sf_list = [sf for sf in all_sfs if sf.is_searchable]
     # Use SortedDict to preserve the display_order.
     filter_sf_dict = SortedDict([(sf.name, sf) for sf in filter_sf_list] + [(sf.name, sf) for sf in textsearch_sf_list])
     return filter_sf_dict
@@ -698,7 +643,7 @@ def schema_filter_geojson(request, slug):
         page = int(request.GET.get('page', 1))
     except ValueError:
         return HttpResponse('Invalid Page %r' % page, status=400)
-    paginated_info = paginate(qs, page=page)
+    paginated_info = paginate(qs.with_attributes(), page=page)
     ni_list = paginated_info[0]  # Don't need anything else.
     # Pagination not captured by queryset, so we hack that into the
     # cache key.
@@ -950,7 +895,7 @@ def location_type_list(request):
 def location_type_detail(request, slug):
     lt = get_object_or_404(LocationType, slug=slug)
     order_by = get_metro()['multiple_cities'] and ('city', 'display_order') or ('display_order',)
-    loc_list = Location.objects.filter(location_type__id=lt.id, is_public=True).order_by(*order_by)
+    loc_list = Location.objects.lean().filter(location_type__id=lt.id, is_public=True).order_by(*order_by)
     lt_list = [{'location_type': i, 'is_current': i == lt} for i in LocationType.objects.filter(is_significant=True).order_by('plural_name')]
     context = {
         'location_type': lt,
@@ -1018,7 +963,7 @@ def block_list(request, city_slug, street_slug):
         city_filter = Q(left_city=city.norm_name) | Q(right_city=city.norm_name)
     else:
         city_filter = Q()
-    blocks = Block.objects.filter(city_filter, **kwargs).order_by('postdir', 'predir', 'from_num', 'to_num')
+    blocks = Block.objects.lean().filter(city_filter, **kwargs).order_by('postdir', 'predir', 'from_num', 'to_num')
     if not blocks:
         raise Http404('This street has no blocks')
     context = {
@@ -1104,7 +1049,7 @@ def _news_context(request, context, max_items, show_upcoming=False, **filterargs
         date_limit = Q(item_date__lte=today())
 
     filterchain.add('schema', list(s_list))
-    newsitem_qs = filterchain.apply().select_related().filter(date_limit)
+    newsitem_qs = filterchain.apply().select_related('schema').filter(date_limit)
     # TODO: can this really only be done via extra()?
     newsitem_qs = newsitem_qs.extra(
         select={'item_date_date': 'date(db_newsitem.item_date)'},
@@ -1170,9 +1115,15 @@ def _preconfigured_map(context):
         loc_json_url = reverse('location_detail_json',
                                  kwargs={'loctype': location.location_type.slug, 
                                          'slug': location.slug})
+        # Ask for a boundary simplified to about the size of a pixel
+        # when the whole location fills the map.
+        params = {}
+        if location.location is not None:
+            xmin, ymin, xmax, ymax = location.location.extent
+            params['tolerance'] = max(xmax - xmin, ymax - ymin) / 1000.0
         loc_boundary = {
             'url': loc_json_url,
-            'params': {},
+            'params': params,
             'title': "%s Boundary" % location.pretty_name,
             'visible': True
         }
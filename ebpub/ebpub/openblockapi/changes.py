@@ -0,0 +1,169 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Incremental sync of NewsItems for API clients.
+
+Every time a NewsItem (or its attributes) is saved or deleted, a
+:py:class:`NewsItemChange <ebpub.openblockapi.models.NewsItemChange>`
+is logged. Clients pass an opaque cursor, and get back all NewsItems
+that changed since then, tombstones for the deleted ones, and a new
+cursor to use next time. That's much cheaper than re-polling
+``items.json`` and diffing, and it catches edits and deletions too.
+
+Change IDs come from a sequence, so they follow the order changes were
+logged in, not the order they were committed in: a long import can log
+change 500, and a quick edit change 600 that commits first. A cursor
+that only remembered "600" would skip 500 forever. So each change
+records the txid of its transaction; the log is read in (txid, id)
+order, and only changes from transactions older than every transaction
+still in progress are returned. Anything newer is held back until
+those transactions finish.
+"""
+
+from django.db import connection
+from django.db.models import Q
+from ebpub.db.models import NewsItem
+from ebpub.openblockapi.itemquery import QueryError
+from ebpub.openblockapi.models import NewsItemChange
+from ebpub.utils.view_utils import get_schema_manager
+
+import base64
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Special cursor value meaning "the end of the log".
+LATEST = 'latest'
+
+
+def encode_cursor(position):
+    """
+    Returns an opaque cursor string for the given (txid, id) position
+    in the change log.
+    """
+    return base64.urlsafe_b64encode('t%d.%d' % position).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (txid, id) position encoded in ``cursor``.
+    Raises QueryError if it's invalid.
+    """
+    try:
+        value = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        if value.startswith('t'):
+            txid, change_id = value[1:].split('.')
+            return (int(txid), int(change_id))
+        if value.startswith('c'):
+            # Old cursors had only the change ID; changes logged
+            # before txids were recorded have txid 0.
+            return (0, int(value[1:]))
+        raise ValueError(value)
+    except (TypeError, ValueError, UnicodeError):
+        raise QueryError('Invalid cursor "%s"' % cursor)
+
+
+def get_txid_limit():
+    """
+    Returns the txid of the oldest transaction still in progress,
+    other than our own. Every change with a lower txid is committed
+    (or rolled back) and visible to us; we can also see our own
+    uncommitted changes.
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT COALESCE(
+            (SELECT min(xip) FROM txid_snapshot_xip(txid_current_snapshot()) AS xip),
+            txid_snapshot_xmax(txid_current_snapshot()))""")
+    return cursor.fetchone()[0]
+
+
+def get_changes(request, cursor=None, limit=DEFAULT_LIMIT):
+    """
+    Returns a dict describing the NewsItems that changed after
+    ``cursor``, as visible to the user making the ``request``:
+
+    * ``'items'``: a list of (action, NewsItem) pairs, where action is
+      ``'created'`` or ``'updated'``; the NewsItems are current, with
+      attributes loaded;
+
+    * ``'deleted'``: a list of NewsItemChanges for deleted NewsItems;
+
+    * ``'cursor'``: the cursor to pass next time;
+
+    * ``'more'``: True if there are more changes right away.
+
+    At most ``limit`` changes are read, and each NewsItem appears only
+    once. With no ``cursor``, starts at the beginning of the log; with
+    ``cursor='latest'``, returns no changes, just a cursor for the end
+    of the log. Changes from transactions that might still be followed
+    by older, uncommitted ones are held back; see the module docs.
+    """
+    changes = NewsItemChange.objects.filter(txid__lt=get_txid_limit())
+    if cursor == LATEST:
+        latest = changes.order_by('-txid', '-id').values_list('txid', 'id')[:1]
+        return {'items': [], 'deleted': [], 'more': False,
+                'cursor': encode_cursor(latest and latest[0] or (0, 0))}
+    after = cursor and decode_cursor(cursor) or (0, 0)
+    after_txid, after_id = after
+    allowed_schema_ids = get_schema_manager(request).allowed_schema_ids()
+    changes = list(changes.filter(
+            Q(txid__gt=after_txid) | Q(txid=after_txid, id__gt=after_id),
+            schema_id__in=allowed_schema_ids).order_by('txid', 'id')[:limit + 1])
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    # Only the last change to each item matters, except that an item
+    # created and then updated in this batch is new to the client.
+    # Changes to one item are serialized by its row lock, so the last
+    # one is the one with the highest ID, whatever its txid.
+    last_change = {}
+    created = set()
+    for change in changes:
+        previous = last_change.get(change.news_item_id)
+        if previous is None or change.id > previous.id:
+            last_change[change.news_item_id] = change
+        if change.action == NewsItemChange.CREATED:
+            created.add(change.news_item_id)
+
+    deleted = []
+    live_ids = []
+    for change in sorted(last_change.values(), key=lambda c: c.id):
+        if change.action == NewsItemChange.DELETED:
+            deleted.append(change)
+        else:
+            live_ids.append(change.news_item_id)
+
+    items = []
+    if live_ids:
+        newsitems = NewsItem.objects.by_request(request).filter(
+            id__in=live_ids).select_related('schema').with_attributes()
+        by_id = dict((ni.id, ni) for ni in newsitems)
+        for news_item_id in live_ids:
+            ni = by_id.get(news_item_id)
+            if ni is None:
+                # Deleted later; the client will see that change in
+                # a later batch.
+                continue
+            action = news_item_id in created and NewsItemChange.CREATED or NewsItemChange.UPDATED
+            items.append((action, ni))
+
+    next_position = changes and (changes[-1].txid, changes[-1].id) or after
+    return {'items': items, 'deleted': deleted, 'more': more,
+            'cursor': encode_cursor(next_position)}
@@ -38,6 +38,7 @@ the API documentation.
 
 from django.contrib.gis import geos
 from ebpub.utils.dates import parse_date
+from ebpub.db.buckets import filter_by_geometry
 from ebpub.db.models import NewsItem
 from ebpub.streets.models import Place
 import pyrfc3339
@@ -68,7 +69,8 @@ def build_item_query(request):
                _radius_filter, _bbox_filter, _attributes_filter, _order_by,
                _object_limit]
 
-    query = NewsItem.objects.by_request(request)
+    query = NewsItem.objects.by_request(request).select_related('schema')
+    query = query.with_attributes()
     params = dict(params)
     state = {}
     for f in filters:
@@ -199,7 +201,7 @@ def _bbox_filter(query, params, state):
         lon1,lat1,lon2,lat2 = (float(x.strip()) for x in bbox.split(','))
         search_region = geos.Polygon.from_bbox([lon1,lat1,lon2,lat2])
         search_region.srid = 4326
-        query = query.filter(location__contained=search_region)
+        query = filter_by_geometry(query, search_region, 'contained')
     except:
         import traceback
         traceback.print_exc()
@@ -244,7 +246,7 @@ def _radius_filter(query, params, state):
     except ValueError:
         raise QueryError('Invalid radius "%s"' % radius)
 
-    query = query.filter(location__bboverlaps=search_region)
+    query = filter_by_geometry(query, search_region)
     state['has_geo_filter'] = True
 
     return query, params, state
@@ -0,0 +1,39 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'NewsItemChange'
+        db.create_table('openblockapi_newsitemchange', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('news_item_id', self.gf('django.db.models.fields.IntegerField')()),
+            ('schema_id', self.gf('django.db.models.fields.IntegerField')()),
+            ('action', self.gf('django.db.models.fields.CharField')(max_length=8)),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+        ))
+        db.send_create_signal('openblockapi', ['NewsItemChange'])
+
+
+    def backwards(self, orm):
+        
+        # Deleting model 'NewsItemChange'
+        db.delete_table('openblockapi_newsitemchange')
+
+
+    models = {
+        'openblockapi.newsitemchange': {
+            'Meta': {'object_name': 'NewsItemChange'},
+            'action': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'news_item_id': ('django.db.models.fields.IntegerField', [], {}),
+            'schema_id': ('django.db.models.fields.IntegerField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'})
+        }
+    }
+
+    complete_apps = ['openblockapi']
@@ -0,0 +1,38 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding field 'NewsItemChange.txid'
+        db.add_column('openblockapi_newsitemchange', 'txid', self.gf('django.db.models.fields.BigIntegerField')(default=0), keep_default=False)
+
+        # The changes API reads the log in (txid, id) order.
+        db.create_index('openblockapi_newsitemchange', ['txid', 'id'])
+
+
+    def backwards(self, orm):
+        
+        db.delete_index('openblockapi_newsitemchange', ['txid', 'id'])
+
+        # Deleting field 'NewsItemChange.txid'
+        db.delete_column('openblockapi_newsitemchange', 'txid')
+
+
+    models = {
+        'openblockapi.newsitemchange': {
+            'Meta': {'object_name': 'NewsItemChange'},
+            'action': ('django.db.models.fields.CharField', [], {'max_length': '8'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'news_item_id': ('django.db.models.fields.IntegerField', [], {}),
+            'schema_id': ('django.db.models.fields.IntegerField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'txid': ('django.db.models.fields.BigIntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['openblockapi']
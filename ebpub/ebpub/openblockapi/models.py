@@ -16,4 +16,81 @@
 #   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-# No models here.
+"""
+Models for the REST API.
+"""
+
+from django.db import connection, models, transaction
+from django.db.models.signals import post_delete, post_save
+from ebpub.db.models import Attribute, NewsItem, attributes_saved
+
+import datetime
+
+
+class NewsItemChange(models.Model):
+    """
+    One entry in the log of NewsItem changes that powers the changes
+    API; see :py:mod:`ebpub.openblockapi.changes`.
+
+    IDs are handed out when a change is logged, not when it's
+    committed, so a change can become visible after changes with
+    higher IDs. So each change also records the ``txid`` of the
+    transaction that logged it, and the log is read in (txid, id)
+    order, only up to the oldest transaction still in progress.
+    There's no foreign key to the NewsItem, so deletions can be logged
+    too.
+
+    Only changes made through the ORM are logged: bulk updates with
+    ``QuerySet.update()`` or raw SQL are not.
+    """
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = ((CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted'))
+
+    news_item_id = models.IntegerField()
+    schema_id = models.IntegerField()
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES)
+    timestamp = models.DateTimeField(default=datetime.datetime.now)
+    txid = models.BigIntegerField(default=0,
+                                  help_text='PostgreSQL txid_current() of the transaction that logged this.')
+
+    def __unicode__(self):
+        return u'%d: NewsItem %d %s' % (self.id, self.news_item_id, self.action)
+
+
+def log_change(news_item_id, schema_id, action):
+    """
+    Adds a NewsItemChange to the log, with the current transaction's txid.
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+        INSERT INTO %s (news_item_id, schema_id, action, timestamp, txid)
+        VALUES (%%s, %%s, %%s, %%s, txid_current())""" % NewsItemChange._meta.db_table,
+                   [news_item_id, schema_id, action, datetime.datetime.now()])
+    transaction.commit_unless_managed()
+
+def log_newsitem_saved(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        # Loading fixtures.
+        return
+    log_change(instance.id, instance.schema_id,
+               created and NewsItemChange.CREATED or NewsItemChange.UPDATED)
+
+def log_newsitem_deleted(sender, instance, **kwargs):
+    log_change(instance.id, instance.schema_id, NewsItemChange.DELETED)
+
+def log_attributes_saved(sender, news_item_id, schema_id, **kwargs):
+    # Attributes are saved separately, after their NewsItem.
+    log_change(news_item_id, schema_id, NewsItemChange.UPDATED)
+
+def log_attribute_saved(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    log_attributes_saved(sender, instance.news_item_id, instance.schema_id)
+
+post_save.connect(log_newsitem_saved, sender=NewsItem)
+post_delete.connect(log_newsitem_deleted, sender=NewsItem)
+post_save.connect(log_attribute_saved, sender=Attribute)
+attributes_saved.connect(log_attributes_saved, sender=Attribute)
@@ -955,6 +955,310 @@ class TestOpenblockAtomFeed(BaseTestCase):
     # ... and, unlike root_attributes, is a pain to test.
 
 
+@mock.patch('ebpub.openblockapi.views.throttle_check', mock.Mock(return_value=0))
+class TestConditionalGet(BaseTestCase):
+
+    fixtures = ('test-schema', 'test-locationtypes', 'test-locations')
+
+    def setUp(self):
+        super(TestConditionalGet, self).setUp()
+        # The default DummyCache would never give us a 304.
+        from django.core.cache import get_cache
+        self.cache_patcher = mock.patch(
+            'ebpub.db.versions.cache',
+            get_cache('django.core.cache.backends.locmem.LocMemCache'))
+        self.cache_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+        super(TestConditionalGet, self).tearDown()
+
+    def test_not_modified(self):
+        url = reverse('locations_json')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assert_(response.has_header('Last-Modified'))
+        with mock.patch('ebpub.openblockapi.views.models.Location.objects') as mock_objects:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(mock_objects.filter.call_count, 0)
+
+    def test_if_modified_since(self):
+        url = reverse('list_types_json')
+        response = self.client.get(url)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified(self):
+        url = reverse('items_json')
+        etag = self.client.get(url)['ETag']
+        NewsItem.objects.create(
+            schema=Schema.objects.get(slug='test-schema'),
+            title='new item', description='', url='http://example.com',
+            item_date=datetime.date.today(), pub_date=datetime.datetime.now(),
+            location=geos.Point(-71.06, 42.35))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unrelated_change(self):
+        url = reverse('place_types_json')
+        etag = self.client.get(url)['ETag']
+        Location.objects.all()[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+@mock.patch('ebpub.openblockapi.views.throttle_check', mock.Mock(return_value=0))
+class TestChangesAPI(BaseTestCase):
+
+    fixtures = ('test-schema',)
+
+    def _create(self, title):
+        return NewsItem.objects.create(
+            schema=Schema.objects.get(slug='test-schema'),
+            title=title, description='', url='http://example.com',
+            item_date=datetime.date(2012, 1, 1),
+            pub_date=datetime.datetime(2012, 1, 1, 12, 0),
+            location=geos.Point(-71.06, 42.35))
+
+    def _get(self, **params):
+        response = self.client.get(reverse('items_changes_json'), params)
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+    def test_created_updated_deleted(self):
+        start = self._get(cursor='latest')
+        self.assertEqual(start['features'], [])
+
+        item1 = self._create('one')
+        item2 = self._create('two')
+        result = self._get(cursor=start['cursor'])
+        self.assertEqual([(f['properties']['title'], f['properties']['change'])
+                          for f in result['features']],
+                         [('one', 'created'), ('two', 'created')])
+        self.assertEqual(result['deleted'], [])
+        self.assertEqual(result['more'], False)
+
+        item1.title = 'one again'
+        item1.save()
+        item2_id = item2.id
+        item2.delete()
+        result = self._get(cursor=result['cursor'])
+        self.assertEqual([(f['properties']['title'], f['properties']['change'])
+                          for f in result['features']],
+                         [('one again', 'updated')])
+        self.assertEqual(len(result['deleted']), 1)
+        self.assertEqual(result['deleted'][0]['id'], item2_id)
+        self.assertEqual(result['deleted'][0]['type'], 'test-schema')
+
+        # Nothing new.
+        self.assertEqual(self._get(cursor=result['cursor'])['features'], [])
+
+    def test_pagination(self):
+        start = self._get(cursor='latest')
+        for i in range(5):
+            self._create('item %d' % i)
+        result = self._get(cursor=start['cursor'], limit=3)
+        self.assertEqual(len(result['features']), 3)
+        self.assertEqual(result['more'], True)
+        result = self._get(cursor=result['cursor'], limit=3)
+        self.assertEqual([f['properties']['title'] for f in result['features']],
+                         ['item 3', 'item 4'])
+        self.assertEqual(result['more'], False)
+
+    def test_schema_permissions(self):
+        start = self._get(cursor='latest')
+        item = self._create('secret')
+        Schema.objects.filter(slug='test-schema').update(is_public=False)
+        item.delete()
+        result = self._get(cursor=start['cursor'])
+        self.assertEqual(result['features'], [])
+        self.assertEqual(result['deleted'], [])
+
+    def test_bad_cursor(self):
+        response = self.client.get(reverse('items_changes_json'), {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_old_cursor(self):
+        from ebpub.openblockapi.changes import decode_cursor, encode_cursor
+        self.assertEqual(decode_cursor('YzQy'), (0, 42))  # 'c42'
+        self.assertEqual(decode_cursor(encode_cursor((123, 42))), (123, 42))
+
+    @mock.patch('ebpub.openblockapi.changes.get_txid_limit')
+    def test_committed_out_of_order(self, mock_limit):
+        from ebpub.openblockapi.models import NewsItemChange
+        schema = Schema.objects.get(slug='test-schema')
+        def log(news_item_id, txid):
+            return NewsItemChange.objects.create(
+                news_item_id=news_item_id, schema_id=schema.id,
+                action=NewsItemChange.DELETED, txid=txid)
+        # A long import logs a change first, with the lower ID;
+        # an edit in an older transaction logs one after it, and
+        # commits first.
+        log(1001, txid=101)
+        log(1002, txid=100)
+        log(1003, txid=102)
+
+        # Transaction 101 is still running, so only 100's change is seen.
+        mock_limit.return_value = 101
+        result = self._get()
+        self.assertEqual([d['id'] for d in result['deleted']], [1002])
+
+        # Once it commits, its change isn't skipped even though its
+        # ID is lower than the last one returned. 102 is still running.
+        mock_limit.return_value = 102
+        result = self._get(cursor=result['cursor'])
+        self.assertEqual([d['id'] for d in result['deleted']], [1001])
+
+        mock_limit.return_value = 103
+        result = self._get(cursor=result['cursor'])
+        self.assertEqual([d['id'] for d in result['deleted']], [1003])
+        self.assertEqual(self._get(cursor=result['cursor'])['deleted'], [])
+
+
+@mock.patch('ebpub.openblockapi.views.check_api_authorization',
+            mock.Mock(return_value=True))
+@mock.patch('ebpub.openblockapi.views.throttle_check', mock.Mock(return_value=0))
+class TestBulkAPI(BaseTestCase):
+
+    fixtures = ('test-schema',)
+
+    def _make_geojson(self, title, **props):
+        props.setdefault('type', 'test-schema')
+        props.setdefault('location_name', 'somewhere')
+        props.setdefault('description', 'descr')
+        props.setdefault('url', 'http://example.com/')
+        props['title'] = title
+        return {'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [1.0, -1.0]},
+                'properties': props}
+
+    def _post(self, body):
+        return self.client.post(reverse('items_bulk'), body,
+                                content_type='application/json')
+
+    def test_feature_collection(self):
+        body = simplejson.dumps({
+                'type': 'FeatureCollection',
+                'features': [self._make_geojson('one'),
+                             self._make_geojson('two', lookup=['Lookup 7700 Name', 'New Lookup'])],
+                })
+        response = self._post(body)
+        self.assertEqual(response.status_code, 200)
+        result = simplejson.loads(response.content)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual([r['status'] for r in result['results']], [201, 201])
+        item = NewsItem.objects.get(title='two')
+        self.assertEqual(result['results'][1]['id'], item.id)
+        self.assertEqual(item.attributes['lookup'].split(',')[0], u'7700')
+
+    def test_ndjson_with_errors(self):
+        body = '\n'.join([
+                simplejson.dumps(self._make_geojson('good')),
+                simplejson.dumps(self._make_geojson('', type='test-schema')),
+                simplejson.dumps(self._make_geojson('bad type', type='nonexistent')),
+                simplejson.dumps(self._make_geojson('bad attr', bogus='x')),
+                ])
+        response = self._post(body)
+        self.assertEqual(response.status_code, 200)
+        result = simplejson.loads(response.content)
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(result['errors'], 3)
+        statuses = [r['status'] for r in result['results']]
+        self.assertEqual(statuses, [201, 400, 400, 400])
+        self.assertEqual(result['results'][1]['errors'],
+                         {'title': [u'This field is required.']})
+        self.assertEqual(result['results'][2]['errors'],
+                         {'type': "schema u'nonexistent' does not exist"})
+        self.assertEqual(result['results'][3]['errors'],
+                         {'bogus': 'no such attribute'})
+        self.assertEqual(NewsItem.objects.filter(title='good').count(), 1)
+
+    @mock.patch('ebpub.geocoder.SmartGeocoder.geocode')
+    def test_geocodes_each_name_once(self, mock_geocode):
+        mock_geocode.return_value = {'point': geos.Point(1, -1)}
+        features = []
+        for i in range(3):
+            feature = self._make_geojson('item %d' % i, location_name='123 Main St.')
+            feature['geometry'] = None
+            features.append(feature)
+        response = self._post(simplejson.dumps({'type': 'FeatureCollection',
+                                                'features': features}))
+        result = simplejson.loads(response.content)
+        self.assertEqual(result['created'], 3)
+        self.assertEqual(mock_geocode.call_count, 1)
+
+    def test_bad_body(self):
+        response = self._post('{"oops')
+        self.assertEqual(response.status_code, 400)
+        response = self._post('[1, 2]')
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('ebpub.openblockapi.views.BULK_MAX_ITEMS', 2)
+    def test_too_many_items(self):
+        features = [self._make_geojson('item %d' % i) for i in range(3)]
+        response = self._post(simplejson.dumps({'type': 'FeatureCollection',
+                                                'features': features}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(NewsItem.objects.count(), 0)
+
+    @mock.patch('ebpub.openblockapi.views.throttle_items', mock.Mock(return_value=30))
+    def test_throttled(self):
+        features = [self._make_geojson('item %d' % i) for i in range(3)]
+        response = self._post(simplejson.dumps({'type': 'FeatureCollection',
+                                                'features': features}))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(NewsItem.objects.count(), 0)
+
+    def test_more_items_than_throttle_limit(self):
+        from django.core.cache.backends.locmem import LocMemCache
+        from ebpub.openblockapi.throttle import CacheThrottle
+        def post(count):
+            features = [self._make_geojson('item %d' % i) for i in range(count)]
+            return self._post(simplejson.dumps({'type': 'FeatureCollection',
+                                                'features': features}))
+        with mock.patch('ebpub.openblockapi.throttle.cache', LocMemCache('throttle', {})):
+            with mock.patch('ebpub.openblockapi.views._throttle',
+                            CacheThrottle(throttle_at=3, timeframe=60)):
+                # Could never fit in the limit, so don't ask for a retry.
+                response = post(4)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.has_header('Retry-After'))
+                self.assertEqual(simplejson.loads(response.content)['errors']['__all__'],
+                                 'At most 3 items allowed per request, got 4')
+
+                response = post(3)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(simplejson.loads(response.content)['created'], 3)
+
+                # Fits once the earlier items age out of the timeframe.
+                response = post(3)
+                self.assertEqual(response.status_code, 503)
+                self.assertTrue(0 < int(response['Retry-After']) <= 60)
+                self.assertEqual(NewsItem.objects.count(), 3)
+
+
+class TestThrottle(TestCase):
+
+    def test_remaining(self):
+        from django.core.cache.backends.locmem import LocMemCache
+        from ebpub.openblockapi.throttle import CacheThrottle
+        with mock.patch('ebpub.openblockapi.throttle.cache', LocMemCache('throttle', {})):
+            throttle = CacheThrottle(throttle_at=10, timeframe=60)
+            self.assertEqual(throttle.remaining('bob'), 10)
+            throttle.accessed('bob', count=4)
+            self.assertEqual(throttle.remaining('bob'), 6)
+            throttle.accessed('bob', count=7)
+            self.assertEqual(throttle.remaining('bob'), 0)
+            self.assertTrue(throttle.should_be_throttled('bob'))
+
+
 class TestUtilFunctions(TestCase):
 
     def test_copy_nomulti(self):
@@ -85,6 +85,15 @@ class BaseThrottle(object):
         """
         pass
 
+    def remaining(self, identifier):
+        """
+        Returns how many more accesses the user may make right now.
+
+        Always returns ``throttle_at`` in this implementation, as it
+        doesn't count accesses.
+        """
+        return int(self.throttle_at)
+
 
 class CacheThrottle(BaseThrottle):
     """
@@ -117,17 +126,28 @@ class CacheThrottle(BaseThrottle):
         # Let them through.
         return False
     
-    def accessed(self, identifier, **kwargs):
+    def accessed(self, identifier, count=1, **kwargs):
         """
         Handles recording the user's access.
         
-        Stores the current timestamp in the "accesses" list within the cache.
+        Stores the current timestamp in the "accesses" list within the cache,
+        ``count`` times, eg. for bulk requests.
         """
         key = self.convert_identifier_to_key(identifier)
         times_accessed = cache.get(key, [])
-        times_accessed.append(int(time.time()))
+        times_accessed.extend([int(time.time())] * count)
         cache.set(key, times_accessed, self.expiration)
 
+    def remaining(self, identifier):
+        """
+        Returns how many more accesses the user may make within the
+        current timeframe.
+        """
+        key = self.convert_identifier_to_key(identifier)
+        minimum_time = int(time.time()) - int(self.timeframe)
+        times_accessed = [access for access in cache.get(key, ()) if access >= minimum_time]
+        return max(0, int(self.throttle_at) - len(times_accessed))
+
     def seconds_till_unthrottling(self, identifier):
         """
         New feature for OpenBlock: try to figure out when the user will be un-throttled.
@@ -25,8 +25,10 @@ urlpatterns = patterns(
     url(r'^items.json$', views.items_json, name="items_json"),
     url(r'^items.atom$', views.items_atom, name="items_atom"),
     url(r'^items/types.json$', views.list_types_json, name="list_types_json"),
+    url(r'^items/changes.json$', views.items_changes_json, name="items_changes_json"),
     url(r'^items/(?P<id_>\d+).json$', views.single_item_json, name="single_item_json"),
     url(r'^items/$', views.items_index, name="items_index"),
+    url(r'^items/bulk/$', views.items_bulk, name="items_bulk"),
     url(r'^locations.json$', views.locations_json, name="locations_json"),
     url(r'^locations/types.json', views.location_types_json, name="location_types_json"),
     url(r'^locations/(?P<loctype>[^/].*)/(?P<slug>.*).json$', views.location_detail_json, name="location_detail_json"),
@@ -20,6 +20,7 @@ from apikey.auth import check_api_authorization  # relative import
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError, transaction
 from django.http import Http404
 from django.http import HttpResponse
 from django.http import HttpResponseBadRequest
@@ -31,8 +32,11 @@ from django.utils import simplejson
 from django.utils.cache import patch_response_headers
 from django.utils.cache import patch_vary_headers
 from ebpub.db import models
+from ebpub.db import simplify
+from ebpub.db.versions import conditional_get, LOCATIONS, NEWSITEMS, PLACES
 from ebpub.geocoder import DoesNotExist
 from ebpub.geocoder.base import full_geocode
+from ebpub.openblockapi import changes
 from ebpub.openblockapi.itemquery import _copy_nomulti
 from ebpub.openblockapi.itemquery import build_item_query, build_place_query, QueryError
 from ebpub.streets.models import PlaceType
@@ -193,11 +197,17 @@ def _get_location_info(geometry, location_name):
         raise NotImplementedError("Should do geocoding here.")
     return location, location_name
 
-def rest_view(methods, cache_timeout=None):
+def rest_view(methods, cache_timeout=None, versions=None):
     """
     Decorator that applies throttling and restricts the available HTTP
     methods, and optionally adds some HTTP cache headers based on cache_timeout.
     Also sets the Vary header.
+
+    If ``versions`` is a list of the kinds of data the view depends on
+    (see :py:mod:`ebpub.db.versions`), GET requests are conditional:
+    responses get ``ETag`` and ``Last-Modified`` headers, and we
+    answer 304 Not Modified without calling the view if the client's
+    copy is still current.
     """
     def inner(func):
         @wraps(func)
@@ -207,12 +217,13 @@ def rest_view(methods, cache_timeout=None):
             # Note throttle_check() does auth as a side effect.
             seconds_throttled = throttle_check(request)
             if seconds_throttled > 0:
-                msg = u'Throttle limit exceeded. Try again in %d seconds.\n' % seconds_throttled
-                response = HttpResponse(msg, status=503)
-                response['Retry-After'] = str(seconds_throttled)
-                response['Content-Type'] = 'text/plain'
+                response = _throttled_response(seconds_throttled)
             else:
-                response = func(request, *args, **kwargs)
+                if versions:
+                    response = conditional_get(
+                        request, versions, lambda: func(request, *args, **kwargs))
+                else:
+                    response = func(request, *args, **kwargs)
                 if cache_timeout is not None:
                     patch_response_headers(response, cache_timeout=cache_timeout)
             # Different users may have different stuff filtered.
@@ -223,6 +234,13 @@ def rest_view(methods, cache_timeout=None):
         return wrapper
     return inner
 
+def _throttled_response(seconds_throttled):
+    msg = u'Throttle limit exceeded. Try again in %d seconds.\n' % seconds_throttled
+    response = HttpResponse(msg, status=503)
+    response['Retry-After'] = str(seconds_throttled)
+    response['Content-Type'] = 'text/plain'
+    return response
+
 from ebpub.openblockapi.throttle import CacheThrottle
 
 
@@ -246,6 +264,34 @@ def throttle_check(request):
     Note this does API key auth as a side effect, if user is not
     already logged in.
     """
+    identifier = _throttle_identifier(request)
+
+    if _throttle.should_be_throttled(identifier):
+        # Throttle limit exceeded.
+        return _throttle.seconds_till_unthrottling(identifier)
+
+    # Log throttle access.
+    _throttle.accessed(identifier, url=request.get_full_path(),
+                      request_method=request.method.lower())
+    return 0
+
+def throttle_items(request, count):
+    """
+    Like throttle_check(), but accounts for ``count`` accesses at
+    once, eg. the items of a bulk request. If they don't all fit in
+    the user's limit, nothing is recorded, and returns the number of
+    seconds after which the user can try again; else returns 0.
+    """
+    if count <= 0:
+        return 0
+    identifier = _throttle_identifier(request)
+    if _throttle.remaining(identifier) < count:
+        return max(1, _throttle.seconds_till_unthrottling(identifier))
+    _throttle.accessed(identifier, count=count, url=request.get_full_path(),
+                       request_method=request.method.lower())
+    return 0
+
+def _throttle_identifier(request):
     # First get best user identifier available.
     if request.user.is_anonymous():
         try:
@@ -253,23 +299,14 @@ def throttle_check(request):
         except PermissionDenied:
             pass
     if request.user.is_authenticated():
-        identifier = request.user.username
+        return request.user.username
     else:
         # We don't check KEY_HEADER here because check_api_authorization()
         # should have resolved that to a valid user account.  So, if
         # we're still not authenticated, any KEY_HEADER in the request
         # was a bad key, and we should ignore it.
-        identifier = "%s_%s" % (request.META.get('REMOTE_ADDR', 'noaddr'),
-                                request.META.get('REMOTE_HOST', 'nohost'))
-
-    if _throttle.should_be_throttled(identifier):
-        # Throttle limit exceeded.
-        return _throttle.seconds_till_unthrottling(identifier)
-
-    # Log throttle access.
-    _throttle.accessed(identifier, url=request.get_full_path(),
-                      request_method=request.method.lower())
-    return 0
+        return "%s_%s" % (request.META.get('REMOTE_ADDR', 'noaddr'),
+                          request.META.get('REMOTE_HOST', 'nohost'))
 
 
 class HttpResponseCreated(HttpResponseRedirect):
@@ -290,7 +327,7 @@ def check_api_available(request):
     """
     return HttpResponse(status=200)
 
-@rest_view(['GET'], cache_timeout=3600)
+@rest_view(['GET'], cache_timeout=3600, versions=[NEWSITEMS, LOCATIONS])
 def items_json(request):
     """
     handles the items.json API endpoint
@@ -309,7 +346,7 @@ def items_json(request):
     except QueryError as err:
         return HttpResponseBadRequest(err.message)
 
-@rest_view(['GET'])
+@rest_view(['GET'], versions=[NEWSITEMS, LOCATIONS])
 def items_atom(request):
     """
     handles the items.atom API endpoint
@@ -322,6 +359,45 @@ def items_atom(request):
     except QueryError as err:
         return HttpResponseBadRequest(err.message)
 
+@rest_view(['GET'])
+def items_changes_json(request):
+    """
+    handles the items/changes.json API endpoint: NewsItems created,
+    updated or deleted since the given cursor.
+    See :py:mod:`ebpub.openblockapi.changes`.
+    """
+    try:
+        try:
+            limit = int(request.GET.get('limit', changes.DEFAULT_LIMIT))
+        except ValueError:
+            raise QueryError('Invalid limit')
+        limit = max(1, min(limit, changes.MAX_LIMIT))
+        result = changes.get_changes(request, request.GET.get('cursor'), limit)
+    except QueryError as err:
+        return HttpResponseBadRequest(err.message)
+    features = []
+    for action, item in result['items']:
+        if item.location is None:
+            # Same as items.json.
+            continue
+        feature = _item_geojson_dict(item)
+        feature['properties']['change'] = action
+        features.append(feature)
+    slugs = dict(models.Schema.objects.filter(
+            id__in=set(c.schema_id for c in result['deleted'])).values_list('id', 'slug'))
+    deleted = [{'id': c.news_item_id,
+                'type': slugs.get(c.schema_id),
+                'deleted': c.timestamp,
+                }
+               for c in result['deleted']]
+    body = {'type': 'FeatureCollection',
+            'features': features,
+            'deleted': deleted,
+            'cursor': result['cursor'],
+            'more': result['more'],
+            }
+    return APIGETResponse(request, body, content_type=JSON_CONTENT_TYPE)
+
 @rest_view(['GET', 'POST'])
 def items_index(request):
     """
@@ -352,13 +428,15 @@ class InvalidNewsItem(Exception):
     def __init__(self, errors):
         self.errors = errors
 
-#@permission_required('db.add_newsitem')
-def _item_create(info):
+def _item_form_data(info):
+    # Checks the GeoJSON Feature ``info`` and extracts the basic
+    # NewsItem fields. Returns (schema, form data, remaining properties);
+    # the caller still has to handle location_name and geometry.
     info = copy.deepcopy(info)
     try:
         assert info.pop('type') == 'Feature'
         props = info['properties']
-    except (KeyError, AssertionError):
+    except (KeyError, AssertionError, AttributeError, TypeError):
         raise InvalidNewsItem({'type': 'not a valid GeoJSON Feature'})
     try:
         slug = props.pop('type', None)
@@ -391,14 +469,30 @@ def _item_create(info):
             data['item_date'] = data['pub_date'].date()
         except Exception:
             data['item_date'] = None
+    return schema, data, props
 
-    data['location'], data['location_name'] = _get_location_info(
-        info.get('geometry'), props.pop('location_name', None))
+def _warn_if_no_location(data):
     if not data['location']:
         logger.warn("Saving NewsItem %s with no geometry" % data['title'])
     if not data['location_name']:
         logger.warn("Saving NewsItem %s with no location_name" % data['title'])
 
+def _convert_attribute(sf, val):
+    # Converts non-lookup attribute values from their JSON form.
+    if sf.is_type('date'):
+        val = normalize_datetime(parse_date(val, '%Y-%m-%d'))
+    elif sf.is_type('time'):
+        val = normalize_datetime(parse_time(val, '%H:%M'))
+    elif sf.is_type('datetime'):
+        val = normalize_datetime(pyrfc3339.parse(val))
+    return val
+
+#@permission_required('db.add_newsitem')
+def _item_create(info):
+    schema, data, props = _item_form_data(info)
+    data['location'], data['location_name'] = _get_location_info(
+        info.get('geometry'), props.pop('location_name', None))
+    _warn_if_no_location(data)
 
     from ebpub.db.forms import NewsItemForm
     form = NewsItemForm(data)
@@ -419,18 +513,220 @@ def _item_create(info):
             val = ','.join((str(lookup.id) for lookup in lookups))
         elif sf.is_lookup:
             val = models.Lookup.objects.get_or_create_lookup(sf, val)
-        elif sf.is_type('date'):
-            val = normalize_datetime(parse_date(val, '%Y-%m-%d'))
-        elif sf.is_type('time'):
-            val = normalize_datetime(parse_time(val, '%H:%M'))
-        elif sf.is_type('datetime'):
-            val = normalize_datetime(pyrfc3339.parse(datetime))
+        else:
+            val = _convert_attribute(sf, val)
         attributes[key] = val
     item.attributes = attributes
     return item
 
 
-@rest_view(['GET'], cache_timeout=3600)
+############################################################
+# Bulk item creation.
+############################################################
+
+# Max number of items per bulk POST.
+BULK_MAX_ITEMS = getattr(settings, 'API_BULK_MAX_ITEMS', 1000)
+
+# Valid items are saved in transactions of this many.
+BULK_BATCH_SIZE = 100
+
+@rest_view(['POST'])
+def items_bulk(request):
+    """
+    POST: Takes a GeoJSON FeatureCollection, or newline-delimited
+    GeoJSON Features, each describing a NewsItem as for
+    ``items_index``, and creates them.
+
+    All items are validated first; the valid ones are then saved in
+    batches. Location names without a geometry are geocoded, each
+    distinct name only once. Every item counts against the user's
+    throttle limit, so a request may have at most as many items as
+    that limit, even if ``API_BULK_MAX_ITEMS`` is higher; more than
+    that could never get through, so it's a 400 rather than a 503.
+
+    Returns a JSON mapping with the number of items ``created``, the
+    number of ``errors``, and a list of ``results`` in the same order
+    as the input, each with a ``status`` of 201 plus the new ``id``
+    and ``url``, or 400 plus ``errors``.
+    """
+    check_api_authorization(request)
+    try:
+        features = _parse_bulk_body(request.raw_post_data)
+    except ValueError, e:
+        return HttpResponseBadRequest(
+            simplejson.dumps({'errors': {'__all__': str(e)}}, indent=2),
+            content_type=JSON_CONTENT_TYPE)
+    max_items = min(BULK_MAX_ITEMS, int(_throttle.throttle_at))
+    if len(features) > max_items:
+        return HttpResponseBadRequest(
+            simplejson.dumps({'errors': {'__all__': 'At most %d items allowed per request, got %d'
+                                         % (max_items, len(features))}}, indent=2),
+            content_type=JSON_CONTENT_TYPE)
+    # rest_view() already counted the request itself.
+    seconds_throttled = throttle_items(request, len(features) - 1)
+    if seconds_throttled > 0:
+        return _throttled_response(seconds_throttled)
+
+    results = [None] * len(features)
+    valid = []
+    geocode = _bulk_geocoder()
+    for i, info in enumerate(features):
+        try:
+            form, attributes = _bulk_validate(info, geocode)
+        except InvalidNewsItem, e:
+            results[i] = {'status': 400, 'errors': e.errors}
+        else:
+            valid.append((i, form, attributes))
+
+    for start in range(0, len(valid), BULK_BATCH_SIZE):
+        batch = valid[start:start + BULK_BATCH_SIZE]
+        try:
+            items = _bulk_save(batch)
+        except DatabaseError, e:
+            logger.exception("Error saving batch of items")
+            for i, form, attributes in batch:
+                results[i] = {'status': 500, 'errors': {'__all__': 'Database error: %s' % e}}
+        else:
+            for (i, form, attributes), item in zip(batch, items):
+                results[i] = {'status': 201, 'id': item.id,
+                              'url': reverse('single_item_json', kwargs={'id_': str(item.id)})}
+
+    created = len([r for r in results if r['status'] == 201])
+    body = {'created': created,
+            'errors': len(results) - created,
+            'results': results}
+    return HttpResponse(simplejson.dumps(body, indent=1), content_type=JSON_CONTENT_TYPE)
+
+def _parse_bulk_body(body):
+    # Returns a list of decoded Features, from either a FeatureCollection
+    # or newline-delimited JSON. Raises ValueError.
+    try:
+        data = simplejson.loads(body)
+    except ValueError:
+        pass
+    else:
+        if isinstance(data, dict):
+            if data.get('type') == 'FeatureCollection':
+                return list(data.get('features') or [])
+            # A single Feature, or one line of newline-delimited JSON.
+            return [data]
+        raise ValueError('Expected a FeatureCollection or newline-delimited Features')
+    features = []
+    for lineno, line in enumerate(body.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            features.append(simplejson.loads(line))
+        except ValueError:
+            raise ValueError('Invalid JSON on line %d' % (lineno + 1))
+    return features
+
+def _bulk_geocoder():
+    # Returns a function that geocodes a location name to a Point, or
+    # raises InvalidNewsItem; each distinct name is only geocoded once.
+    from ebpub.geocoder import SmartGeocoder, GeocodingException, ParsingError
+    geocoder = SmartGeocoder()
+    results = {}
+    def geocode(location_name):
+        if location_name not in results:
+            try:
+                results[location_name] = geocoder.geocode(location_name)['point']
+            except (GeocodingException, ParsingError):
+                results[location_name] = None
+        point = results[location_name]
+        if point is None:
+            raise InvalidNewsItem({'location_name': 'could not geocode %r' % location_name})
+        return point
+    return geocode
+
+def _bulk_validate(info, geocode):
+    # Returns (NewsItemForm, attributes) for one item, without saving
+    # anything. Raises InvalidNewsItem.
+    from django.contrib.gis.geos import GEOSException
+    from ebpub.db.forms import NewsItemForm
+    from ebpub.db.schemaregistry import schema_registry
+    schema, data, props = _item_form_data(info)
+    geometry = info.get('geometry')
+    location_name = props.pop('location_name', None)
+    if geometry:
+        try:
+            data['location'], data['location_name'] = _get_location_info(geometry, location_name)
+        except NotImplementedError:
+            raise InvalidNewsItem({'location_name': 'required with a geometry'})
+        except (GEOSException, ValueError):
+            raise InvalidNewsItem({'geometry': 'not a valid GeoJSON geometry'})
+    elif location_name:
+        data['location'], data['location_name'] = geocode(location_name), location_name
+    else:
+        data['location'] = data['location_name'] = None
+    _warn_if_no_location(data)
+
+    form = NewsItemForm(data)
+    if not form.is_valid():
+        raise InvalidNewsItem(form.errors)
+
+    # Lookups are resolved when saving, so we can create them in bulk.
+    attributes = {}
+    errors = {}
+    for key, val in props.items():
+        sf = schema_registry.get_schemafield(schema.id, key)
+        if sf is None:
+            errors[key] = 'no such attribute'
+        elif sf.is_many_to_many_lookup():
+            if not isinstance(val, list):
+                val = [val]
+            attributes[key] = [unicode(v) for v in val]
+        elif sf.is_lookup:
+            attributes[key] = unicode(val)
+        else:
+            try:
+                attributes[key] = _convert_attribute(sf, val)
+            except Exception:
+                errors[key] = 'invalid value %r' % (val,)
+    if errors:
+        raise InvalidNewsItem(errors)
+    return form, attributes
+
+@transaction.commit_on_success
+def _bulk_save(batch):
+    # Saves a batch of (index, NewsItemForm, attributes) in one
+    # transaction; returns the new NewsItems.
+    from ebpub.db.lookupcache import LookupCache
+    from ebpub.db.schemaregistry import schema_registry
+    lookup_names = {}
+    for i, form, attributes in batch:
+        schema_id = form.cleaned_data['schema'].id
+        for key, val in attributes.items():
+            sf = schema_registry.get_schemafield(schema_id, key)
+            if sf.is_lookup:
+                names = lookup_names.setdefault(sf.id, (sf, []))[1]
+                if sf.is_many_to_many_lookup():
+                    names.extend(val)
+                else:
+                    names.append(val)
+    lookup_caches = {}
+    for sf, names in lookup_names.values():
+        lookup_caches[sf.id] = LookupCache(sf)
+        lookup_caches[sf.id].get_or_create_many(names)
+
+    items = []
+    for i, form, attributes in batch:
+        item = form.save()
+        for key, val in attributes.items():
+            sf = schema_registry.get_schemafield(item.schema_id, key)
+            if sf.is_many_to_many_lookup():
+                cache = lookup_caches[sf.id]
+                attributes[key] = ','.join(str(cache.get_or_create(v).id) for v in val)
+            elif sf.is_lookup:
+                attributes[key] = lookup_caches[sf.id].get_or_create(val).id
+        if attributes:
+            item.attributes = attributes
+        items.append(item)
+    return items
+
+
+@rest_view(['GET'], cache_timeout=3600, versions=[NEWSITEMS])
 def single_item_json(request, id_=None):
     """
     GET a single item as GeoJSON.
@@ -439,7 +735,8 @@ def single_item_json(request, id_=None):
     # TODO: handle PUT, DELETE?
     from ebpub.db.models import NewsItem
     item = get_object_or_404(
-        NewsItem.objects.by_request(request).select_related(), pk=id_)
+        NewsItem.objects.by_request(request).select_related().with_attributes(),
+        pk=id_)
     return APIGETResponse(request, item, content_type=JSON_CONTENT_TYPE)
 
 
@@ -564,7 +861,7 @@ def _geocode_geojson(query):
     return features
 
 
-@rest_view(['GET'], cache_timeout = 24 * 3600)
+@rest_view(['GET'], cache_timeout=24 * 3600, versions=[NEWSITEMS])
 def list_types_json(request):
     """
     List the known NewsItem types (Schemas).
@@ -592,14 +889,14 @@ def list_types_json(request):
     return APIGETResponse(request, simplejson.dumps(schemas, indent=1),
                           content_type=JSON_CONTENT_TYPE)
 
-@rest_view(['GET'], cache_timeout=24 * 3600)
+@rest_view(['GET'], cache_timeout=24 * 3600, versions=[LOCATIONS])
 def locations_json(request):
     locations = models.Location.objects.filter(is_public=True)
     loctype = request.GET.get('type')
     if loctype is not None:
         locations = locations.filter(location_type__slug=loctype)
 
-    locations = locations.order_by('display_order').select_related().defer('location')
+    locations = locations.order_by('display_order').select_related('location_type').lean()
     
     loc_objs = [
         {'id': "%s/%s" % (loc.location_type.slug, loc.slug),
@@ -613,7 +910,7 @@ def locations_json(request):
     return APIGETResponse(request, simplejson.dumps(loc_objs, indent=1),
                           content_type=JSON_CONTENT_TYPE)
 
-@rest_view(['GET'], cache_timeout=24 * 3600)
+@rest_view(['GET'], cache_timeout=24 * 3600, versions=[LOCATIONS])
 def location_detail_json(request, loctype, slug):
     # TODO: this will obsolete ebpub.db.views.ajax_location
     try:
@@ -621,18 +918,23 @@ def location_detail_json(request, loctype, slug):
     except (ValueError, models.LocationType.DoesNotExist):
         raise Http404("No such location type %r" % loctype)
     try:
-        location = models.Location.objects.geojson().get(
+        tolerance = simplify.parse_tolerance(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid tolerance or zoom")
+    try:
+        # The geometry comes from location_geojson(), maybe simplified.
+        location = models.Location.objects.lean().centroid(model_att='center').get(
             location_type=loctype_obj, slug=slug)
     except (ValueError, models.Location.DoesNotExist):
         raise Http404("No such location %r/%r" % (loctype, slug))
     geojson = {'type': 'Feature',
                'id': '%s/%s' % (loctype, slug),
-               'geometry': simplejson.loads(location.geojson),
+               'geometry': simplejson.loads(simplify.location_geojson(location, tolerance)),
                'properties': {'type': loctype,
                               'slug': location.slug,
                               'source': location.source,
                               'description': location.description,
-                              'centroid': location.location.centroid.wkt,
+                              'centroid': location.center and location.center.wkt or None,
                               'area': location.area,
                               'population': location.population,
                               'city': location.city,
@@ -643,7 +945,7 @@ def location_detail_json(request, loctype, slug):
     geojson = simplejson.dumps(geojson, indent=1)
     return APIGETResponse(request, geojson, content_type=JSON_CONTENT_TYPE)
 
-@rest_view(['GET'], cache_timeout = 24 * 3600)
+@rest_view(['GET'], cache_timeout=24 * 3600, versions=[LOCATIONS])
 def location_types_json(request):
     typelist = models.LocationType.objects.order_by('plural_name').values(
         'name', 'plural_name', 'scope', 'slug')
@@ -655,7 +957,7 @@ def location_types_json(request):
                          content_type=JSON_CONTENT_TYPE)
 
 
-@rest_view(['GET'], cache_timeout = 24 * 3600)
+@rest_view(['GET'], cache_timeout=24 * 3600, versions=[PLACES])
 def place_types_json(request):
     typelist = PlaceType.objects.filter(is_mappable=True).order_by('plural_name').values(
         'name', 'plural_name', 'slug')
@@ -668,7 +970,7 @@ def place_types_json(request):
     return APIGETResponse(request, simplejson.dumps(typedict, indent=1),
                          content_type=JSON_CONTENT_TYPE)
 
-@rest_view(['GET'], cache_timeout = 24 * 3600)
+@rest_view(['GET'], cache_timeout=24 * 3600, versions=[PLACES])
 def place_detail_json(request, placetype):
     try:
         placetype_obj = PlaceType.objects.get(slug=placetype, is_mappable=True)
@@ -685,7 +987,7 @@ def place_detail_json(request, placetype):
     places, params = build_place_query(params)
     for place in places:
         feature = {'type': 'Feature',
-                   'geometry': simplejson.loads(place.location.geojson),
+                   'geometry': simplify.round_geojson(simplejson.loads(place.location.geojson)),
                    'properties': {'type': placetype,
                                   'name': place.pretty_name,
                                   'address': place.address,
@@ -26,6 +26,7 @@ from django.utils import simplejson
 from django.utils.cache import patch_response_headers
 from ebpub.db.models import NewsItem
 from ebpub.db.schemafilters import FilterChain
+from ebpub.db.simplify import round_geojson
 from ebpub.db.views import _get_filter_schemafields
 from ebpub.openblockapi.itemquery import build_item_query
 from ebpub.openblockapi.views import JSON_CONTENT_TYPE
@@ -503,7 +504,7 @@ def map_items_json(request):
     items, params = build_item_query(request)
 
     def _item_to_feature(item):
-        geom = simplejson.loads(item.location.geojson)
+        geom = round_geojson(simplejson.loads(item.location.geojson))
         result = {
             'type': 'Feature',
             'geometry': geom,
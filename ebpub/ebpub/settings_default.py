@@ -151,6 +151,10 @@ SKIP_SOUTH_TESTS = True
 SOUTH_TESTS_MIGRATE = True
 
 MIDDLEWARE_CLASSES = (
+    # Does nothing unless SQL_PROFILE_SAMPLE_RATE is set, see below.
+    'ebpub.utils.sqlprofile.SQLProfileMiddleware',
+    # Does nothing unless DATABASE_REPLICAS is set; see ebpub.utils.multidb.
+    'ebpub.utils.multidb.ReplicaMiddleware',
     'django.middleware.gzip.GZipMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -422,6 +426,15 @@ AUTH_PROFILE_MODULE = 'preferences.Profile'
 # a request argument and returns True or False.
 NEIGHBORNEWS_USE_CAPTCHA = False
 
+# Per-view SQL profiling (see ebpub.utils.sqlprofile): fraction of
+# requests to profile, eg. 0.05. Zero turns it off.  Results are
+# kept in CACHES['default'], so that must not be a DummyCache.
+SQL_PROFILE_SAMPLE_RATE = 0
+# Stats are kept in buckets of this many seconds...
+SQL_PROFILE_WINDOW = 60 * 60
+# ... and this many buckets are kept.
+SQL_PROFILE_BUCKETS = 24
+
 # Batch jobs (django-background-task): how long (in seconds) can a job
 # be locked before we decide it's dead?
 MAX_RUN_TIME = 60 * 15
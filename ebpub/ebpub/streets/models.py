@@ -82,6 +82,7 @@ from django.core import urlresolvers
 from django.db.models import Q
 from ebpub.geocoder.parser.parsing import normalize
 from ebpub.metros.allmetros import get_metro
+from ebpub.utils.geodjango import LeanGeoManager
 import logging
 import operator
 import re
@@ -138,7 +139,7 @@ def proper_city(block):
         block_city = _first_not_false(block.left_city, block.right_city, u'')
     return block_city
 
-class BlockManager(models.GeoManager):
+class BlockManager(LeanGeoManager):
     def search(self, street, number=None, prefix=None, predir=None,
                suffix=None, postdir=None, city=None, state=None, zipcode=None):
         """
@@ -645,7 +646,7 @@ class Place(models.Model):
                            help_text='link to additional information')
 
     location = models.PointField(blank=True)
-    objects = models.GeoManager()
+    objects = LeanGeoManager()
 
     def __unicode__(self):
         if self.address:
@@ -730,7 +731,7 @@ class BlockIntersection(models.Model):
         return u'%s intersecting %s' % (self.block, self.intersecting_block)
 
 
-class IntersectionManager(models.GeoManager):
+class IntersectionManager(LeanGeoManager):
     def search(self, predir_a=None, prefix_a=None, street_a=None, suffix_a=None, postdir_a=None,
                      predir_b=None, prefix_b=None, street_b=None, suffix_b=None, postdir_b=None):
         """
@@ -844,3 +845,12 @@ class Suburb(models.Model):
 
     def __unicode__(self):
         return self.name
+
+
+# Version stamps for conditional GET; see ebpub.db.versions.
+from django.db.models.signals import post_save, post_delete
+from ebpub.db import versions
+for _model in (PlaceType, Place):
+    post_save.connect(versions.places_changed, sender=_model)
+    post_delete.connect(versions.places_changed, sender=_model)
+del _model
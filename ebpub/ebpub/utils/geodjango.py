@@ -23,6 +23,7 @@ Utility functions for working with GeoDjango GDAL and GEOS data
 """
 
 from django.contrib.gis import geos
+from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point, LineString, Polygon, GeometryCollection, MultiPoint, MultiLineString, MultiPolygon
 from ebpub.metros.allmetros import get_metro
 import logging
@@ -303,3 +304,50 @@ def geos_with_projection(geom, projection=4326):
     if hasattr(geom, 'geos'):
         geom = geom.geos
     return geom
+
+
+def geometry_field_names(model):
+    """
+    Returns the names of all geometry fields of the given model.
+    """
+    from django.contrib.gis.db.models.fields import GeometryField
+    return [f.name for f in model._meta.fields if isinstance(f, GeometryField)]
+
+
+class LeanGeoQuerySet(models.query.GeoQuerySet):
+
+    """
+    GeoQuerySet with a :py:meth:`lean` preset for list and chart code
+    that doesn't need geometries.
+    """
+
+    def lean(self, *fields):
+        """
+        Returns a QuerySet that doesn't load any geometry fields, which
+        can be big (think ZIP code polygons); or, if ``fields`` are
+        given, loads only those.
+
+        Instances are deferred models: accessing a field that wasn't
+        loaded costs one query per instance, so only use this where
+        the geometry really isn't needed.
+        """
+        if fields:
+            return self.only(*fields)
+        return self.defer(*geometry_field_names(self.model))
+
+
+class LeanGeoManager(models.GeoManager):
+
+    """
+    GeoManager whose querysets have a ``lean()`` method;
+    see :py:meth:`LeanGeoQuerySet.lean`.
+    """
+
+    def get_query_set(self):
+        return LeanGeoQuerySet(self.model, using=self._db)
+
+    def lean(self, *fields):
+        """
+        See :py:meth:`LeanGeoQuerySet.lean`
+        """
+        return self.get_query_set().lean(*fields)
@@ -16,8 +16,70 @@
 #   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+"""
+Database routers, for sites with more than one database.
+
+:py:class:`PerModelDBRouter` assigns whole models to databases.
+
+:py:class:`ReplicaRouter` sends reads to read-only replicas of the
+primary ("default") database, eg. PostgreSQL streaming replication
+standbys, so scrapers writing to the primary don't compete with page
+views, API requests and batch jobs for it. To use it::
+
+    DATABASES = {
+        'default': {...},  # The primary.
+        'replica1': {...},
+        'replica2': {...},
+    }
+    DATABASE_REPLICAS = ['replica1', 'replica2']
+    DATABASE_ROUTERS = ['ebpub.utils.multidb.ReplicaRouter']
+
+and keep :py:class:`ReplicaMiddleware` in ``MIDDLEWARE_CLASSES``.
+Then:
+
+* Reads go to a randomly chosen replica, the same one for the rest
+  of the request (or thread). Replicas that can't be reached, or
+  that are more than ``DATABASE_REPLICA_MAX_LAG`` seconds (default 30)
+  behind the primary, are skipped; each replica is checked at most
+  every ``DATABASE_REPLICA_CHECK_INTERVAL`` seconds (default 10), see
+  :py:class:`ReplicaHealth`. If no replica is usable, reads go to
+  the primary.
+
+* Writes go to the primary. After a write, the rest of the request
+  reads from the primary too, so it sees what it just wrote; and
+  after a POST (etc.) that wrote something, the middleware sets a
+  cookie so the same browser reads from the primary for the next
+  ``DATABASE_REPLICA_MAX_LAG`` seconds, eg. on the page it's
+  redirected to.
+
+* Batch jobs can pin all their reads to one replica with
+  :py:func:`use_replica`, or to the primary with
+  :py:func:`use_primary`.
+
+Raw SQL on ``django.db.connection`` always goes to the primary, and
+the router doesn't notice writes made that way. Code that wants raw
+SQL reads to follow :py:func:`use_replica` can use
+``connections[pinned_db()]``.
+
+It's also usable with :py:class:`PerModelDBRouter`'s
+``DATABASE_ROUTES``: models routed there ignore the replicas.
+
+To try it out with two local databases, make the replica a copy of
+the primary (or set its ``TEST_MIRROR`` to ``'default'`` for tests).
+"""
+
+from contextlib import contextmanager
 from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+import logging
+import random
 import re
+import threading
+import time
+
+logger = logging.getLogger('ebpub.utils.multidb')
 
 class PerModelDBRouter:
     """
@@ -92,3 +154,247 @@ class PerModelDBRouter:
             else:
                 return None
         return assigned_db_alias == db
+
+
+# Defaults for settings; see module docs.
+MAX_LAG = 30
+CHECK_INTERVAL = 10
+
+# Cookie that sends a browser's reads to the primary for a while.
+PRIMARY_COOKIE = 'ebpub_use_primary'
+
+# How far a replica is behind the primary, in seconds. Zero if it has
+# replayed everything it received; NULL if it hasn't replayed
+# anything yet, which we treat like being down.
+POSTGRESQL_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_xlog_receive_location() = pg_last_xlog_replay_location() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END"""
+
+# Other databases can only tell us they're up.
+DEFAULT_LAG_SQL = 'SELECT 0'
+
+
+def _setting(name, default):
+    return getattr(settings, 'DATABASE_REPLICA_' + name, default)
+
+
+def replicas():
+    """
+    Returns the aliases of the replica databases, from
+    ``settings.DATABASE_REPLICAS``.
+    """
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+class ReplicaHealth(object):
+    """
+    Keeps track of how far behind each replica is, checking each one
+    at most every ``DATABASE_REPLICA_CHECK_INTERVAL`` seconds. You
+    normally want the module-level ``health`` instance.
+    """
+
+    def __init__(self):
+        self._status = {}  # {alias: (time checked, lag or None)}
+
+    def check(self, alias):
+        """
+        Returns how many seconds ``alias`` is behind the primary, or
+        None if it can't be reached.
+        """
+        engine = settings.DATABASES[alias]['ENGINE']
+        if 'postgis' in engine or 'postgresql' in engine:
+            sql = POSTGRESQL_LAG_SQL
+        else:
+            sql = DEFAULT_LAG_SQL
+        try:
+            cursor = connections[alias].cursor()
+            cursor.execute(sql)
+            lag = cursor.fetchone()[0]
+            # Don't leave a transaction open on the replica.
+            transaction.rollback_unless_managed(using=alias)
+        except Exception:
+            logger.warn("Replica database %r is unavailable" % alias, exc_info=True)
+            try:
+                connections[alias].close()
+            except Exception:
+                pass
+            return None
+        if lag is None:
+            logger.warn("Replica database %r hasn't replayed anything yet" % alias)
+            return None
+        return float(lag)
+
+    def lag(self, alias):
+        """
+        Like :py:meth:`check`, but only checks again if the last
+        check is older than ``DATABASE_REPLICA_CHECK_INTERVAL``.
+        """
+        now = time.time()
+        status = self._status.get(alias)
+        if status is None or now - status[0] >= _setting('CHECK_INTERVAL', CHECK_INTERVAL):
+            # Threads may race to check; that's harmless.
+            status = (now, self.check(alias))
+            self._status[alias] = status
+        return status[1]
+
+    def is_usable(self, alias, max_lag=None):
+        """
+        Whether ``alias`` is up and at most ``max_lag`` (default
+        ``DATABASE_REPLICA_MAX_LAG``) seconds behind.
+        """
+        if max_lag is None:
+            max_lag = _setting('MAX_LAG', MAX_LAG)
+        lag = self.lag(alias)
+        if lag is None:
+            return False
+        if lag > max_lag:
+            logger.info("Replica database %r is %.1f seconds behind" % (alias, lag))
+            return False
+        return True
+
+    def reset(self):
+        self._status.clear()
+
+health = ReplicaHealth()
+
+
+def choose_replica(max_lag=None):
+    """
+    Returns the alias of a randomly chosen usable replica, or None if
+    there aren't any.
+    """
+    usable = [alias for alias in replicas() if health.is_usable(alias, max_lag)]
+    if usable:
+        return random.choice(usable)
+    return None
+
+
+class _ReplicaState(threading.local):
+    # Per-thread routing state; cleared by ReplicaMiddleware for
+    # each request.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pinned = None  # Alias set by use_replica() / use_primary().
+        self.replica = None  # Replica chosen for this request.
+        self.wrote = False
+        self.use_primary = False
+
+_state = _ReplicaState()
+
+
+@contextmanager
+def use_replica(alias=None, max_lag=None):
+    """
+    Context manager that sends all ORM reads in this thread to one
+    replica, chosen by :py:func:`choose_replica` unless ``alias`` is
+    given, even after writes. Falls back to the primary if no
+    replica is usable. Yields the alias used, eg::
+
+        with use_replica():
+            send_all(frequency)
+
+    Reads may then be up to ``max_lag`` seconds (default
+    ``DATABASE_REPLICA_MAX_LAG``) out of date, so don't use this for
+    reads that need to see earlier writes.
+    """
+    if alias is None:
+        alias = choose_replica(max_lag)
+        if alias is None:
+            if replicas():
+                logger.warn("No usable replica database; reading from the primary")
+            alias = DEFAULT_DB_ALIAS
+    previous = _state.pinned
+    _state.pinned = alias
+    try:
+        yield alias
+    finally:
+        _state.pinned = previous
+
+
+def use_primary():
+    """
+    Context manager that sends all ORM reads in this thread to the
+    primary database.
+    """
+    return use_replica(DEFAULT_DB_ALIAS)
+
+
+def pinned_db():
+    """
+    Returns the alias that :py:func:`use_replica` or
+    :py:func:`use_primary` pinned reads to, or the primary's alias.
+    For raw SQL reads.
+    """
+    return _state.pinned or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter(PerModelDBRouter):
+    """
+    Router that sends reads to replicas and writes to the primary;
+    see module docs.
+    """
+
+    @property
+    def routes(self):
+        if hasattr(self, '_routes'):
+            return self._routes
+        return getattr(settings, 'DATABASE_ROUTES', {})
+
+    def db_for_read(self, model, **hints):
+        db = self._find_db(model)
+        if db is not None:
+            return db
+        if _state.pinned is not None:
+            return _state.pinned
+        if _state.wrote or _state.use_primary:
+            return DEFAULT_DB_ALIAS
+        if _state.replica is None or not health.is_usable(_state.replica):
+            _state.replica = choose_replica()
+        return _state.replica or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        # Never fall back to the database the instance was read from.
+        return self._find_db(model) or DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas are copies of the primary.
+        same = set([DEFAULT_DB_ALIAS] + replicas())
+        if obj1._state.db in same and obj2._state.db in same:
+            return True
+        return PerModelDBRouter.allow_relation(self, obj1, obj2, **hints)
+
+    def allow_syncdb(self, db, model):
+        if db in replicas():
+            return False
+        return PerModelDBRouter.allow_syncdb(self, db, model)
+
+
+class ReplicaMiddleware(object):
+    """
+    Resets :py:class:`ReplicaRouter`'s state for each request, and
+    keeps browsers that just changed something reading from the
+    primary for a while. Does nothing unless ``DATABASE_REPLICAS`` is
+    set.
+    """
+
+    def __init__(self):
+        if not replicas():
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+        _state.reset()
+        if request.COOKIES.get(PRIMARY_COOKIE):
+            _state.use_primary = True
+
+    def process_response(self, request, response):
+        if _state.wrote and request.method not in ('GET', 'HEAD'):
+            response.set_cookie(PRIMARY_COOKIE, '1',
+                                max_age=max(1, int(_setting('MAX_LAG', MAX_LAG))))
+        _state.reset()
+        return response
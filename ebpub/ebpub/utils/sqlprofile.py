@@ -0,0 +1,404 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Per-view SQL profiling that's cheap enough to leave on in production.
+
+:py:class:`SQLProfileMiddleware` picks a random sample of requests
+(``SQL_PROFILE_SAMPLE_RATE``, eg. 0.05 for 5%) and records, per view,
+how many queries each one ran, how long they took, and which queries
+they were. Queries are grouped by "fingerprint": the SQL with all
+literal values replaced by ``?``, so that eg. every
+``SELECT ... WHERE id = 123`` counts as the same query.
+
+Each process accumulates stats in memory and merges them into the
+Django cache every ``SQL_PROFILE_FLUSH_INTERVAL`` seconds, in buckets
+of ``SQL_PROFILE_WINDOW`` seconds; the last ``SQL_PROFILE_BUCKETS``
+buckets are kept. So you need a cache that's shared between processes
+(eg. memcached) to see stats from all of them. Merging isn't atomic,
+so with many processes the occasional flush may get lost; that's fine
+for sampled stats.
+
+To see the results, use the ``sql_profile`` management command, or
+the "SQL profile" page of the admin UI.
+
+To enable it, set ``SQL_PROFILE_SAMPLE_RATE`` to a number greater than
+0. ``SQLProfileMiddleware`` should be first in ``MIDDLEWARE_CLASSES``,
+so it sees queries made by other middleware too.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+import bisect
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger('ebpub.utils.sqlprofile')
+
+# Defaults for settings; see module docs.
+SAMPLE_RATE = 0
+WINDOW = 60 * 60
+BUCKETS = 24
+FLUSH_INTERVAL = 30
+
+# Upper bounds of histogram bins; the last bin is everything larger.
+QUERY_COUNT_BINS = (0, 1, 5, 10, 25, 50, 100, 250, 500)
+DB_TIME_BINS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)  # milliseconds
+
+# Keep only this many of the most expensive fingerprints, per bucket
+# and per view, so the cache entries stay small.
+MAX_FINGERPRINTS = 200
+MAX_VIEW_FINGERPRINTS = 25
+
+# Don't store crazy long SQL.
+MAX_SQL_LENGTH = 2000
+
+CACHE_KEY_PREFIX = 'ebpub.sqlprofile.'
+
+
+def _setting(name, default):
+    return getattr(settings, 'SQL_PROFILE_' + name, default)
+
+
+_string_re = re.compile(r"[EeBbXx]?'(?:[^']|'')*'")
+_number_re = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+_boolean_re = re.compile(r'\b(?:true|false)\b', re.I)
+_in_list_re = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.I)
+_tuple = r'\(\s*\?(?:\s*,\s*\?)*\s*\)'
+_values_re = re.compile(r'(%s)(?:\s*,\s*%s)+' % (_tuple, _tuple))
+_executemany_re = re.compile(r'^\d+ times: ')
+_whitespace_re = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """
+    Returns ``sql`` with literal values replaced by ``?``, lists of
+    values collapsed, and whitespace squeezed, so that queries that
+    differ only in their parameters look the same.
+
+    >>> normalize_sql("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'it''s'")
+    'SELECT * FROM t WHERE id IN (...) AND name = ?'
+    """
+    sql = _executemany_re.sub('', sql)
+    sql = _string_re.sub('?', sql)
+    sql = _number_re.sub('?', sql)
+    sql = _boolean_re.sub('?', sql)
+    sql = _in_list_re.sub('IN (...)', sql)
+    sql = _values_re.sub(r'\1, ...', sql)
+    sql = _whitespace_re.sub(' ', sql).strip()
+    return sql[:MAX_SQL_LENGTH]
+
+
+def fingerprint(sql):
+    """
+    Returns a (key, normalized_sql) tuple for a query; ``key`` is a
+    short hash that's the same for all queries with the same
+    :py:func:`normalize_sql` form.
+    """
+    normalized = normalize_sql(sql)
+    return hashlib.md5(normalized.encode('utf8')).hexdigest()[:12], normalized
+
+
+def view_name(view_func):
+    """
+    Returns a dotted name for a view function, eg.
+    'ebpub.db.views.place_detail_overview'.
+    """
+    func = getattr(view_func, 'func', view_func)  # functools.partial
+    name = getattr(func, '__name__', None) or func.__class__.__name__
+    return '%s.%s' % (getattr(func, '__module__', '?'), name)
+
+
+def _empty_view():
+    return {
+        'requests': 0,
+        'queries': 0,
+        'db_time': 0.0,
+        'max_queries': 0,
+        'max_db_time': 0.0,
+        'query_hist': [0] * (len(QUERY_COUNT_BINS) + 1),
+        'time_hist': [0] * (len(DB_TIME_BINS) + 1),
+        'fingerprints': {},  # {key: [count, time]}
+    }
+
+
+def _empty_stats():
+    return {
+        'views': {},  # {view name: see _empty_view()}
+        'fingerprints': {},  # {key: {'sql': ..., 'count': ..., 'time': ...}}
+    }
+
+
+def _trim(fingerprints, limit, get_time):
+    if len(fingerprints) <= limit:
+        return fingerprints
+    keep = sorted(fingerprints.items(), key=lambda item: get_time(item[1]),
+                  reverse=True)[:limit]
+    return dict(keep)
+
+
+def merge_stats(into, other):
+    """
+    Adds the stats dict ``other`` into ``into``, and returns ``into``.
+    """
+    for name, view in other['views'].items():
+        target = into['views'].get(name)
+        if target is None:
+            target = into['views'][name] = _empty_view()
+        for key in ('requests', 'queries', 'db_time'):
+            target[key] += view[key]
+        target['max_queries'] = max(target['max_queries'], view['max_queries'])
+        target['max_db_time'] = max(target['max_db_time'], view['max_db_time'])
+        for hist in ('query_hist', 'time_hist'):
+            target[hist] = [a + b for (a, b) in zip(target[hist], view[hist])]
+        for key, (count, db_time) in view['fingerprints'].items():
+            counts = target['fingerprints'].setdefault(key, [0, 0.0])
+            counts[0] += count
+            counts[1] += db_time
+    for key, info in other['fingerprints'].items():
+        target = into['fingerprints'].get(key)
+        if target is None:
+            into['fingerprints'][key] = dict(info)
+        else:
+            target['count'] += info['count']
+            target['time'] += info['time']
+    return into
+
+
+class ProfileCollector(object):
+    """
+    Accumulates per-view query stats in memory, and periodically
+    merges them into the Django cache. You normally want the
+    module-level ``collector`` instance.
+    """
+
+    def __init__(self, cache=cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._pending = _empty_stats()
+        self._last_flush = time.time()
+
+    def add(self, view, queries):
+        """
+        Records one request to ``view`` (a name), which ran ``queries``:
+        a list of dicts with 'sql' and 'time' (in seconds, may be a
+        string) like Django's ``connection.queries``.
+        """
+        fingerprints = []
+        total_time = 0.0
+        for query in queries:
+            db_time = float(query['time'])
+            total_time += db_time
+            fingerprints.append(fingerprint(query['sql']) + (db_time,))
+        with self._lock:
+            stats = self._pending
+            target = stats['views'].get(view)
+            if target is None:
+                target = stats['views'][view] = _empty_view()
+            target['requests'] += 1
+            target['queries'] += len(queries)
+            target['db_time'] += total_time
+            target['max_queries'] = max(target['max_queries'], len(queries))
+            target['max_db_time'] = max(target['max_db_time'], total_time)
+            target['query_hist'][bisect.bisect_left(QUERY_COUNT_BINS, len(queries))] += 1
+            target['time_hist'][bisect.bisect_left(DB_TIME_BINS, total_time * 1000)] += 1
+            for key, sql, db_time in fingerprints:
+                counts = target['fingerprints'].setdefault(key, [0, 0.0])
+                counts[0] += 1
+                counts[1] += db_time
+                info = stats['fingerprints'].get(key)
+                if info is None:
+                    info = stats['fingerprints'][key] = {'sql': sql, 'count': 0, 'time': 0.0}
+                info['count'] += 1
+                info['time'] += db_time
+        if time.time() - self._last_flush >= _setting('FLUSH_INTERVAL', FLUSH_INTERVAL):
+            self.flush()
+
+    def _bucket_key(self, bucket):
+        return '%s%d' % (CACHE_KEY_PREFIX, bucket)
+
+    def _current_bucket(self):
+        return int(time.time() // _setting('WINDOW', WINDOW))
+
+    def flush(self):
+        """
+        Merges the stats collected so far into the cache.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = _empty_stats()
+            self._last_flush = time.time()
+        if not pending['views']:
+            return
+        key = self._bucket_key(self._current_bucket())
+        stats = self.cache.get(key) or _empty_stats()
+        merge_stats(stats, pending)
+        stats['fingerprints'] = _trim(stats['fingerprints'], MAX_FINGERPRINTS,
+                                      lambda info: info['time'])
+        for view in stats['views'].values():
+            view['fingerprints'] = _trim(view['fingerprints'], MAX_VIEW_FINGERPRINTS,
+                                         lambda counts: counts[1])
+        timeout = _setting('WINDOW', WINDOW) * (_setting('BUCKETS', BUCKETS) + 1)
+        self.cache.set(key, stats, timeout)
+
+    def _bucket_keys(self, buckets=None):
+        if buckets is None:
+            buckets = _setting('BUCKETS', BUCKETS)
+        current = self._current_bucket()
+        return [self._bucket_key(b) for b in range(current - buckets + 1, current + 1)]
+
+    def get_stats(self, buckets=None):
+        """
+        Returns the merged stats of the last ``buckets`` windows
+        (default ``SQL_PROFILE_BUCKETS``), including this process'
+        unflushed stats.
+        """
+        stats = _empty_stats()
+        for bucket_stats in self.cache.get_many(self._bucket_keys(buckets)).values():
+            merge_stats(stats, bucket_stats)
+        with self._lock:
+            merge_stats(stats, self._pending)
+        return stats
+
+    def reset(self):
+        """
+        Forgets all stats, in this process and in the cache.
+        """
+        with self._lock:
+            self._pending = _empty_stats()
+        self.cache.delete_many(self._bucket_keys())
+
+
+collector = ProfileCollector()
+
+
+def make_report(stats, limit=10, view=None):
+    """
+    Summarizes stats from :py:meth:`ProfileCollector.get_stats` as a
+    dict with lists of 'views' and 'fingerprints', most total DB time
+    first, each with averages and (for views) histograms and their own
+    top fingerprints. If ``view`` is given, only views whose name
+    contains it are included.
+    """
+    all_fingerprints = stats['fingerprints']
+    views = []
+    for name, info in stats['views'].items():
+        if view and view not in name:
+            continue
+        requests = info['requests'] or 1
+        top = sorted(info['fingerprints'].items(), key=lambda item: item[1][1],
+                     reverse=True)[:limit]
+        views.append({
+            'name': name,
+            'requests': info['requests'],
+            'queries': info['queries'],
+            'db_time': info['db_time'],
+            'avg_queries': float(info['queries']) / requests,
+            'avg_db_time': info['db_time'] / requests,
+            'max_queries': info['max_queries'],
+            'max_db_time': info['max_db_time'],
+            'query_hist': _histogram(QUERY_COUNT_BINS, info['query_hist']),
+            'time_hist': _histogram(DB_TIME_BINS, info['time_hist'], unit='ms', step=0),
+            'fingerprints': [
+                {'key': key,
+                 'sql': all_fingerprints.get(key, {}).get('sql', '(unknown)'),
+                 'count': count,
+                 'per_request': float(count) / requests,
+                 'time': db_time}
+                for key, (count, db_time) in top],
+        })
+    views.sort(key=lambda info: info['db_time'], reverse=True)
+    fingerprints = sorted(
+        [dict(info, key=key, avg_time=info['time'] / (info['count'] or 1))
+         for key, info in all_fingerprints.items()],
+        key=lambda info: info['time'], reverse=True)[:limit]
+    return {'views': views[:limit], 'fingerprints': fingerprints}
+
+
+def _histogram(bins, counts, unit='', step=1):
+    # Returns a list of (label, count) pairs. ``step`` is the gap
+    # between one bin's upper bound and the next one's lower bound.
+    labels = []
+    low = 0
+    for high in bins:
+        if high == low:
+            labels.append('%s%s' % (high, unit))
+        else:
+            labels.append('%s-%s%s' % (low, high, unit))
+        low = high + step
+    labels.append('>%s%s' % (bins[-1], unit))
+    return zip(labels, counts)
+
+
+class SQLProfileMiddleware(object):
+    """
+    Records the queries of a random sample of requests; see the
+    module docs.
+    """
+
+    def __init__(self):
+        self.sample_rate = _setting('SAMPLE_RATE', SAMPLE_RATE)
+        if not self.sample_rate:
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        if random.random() >= self.sample_rate:
+            return None
+        # Turn on Django's query logging for this request only,
+        # and remember where this request's queries start.
+        state = []
+        for conn in connections.all():
+            state.append((conn, conn.use_debug_cursor, len(conn.queries)))
+            conn.use_debug_cursor = True
+        request._sql_profile = {'state': state, 'view': None}
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, '_sql_profile', None)
+        if profile is not None:
+            profile['view'] = view_name(view_func)
+        return None
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_sql_profile', None)
+        if profile is None:
+            return response
+        del request._sql_profile
+        queries = []
+        for conn, use_debug_cursor, start in profile['state']:
+            queries.extend(conn.queries[start:])
+            conn.use_debug_cursor = use_debug_cursor
+            if not (use_debug_cursor or settings.DEBUG):
+                # Don't let the log grow forever.
+                del conn.queries[start:]
+        # Requests that didn't resolve to a view are eg. redirects
+        # by CommonMiddleware, or 404s.
+        view = profile['view'] or '(no view, status %s)' % response.status_code
+        try:
+            collector.add(view, queries)
+        except Exception:
+            # Profiling must never break the site.
+            logger.exception("Error recording SQL profile for %s" % view)
+        return response
@@ -131,10 +131,215 @@ class TestModelUtils(TransactionTestCase):
         self.assertRaises(TypeError, is_instance_of_model, f, Foo())
 
 
+class TestSQLProfile(unittest.TestCase):
+
+    def setUp(self):
+        from django.core.cache.backends.locmem import LocMemCache
+        from ebpub.utils import sqlprofile
+        self.sqlprofile = sqlprofile
+        self._orig_collector = sqlprofile.collector
+        sqlprofile.collector = self.collector = sqlprofile.ProfileCollector(
+            cache=LocMemCache('sqlprofile-test', {}))
+
+    def tearDown(self):
+        self.sqlprofile.collector = self._orig_collector
+
+    def test_normalize_sql(self):
+        normalize_sql = self.sqlprofile.normalize_sql
+        self.assertEqual(
+            normalize_sql("SELECT * FROM db_newsitem2 WHERE id IN (1, 2, 3) AND title = 'it''s'"),
+            'SELECT * FROM db_newsitem2 WHERE id IN (...) AND title = ?')
+        self.assertEqual(
+            normalize_sql('INSERT INTO "t" ("a", "b") VALUES (1, true), (2, false)'),
+            'INSERT INTO "t" ("a", "b") VALUES (?, ?), ...')
+        self.assertEqual(
+            normalize_sql('3 times: UPDATE t SET x = -1.5\n  WHERE "t"."id" = 7'),
+            'UPDATE t SET x = ? WHERE "t"."id" = ?')
+
+    def test_fingerprint(self):
+        fingerprint = self.sqlprofile.fingerprint
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id = 1'),
+                         fingerprint('SELECT  *  FROM t WHERE id = 22'))
+        self.assertNotEqual(fingerprint('SELECT * FROM t WHERE id = 1')[0],
+                            fingerprint('SELECT * FROM u WHERE id = 1')[0])
+
+    def test_collector(self):
+        self.collector.add('myview', [{'sql': 'SELECT 1', 'time': '0.010'},
+                                      {'sql': 'SELECT 2', 'time': '0.030'}])
+        self.collector.flush()
+        self.collector.add('myview', [])
+        report = self.sqlprofile.make_report(self.collector.get_stats())
+        self.assertEqual(len(report['views']), 1)
+        view = report['views'][0]
+        self.assertEqual(view['name'], 'myview')
+        self.assertEqual(view['requests'], 2)
+        self.assertEqual(view['queries'], 2)
+        self.assertAlmostEqual(view['db_time'], 0.04)
+        self.assertEqual(view['max_queries'], 2)
+        self.assertEqual(dict(view['query_hist'])['0'], 1)
+        self.assertEqual(dict(view['query_hist'])['2-5'], 1)
+        self.assertEqual(view['fingerprints'][0]['sql'], 'SELECT ?')
+        self.assertEqual(view['fingerprints'][0]['count'], 2)
+        self.assertEqual(view['fingerprints'][0]['per_request'], 1.0)
+
+        self.collector.reset()
+        self.assertEqual(self.sqlprofile.make_report(self.collector.get_stats())['views'], [])
+
+    def test_middleware(self):
+        from django.conf import settings
+        from django.core.exceptions import MiddlewareNotUsed
+        from django.db import connection
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        def view(request):
+            cursor = connection.cursor()
+            for i in range(3):
+                cursor.execute('SELECT %s', [i])
+            return HttpResponse('')
+
+        orig_rate = getattr(settings, 'SQL_PROFILE_SAMPLE_RATE', 0)
+        try:
+            settings.SQL_PROFILE_SAMPLE_RATE = 0
+            self.assertRaises(MiddlewareNotUsed, self.sqlprofile.SQLProfileMiddleware)
+            settings.SQL_PROFILE_SAMPLE_RATE = 1
+            middleware = self.sqlprofile.SQLProfileMiddleware()
+        finally:
+            settings.SQL_PROFILE_SAMPLE_RATE = orig_rate
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        middleware.process_view(request, view, (), {})
+        middleware.process_response(request, view(request))
+        self.assertEqual(connection.use_debug_cursor, None)
+        report = self.sqlprofile.make_report(self.collector.get_stats())
+        self.assertEqual(report['views'][0]['name'], 'ebpub.utils.tests.view')
+        self.assertEqual(report['views'][0]['queries'], 3)
+
+
+class TestReplicaRouter(unittest.TestCase):
+
+    def setUp(self):
+        from django.conf import settings
+        from ebpub.utils import multidb
+        self.settings = settings
+        self.multidb = multidb
+        self._orig_replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        settings.DATABASE_REPLICAS = ['replica1', 'replica2']
+        self.lags = {'replica1': 0, 'replica2': 0}
+        self._orig_check = multidb.health.check
+        multidb.health.check = lambda alias: self.lags[alias]
+        multidb.health.reset()
+        multidb._state.reset()
+        self.router = multidb.ReplicaRouter()
+
+    def tearDown(self):
+        self.settings.DATABASE_REPLICAS = self._orig_replicas
+        self.multidb.health.check = self._orig_check
+        self.multidb.health.reset()
+        self.multidb._state.reset()
+
+    def test_read(self):
+        db = self.router.db_for_read(Location)
+        self.assert_(db in ('replica1', 'replica2'))
+        # Same one for the rest of the request.
+        for i in range(10):
+            self.assertEqual(self.router.db_for_read(Location), db)
+
+    def test_read__lagging_or_down(self):
+        self.lags['replica1'] = 1000
+        self.lags['replica2'] = None
+        self.assertEqual(self.router.db_for_read(Location), 'default')
+        self.multidb.health.reset()
+        self.lags['replica2'] = 1
+        self.assertEqual(self.router.db_for_read(Location), 'replica2')
+
+    def test_health_check_interval(self):
+        checked = []
+        def check(alias):
+            checked.append(alias)
+            return 0
+        self.multidb.health.check = check
+        self.multidb.health.is_usable('replica1')
+        self.multidb.health.is_usable('replica1')
+        self.assertEqual(checked, ['replica1'])
+        orig_interval = self.multidb.CHECK_INTERVAL
+        self.multidb.CHECK_INTERVAL = 0
+        try:
+            self.multidb.health.is_usable('replica1')
+        finally:
+            self.multidb.CHECK_INTERVAL = orig_interval
+        self.assertEqual(checked, ['replica1', 'replica1'])
+
+    def test_read_after_write(self):
+        self.assertEqual(self.router.db_for_write(Location), 'default')
+        self.assertEqual(self.router.db_for_read(Location), 'default')
+
+    def test_use_replica(self):
+        self.router.db_for_write(Location)
+        self.assertEqual(self.multidb.pinned_db(), 'default')
+        with self.multidb.use_replica() as db:
+            self.assert_(db in ('replica1', 'replica2'))
+            self.assertEqual(self.router.db_for_read(Location), db)
+            self.assertEqual(self.multidb.pinned_db(), db)
+            with self.multidb.use_primary():
+                self.assertEqual(self.router.db_for_read(Location), 'default')
+            self.assertEqual(self.router.db_for_read(Location), db)
+            self.assertEqual(self.router.db_for_write(Location), 'default')
+        self.assertEqual(self.router.db_for_read(Location), 'default')
+        self.assertEqual(self.multidb.pinned_db(), 'default')
+
+    def test_use_replica__none_usable(self):
+        self.lags['replica1'] = self.lags['replica2'] = None
+        with self.multidb.use_replica() as db:
+            self.assertEqual(db, 'default')
+            self.assertEqual(self.router.db_for_read(Location), 'default')
+
+    def test_per_model_routes(self):
+        self.router._routes = {'other': ['db.LocationType']}
+        self.assertEqual(self.router.db_for_read(LocationType), 'other')
+        self.assertEqual(self.router.db_for_write(LocationType), 'other')
+        self.assertEqual(self.router.db_for_write(Location), 'default')
+
+    def test_allow_syncdb(self):
+        self.assertEqual(self.router.allow_syncdb('replica1', Location), False)
+        self.assertEqual(self.router.allow_syncdb('default', Location), None)
+
+    def test_allow_relation(self):
+        loc, loctype = Location(), LocationType()
+        loc._state.db, loctype._state.db = 'replica1', 'default'
+        self.assertEqual(self.router.allow_relation(loc, loctype), True)
+        loc._state.db = 'other'
+        self.assertEqual(self.router.allow_relation(loc, loctype), None)
+
+    def test_middleware(self):
+        from django.core.exceptions import MiddlewareNotUsed
+        from django.http import HttpResponse
+        from django.test.client import RequestFactory
+        middleware = self.multidb.ReplicaMiddleware()
+        request = RequestFactory().post('/')
+        middleware.process_request(request)
+        self.router.db_for_write(Location)
+        response = middleware.process_response(request, HttpResponse(''))
+        self.assert_(self.multidb.PRIMARY_COOKIE in response.cookies)
+        self.assertNotEqual(self.router.db_for_read(Location), 'default')
+
+        # The next request reads from the primary.
+        request = RequestFactory().get('/')
+        request.COOKIES[self.multidb.PRIMARY_COOKIE] = '1'
+        middleware.process_request(request)
+        self.assertEqual(self.router.db_for_read(Location), 'default')
+        response = middleware.process_response(request, HttpResponse(''))
+        self.failIf(self.multidb.PRIMARY_COOKIE in response.cookies)
+
+        self.settings.DATABASE_REPLICAS = []
+        self.assertRaises(MiddlewareNotUsed, self.multidb.ReplicaMiddleware)
+
+
 def suite():
     # Note, not used by django.nose;
     # for that, run eg. django-admin.py test --with-doctest ebpub/ebpub/utils/
-    suite = unittest.TestLoader().loadTestsFromTestCase(PidTests, TestModelUtils)
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite([loader.loadTestsFromTestCase(cls) for cls in
+                                (PidTests, TestModelUtils, TestSQLProfile, TestReplicaRouter)])
     import doctest
     import ebpub.utils.text
     suite.addTest(doctest.DocTestSuite(ebpub.utils.text))
@@ -142,7 +347,7 @@ def suite():
     suite.addTest(doctest.DocTestSuite(ebpub.utils.bunch))
     import ebpub.utils.dates
     suite.addTest(doctest.DocTestSuite(ebpub.utils.dates))
-    import ebpub.utils.dates
+    import ebpub.utils.geodjango
     suite.addTest(doctest.DocTestSuite(ebpub.utils.geodjango))
     return suite
 
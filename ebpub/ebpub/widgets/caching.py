@@ -0,0 +1,139 @@
+#   Copyright 2012 OpenPlans, and contributors
+#
+#   This file is part of ebpub
+#
+#   ebpub is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   ebpub is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with ebpub.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Caching for :py:mod:`widgets <ebpub.widgets>`.
+
+Widgets are embedded on other sites, so ``widget_javascript`` and
+``widget_content`` can get far more traffic than the rest of
+OpenBlock. To keep them cheap:
+
+* Widget templates and item link templates are compiled once per
+  process and reused, see :py:func:`get_template`.
+
+* Rendered widgets, and the item lists used by the pinned item admin
+  UI, are kept in the Django cache, see :py:func:`get_cached`. The
+  cache key changes whenever NewsItems change (according to
+  :py:mod:`ebpub.db.versions`), or the widget, its template, its
+  types or its pinned items are saved or deleted, so stale output is
+  never served. Cached output also expires when the next pinned item
+  does.
+
+As with :py:mod:`ebpub.db.versions`, this only works across processes
+if the cache is shared, eg. memcached; with the default DummyCache,
+nothing but template compilation is cached.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template import Template
+from django.utils.encoding import smart_str
+from ebpub.db.versions import get_version, NEWSITEMS, VERSION_CACHE_TIME
+
+import datetime
+import hashlib
+import uuid
+
+# How long to cache rendered widgets and item lists, in seconds.
+WIDGET_CACHE_TIME = getattr(settings, 'WIDGET_CACHE_TIME', 60 * 15)
+
+# Max number of compiled templates to keep in each process.
+MAX_TEMPLATES = 200
+
+STAMP_CACHE_KEY = 'ebpub.widgets.stamp.%s'
+DATA_CACHE_KEY = 'ebpub.widgets.%s.%s.%s'
+
+_templates = {}
+
+
+def get_template(code):
+    """
+    Returns a compiled django Template for the given code, compiling
+    it only the first time it's seen.
+    """
+    key = hashlib.md5(smart_str(code)).hexdigest()
+    t = _templates.get(key)
+    if t is None:
+        if len(_templates) >= MAX_TEMPLATES:
+            _templates.clear()
+        t = _templates[key] = Template(code)
+    return t
+
+
+def touch(widget_id):
+    """
+    Records that the widget with the given ID, or its pinned items,
+    changed.
+    """
+    cache.set(STAMP_CACHE_KEY % widget_id, uuid.uuid4().hex, VERSION_CACHE_TIME)
+
+
+def _get_stamp(widget_id):
+    stamp = cache.get(STAMP_CACHE_KEY % widget_id, None)
+    if stamp is None:
+        stamp = uuid.uuid4().hex
+        cache.add(STAMP_CACHE_KEY % widget_id, stamp, VERSION_CACHE_TIME)
+    return stamp
+
+
+def _cache_timeout(widget):
+    # Don't keep anything past the next pinned item expiration.
+    from ebpub.widgets.models import PinnedItem
+    expirations = PinnedItem.objects.filter(
+        widget=widget, expiration_date__isnull=False).order_by(
+        'expiration_date').values_list('expiration_date', flat=True)[:1]
+    if expirations:
+        delta = expirations[0] - datetime.datetime.now()
+        seconds = delta.days * 86400 + delta.seconds + 1
+        return max(1, min(WIDGET_CACHE_TIME, seconds))
+    return WIDGET_CACHE_TIME
+
+
+def get_cached(widget, name, compute, extra=()):
+    """
+    Returns ``compute()``, cached per ``widget``, ``name`` and ``extra``
+    (any other hashable data the result depends on) until the widget
+    or NewsItems change.
+
+    Does one database query on a cache hit.
+    """
+    etag = get_version([NEWSITEMS])[0]
+    template = widget.template
+    version = hashlib.md5(repr((
+                etag, _get_stamp(widget.id), smart_str(template.code), template.content_type,
+                tuple(extra)))).hexdigest()
+    key = DATA_CACHE_KEY % (name, widget.id, version)
+    value = cache.get(key, None)
+    if value is None:
+        value = compute()
+        cache.set(key, value, _cache_timeout(widget))
+    return value
+
+
+# Signal handlers.
+
+def widget_changed(sender, instance, **kwargs):
+    if kwargs.get('reverse'):
+        # Widgets were added to or removed from a Schema.
+        for widget_id in kwargs.get('pk_set') or ():
+            touch(widget_id)
+    else:
+        touch(instance.id)
+
+def pin_changed(sender, instance, **kwargs):
+    touch(instance.widget_id)
@@ -19,7 +19,7 @@
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.gis.db import models
-from ebpub.db.models import NewsItem, Location, Schema
+from ebpub.db.models import NewsItem, Location, Schema, populate_attributes
 import datetime
 from operator import attrgetter
 
@@ -96,7 +96,7 @@ class Widget(models.Model):
         # widget.  Delete any that have expired.
         expired_pinned = []
         pinned_items = []
-        for pi in PinnedItem.objects.filter(widget=self).all(): 
+        for pi in PinnedItem.objects.filter(widget=self).select_related('news_item'):
             # did it expire? 
             if pi.expiration_date is not None and pi.expiration_date < now:
                 # get rid of it if so
@@ -115,6 +115,7 @@ class Widget(models.Model):
         widget_items = [x for x in widget_items if x.id not in pinned_ids]
         
         # Insert pinned items into the list of items
+        populate_attributes([pi.news_item for pi in pinned_items])
         pinned_items.sort(key=attrgetter('item_number'))
         for pi in pinned_items:
             widget_items.insert(pi.item_number, pi.news_item)
@@ -128,7 +129,7 @@ class Widget(models.Model):
         'pinned' items. 
         """
         # TODO integrate with other ways to search for items ?
-        query = NewsItem.objects.all()
+        query = NewsItem.objects.select_related('schema').with_attributes()
         
         type_filter = [x for x in self.types.all()]
         if len(type_filter): 
@@ -166,3 +167,11 @@ class PinnedItem(models.Model):
     expiration_date = models.DateTimeField(null=True)
 
 
+# Keep cached widget output fresh; see ebpub.widgets.caching.
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from ebpub.widgets import caching
+post_save.connect(caching.widget_changed, sender=Widget)
+post_delete.connect(caching.widget_changed, sender=Widget)
+m2m_changed.connect(caching.widget_changed, sender=Widget.types.through)
+post_save.connect(caching.pin_changed, sender=PinnedItem)
+post_delete.connect(caching.pin_changed, sender=PinnedItem)
@@ -39,3 +39,60 @@ Another way to test that 1 + 1 is equal to 2.
 True
 """}
 
+
+
+from django.core.cache.backends.locmem import LocMemCache
+from ebpub.db.models import NewsItem
+from ebpub.widgets import caching
+from ebpub.widgets.models import PinnedItem, Template, Widget
+import datetime
+import mock
+
+
+class TestWidgetCaching(TestCase):
+
+    fixtures = ('test-schemafilter-views.json',)
+
+    def setUp(self):
+        self.template = Template.objects.create(name='t', slug='t', code='{{ widget.slug }}')
+        self.widget = Widget.objects.create(name='w', slug='w', template=self.template)
+        self.cache = LocMemCache('widgets', {})
+        # NewsItem versions use the cache too.
+        self.patchers = [mock.patch('ebpub.widgets.caching.cache', self.cache),
+                         mock.patch('ebpub.db.versions.cache', self.cache)]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_get_template(self):
+        self.assert_(caching.get_template(u'{{ x }}') is caching.get_template(u'{{ x }}'))
+
+    def test_get_cached(self):
+        compute = mock.Mock(return_value='result')
+        self.assertEqual(caching.get_cached(self.widget, 'render', compute), 'result')
+        self.assertEqual(caching.get_cached(self.widget, 'render', compute), 'result')
+        self.assertEqual(compute.call_count, 1)
+        # Different extra data, different result.
+        caching.get_cached(self.widget, 'render', compute, extra=(1,))
+        self.assertEqual(compute.call_count, 2)
+
+    def test_get_cached__invalidated(self):
+        compute = mock.Mock(return_value='result')
+        caching.get_cached(self.widget, 'render', compute)
+        PinnedItem.objects.create(widget=self.widget, item_number=0,
+                                  news_item=NewsItem.objects.get(id=1))
+        caching.get_cached(self.widget, 'render', compute)
+        self.assertEqual(compute.call_count, 2)
+        self.template.code = 'changed'
+        caching.get_cached(self.widget, 'render', compute)
+        self.assertEqual(compute.call_count, 3)
+
+    def test_cache_timeout__pin_expiration(self):
+        self.assertEqual(caching._cache_timeout(self.widget), caching.WIDGET_CACHE_TIME)
+        PinnedItem.objects.create(
+            widget=self.widget, item_number=0, news_item=NewsItem.objects.get(id=1),
+            expiration_date=datetime.datetime.now() + datetime.timedelta(seconds=60))
+        self.assert_(caching._cache_timeout(self.widget) <= 61)
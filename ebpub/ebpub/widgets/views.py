@@ -19,13 +19,14 @@
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseNotAllowed
 from django.shortcuts import render_to_response, get_object_or_404
-from django.template import Context, Template
+from django.template import Context
 from django.template.context import RequestContext
 from django.utils import simplejson as json
 from ebpub.accounts.utils import login_required
 from ebpub.db.models import NewsItem
+from ebpub.db.tagcache import get_tag_cache
+from ebpub.widgets import caching
 from ebpub.widgets.models import Widget, PinnedItem
-from operator import attrgetter
 import datetime
 import logging
 
@@ -37,7 +38,7 @@ def widget_javascript(request, slug):
     The javsacript renders the widget using its template, once, on page load.
     """
     try:
-        widget = Widget.objects.get(slug=slug)
+        widget = Widget.objects.select_related('template').get(slug=slug)
     except Widget.DoesNotExist:
         return HttpResponse(status=404)
 
@@ -50,7 +51,7 @@ def widget_content(request, slug):
     View that renders the widget using its template.
     """
     try:
-        widget = Widget.objects.get(slug=slug)
+        widget = Widget.objects.select_related('template').get(slug=slug)
     except Widget.DoesNotExist:
         return HttpResponse(status=404)
     return HttpResponse(render_widget(widget), status=200,
@@ -58,20 +59,26 @@ def widget_content(request, slug):
 
 def render_widget(widget, items=None):
     """Returns an HTML string of the widget rendered using its template.
+
+    If ``items`` isn't given, renders the widget's current items, and
+    caches the result; see :py:mod:`ebpub.widgets.caching`.
     """
     if items is None:
-        items = widget.fetch_items()
+        return caching.get_cached(widget, 'render',
+                                  lambda: render_widget(widget, widget.fetch_items()))
     info = {
         'items': [template_context_for_item(x, widget) for x in items],
         'widget': widget
     }
-    # TODO: cache template compilation
     code = widget.template.code
     if not ' load eb ' in code:
         # Convenience so template authors don't have to remember this detail.
         code = '{% load eb %}\n' + code
-    t = Template(code)
-    return t.render(Context(info))
+    t = caching.get_template(code)
+    context = Context(info)
+    # So eg. get_locations_for_item can load data for all items at once.
+    get_tag_cache(context).add_newsitems(list(items))
+    return t.render(context)
 
 def template_context_for_item(newsitem, widget=None):
     # try to make something ... reasonable for use in
@@ -132,7 +139,7 @@ def template_context_for_item(newsitem, widget=None):
     return ctx
 
 def _eval_item_link_template(template, context):
-    t = Template(template)
+    t = caching.get_template(template)
     return t.render(Context(context)).strip()
 
 ##########################################################################
@@ -199,7 +206,7 @@ def ajax_widget_raw_items(request, slug):
     if not request.user.is_superuser == True:
         return HttpResponse("You must be an administrator to access this function.", status=401)
 
-    widget = get_object_or_404(Widget.objects, slug=slug)
+    widget = get_object_or_404(Widget.objects.select_related('template'), slug=slug)
 
     try:
         start = int(request.GET.get('start', 0))
@@ -207,14 +214,10 @@ def ajax_widget_raw_items(request, slug):
     except ValueError:
         return HttpResponse(status=400)
 
-    items = widget.raw_item_query(start, count).all()
-    item_infos = []
-    for item in items:
-        item_info = {
-            'id': item.id,
-            'title': item.title,
-        }
-        item_infos.append(item_info)
+    item_infos = caching.get_cached(
+        widget, 'raw_items',
+        lambda: [_item_info(item) for item in widget.raw_item_query(start, count)],
+        extra=(start, count))
 
     info = {'items': item_infos, 'start': start}
     return HttpResponse(json.dumps(info), mimetype="application/json")
@@ -253,7 +256,7 @@ def ajax_widget_pins(request, slug):
     if not request.user.is_superuser == True:
         return HttpResponse("You must be an administrator to access this function.", status=401)
 
-    widget = get_object_or_404(Widget.objects, slug=slug)
+    widget = get_object_or_404(Widget.objects.select_related('template'), slug=slug)
 
     if request.method == 'GET':
         return _get_ajax_widget_pins(request, widget)
@@ -266,25 +269,26 @@ def _get_ajax_widget_pins(request, widget):
     # Retrieves a json structure that describes the
     # items currently "pinned" in a widget as described
     # in ajax_widget_pins.
-    pins = list(PinnedItem.objects.filter(widget=widget).all())
-    pins.sort(key=attrgetter('item_number'))
-
-    item_infos = []
-    for pin in pins:
-        item_info = {
-            'id': pin.news_item.id,
-            'title': pin.news_item.title,
-            'index': pin.item_number
-        }
-        if pin.expiration_date is not None:
-            item_info['expiration_date'] = pin.expiration_date.date().strftime('%m/%d/%Y')
-            item_info['expiration_time'] = pin.expiration_date.time().strftime('%I:%M%p')
-
-        item_infos.append(item_info)
-
-    info = {'items': item_infos}
+    def get_pin_infos():
+        pins = PinnedItem.objects.filter(widget=widget).select_related(
+            'news_item').order_by('item_number')
+        item_infos = []
+        for pin in pins:
+            item_info = _item_info(pin.news_item)
+            item_info['index'] = pin.item_number
+            if pin.expiration_date is not None:
+                item_info['expiration_date'] = pin.expiration_date.date().strftime('%m/%d/%Y')
+                item_info['expiration_time'] = pin.expiration_date.time().strftime('%I:%M%p')
+            item_infos.append(item_info)
+        return item_infos
+
+    info = {'items': caching.get_cached(widget, 'pins', get_pin_infos)}
     return HttpResponse(json.dumps(info), mimetype="application/json")
 
+def _item_info(newsitem):
+    # The description of a NewsItem used by the pinned item admin UI.
+    return {'id': newsitem.id, 'title': newsitem.title}
+
 def _set_ajax_widget_pins(request, widget):
     # Sets pinned items in a widget based a json structure
     # as described in ajax_widget_pins.
@@ -108,6 +108,9 @@ setup(
             'import_neighborhoods = ebpub.db.bin.import_hoods:main',
             'import_zips_tiger = ebpub.db.bin.import_zips:main',
             # 'import_zips_esri = ebpub.streets.blockimport.esri.importers.zipcodes:TODO',
+            'simplify_locations = ebpub.db.bin.simplify_locations:main',
+            'update_newsitem_buckets = ebpub.db.bin.update_newsitem_buckets:main',
+            'partition_newsitems = ebpub.db.bin.partition_newsitems:main',
             'update_aggregates = ebpub.db.bin.update_aggregates:main',
             'populate_streets = ebpub.streets.bin.populate_streets:main',
             'populate_suburbs = ebpub.streets.bin.populate_suburbs:main',
@@ -116,6 +119,8 @@ setup(
             'delete_blocks_outside_city = ebpub.streets.bin.delete_blocks_outside_city:delete_blocks_outside_city',
             'import_blocks_tiger = ebpub.streets.blockimport.tiger.import_blocks:main',
             'import_blocks_esri = ebpub.streets.blockimport.esri.importers.blocks:main',
+            'make_synthetic_metro = ebpub.benchmark.metro:main',
+            'run_benchmarks = ebpub.benchmark.scenarios:main',
             ],
         },
     classifiers=[
@@ -37,9 +37,15 @@ class OpenblockAdminSite(AdminSite):
         Add some extra URLs to the admin site, as per
         https://docs.djangoproject.com/en/dev/ref/contrib/admin/#adding-views-to-admin-sites
         """
+        from django.conf.urls.defaults import patterns, url
         from obadmin.admin.urls import urlpatterns as local_urls
+        from obadmin.admin.views import sql_profile
 
-        url_patterns = local_urls
+        url_patterns = patterns('',
+            url(r'^sql-profile/$', self.admin_view(sql_profile),
+                name='sql-profile'),
+        )
+        url_patterns += local_urls
         url_patterns += AdminSite.get_urls(self)
 
         return url_patterns
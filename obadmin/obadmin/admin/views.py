@@ -32,6 +32,7 @@ from ebdata.blobs.models import Seed
 from ebdata.scrapers.general.spreadsheet import retrieval
 from ebpub.db.models import LocationType
 from ebpub.db.models import Schema, SchemaField, NewsItem, Lookup, DataUpdate
+from ebpub.utils import sqlprofile
 from . import forms
 
 import logging
@@ -147,6 +148,24 @@ def scraper_history_schema(request, slug):
     return render_to_response('obadmin/scraper_history_schema.html', {'schema': s, 'dataupdate_list': du_list})
 
 
+def sql_profile(request):
+    """
+    Staff-only report of per-view SQL stats; see ebpub.utils.sqlprofile.
+    """
+    view = request.GET.get('view') or None
+    if request.method == 'POST' and request.POST.get('reset'):
+        sqlprofile.collector.reset()
+        messages.info(request, 'SQL profile stats have been reset.')
+        return HttpResponseRedirect('./')
+    report = sqlprofile.make_report(sqlprofile.collector.get_stats(),
+                                    limit=25, view=view)
+    return render(request, 'obadmin/sql_profile.html', {
+            'report': report,
+            'view': view,
+            'sample_rate': getattr(settings, 'SQL_PROFILE_SAMPLE_RATE', 0),
+            })
+
+
 def newsitem_details(request, news_item_id):
     """
     Shows all of the raw values in a NewsItem for debugging.